@@ -410,7 +410,17 @@ class Application(Configurator):
         a function or a picklable object.
 
         Default ``None``
+
+    .. attribute:: autoscale
+
+        ``False`` when the workers of the application cannot be added or
+        removed following their load, the
+        :ref:`max_workers <setting-max_workers>` setting is then ignored.
+
+        Default ``True``
     """
+    autoscale = True
+
     def __init__(self, callable=None, load_config=True, **params):
         super().__init__(**params)
         self.cfg.callable = callable
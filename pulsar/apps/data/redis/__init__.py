@@ -25,6 +25,44 @@ Redis Pipeline
 .. autoclass:: pulsar.apps.data.redis.client.Pipeline
    :members:
    :member-order: bysource
+
+Locks
+~~~~~~~~~~~~~~~
+
+.. automodule:: pulsar.apps.data.redis.lock
+
+.. autoclass:: pulsar.apps.data.redis.lock.Lock
+   :members:
+   :member-order: bysource
+
+.. autoclass:: pulsar.apps.data.redis.lock.LockWaiters
+   :members:
+   :member-order: bysource
+
+Sharded Store
+~~~~~~~~~~~~~~~
+
+.. automodule:: pulsar.apps.data.redis.sharded
+
+.. autoclass:: pulsar.apps.data.redis.sharded.ShardedStore
+   :members:
+   :member-order: bysource
+
+Publish/Subscribe Fan-in
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+.. autoclass:: pulsar.apps.data.redis.pubsub.PubSubFanIn
+   :members:
+   :member-order: bysource
+
+Client Cache
+~~~~~~~~~~~~~~~
+
+.. automodule:: pulsar.apps.data.redis.cache
+
+.. autoclass:: pulsar.apps.data.redis.cache.ClientCache
+   :members:
+   :member-order: bysource
 '''
 from pulsar.utils.config import Global
 from pulsar.apps.data import register_store
@@ -33,11 +71,15 @@ from pulsar.apps.ds import RedisError, NoScriptError, redis_parser
 from .store import RedisStore, RedisStoreConnection
 from .client import ResponseError, Consumer, Pipeline
 from .lock import RedisScript, LockError
+from .cache import ClientCache
+from .sharded import ShardedStore
+from .pubsub import RedisPubSub, PubSubFanIn
 
 
 __all__ = ['RedisStore', 'RedisError', 'NoScriptError', 'redis_parser',
            'RedisStoreConnection', 'Consumer', 'Pipeline', 'ResponseError',
-           'RedisScript', 'LockError']
+           'RedisScript', 'LockError', 'ClientCache', 'ShardedStore',
+           'RedisPubSub', 'PubSubFanIn']
 
 
 class RedisServer(Global):
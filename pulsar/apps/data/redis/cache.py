@@ -0,0 +1,264 @@
+'''Client side cache of the replies of :class:`.RedisStore` reads.
+
+Replies of read commands on a single key are kept in a least recently
+used cache bounded in size and, optionally, in time. Cached replies are
+invalidated by the keyspace notifications of the server, received over a
+dedicated pub/sub connection, and by the write commands of the store.
+
+Keyspace notifications are enabled in the server, with
+``CONFIG SET notify-keyspace-events``, if needed. Commands which change
+keys without notifications, such as ``FLUSHDB`` sent by other clients,
+are not seen by the cache until the cached replies time out. When the
+server refuses the ``CONFIG`` commands the cache is disabled and commands
+are executed without caching.
+'''
+import logging
+from collections import OrderedDict
+from itertools import chain
+
+from pulsar import ensure_future
+from pulsar.utils.pep import to_bytes, to_string
+from pulsar.apps.ds import COMMANDS_INFO, ResponseError
+
+
+# Read commands on a single key whose replies are cached
+CACHED_COMMANDS = frozenset(('exists', 'get', 'getrange', 'hexists', 'hget',
+                             'hgetall', 'hlen', 'lindex', 'llen', 'lrange',
+                             'scard', 'sismember', 'smembers', 'strlen',
+                             'type', 'zcard', 'zscore'))
+# Keyspace notification classes needed by the cache
+KEYSPACE_EVENTS = frozenset('g$lshzxet')
+
+logger = logging.getLogger('pulsar.redis')
+
+
+class ClientCache:
+    '''Least recently used cache of the replies of :data:`CACHED_COMMANDS`
+
+    .. attribute:: size
+
+        Maximum number of cached replies
+
+    .. attribute:: ttl
+
+        Number of seconds a reply is cached for, ``None`` for no limit
+
+    .. attribute:: enabled
+
+        ``False`` once the server refused to enable keyspace notifications
+    '''
+    def __init__(self, store, size, ttl=None):
+        self.store = store
+        self.size = size
+        self.ttl = ttl
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._loop = store._loop
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._loading = {}
+        self._pubsub = None
+        self._prefix = None
+        self._subscribing = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.store)
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def subscribed(self):
+        '''``True`` when receiving the keyspace notifications of the server
+        '''
+        return self._pubsub is not None
+
+    def info(self):
+        '''Size and hit/miss statistics of the cache
+        '''
+        requests = self.hits + self.misses
+        return {'size': self.size,
+                'ttl': self.ttl,
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'keys': len(self._keys),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions}
+
+    async def execute(self, execute, args, options):
+        '''Execute a command with the ``execute`` coroutine, replying from
+        the cache when possible
+        '''
+        command = to_string(args[0]).lower()
+        if (command in CACHED_COMMANDS and len(args) > 1 and not options and
+                self.enabled):
+            if self._pubsub is None:
+                await self._subscribe()
+            if not self.enabled:
+                return await execute(*args)
+            entry = (command,) + tuple(map(to_bytes, args[1:]))
+            cached = self._entries.get(entry)
+            if cached is not None:
+                value, expiry = cached
+                if expiry is None or expiry > self._loop.time():
+                    self._entries.move_to_end(entry)
+                    self.hits += 1
+                    return _copy(value)
+                self._remove(entry)
+            self.misses += 1
+            # a reply is stale if its key is invalidated while loading
+            key = entry[1]
+            stale = [False]
+            loading = self._loading.get(key)
+            if loading is None:
+                self._loading[key] = loading = []
+            loading.append(stale)
+            try:
+                value = await execute(*args)
+            finally:
+                loading.remove(stale)
+                if not loading:
+                    self._loading.pop(key)
+            if not stale[0] and self._pubsub is not None:
+                self._add(entry, _copy(value))
+            return value
+        keys = self._written_keys(command, args)
+        if keys is None:
+            return await execute(*args, **options)
+        self.invalidate(*keys)
+        try:
+            return await execute(*args, **options)
+        finally:
+            self.invalidate(*keys)
+
+    async def execute_pipeline(self, execute, commands, raise_on_error):
+        '''Execute pipeline ``commands`` with the ``execute`` coroutine and
+        invalidate the keys they write
+        '''
+        writes = [self._written_keys(to_string(args[0]).lower(), args)
+                  for args, _ in commands]
+        writes = [keys for keys in writes if keys is not None]
+        if not writes:
+            return await execute(commands, raise_on_error)
+        keys = tuple(chain.from_iterable(writes)) if all(writes) else ()
+        self.invalidate(*keys)
+        try:
+            return await execute(commands, raise_on_error)
+        finally:
+            self.invalidate(*keys)
+
+    def invalidate(self, *keys):
+        '''Remove the cached replies of ``keys``, of all keys when no key
+        is given
+        '''
+        if not keys:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys.clear()
+            for loading in self._loading.values():
+                for stale in loading:
+                    stale[0] = True
+        else:
+            for key in keys:
+                key = to_bytes(key)
+                for stale in self._loading.get(key, ()):
+                    stale[0] = True
+                entries = self._keys.pop(key, None)
+                if entries:
+                    self.invalidations += len(entries)
+                    for entry in entries:
+                        self._entries.pop(entry)
+
+    def close(self):
+        '''Stop receiving notifications and clear the cache
+        '''
+        pubsub = self._pubsub
+        self._lost()
+        if pubsub:
+            return ensure_future(pubsub.close(), loop=self._loop)
+
+    # INTERNALS
+    def _written_keys(self, command, args):
+        # Keys written by a command, an empty tuple for all keys and None
+        # for read commands
+        info = COMMANDS_INFO.get(command)
+        if info and info.write:
+            return info.request_keys(args) if info.keys else ()
+
+    def _add(self, entry, value):
+        entries = self._entries
+        if entry not in entries:
+            while len(entries) >= self.size:
+                self._remove(next(iter(entries)))
+                self.evictions += 1
+            key = entry[1]
+            keys = self._keys.get(key)
+            if keys is None:
+                self._keys[key] = keys = set()
+            keys.add(entry)
+        expiry = self._loop.time() + self.ttl if self.ttl else None
+        entries[entry] = (value, expiry)
+
+    def _remove(self, entry):
+        self._entries.pop(entry)
+        key = entry[1]
+        keys = self._keys[key]
+        keys.discard(entry)
+        if not keys:
+            self._keys.pop(key)
+
+    async def _subscribe(self):
+        if self._subscribing is None:
+            self._subscribing = ensure_future(self._start(), loop=self._loop)
+        await self._subscribing
+
+    async def _start(self):
+        store = self.store
+        try:
+            try:
+                events = await store._execute('config', 'get',
+                                              'notify-keyspace-events')
+                if isinstance(events, list):
+                    events = events[1] if len(events) > 1 else b''
+                events = to_string(events or b'')
+                if 'K' not in events or not ('A' in events or
+                                             KEYSPACE_EVENTS <= set(events)):
+                    await store._execute('config', 'set',
+                                         'notify-keyspace-events',
+                                         events + 'KA')
+            except ResponseError as exc:
+                # CONFIG is not available, replies cannot be invalidated
+                logger.warning('Client cache of %s disabled, keyspace '
+                               'notifications not enabled: %s', store, exc)
+                self.enabled = False
+                return
+            prefix = '__keyspace@%d__:' % store.database
+            pubsub = store.pubsub()
+            pubsub.add_client(self._notified)
+            pubsub.bind_event('connection_lost', self._lost)
+            await pubsub.psubscribe('%s*' % prefix)
+            self._prefix = prefix
+            self._pubsub = pubsub
+        finally:
+            self._subscribing = None
+
+    def _notified(self, channel, message):
+        if channel.startswith(self._prefix):
+            self.invalidate(channel[len(self._prefix):])
+
+    def _lost(self, *args, **kw):
+        # Without notifications cached replies can be stale
+        self._pubsub = None
+        self.invalidate()
+
+
+def _copy(value):
+    # Replies of lists, hashes and sets are mutable
+    return value.copy() if isinstance(value, (list, dict, set)) else value
@@ -100,6 +100,27 @@ def sort_return_tuples(response, groups=None, **options):
     return list(zip(*[response[i::groups] for i in range(groups)]))
 
 
+def scan_callback(response, callback=None):
+    cursor, values = response
+    return int(cursor), callback(values) if callback else values
+
+
+def zscan_pairs(response):
+    it = iter(response)
+    return [(member, float(score)) for member, score in zip(it, it)]
+
+
+def stream_entries(response):
+    return [(id, None if pairs is None else pairs_to_object(pairs))
+            for id, pairs in response]
+
+
+def xread_callback(response):
+    if not response:
+        return []
+    return [(key, stream_entries(entries)) for key, entries in response]
+
+
 def pubsub_callback(response, subcommand=None):
     if subcommand == 'numsub':
         it = iter(response)
@@ -121,6 +142,9 @@ class Consumer(pulsar.ProtocolConsumer):
         ),
         string_keys_to_dict('SORT', sort_return_tuples),
         string_keys_to_dict('BLPOP BRPOP', lambda r: r and tuple(r) or None),
+        string_keys_to_dict('BZPOPMIN BZPOPMAX',
+                            lambda r: r and (r[0], r[1], float(r[2])) or None),
+        string_keys_to_dict('ZPOPMIN ZPOPMAX', zscan_pairs),
         string_keys_to_dict('SMEMBERS SDIFF SINTER SUNION', set),
         string_keys_to_dict('INCRBYFLOAT HINCRBYFLOAT ZINCRBY ZSCORE',
                             lambda v: float(v) if v is not None else v),
@@ -129,7 +153,12 @@ class Consumer(pulsar.ProtocolConsumer):
         string_keys_to_dict('EXISTS EXPIRE EXPIREAT PEXPIRE PEXPIREAT '
                             'PERSIST RENAMENX',
                             lambda r: bool(r)),
+        string_keys_to_dict('SCAN SSCAN', scan_callback),
+        string_keys_to_dict('XRANGE XREVRANGE', stream_entries),
+        string_keys_to_dict('XREAD XREADGROUP', xread_callback),
         {
+            'HSCAN': lambda r: scan_callback(r, pairs_to_object),
+            'ZSCAN': lambda r: scan_callback(r, zscan_pairs),
             'PING': lambda r: r == b'PONG',
             'PUBSUB': pubsub_callback,
             'INFO': parse_info,
@@ -227,6 +256,16 @@ class RedisClient:
 
     # special commands
 
+    # KEYS
+    def scan(self, cursor=0, match=None, count=None, type=None):
+        """Incrementally iterate over keys.
+
+        Return a two elements tuple with the next ``cursor``
+        (``0`` when the iteration is over) and a list of keys.
+        """
+        return self.execute('scan', cursor,
+                            *self._scan_args(match, count, type))
+
     # STRINGS
     def decrby(self, key, ammount=None):
         if ammount is None:
@@ -285,7 +324,17 @@ class RedisClient:
         [args.extend(pair) for pair in mapping_iterator(iterable)]
         return self.execute('hmset', key, *args)
 
+    def hscan(self, key, cursor=0, match=None, count=None):
+        return self.execute('hscan', key, cursor,
+                            *self._scan_args(match, count))
+
     # LISTS
+    def blmove(self, src, dst, wherefrom, whereto, timeout=0):
+        if timeout is None:
+            timeout = 0
+        return self.execute_command('BLMOVE', src, dst, wherefrom, whereto,
+                                    timeout)
+
     def blpop(self, keys, timeout=0):
         if timeout is None:
             timeout = 0
@@ -311,7 +360,32 @@ class RedisClient:
             timeout = 0
         return self.execute_command('BRPOPLPUSH', src, dst, timeout)
 
+    # SETS
+    def sscan(self, key, cursor=0, match=None, count=None):
+        return self.execute('sscan', key, cursor,
+                            *self._scan_args(match, count))
+
     # SORTED SETS
+    def bzpopmax(self, keys, timeout=0):
+        if timeout is None:
+            timeout = 0
+        if isinstance(keys, str_or_bytes):
+            keys = [keys]
+        else:
+            keys = list(keys)
+        keys.append(timeout)
+        return self.execute_command('BZPOPMAX', *keys)
+
+    def bzpopmin(self, keys, timeout=0):
+        if timeout is None:
+            timeout = 0
+        if isinstance(keys, str_or_bytes):
+            keys = [keys]
+        else:
+            keys = list(keys)
+        keys.append(timeout)
+        return self.execute_command('BZPOPMIN', *keys)
+
     def zadd(self, name, *args, **kwargs):
         """
         Set any number of score, element-name pairs to the key ``name``. Pairs
@@ -401,6 +475,50 @@ class RedisClient:
         return self.execute_command('ZREVRANGEBYSCORE', key, min, max, *pieces,
                                     withscores=withscores)
 
+    def zscan(self, key, cursor=0, match=None, count=None):
+        return self.execute('zscan', key, cursor,
+                            *self._scan_args(match, count))
+
+    # STREAMS
+    def xadd(self, key, fields, id='*', maxlen=None, minid=None,
+             approximate=True, nomkstream=False):
+        pieces = []
+        if nomkstream:
+            pieces.append(b'NOMKSTREAM')
+        if maxlen is not None or minid is not None:
+            pieces.append(b'MAXLEN' if maxlen is not None else b'MINID')
+            if approximate:
+                pieces.append(b'~')
+            pieces.append(maxlen if maxlen is not None else minid)
+        pieces.append(id)
+        for pair in mapping_iterator(fields):
+            pieces.extend(pair)
+        return self.execute('xadd', key, *pieces)
+
+    def xrange(self, key, min='-', max='+', count=None):
+        pieces = [b'COUNT', count] if count is not None else []
+        return self.execute('xrange', key, min, max, *pieces)
+
+    def xrevrange(self, key, max='+', min='-', count=None):
+        pieces = [b'COUNT', count] if count is not None else []
+        return self.execute('xrevrange', key, max, min, *pieces)
+
+    def xread(self, streams, count=None, block=None):
+        '''Read entries of ``streams``, a mapping of keys to the IDs
+        after which entries are read, blocking for ``block`` milliseconds
+        when given
+        '''
+        return self.execute('xread', *self._xread_args(streams, count,
+                                                       block))
+
+    def xreadgroup(self, group, consumer, streams, count=None, block=None,
+                   noack=False):
+        pieces = [b'GROUP', group, consumer]
+        if noack:
+            pieces.append(b'NOACK')
+        pieces.extend(self._xread_args(streams, count, block))
+        return self.execute('xreadgroup', *pieces)
+
     def eval(self, script, keys=None, args=None):
         return self._eval('eval', script, keys, args)
 
@@ -484,6 +602,28 @@ class RedisClient:
             raise AttributeError("'%s' object has no attribute '%s'" %
                                  (type(self), name))
 
+    def _scan_args(self, match, count, type=None):
+        pieces = []
+        if match is not None:
+            pieces.extend((b'MATCH', match))
+        if count is not None:
+            pieces.extend((b'COUNT', count))
+        if type is not None:
+            pieces.extend((b'TYPE', type))
+        return pieces
+
+    def _xread_args(self, streams, count, block):
+        pieces = []
+        if count is not None:
+            pieces.extend((b'COUNT', count))
+        if block is not None:
+            pieces.extend((b'BLOCK', block))
+        keys, ids = zip(*mapping_iterator(streams))
+        pieces.append(b'STREAMS')
+        pieces.extend(keys)
+        pieces.extend(ids)
+        return pieces
+
     def _eval(self, command, script, keys, args):
         all_args = keys if keys is not None else ()
         num_keys = len(all_args)
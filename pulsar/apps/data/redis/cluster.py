@@ -0,0 +1,169 @@
+'''Routing of commands to the shards of a redis or pulsar-ds cluster.
+
+The slot map is fetched with ``CLUSTER SLOTS`` from the store address and
+refreshed when a shard replies with a ``MOVED`` error. Commands are sent to
+the shard owning the slot of their first key, ``MGET``, ``MSET`` and ``DEL``
+are split into one command per shard. The keys of a pipeline must be in
+the same slot.
+'''
+import asyncio
+from bisect import bisect_right
+from functools import partial
+
+from pulsar import Pool
+from pulsar.utils.pep import to_string
+from pulsar.apps.ds import COMMANDS_INFO, MovedError, ResponseError
+from pulsar.apps.ds.cluster import key_slot
+
+
+# Maximum number of MOVED redirections followed by a command
+MAX_REDIRECTIONS = 5
+
+
+class Cluster:
+    '''Route the commands of a :class:`.RedisStore` to the shards of
+    a cluster
+    '''
+    def __init__(self, store):
+        self.store = store
+        self._loop = store._loop
+        self._pools = {store._host: store._pool}
+        self._starts = None
+        self._ranges = None
+        self._refresh = None
+        self._split = {'mget': (1, self._mget),
+                       'mset': (2, self._mset),
+                       'del': (1, self._del)}
+
+    async def execute(self, command, *args, **options):
+        name = to_string(command).lower()
+        split = self._split.get(name)
+        if split:
+            width, combine = split
+            nodes = await self._nodes(args, width)
+            if len(nodes) > 1:
+                return combine(await asyncio.gather(*[
+                    self._execute(address, command, items, options)
+                    for address, (items, _) in nodes.items()],
+                    loop=self._loop), nodes.values())
+        info = COMMANDS_INFO.get(name)
+        keys = info.request_keys((name,) + args) if info else ()
+        address = await self._address(keys[0]) if keys else self.store._host
+        return await self._execute(address, command, args, options)
+
+    async def execute_pipeline(self, commands, raise_on_error=True):
+        '''Execute ``commands`` in the shard of their keys, which must
+        be in the same slot
+        '''
+        keys = []
+        for args, _ in commands:
+            info = COMMANDS_INFO.get(to_string(args[0]).lower())
+            if info:
+                keys.extend(info.request_keys(args))
+        if len(set(map(key_slot, keys))) > 1:
+            raise ResponseError("CROSSSLOT Keys in request don't hash to "
+                                "the same slot")
+        address = await self._address(keys[0]) if keys else self.store._host
+        pool = self._pool(address)
+        conn = await pool.connect()
+        with conn:
+            return await conn.execute_pipeline(commands, raise_on_error)
+
+    async def slots(self):
+        '''The ``(start, end, address)`` slot ranges of the cluster
+        '''
+        await self._slots()
+        return [(start, end, address)
+                for start, (end, address) in zip(self._starts, self._ranges)]
+
+    async def broadcast(self, command, *args, **options):
+        '''Execute a command in all shards and return the list of results
+        '''
+        await self._slots()
+        addresses = sorted(set((address for _, address in self._ranges)))
+        return await asyncio.gather(*[
+            self._execute(address, command, args, options)
+            for address in addresses], loop=self._loop)
+
+    def close(self):
+        '''Close the connections with all shards
+        '''
+        return asyncio.gather(*[pool.close() for pool in self._pools.values()],
+                              loop=self._loop)
+
+    # INTERNALS
+    async def _execute(self, address, command, args, options,
+                       redirections=0):
+        pool = self._pool(address)
+        conn = await pool.connect()
+        try:
+            with conn:
+                return await conn.execute(command, *args, **options)
+        except MovedError as exc:
+            if redirections >= MAX_REDIRECTIONS:
+                raise
+            await self._slots(True)
+            return await self._execute(exc.address, command, args, options,
+                                       redirections + 1)
+
+    async def _address(self, key):
+        await self._slots()
+        slot = key_slot(key)
+        index = bisect_right(self._starts, slot) - 1
+        if index < 0 or slot > self._ranges[index][0]:
+            raise ResponseError('Slot %d is not served by the cluster' % slot)
+        return self._ranges[index][1]
+
+    async def _nodes(self, args, width):
+        # Group the items of a multi-key command by shard, keeping
+        # the position of each key
+        nodes = {}
+        for index in range(0, len(args), width):
+            address = await self._address(args[index])
+            items, positions = nodes.setdefault(address, ([], []))
+            items.extend(args[index:index+width])
+            positions.append(index // width)
+        return nodes
+
+    async def _slots(self, refresh=False):
+        if self._starts is None or refresh:
+            if not self._refresh:
+                self._refresh = asyncio.ensure_future(self._fetch_slots(),
+                                                      loop=self._loop)
+            try:
+                await asyncio.shield(self._refresh, loop=self._loop)
+            finally:
+                self._refresh = None
+
+    async def _fetch_slots(self):
+        pool = self.store._pool
+        conn = await pool.connect()
+        with conn:
+            slots = await conn.execute('cluster', 'slots')
+        starts, ranges = [], []
+        for start, end, node, *_ in sorted(slots, key=lambda s: int(s[0])):
+            starts.append(int(start))
+            ranges.append((int(end), (to_string(node[0]), int(node[1]))))
+        self._starts, self._ranges = starts, ranges
+
+    def _pool(self, address):
+        pool = self._pools.get(address)
+        if pool is None:
+            store = self.store
+            pool = Pool(partial(store.connect, address=address),
+                        loop=self._loop, **store._pool_options)
+            self._pools[address] = pool
+        return pool
+
+    def _mget(self, results, nodes):
+        values = [None]*sum((len(positions) for _, positions in nodes))
+        for result, (_, positions) in zip(results, nodes):
+            for position, value in zip(positions, result):
+                values[position] = value
+        return values
+
+    def _mset(self, results, nodes):
+        return all(results)
+
+    def _del(self, results, nodes):
+        return sum(results)
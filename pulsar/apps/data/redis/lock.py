@@ -1,7 +1,36 @@
+'''Distributed locks on redis and pulsar-ds stores.
+
+A :class:`Lock` is a key set, if not already set, to a random token of the
+lock holder. The key is the lock name or, on a cluster, the lock name in
+a ``{<name>}`` hash tag so that the lock and its fencing counter are in
+the same slot.
+A lock acquired on a list of clients of independent stores follows the
+Redlock_ algorithm, it is held when acquired by a majority of the stores
+within its ``timeout``.
+
+Releasing a lock publishes a message in the ``<name>:released`` channel.
+Blocked :meth:`Lock.acquire` subscribe to it, with the
+:class:`LockWaiters` of the store, and try again once notified, or once
+the lease of the holder has expired, rather than polling the store.
+
+Each acquisition increments the ``<key>:fencing`` counter, the
+:attr:`Lock.fencing_token` of the holder. Tokens increase with each new
+holder and can be checked by the resources protected by the lock to
+reject the writes of a holder whose lease has expired.
+
+.. _Redlock: http://redis.io/topics/distlock
+'''
 import uuid
-from asyncio import sleep
+import logging
+from collections import OrderedDict
+from functools import partial
+from asyncio import sleep, gather, wait_for, TimeoutError
+
+from pulsar import isawaitable, ensure_future, LockError, LockBase
+from pulsar.apps.ds import NoScriptError
 
-from pulsar import isawaitable, LockError, LockBase
+
+logger = logging.getLogger('pulsar.redis')
 
 
 class RedisScript:
@@ -21,77 +50,334 @@ class RedisScript:
 
         result = client.evalsha(self.sha, keys, args)
         if isawaitable(result):
-            result = await result
+            try:
+                result = await result
+            except NoScriptError:
+                # the script cache of the server was flushed or, in a
+                # cluster, the script was loaded in another node.
+                # EVAL runs the script and caches it in the server
+                return await client.eval(self.script, keys, args)
         return result
 
 
+class LockWaiters:
+    '''Wake up the :class:`Lock` waiting for the release of a lock
+
+    One instance, with one :class:`.PubSub` handler, is shared by the
+    locks of a store. Channels are subscribed while at least one lock
+    waits on them. A release wakes up the lock waiting the longest only,
+    the other locks wait for the next release.
+    '''
+    def __init__(self, store):
+        self.store = store
+        self._loop = store._loop
+        self._pubsub = None
+        self._channels = {}
+        self._waiters = {}
+        self._unsubscribing = {}
+        self._generation = 0
+
+    @property
+    def generation(self):
+        '''Incremented when subscriptions are lost
+        '''
+        return self._generation
+
+    async def subscribe(self, channel):
+        '''Subscribe to ``channel``, once per waiting lock, and return the
+        generation of the subscription
+        '''
+        if self._pubsub is None:
+            self._pubsub = self.store.pubsub()
+            self._pubsub.add_client(self)
+            self._pubsub.bind_event('connection_lost', self._lost)
+        generation = self._generation
+        self._channels[channel] = self._channels.get(channel, 0) + 1
+        unsubscribing = self._unsubscribing.get(channel)
+        if unsubscribing:
+            await unsubscribing
+        await self._pubsub.subscribe(channel)
+        return generation
+
+    def unsubscribe(self, channel, generation):
+        '''Unsubscribe a lock from ``channel``. Subscriptions of a previous
+        generation were lost with their connection.
+        '''
+        if generation != self._generation:
+            return
+        count = self._channels.pop(channel, 0) - 1
+        if count > 0:
+            self._channels[channel] = count
+        else:
+            self._waiters.pop(channel, None)
+            if self._pubsub:
+                self._unsubscribing[channel] = ensure_future(
+                    self._unsubscribe(channel), loop=self._loop)
+
+    def waiter(self, channel):
+        '''A future called back by a message on ``channel``
+        '''
+        waiter = self._loop.create_future()
+        waiters = self._waiters.get(channel)
+        if waiters is None:
+            self._waiters[channel] = waiters = OrderedDict()
+        waiters[waiter] = None
+        waiter.add_done_callback(partial(waiters.pop, default=None))
+        return waiter
+
+    def close(self):
+        pubsub, self._pubsub = self._pubsub, None
+        self._lost()
+        if pubsub:
+            return ensure_future(pubsub.close(), loop=self._loop)
+
+    def __call__(self, channel, message):
+        waiters = self._waiters.get(channel)
+        while waiters:
+            waiter, _ = waiters.popitem(last=False)
+            if not waiter.done():
+                waiter.set_result(message)
+                break
+
+    async def _unsubscribe(self, channel):
+        try:
+            await self._pubsub.unsubscribe(channel)
+        finally:
+            self._unsubscribing.pop(channel, None)
+
+    def _lost(self, *args, **kw):
+        # wake up all waiters, they try again and subscribe again
+        self._pubsub = None
+        self._generation += 1
+        self._channels.clear()
+        waiters, self._waiters = self._waiters, {}
+        for channel in waiters.values():
+            for waiter in tuple(channel):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+
 class Lock(LockBase):
     """Asynchronous locking primitive for distributing computing
+
+    ``client`` is a :class:`.RedisClient` or, for the Redlock algorithm,
+    a list of clients of independent stores.
+
+    .. attribute:: sleep
+
+        Maximum number of seconds between two attempts to acquire the
+        lock when no release is notified, ``None`` to wait for the
+        notification or the expiry of the lease of the holder.
+
+    .. attribute:: auto_extend
+
+        Extend the lease, every third of ``timeout``, until released
+
+    .. attribute:: drift
+
+        Clock drift, as a fraction of ``timeout``, subtracted from the
+        validity of a lock acquired on several stores
     """
-    def __init__(self, client, name, timeout=None, blocking=True, sleep=0.2):
-        super().__init__(name, loop=client._loop, timeout=timeout,
+    def __init__(self, client, name, timeout=None, blocking=True, sleep=None,
+                 auto_extend=False, drift=0.01):
+        clients = list(client) if isinstance(client, (list, tuple)) else [
+            client]
+        super().__init__(name, loop=clients[0]._loop, timeout=timeout,
                          blocking=blocking)
         self._token = None
-        self.client = client
+        self._fencing_token = None
+        self._extending = None
+        self.client = clients[0]
+        self.clients = clients
+        self.quorum = len(clients) // 2 + 1
         self.sleep = sleep
-        if self.blocking:
+        self.auto_extend = auto_extend
+        self.drift = drift
+        if self.sleep and self.blocking and self.blocking is not True:
             self.sleep = min(self.sleep, self.blocking)
 
+    @property
+    def key(self):
+        '''Key of the lock in the stores, the :attr:`name` in a hash tag
+        when one of the stores is a cluster
+        '''
+        if any(client.store._cluster for client in self.clients):
+            return '{%s}' % self.name
+        return self.name
+
+    @property
+    def channel(self):
+        '''Channel of the release notifications
+        '''
+        return '%s:released' % self.name
+
+    @property
+    def fencing_token(self):
+        '''Fencing token of the current acquisition, an integer increasing
+        with each acquisition of the lock, or ``None``
+        '''
+        return self._fencing_token
+
     def locked(self):
         ''''Return the token that acquire the lock or None.
         '''
         return bool(self._token)
 
-    async def _acquire(self):
-        token = uuid.uuid1().hex.encode('utf-8')
-        timeout = self.timeout and int(self.timeout * 1000) or ''
-        acquired = await self.lua_acquire(self.client, keys=[self.name],
-                                          args=[token, timeout])
-        if acquired:
-            self._token = token
-
-        return acquired
-
     async def acquire(self):
         loop = self._loop
         start = loop.time()
-        acquired = await self._acquire()
-        if self.blocking is False:
+        acquired, expiry = await self._acquire()
+        if acquired or self.blocking is False:
             return acquired
         timeout = self.blocking
         if timeout is True:
             timeout = 0
-        while not acquired:
-            if timeout and loop.time() - start >= timeout:
-                break
-            await sleep(self.sleep)
-            acquired = await self._acquire()
-
+        waiters = self.client.store.lock_waiters()
+        channel = self.channel
+        generation = await waiters.subscribe(channel)
+        released = None
+        try:
+            while True:
+                if generation != waiters.generation:
+                    generation = await waiters.subscribe(channel)
+                # wait for releases notified after this attempt
+                released = waiters.waiter(channel)
+                acquired, expiry = await self._acquire()
+                if acquired:
+                    break
+                delays = [self.sleep, expiry]
+                if timeout:
+                    delays.append(timeout - loop.time() + start)
+                delays = [d for d in delays if d is not None]
+                delay = min(delays) if delays else None
+                if delay is not None and delay <= 0:
+                    break
+                try:
+                    await wait_for(released, delay, loop=loop)
+                except TimeoutError:
+                    pass
+        finally:
+            # a pending waiter would take the wake up of another lock
+            if released:
+                released.cancel()
+            waiters.unsubscribe(channel, generation)
         return acquired
 
     async def release(self):
         expected_token = self._token
         if not expected_token:
             raise LockError("Cannot release an unlocked lock")
-        released = await self.lua_release(self.client, keys=[self.name],
-                                          args=[expected_token])
         self._token = None
-        if not released:
+        self._fencing_token = None
+        if self._extending:
+            self._extending.cancel()
+            self._extending = None
+        released = await self._all(self.lua_release, expected_token,
+                                   self.channel)
+        if released < self.quorum:
             raise LockError("Cannot release a lock that's no longer owned")
         return True
 
+    async def extend(self, timeout=None):
+        '''Extend the lease of the lock to ``timeout`` seconds, by
+        default the lock ``timeout``
+        '''
+        if not self._token:
+            raise LockError("Cannot extend an unlocked lock")
+        timeout = timeout or self.timeout
+        if not timeout:
+            raise LockError("Cannot extend a lock without timeout")
+        extended = await self._all(self.lua_extend, self._token,
+                                   int(timeout * 1000))
+        return extended >= self.quorum
+
+    # INTERNALS
+    async def _acquire(self):
+        # Return whether the lock was acquired and, when not, the number
+        # of seconds before the lease of the holder expires or None
+        token = uuid.uuid1().hex.encode('utf-8')
+        timeout = self.timeout and int(self.timeout * 1000) or ''
+        keys = [self.key, '%s:fencing' % self.key]
+        start = self._loop.time()
+        results = await self._gather([
+            self.lua_acquire(client, keys=keys, args=[token, timeout])
+            for client in self.clients])
+        results = [tuple(map(int, r)) for r in results if r]
+        fences = [fence for fence, _ in results if fence]
+        expiries = [expiry for _, expiry in results if expiry > 0]
+        if len(fences) >= self.quorum:
+            validity = None
+            if self.timeout and len(self.clients) > 1:
+                validity = (self.timeout*(1 - self.drift) -
+                            self._loop.time() + start)
+            if validity is None or validity > 0:
+                fence = max(fences)
+                if len(set(fences)) > 1:
+                    # raise the counters behind so that any later majority
+                    # includes a counter at least equal to this token
+                    await self._gather([
+                        self.lua_fence(client, keys=keys[1:], args=[fence])
+                        for client in self.clients])
+                self._token = token
+                self._fencing_token = fence
+                if self.auto_extend and self.timeout:
+                    self._extending = ensure_future(self._extend(token),
+                                                    loop=self._loop)
+                return True, None
+        if fences:
+            # no quorum, remove the locks acquired without notifying
+            # the waiters since the lock was not released by a holder
+            await self._all(self.lua_discard, token)
+        return False, min(expiries) / 1000 if expiries else None
+
+    async def _all(self, script, *args):
+        # Number of stores where the script returned 1
+        results = await self._gather([
+            script(client, keys=[self.key], args=args)
+            for client in self.clients])
+        return sum(1 for result in results if result == 1)
+
+    async def _gather(self, coroutines):
+        # With several stores, an error is a failure in one store only
+        if len(coroutines) == 1:
+            return [await coroutines[0]]
+        results = await gather(*coroutines, return_exceptions=True,
+                               loop=self._loop)
+        return [None if isinstance(r, Exception) else r for r in results]
+
+    async def _extend(self, token):
+        while self._token == token:
+            await sleep(self.timeout / 3, loop=self._loop)
+            if self._token != token:
+                break
+            if not await self.extend():
+                logger.warning('Lost lock "%s" while extending its lease',
+                               self.name)
+                if self._token == token:
+                    self._token = None
+                    self._fencing_token = None
+                    self._extending = None
+                break
+
+    # KEYS[1] - lock key
+    # KEYS[2] - fencing counter
+    # ARGV[1] - token
+    # ARGV[2] - timeout in milliseconds or empty
+    # return {fencing token, 0} if the lock was acquired, otherwise
+    # {0, milliseconds before the lock expires or -1}
     lua_acquire = RedisScript("""
         if redis.call('setnx', KEYS[1], ARGV[1]) == 1 then
             if ARGV[2] ~= '' then
                 redis.call('pexpire', KEYS[1], ARGV[2])
             end
-            return 1
+            return {redis.call('incr', KEYS[2]), 0}
         end
-        return 0
+        return {0, redis.call('pttl', KEYS[1])}
     """)
 
-    # KEYS[1] - lock name
+    # KEYS[1] - lock key
     # ARGS[1] - token
+    # ARGS[2] - channel of release notifications
     # return 1 if the lock was released, otherwise 0
     lua_release = RedisScript("""
         local token = redis.call('get', KEYS[1])
@@ -99,5 +385,39 @@ class Lock(LockBase):
             return 0
         end
         redis.call('del', KEYS[1])
+        redis.call('publish', ARGV[2], ARGV[1])
+        return 1
+    """)
+
+    # KEYS[1] - lock key
+    # ARGS[1] - token
+    # return 1 if the lock was removed, otherwise 0
+    lua_discard = RedisScript("""
+        if redis.call('get', KEYS[1]) ~= ARGV[1] then
+            return 0
+        end
+        redis.call('del', KEYS[1])
+        return 1
+    """)
+
+    # KEYS[1] - lock key
+    # ARGS[1] - token
+    # ARGS[2] - timeout in milliseconds
+    # return 1 if the lease was extended, otherwise 0
+    lua_extend = RedisScript("""
+        if redis.call('get', KEYS[1]) ~= ARGV[1] then
+            return 0
+        end
+        redis.call('pexpire', KEYS[1], ARGV[2])
+        return 1
+    """)
+
+    # KEYS[1] - fencing counter
+    # ARGS[1] - fencing token
+    lua_fence = RedisScript("""
+        local fence = tonumber(redis.call('get', KEYS[1]) or '0')
+        if fence < tonumber(ARGV[1]) then
+            redis.call('set', KEYS[1], ARGV[1])
+        end
         return 1
     """)
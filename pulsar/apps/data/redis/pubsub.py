@@ -1,21 +1,42 @@
+from collections import deque
 from functools import partial
 from asyncio import gather
 
-from pulsar import Protocol
+from pulsar import Protocol, ensure_future
+from pulsar.utils.pep import to_bytes
 from pulsar.apps.data import PubSub
 
 
 class PubsubProtocol(Protocol):
+    '''Protocol of a subscribed connection
 
+    When the store is multiplexed, each command is followed by a ``PING``
+    and completes once its ``PONG`` is received, when the server has
+    processed the command. Commands sent over the multiplexed connections
+    afterwards see the changed subscriptions. Without a command only the
+    ``PING`` is sent.
+    '''
     def __init__(self, handler, **kw):
         super().__init__(handler._loop, **kw)
         self.parser = self._producer._parser_class()
         self.handler = handler
+        self._waiting = deque()
+        self.bind_event('connection_lost', self._abort)
 
     async def execute(self, *args):
         # must be an asynchronous object like the base class method
-        chunk = self.parser.multi_bulk(args)
-        self._transport.write(chunk)
+        parser = self.parser
+        if not self._producer._multiplex:
+            if args:
+                self._transport.write(parser.multi_bulk(args))
+            return
+        data = parser.multi_bulk((b'PING',))
+        if args:
+            data = parser.multi_bulk(args) + data
+        self._transport.write(data)
+        waiter = self._loop.create_future()
+        self._waiting.append(waiter)
+        await waiter
 
     def data_received(self, data):
         parser = self.parser
@@ -25,20 +46,229 @@ class PubsubProtocol(Protocol):
             if not isinstance(response, Exception):
                 if isinstance(response, list):
                     command = response[0]
-                    if command == b'message':
-                        response = response[1:3]
-                        self.handler.broadcast(response)
-                    elif command == b'pmessage':
-                        response = response[2:4]
-                        self.handler.broadcast(response)
+                    if command == b'message' or command == b'pmessage':
+                        self.message_received(response)
+                    elif command == b'pong':
+                        self._pong()
+                elif response == b'PONG':
+                    self._pong()
             else:
                 raise response
             response = parser.get()
 
+    def message_received(self, response):
+        '''Broadcast a ``message`` or ``pmessage`` reply to the handler
+        '''
+        self.handler.broadcast(response[-2:])
+
+    def _pong(self):
+        if self._waiting:
+            waiter = self._waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _abort(self, _, exc=None):
+        waiting, self._waiting = self._waiting, deque()
+        for waiter in waiting:
+            if not waiter.done():
+                waiter.set_exception(
+                    exc or ConnectionResetError('%s closed' % self))
+
+
+# PubSubFanIn shared by the stores of a process
+_FANINS = {}
+
+
+class FanInProtocol(PubsubProtocol):
+    '''Subscribed connection of a :class:`.PubSubFanIn`
+    '''
+    def message_received(self, response):
+        self.handler.dispatch(response)
+
+
+class PubSubFanIn:
+    '''One subscribed connection shared by the :class:`.RedisPubSub`
+    handlers of the stores of a server
+
+    Channels and patterns are subscribed with the server when the first
+    handler subscribes to them and unsubscribed when the last handler
+    unsubscribes. Messages are dispatched to the handlers subscribed to
+    their channel, or pattern, with an in memory index, so that the number
+    of subscribed connections no longer grows with the number of handlers.
+
+    Stores of a process with the same event loop, address and password
+    share one fan-in, obtained with :meth:`acquire`, whatever their
+    database since channels are not bound to databases. The connection is
+    closed once all these stores have released it.
+    '''
+    def __init__(self, store):
+        self.store = store
+        self._loop = store._loop
+        self._connection = None
+        self._connecting = None
+        self._channels = {}
+        self._patterns = {}
+        self._stores = []
+
+    @classmethod
+    def acquire(cls, store):
+        '''The fan-in shared by ``store`` with the other stores of the same
+        server
+        '''
+        key = (store._loop, store._host, store._password,
+               bool(store._multiplex))
+        fanin = _FANINS.get(key)
+        if fanin is None:
+            _FANINS[key] = fanin = cls(store)
+            fanin._key = key
+        fanin._stores.append(store)
+        return fanin
+
+    def release(self, store):
+        '''Release the fan-in acquired by ``store``, the shared connection
+        is closed when no other store uses it
+        '''
+        if store in self._stores:
+            self._stores.remove(store)
+        if not self._stores:
+            if _FANINS.get(getattr(self, '_key', None)) is self:
+                _FANINS.pop(self._key)
+            return self.close()
+        if self.store is store:
+            # connect with a store still in use
+            self.store = self._stores[0]
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.store)
+    __str__ = __repr__
+
+    @property
+    def channels(self):
+        '''Number of local handlers subscribed to each channel
+        '''
+        return dict(((name, len(handlers))
+                     for name, handlers in self._channels.items()))
+
+    @property
+    def patterns(self):
+        '''Number of local handlers subscribed to each pattern
+        '''
+        return dict(((name, len(handlers))
+                     for name, handlers in self._patterns.items()))
+
+    async def subscribe(self, handler, command, names):
+        '''Subscribe ``handler`` to channels, or patterns when ``command``
+        is ``PSUBSCRIBE``, and return the shared connection
+        '''
+        index = self._index(command)
+        new = []
+        for name in names:
+            name = to_bytes(name)
+            handlers = index.get(name)
+            if handlers is None:
+                index[name] = handlers = set()
+                new.append(name)
+            handlers.add(handler)
+        try:
+            connection = await self._connect()
+        except Exception:
+            for name in new:
+                self._index(command).pop(name, None)
+            raise
+        if new:
+            await connection.execute(command, *new)
+        else:
+            # wait for the subscriptions of other handlers
+            await connection.execute()
+        return connection
+
+    async def unsubscribe(self, handler, command, names=None):
+        '''Unsubscribe ``handler`` from channels, or patterns when
+        ``command`` is ``PUNSUBSCRIBE``, from all of them when no names
+        are given
+        '''
+        index = self._index(command)
+        if names:
+            names = [to_bytes(name) for name in names]
+        else:
+            names = [name for name, handlers in index.items()
+                     if handler in handlers]
+        gone = []
+        for name in names:
+            handlers = index.get(name)
+            if handlers and handler in handlers:
+                handlers.discard(handler)
+                if not handlers:
+                    index.pop(name)
+                    gone.append(name)
+        if gone and self._connection:
+            await self._connection.execute(command, *gone)
+
+    def dispatch(self, response):
+        '''Dispatch a ``message`` or ``pmessage`` reply to the handlers
+        subscribed to its channel or pattern
+        '''
+        if response[0] == b'message':
+            handlers = self._channels.get(response[1])
+        else:
+            handlers = self._patterns.get(response[1])
+        if handlers:
+            message = response[-2:]
+            for handler in tuple(handlers):
+                handler.broadcast(message)
+
+    def close(self):
+        '''Close the shared connection
+        '''
+        if self._connection:
+            return self._connection.close()
+
+    # INTERNALS
+    def _index(self, command):
+        if command.upper().startswith('P'):
+            return self._patterns
+        return self._channels
+
+    async def _connect(self):
+        if self._connection:
+            return self._connection
+        if self._connecting is None:
+            self._connecting = ensure_future(self._open(), loop=self._loop)
+        return await self._connecting
+
+    async def _open(self):
+        try:
+            protocol_factory = partial(FanInProtocol, self,
+                                       producer=self.store)
+            connection = await self.store.connect(protocol_factory)
+            connection.bind_event('connection_lost', self._lost)
+            self._connection = connection
+            return connection
+        finally:
+            self._connecting = None
+
+    def _lost(self, _, exc=None):
+        # subscriptions are lost with the connection
+        handlers = set()
+        for index in (self._channels, self._patterns):
+            for subscribed in index.values():
+                handlers.update(subscribed)
+            index.clear()
+        self._connection = None
+        for handler in handlers:
+            handler._conn_lost(None, exc)
+
 
 class RedisPubSub(PubSub):
     '''Asynchronous Publish/Subscriber handler for pulsar and redis stores.
+
+    When the store has a :class:`.PubSubFanIn`, subscriptions go through
+    its shared connection.
     '''
+    def __init__(self, store, protocol=None):
+        super().__init__(store, protocol=protocol)
+        self._fanin = getattr(store, 'fanin', None)
+
     def publish(self, channel, message):
         if self._protocol:
             message = self._protocol.encode(message)
@@ -65,7 +295,7 @@ class RedisPubSub(PubSub):
 
     def punsubscribe(self, *patterns):
         if self._connection:
-            return self._connection.execute('PUNSUBSCRIBE', *patterns)
+            return self._unsubscribe('PUNSUBSCRIBE', *patterns)
 
     def subscribe(self, channel, *channels):
         return self._subscribe('SUBSCRIBE', channel, *channels)
@@ -74,21 +304,28 @@ class RedisPubSub(PubSub):
         '''Un-subscribe from a list of ``channels``.
         '''
         if self._connection:
-            return self._connection.execute('UNSUBSCRIBE', *channels)
+            return self._unsubscribe('UNSUBSCRIBE', *channels)
 
     async def close(self):
         '''Stop listening for messages.
         '''
         if self._connection:
             await gather(
-                self._connection.execute('PUNSUBSCRIBE'),
-                self._connection.execute('UNSUBSCRIBE'),
+                self._unsubscribe('PUNSUBSCRIBE'),
+                self._unsubscribe('UNSUBSCRIBE'),
                 loop=self._loop
             )
-            await self._connection.close()
+            if self._fanin:
+                self._connection = None
+            else:
+                await self._connection.close()
 
     #    INTERNALS
     async def _subscribe(self, *args):
+        if self._fanin:
+            self._connection = await self._fanin.subscribe(self, args[0],
+                                                           args[1:])
+            return
         if not self._connection:
             protocol_factory = partial(PubsubProtocol, self,
                                        producer=self.store)
@@ -97,6 +334,11 @@ class RedisPubSub(PubSub):
         result = await self._connection.execute(*args)
         return result
 
+    def _unsubscribe(self, *args):
+        if self._fanin:
+            return self._fanin.unsubscribe(self, args[0], args[1:])
+        return self._connection.execute(*args)
+
     def _conn_lost(self, con, exc=None):
         self._connection = None
         self.fire_event('connection_lost')
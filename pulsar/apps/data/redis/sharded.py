@@ -0,0 +1,259 @@
+'''Distribution of keys among several redis or pulsar-ds stores.
+
+Nodes are placed on a consistent hash ring at ``replicas`` virtual points
+each, a key belongs to the node of the first point following its hash.
+Adding a node only moves the keys falling before its points, about one
+key out of the number of nodes, while removing one moves only its keys.
+
+As in a redis cluster, only the part of a key between ``{`` and ``}``,
+the hash tag, is hashed when present, so that keys sharing a tag are
+stored in the same node. ``MGET``, ``MSET`` and ``DEL`` are split into
+one command per node, other commands must have all their keys in one
+node.
+'''
+import asyncio
+from bisect import bisect, insort
+from collections import OrderedDict
+from hashlib import md5
+
+from pulsar.utils.pep import to_bytes, to_string
+from pulsar.apps.ds import COMMANDS_INFO, ResponseError
+from pulsar.apps.data import create_store, parse_store_url
+
+from .client import RedisClient, Pipeline
+
+
+def hash_key(key):
+    '''The position of ``key`` in a hash ring, a 32 bits integer
+    '''
+    key = to_bytes(key)
+    start = key.find(b'{')
+    if start >= 0:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start+1:end]
+    return int.from_bytes(md5(key).digest()[:4], 'little')
+
+
+def node_points(name, replicas):
+    '''The ``replicas`` positions of the node ``name`` in a hash ring
+    '''
+    points = []
+    for index in range((replicas + 3) // 4):
+        digest = md5(('%s-%d' % (name, index)).encode('utf-8')).digest()
+        points.extend(int.from_bytes(digest[n:n+4], 'little')
+                      for n in range(0, 16, 4))
+    return points[:replicas]
+
+
+class ShardedStore:
+    '''Distribute the keys of commands among several :class:`.RedisStore`
+    with a consistent hash ring
+
+    ``urls`` is a list of ``redis://`` or ``pulsar://`` urls, other key
+    valued parameters are passed to :func:`.create_store` for each node.
+    Transactions and pipelines are split into one transaction per node,
+    executed in parallel, and are therefore not atomic across nodes.
+    Commands without keys are sent to the first node.
+
+    .. attribute:: replicas
+
+        Number of virtual nodes of each store in the ring
+    '''
+    def __init__(self, urls, replicas=160, **kw):
+        self.replicas = replicas
+        self._params = kw
+        self._nodes = OrderedDict()
+        self._points = []
+        self._ring = {}
+        self._split = {'mget': (1, self._mget),
+                       'mset': (2, self._mset),
+                       'del': (1, self._del)}
+        for url in urls:
+            self.add_node(url)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join(self._nodes))
+    __str__ = __repr__
+
+    @property
+    def _loop(self):
+        return self.first_node._loop
+
+    @property
+    def nodes(self):
+        '''The list of stores in the ring
+        '''
+        return list(self._nodes.values())
+
+    @property
+    def first_node(self):
+        if not self._nodes:
+            raise ResponseError('No node in the ring')
+        return next(iter(self._nodes.values()))
+
+    def add_node(self, url, **kw):
+        '''Add a node to the ring and return its store
+        '''
+        params = self._params.copy()
+        params.update(kw)
+        store = create_store(url, **params)
+        name = self.node_name(store)
+        if name in self._nodes:
+            raise ValueError('Node %s already in the ring' % name)
+        self._nodes[name] = store
+        for point in node_points(name, self.replicas):
+            # the first node owning a point keeps it
+            if point not in self._ring:
+                self._ring[point] = name
+                insort(self._points, point)
+        return store
+
+    def remove_node(self, node):
+        '''Remove a node, given by its url or store, from the ring and
+        return its store
+        '''
+        store = self._nodes.pop(self.node_name(node))
+        self._points = []
+        self._ring = {}
+        for node in self._nodes:
+            for point in node_points(node, self.replicas):
+                if point not in self._ring:
+                    self._ring[point] = node
+                    self._points.append(point)
+        self._points.sort()
+        return store
+
+    def node(self, key):
+        '''The store of ``key``
+        '''
+        return self._nodes[self._node_name(key)]
+
+    def node_name(self, store):
+        '''Name of the node of a ``store``, or of its url, in the ring:
+        its address and database
+        '''
+        if isinstance(store, str):
+            _, host, params = parse_store_url(store)
+            database = params.get('database')
+        else:
+            host, database = store._host, store.database
+        if isinstance(host, tuple):
+            host = '%s:%s' % host
+        return '%s/%s' % (host, database or 0)
+
+    def client(self):
+        '''Get a :class:`.RedisClient` for the sharded store'''
+        return RedisClient(self)
+
+    def pipeline(self):
+        '''Get a :class:`.Pipeline` for the sharded store'''
+        return Pipeline(self)
+
+    def pubsub(self, protocol=None):
+        '''Publish and subscribe with the first node
+        '''
+        return self.first_node.pubsub(protocol=protocol)
+
+    async def ping(self):
+        return all(await self.broadcast('ping'))
+
+    async def execute(self, command, *args, **options):
+        name = to_string(command).lower()
+        split = self._split.get(name)
+        if split:
+            width, combine = split
+            nodes = self._group(args, width)
+            if len(nodes) > 1:
+                return combine(await asyncio.gather(*[
+                    self._nodes[node].execute(command, *items, **options)
+                    for node, (items, _) in nodes.items()],
+                    loop=self._loop), nodes.values())
+        store = self._command_node(name, command, args)
+        return await store.execute(command, *args, **options)
+
+    async def execute_pipeline(self, commands, raise_on_error=True):
+        '''Execute the commands of a transaction, between ``MULTI`` and
+        ``EXEC``, in one transaction per node
+        '''
+        first, *commands, last = commands
+        nodes = OrderedDict()
+        for position, (args, options) in enumerate(commands):
+            store = self._command_node(to_string(args[0]).lower(),
+                                       args[0], args[1:])
+            node = nodes.get(store)
+            if node is None:
+                nodes[store] = node = ([first], [])
+            node[0].append((args, options))
+            node[1].append(position)
+        results = await asyncio.gather(*[
+            store.execute_pipeline(cmds + [last], raise_on_error)
+            for store, (cmds, _) in nodes.items()], loop=self._loop)
+        response = [None]*len(commands)
+        for result, (_, positions) in zip(results, nodes.values()):
+            for position, value in zip(positions, result):
+                response[position] = value
+        return response
+
+    def broadcast(self, command, *args, **options):
+        '''Execute a command in all nodes and return the list of results
+        '''
+        return asyncio.gather(*[store.execute(command, *args, **options)
+                                for store in self._nodes.values()],
+                              loop=self._loop)
+
+    def flush(self):
+        return self.broadcast('flushdb')
+
+    def close(self):
+        '''Close the connections with all nodes
+        '''
+        return asyncio.gather(*[store.close()
+                                for store in self._nodes.values()],
+                              loop=self._loop)
+
+    # INTERNALS
+    def _node_name(self, key):
+        points = self._points
+        if not points:
+            raise ResponseError('No node in the ring')
+        index = bisect(points, hash_key(key))
+        return self._ring[points[index if index < len(points) else 0]]
+
+    def _command_node(self, name, command, args):
+        # The store of the keys of a command
+        info = COMMANDS_INFO.get(name)
+        keys = info.request_keys((command,) + tuple(args)) if info else ()
+        if not keys:
+            return self.first_node
+        node = self._node_name(keys[0])
+        for key in keys[1:]:
+            if self._node_name(key) != node:
+                raise ResponseError("CROSSSHARD Keys in request don't hash "
+                                    "to the same node")
+        return self._nodes[node]
+
+    def _group(self, args, width):
+        # Group the items of a multi-key command by node, keeping
+        # the position of each key
+        nodes = OrderedDict()
+        for index in range(0, len(args), width):
+            node = self._node_name(args[index])
+            items, positions = nodes.setdefault(node, ([], []))
+            items.extend(args[index:index+width])
+            positions.append(index // width)
+        return nodes
+
+    def _mget(self, results, nodes):
+        values = [None]*sum((len(positions) for _, positions in nodes))
+        for result, (_, positions) in zip(results, nodes):
+            for position, value in zip(positions, result):
+                values[position] = value
+        return values
+
+    def _mset(self, results, nodes):
+        return all(results)
+
+    def _del(self, results, nodes):
+        return sum(results)
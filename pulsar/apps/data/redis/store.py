@@ -1,12 +1,18 @@
+import asyncio
+from collections import deque
 from functools import partial
+from operator import attrgetter
 
-from pulsar import Connection, Pool, get_actor
+from pulsar import Connection, Pool, get_actor, ensure_future
 from pulsar.utils.pep import to_string
 from pulsar.apps.data import RemoteStore
 from pulsar.apps.ds import redis_parser
 
 from .client import RedisClient, Pipeline, Consumer, ResponseError
-from .pubsub import RedisPubSub
+from .pubsub import RedisPubSub, PubSubFanIn
+from .cluster import Cluster
+from .cache import ClientCache
+from .lock import LockWaiters
 
 
 class RedisStoreConnection(Connection):
@@ -32,14 +38,124 @@ class RedisStoreConnection(Connection):
         return result
 
 
+class MultiplexConnection(RedisStoreConnection):
+    '''A :class:`.RedisStoreConnection` shared by concurrent coroutines
+
+    Commands are not written when :meth:`execute` is called but queued
+    and written at once, with ``pack_pipeline``, in the next iteration of
+    the event loop. Responses are matched to commands first in first out.
+    '''
+    RESPONSE_CALLBACKS = Consumer.RESPONSE_CALLBACKS
+    parse_response = Consumer.parse_response
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._commands = []
+        self._waiting = deque()
+        self.bind_event('connection_lost', self._abort)
+
+    @property
+    def pending(self):
+        '''Number of commands waiting for a response
+        '''
+        return len(self._waiting)
+
+    def execute(self, *args, **options):
+        if self.closed:
+            raise ConnectionResetError('%s is closed' % self)
+        future = self._loop.create_future()
+        if not self._commands:
+            self._loop.call_soon(self._flush)
+        self._commands.append((args, options))
+        self._waiting.append((args[0], options, future))
+        return future
+
+    def data_received(self, data):
+        parser = self.parser
+        parser.feed(data)
+        response = parser.get()
+        while response is not False:
+            if not self._waiting:
+                # a response without command, responses can no longer be
+                # matched to their commands
+                self.logger.error('Unexpected response in %s, closing',
+                                  self)
+                self.close()
+                return
+            command, options, future = self._waiting.popleft()
+            if not future.done():
+                if isinstance(response, Exception):
+                    future.set_exception(response)
+                else:
+                    try:
+                        response = self.parse_response(response, command,
+                                                       options)
+                    except Exception as exc:
+                        future.set_exception(exc)
+                    else:
+                        future.set_result(response)
+            response = parser.get()
+
+    # INTERNALS
+    def _flush(self):
+        commands, self._commands = self._commands, []
+        if commands and not self.closed:
+            self._transport.write(self.parser.pack_pipeline(commands))
+
+    def _abort(self, _, exc=None):
+        self._commands = []
+        waiting, self._waiting = self._waiting, deque()
+        for _, _, future in waiting:
+            if not future.done():
+                future.set_exception(
+                    exc or ConnectionResetError('%s closed' % self))
+
+
 class RedisStore(RemoteStore):
     '''Redis :class:`.Store` implementation.
+
+    When the ``cluster`` parameter is set, for example with the
+    ``pulsar://127.0.0.1:6410?cluster=1`` url, commands are routed to the
+    shards of a cluster by the slot of their keys.
+
+    When the ``multiplex`` parameter is set to a positive number, for
+    example with the ``pulsar://127.0.0.1:6410?multiplex=2`` url, single
+    commands are sent over at most ``multiplex`` shared
+    :class:`.MultiplexConnection` rather than checking a connection out
+    of the :attr:`pool`. Pipelines and the :attr:`POOL_COMMANDS`, which
+    block or change the state of a connection, still use the pool.
+
+    When the ``cache`` parameter is set to a positive number, for example
+    with the ``pulsar://127.0.0.1:6410?cache=1000&cache_ttl=60`` url, the
+    replies of reads on single keys are cached in a :class:`.ClientCache`
+    of at most ``cache`` replies, for at most ``cache_ttl`` seconds, and
+    invalidated by keyspace notifications. The cache is not available
+    with ``cluster``.
+
+    The ``pool_min_size``, ``pool_idle_timeout`` and
+    ``pool_max_lifetime`` parameters set the ``min_size``,
+    ``idle_timeout`` and ``max_lifetime`` of the connection :attr:`pool`,
+    reported by :meth:`pool_stats`.
+
+    When the ``shared_pubsub`` parameter is set, for example with the
+    ``pulsar://127.0.0.1:6410?shared_pubsub=1`` url, all the
+    :meth:`pubsub` handlers of the store subscribe over the one connection
+    of a :class:`.PubSubFanIn`, which counts as a single subscriber in
+    the server. The connection is shared with the other stores of the
+    process connected to the same server with ``shared_pubsub``.
     '''
     protocol_factory = partial(RedisStoreConnection, Consumer)
     supported_queries = frozenset(('filter', 'exclude'))
+    POOL_COMMANDS = frozenset((
+        'auth', 'blmove', 'blpop', 'brpop', 'brpoplpush', 'bzpopmax',
+        'bzpopmin', 'client', 'discard', 'exec', 'monitor', 'multi',
+        'psubscribe', 'punsubscribe', 'quit', 'select', 'subscribe',
+        'unsubscribe', 'unwatch', 'wait', 'watch', 'xread', 'xreadgroup'))
 
     def _init(self, namespace=None, parser_class=None, pool_size=50,
-              decode_responses=False, **kwargs):
+              decode_responses=False, cluster=False, multiplex=0, cache=0,
+              cache_ttl=None, shared_pubsub=False, pool_min_size=0,
+              pool_idle_timeout=None, pool_max_lifetime=None, **kwargs):
         self._decode_responses = decode_responses
         if not parser_class:
             actor = get_actor()
@@ -48,7 +164,38 @@ class RedisStore(RemoteStore):
         self._parser_class = parser_class
         if namespace:
             self._urlparams['namespace'] = namespace
-        self._pool = Pool(self.connect, pool_size=pool_size, loop=self._loop)
+        self._pool_options = {
+            'pool_size': int(pool_size),
+            'min_size': int(pool_min_size or 0),
+            'idle_timeout': float(pool_idle_timeout or 0) or None,
+            'max_lifetime': float(pool_max_lifetime or 0) or None}
+        for name in ('min_size', 'idle_timeout', 'max_lifetime'):
+            if self._pool_options[name]:
+                self._urlparams['pool_%s' % name] = self._pool_options[name]
+        self._pool = Pool(self.connect, loop=self._loop,
+                          **self._pool_options)
+        self._cluster = None
+        if cluster and cluster not in ('0', 'false'):
+            self._urlparams['cluster'] = 1
+            self._cluster = Cluster(self)
+        self._multiplex = int(multiplex or 0)
+        if self._multiplex:
+            self._urlparams['multiplex'] = self._multiplex
+        self._multiplexed = []
+        self._multiplex_connect = None
+        self._cache = None
+        cache = int(cache or 0)
+        if cache and not self._cluster:
+            self._urlparams['cache'] = cache
+            cache_ttl = float(cache_ttl) if cache_ttl else None
+            if cache_ttl:
+                self._urlparams['cache_ttl'] = cache_ttl
+            self._cache = ClientCache(self, cache, cache_ttl)
+        self._lock_waiters = None
+        self._fanin = None
+        if shared_pubsub and shared_pubsub not in ('0', 'false'):
+            self._urlparams['shared_pubsub'] = 1
+            self._fanin = PubSubFanIn.acquire(self)
         if self._database is None:
             self._database = 0
         self._database = int(self._database)
@@ -58,6 +205,28 @@ class RedisStore(RemoteStore):
     def pool(self):
         return self._pool
 
+    def pool_stats(self):
+        '''The :meth:`.Pool.stats` of the connection pools, by address
+        '''
+        pools = self._cluster._pools if self._cluster else {
+            self._host: self._pool}
+        return dict(((address if isinstance(address, str) else
+                      '%s:%s' % address, pool.stats())
+                     for address, pool in pools.items()))
+
+    @property
+    def cache(self):
+        '''The :class:`.ClientCache` of this store, if enabled
+        '''
+        return self._cache
+
+    @property
+    def fanin(self):
+        '''The :class:`.PubSubFanIn` shared by the :meth:`pubsub` handlers,
+        if enabled
+        '''
+        return self._fanin
+
     @property
     def namespace(self):
         '''The prefix namespace to append to all transaction on keys
@@ -79,30 +248,58 @@ class RedisStore(RemoteStore):
     def pubsub(self, protocol=None):
         return RedisPubSub(self, protocol=protocol)
 
+    def lock_waiters(self):
+        '''The :class:`.LockWaiters` of the locks of this store
+        '''
+        if self._lock_waiters is None:
+            self._lock_waiters = LockWaiters(self)
+        return self._lock_waiters
+
     def ping(self):
         return self.client().ping()
 
     async def execute(self, *args, **options):
+        if self._cache is not None:
+            return await self._cache.execute(self._execute, args, options)
+        return await self._execute(*args, **options)
+
+    async def execute_pipeline(self, commands, raise_on_error=True):
+        if self._cache is not None:
+            return await self._cache.execute_pipeline(
+                self._execute_pipeline, commands, raise_on_error)
+        return await self._execute_pipeline(commands, raise_on_error)
+
+    async def _execute(self, *args, **options):
+        if self._cluster:
+            return await self._cluster.execute(*args, **options)
+        if (self._multiplex and
+                to_string(args[0]).lower() not in self.POOL_COMMANDS):
+            connection = await self._multiplexed_connection()
+            return await connection.execute(*args, **options)
         connection = await self._pool.connect()
         with connection:
             result = await connection.execute(*args, **options)
             return result
 
-    async def execute_pipeline(self, commands, raise_on_error=True):
+    async def _execute_pipeline(self, commands, raise_on_error=True):
+        if self._cluster:
+            return await self._cluster.execute_pipeline(commands,
+                                                        raise_on_error)
         conn = await self._pool.connect()
         with conn:
             result = await conn.execute_pipeline(commands, raise_on_error)
             return result
 
-    async def connect(self, protocol_factory=None):
+    async def connect(self, protocol_factory=None, address=None):
         protocol_factory = protocol_factory or self.create_protocol
-        if isinstance(self._host, tuple):
-            host, port = self._host
+        address = address or self._host
+        if isinstance(address, tuple):
+            host, port = address
             transport, connection = await self._loop.create_connection(
                 protocol_factory, host, port)
         else:
             raise NotImplementedError('Could not connect to %s' %
-                                      str(self._host))
+                                      str(address))
         if self._password:
             await connection.execute('AUTH', self._password)
         if self._database:
@@ -110,11 +307,24 @@ class RedisStore(RemoteStore):
         return connection
 
     def flush(self):
+        if self._cluster:
+            return self._cluster.broadcast('flushdb')
         return self.execute('flushdb')
 
     def close(self):
         '''Close all open connections.'''
-        return self._pool.close()
+        waiters = [connection.close() for connection in self._multiplexed]
+        for closing in (self._cache, self._lock_waiters):
+            if closing is not None:
+                waiters.append(closing.close())
+        if self._fanin is not None:
+            waiters.append(self._fanin.release(self))
+        if self._cluster:
+            waiters.append(self._cluster.close())
+        else:
+            waiters.append(self._pool.close())
+        return asyncio.gather(*[w for w in waiters if w is not None],
+                              loop=self._loop)
 
     def has_query(self, query_type):
         return query_type in self.supported_queries
@@ -131,6 +341,42 @@ class RedisStore(RemoteStore):
         data['namespace'] = self.basekey(meta)
         return data
 
+    # INTERNALS
+    async def _multiplexed_connection(self):
+        # The multiplexed connection with the fewest commands waiting for
+        # a response. A new one is opened in the background when all are
+        # busy, until there are ``multiplex`` of them.
+        connections = self._multiplexed
+        while connections:
+            connection = min(connections, key=attrgetter('pending'))
+            if connection.closed:
+                connections.remove(connection)
+                continue
+            if (connection.pending and len(connections) < self._multiplex and
+                    self._multiplex_connect is None):
+                self._multiplex_connect = ensure_future(
+                    self._connect_multiplexed(), loop=self._loop)
+            return connection
+        if self._multiplex_connect is None:
+            self._multiplex_connect = ensure_future(
+                self._connect_multiplexed(), loop=self._loop)
+        return await self._multiplex_connect
+
+    async def _connect_multiplexed(self):
+        try:
+            connection = await self.connect(partial(
+                MultiplexConnection, loop=self._loop, producer=self,
+                logger=self._logger))
+        finally:
+            self._multiplex_connect = None
+        self._multiplexed.append(connection)
+        connection.bind_event('connection_lost', self._multiplexed_lost)
+        return connection
+
+    def _multiplexed_lost(self, connection, exc=None):
+        if connection in self._multiplexed:
+            self._multiplexed.remove(connection)
+
 
 class CompiledQuery:
 
@@ -0,0 +1,299 @@
+'''Append only file persistence for pulsar-ds.
+
+Write commands are appended to the file in the redis protocol and
+replayed through :meth:`.ClientMixin.execute` when the server starts.
+Commands with relative timeouts are stored with absolute timestamps so
+that replaying them does not extend the life of keys, the same encoding
+is used to feed replicas.
+
+The file is compacted by :class:`.AofRewriter`, which writes the
+commands needed to rebuild the dataset into a new file, followed by the
+commands received while the rewrite was in progress.
+'''
+import os
+import time
+from itertools import islice
+
+from .client import ReplayClient
+from .snapshot import SnapshotWriter, SnapshotError
+from .streams import Stream, format_id
+
+
+FSYNC_POLICIES = ('always', 'everysec', 'no')
+
+# Commands which write their effects with Storage._propagate
+PROPAGATED = frozenset(('blmove', 'blpop', 'brpop', 'brpoplpush',
+                        'bzpopmax', 'bzpopmin', 'spop', 'xadd', 'xclaim',
+                        'xgroup', 'xreadgroup', 'xtrim'))
+
+# Maximum number of items in a command written by a rewrite
+REWRITE_ITEMS = 64
+
+
+def pexpireat(key, seconds):
+    return (b'pexpireat', key, int(1000*(time.time() + seconds)))
+
+
+def absolute_timeouts(request):
+    '''Translate commands with relative timeouts into a ``SET`` or
+    ``RESTORE`` followed by a ``PEXPIREAT``.
+    '''
+    command = request[0]
+    if command == 'expire':
+        return (pexpireat(request[1], int(request[2])),)
+    elif command == 'pexpire':
+        return (pexpireat(request[1], 0.001*int(request[2])),)
+    elif command == 'setex':
+        return ((b'set', request[1], request[3]),
+                pexpireat(request[1], int(request[2])))
+    elif command == 'psetex':
+        return ((b'set', request[1], request[3]),
+                pexpireat(request[1], 0.001*int(request[2])))
+    elif command == 'restore':
+        ttl = int(request[2])
+        commands = [(b'restore', request[1], b'0', request[3])]
+        if ttl > 0:
+            commands.append(pexpireat(request[1], ttl))
+        return commands
+    elif command == 'set':
+        args = [b'set', request[1], request[2]]
+        timeout = 0
+        options = iter(request[3:])
+        for opt in options:
+            name = opt.lower()
+            if name == b'ex':
+                timeout += int(next(options))
+            elif name == b'px':
+                timeout += 0.001*int(next(options))
+            else:
+                args.append(opt)
+        if timeout:
+            return args, pexpireat(request[1], timeout)
+        return (args,)
+    return (request,)
+
+
+class AppendOnlyFile:
+    '''The append only file of a :class:`.Storage`.
+
+    Commands are accumulated in a buffer which is written to the file
+    after every command when ``fsync`` is ``always`` and by the
+    :class:`.Storage` cron otherwise.
+    '''
+    def __init__(self, store, filename, fsync='everysec'):
+        self.store = store
+        self.filename = filename
+        self.fsync = fsync
+        self.base_size = 0
+        self._loop = store._loop
+        self._pack = store._parser.pack_command
+        self._buffer = bytearray()
+        self._rewrite = None
+        self._fsyncing = None
+        self._unsynced = False
+        self._last_fsync = self._loop.time()
+        self._open()
+
+    @property
+    def size(self):
+        return self._file.tell() + len(self._buffer)
+
+    def feed(self, num, data):
+        '''Append ``data``, the encoded commands executed on database
+        ``num``
+        '''
+        if num != self._db:
+            self._db = num
+            self._buffer.extend(self._pack((b'select', num)))
+        self._buffer.extend(data)
+        if self._rewrite is not None:
+            if num != self._rewrite_db:
+                self._rewrite_db = num
+                self._rewrite.extend(self._pack((b'select', num)))
+            self._rewrite.extend(data)
+
+    def flush(self):
+        '''Write the buffer to the file and fsync according to policy
+        '''
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._file.flush()
+            self._buffer.clear()
+            if self.fsync == 'always':
+                return os.fsync(self._file.fileno())
+            self._unsynced = True
+        if self.fsync == 'everysec' and self._unsynced and not self._fsyncing:
+            now = self._loop.time()
+            if now - self._last_fsync >= 1:
+                self._last_fsync = now
+                self._unsynced = False
+                self._fsyncing = self._loop.run_in_executor(
+                    None, os.fsync, self._file.fileno())
+                self._fsyncing.add_done_callback(self._fsync_done)
+
+    def start_rewrite(self):
+        self._rewrite = bytearray()
+        self._rewrite_db = None
+
+    def end_rewrite(self, file):
+        '''Write commands received during a rewrite into ``file``
+        '''
+        self.flush()
+        file.write(self._rewrite)
+        self._rewrite = None
+
+    def reopen(self):
+        '''Start appending to a rewritten file
+        '''
+        old = self._file
+        if self._fsyncing:
+            self._fsyncing.add_done_callback(lambda f: old.close())
+        else:
+            old.close()
+        self._open()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def _open(self):
+        self._file = open(self.filename, 'ab')
+        self._db = None
+        self.base_size = self._file.tell()
+
+    def _fsync_done(self, future):
+        self._fsyncing = None
+        if future.exception():
+            self.store.logger.error('Could not fsync "%s": %s',
+                                    self.filename, future.exception())
+
+
+class AofRewriter(SnapshotWriter):
+    '''Write the commands which rebuild a :class:`.Storage` into
+    ``filename``.
+
+    Commands received by ``aof`` while the rewrite is in progress are
+    added at the end of the file when the rewriter is closed.
+    '''
+    def __init__(self, store, filename, aof=None):
+        self._pack = store._parser.pack_command
+        self._aof = aof
+        super().__init__(store, filename)
+        if aof:
+            aof.start_rewrite()
+
+    def close(self):
+        if self._aof:
+            self._aof.end_rewrite(self._file)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._temp, self.filename)
+        if self._aof:
+            self._aof.reopen()
+
+    def abort(self):
+        if self._aof:
+            self._aof._rewrite = None
+        super().abort()
+
+    def _header(self):
+        pass
+
+    def _write_key(self, db, key):
+        value = db._data[key]
+        when = db._expires.get(key)
+        if when is not None and when <= self._started:
+            return
+        pack = self._pack
+        chunks = []
+        if db is not self._db:
+            self._db = db
+            chunks.append(pack((b'select', db._num)))
+        store = self.store
+        if isinstance(value, bytearray):
+            chunks.append(pack((b'set', key, bytes(value))))
+        elif isinstance(value, store.list_type):
+            chunks.extend(self._items(b'rpush', key, value))
+        elif isinstance(value, store.set_type):
+            chunks.extend(self._items(b'sadd', key, value))
+        elif isinstance(value, store.hash_type):
+            items = (v for item in value.items() for v in item)
+            chunks.extend(self._items(b'hmset', key, items, 2))
+        elif isinstance(value, store.zset_type):
+            items = (v for score, member in value.items()
+                     for v in (repr(score), member))
+            chunks.extend(self._items(b'zadd', key, items, 2))
+        elif isinstance(value, Stream):
+            chunks.extend(self._stream(key, value))
+        else:
+            raise SnapshotError('Cannot encode %s' % type(value))
+        if when is not None:
+            when = int(1000*(when + self._delta))
+            chunks.append(pack((b'pexpireat', key, when)))
+        self._write(*chunks)
+        self.keys += 1
+
+    def _stream(self, key, value):
+        pack = self._pack
+        if value:
+            for id, pairs in value.range():
+                yield pack([b'xadd', key, format_id(id)] + pairs)
+        else:
+            # create an empty stream
+            yield pack((b'xadd', key, b'maxlen', 0, b'0-1', b'x', b'y'))
+        yield pack((b'xsetid', key, format_id(value.last_id),
+                    b'entriesadded', value.entries_added,
+                    b'maxdeletedid', format_id(value.max_deleted_id)))
+        for group in value.groups.values():
+            args = [b'xgroup', b'create', key, group.name,
+                    format_id(group.last_id)]
+            if group.entries_read is not None:
+                args.extend((b'entriesread', group.entries_read))
+            yield pack(args)
+            for consumer in group.consumers:
+                yield pack((b'xgroup', b'createconsumer', key, group.name,
+                            consumer))
+            for id, entry in group.pending_range():
+                yield pack((b'xclaim', key, group.name, entry.consumer.name,
+                            0, format_id(id), b'time', entry.delivery_time,
+                            b'retrycount', entry.delivery_count, b'force',
+                            b'justid'))
+
+    def _items(self, command, key, items, width=1):
+        items = iter(items)
+        size = width*REWRITE_ITEMS
+        chunk = list(islice(items, size))
+        while chunk:
+            yield self._pack([command, key] + chunk)
+            chunk = list(islice(items, size))
+
+
+class AofReader:
+    '''Iterate over the requests stored in an append only file
+    '''
+    def __init__(self, store, filename):
+        self.filename = filename
+        self.size = os.path.getsize(filename)
+        self._file = open(filename, 'rb')
+        self._parser = store._server._parser_class()
+        self.client = ReplayClient(store)
+
+    @property
+    def position(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+    def __iter__(self):
+        parser = self._parser
+        while True:
+            chunk = self._file.read(65536)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            request = parser.get()
+            while request is not False:
+                yield request
+                request = parser.get()
@@ -1,3 +1,4 @@
+import re
 import time
 from functools import partial
 
@@ -9,6 +10,9 @@ from .parser import CommandError
 
 
 COMMANDS_INFO = OrderedDict()
+# Groups of commands whose first argument is a key
+KEY_GROUPS = frozenset(('Keys', 'Strings', 'Hashes', 'Lists', 'Sets',
+                        'Sorted Sets', 'Streams'))
 
 
 def check_input(request, failed):
@@ -16,17 +20,68 @@ def check_input(request, failed):
         raise CommandError("wrong number of arguments for '%s'" % request[0])
 
 
+def numkeys(request, offset=3):
+    '''Keys of commands with a ``numkeys`` argument at ``offset - 1``
+    '''
+    try:
+        return request[offset:offset+int(request[offset-1])]
+    except (IndexError, ValueError):
+        return ()
+
+
+def store_numkeys(request):
+    '''Keys of commands storing the result of ``numkeys`` keys
+    '''
+    return list(request[1:2]) + list(numkeys(request))
+
+
+def sort_keys(request):
+    '''Keys of ``SORT``, the sorted key and the destination of the
+    ``STORE`` option
+    '''
+    index = 2
+    while index < len(request):
+        option = request[index].lower()
+        if option == b'store':
+            return list(request[1:2]) + list(request[index+1:index+2])
+        index += 3 if option == b'limit' else 2 if option in (
+            b'by', b'get') else 1
+    return request[1:2]
+
+
+def stream_keys(request):
+    '''Keys of ``XREAD`` and ``XREADGROUP``, the first half of the arguments
+    following the ``STREAMS`` option
+    '''
+    index = 1
+    while index < len(request):
+        option = request[index].lower()
+        if option == b'streams':
+            args = request[index+1:]
+            return args[:len(args)//2]
+        index += 3 if option == b'group' else 1 if option == b'noack' else 2
+    return ()
+
+
 class command:
     '''Decorator for pulsar-ds server commands
+
+    ``keys`` is a ``(first, last, step)`` tuple with the positions of keys
+    in a request, ``last`` being negative when counted from the end, or a
+    function returning the keys of a request. By default the first argument
+    of commands in :data:`KEY_GROUPS` is the only key.
     '''
     def __init__(self, group, write=False, name=None,
-                 script=1, supported=True, subcommands=None):
+                 script=1, supported=True, subcommands=None, keys=None):
         self.group = group
         self.write = write
         self.name = name
         self.script = script
         self.supported = supported
         self.subcommands = subcommands
+        if keys is None and group in KEY_GROUPS:
+            keys = (1, 1, 1)
+        self.keys = keys
 
     @property
     def url(self):
@@ -40,6 +95,18 @@ class command:
         f._info = self
         return f
 
+    def request_keys(self, request):
+        '''The keys in ``request``
+        '''
+        keys = self.keys
+        if not keys:
+            return ()
+        elif hasattr(keys, '__call__'):
+            return keys(request)
+        first, last, step = keys
+        last = len(request) + last + 1 if last < 0 else last + 1
+        return request[first:last:step]
+
 
 class ClientMixin:
 
@@ -72,7 +139,7 @@ class ClientMixin:
                 return self.reply_error('Blocked client cannot request')
             if self.transaction is not None and command not in 'exec':
                 self.transaction.append((handle, request))
-                return self._transport.write(self.store.QUEUED)
+                return self._send(self.store.QUEUED)
         self._execute_command(handle, request)
 
     def _execute_command(self, handle, request):
@@ -82,11 +149,42 @@ class ClientMixin:
                 if not handle:
                     self._loop.logger.info("unknown command '%s'" % command)
                     return self.reply_error("unknown command '%s'" % command)
-                if self.store._password != self.password:
+                store = self.store
+                if store._password != self.password:
                     if command != 'auth':
                         return self.reply_error(
                             'Authentication required', 'NOAUTH')
-                handle(self, request, len(request) - 1)
+                if (store._loading and not self.flag & store.REPLAY and
+                        command not in store.LOADING_COMMANDS):
+                    return self.reply_error(
+                        'pulsar-ds is loading the dataset in memory',
+                        'LOADING')
+                info = handle._info
+                if store._cluster and info.keys:
+                    error = store._cluster.check(info.request_keys(request))
+                    if error:
+                        return self.reply_error(*error)
+                write = info.write
+                if store._replica and write and not self.flag & store.REPLAY:
+                    return self.reply_error(
+                        "You can't write against a read only replica.",
+                        'READONLY')
+                if (write and store._memory and not store._replica and
+                        not self.flag & store.REPLAY and
+                        not store._memory.free() and
+                        command not in store.OOM_COMMANDS):
+                    return self.reply_error(store.OOM, 'OOM')
+                if store._snapshot and write:
+                    store._snapshot.before_write(self.db,
+                                                 info.request_keys(request))
+                start = time.perf_counter()
+                try:
+                    if write and (store._aof or store._master):
+                        store._execute_write(self, handle, request)
+                    else:
+                        handle(self, request, len(request) - 1)
+                finally:
+                    store._executed(self, request, time.perf_counter() - start)
             else:
                 command = ''
                 return self.reply_error("no command")
@@ -130,8 +228,43 @@ class ClientMixin:
         raise NotImplementedError
 
 
+class ReplayClient(ClientMixin):
+    '''Execute commands read from an append only file or from a master,
+    replies are discarded
+    '''
+    def __init__(self, store):
+        super().__init__(store)
+        self._loop = store._loop
+        self.flag = store.REPLAY
+        self.channels = ()
+        self.patterns = ()
+        self.password = store._password
+
+    def _noop(self, *args):
+        pass
+
+    reply_ok = _noop
+    reply_status = _noop
+    reply_error = _noop
+    reply_wrongtype = _noop
+    reply_int = _noop
+    reply_one = _noop
+    reply_zero = _noop
+    reply_bulk = _noop
+    reply_multi_bulk = _noop
+    reply_multi_bulk_len = _noop
+    _send = _noop
+
+
 class PulsarStoreClient(pulsar.Protocol, ClientMixin):
-    '''Used both by client and server'''
+    '''Used both by client and server
+
+    Replies to the requests of a chunk of data received are accumulated
+    and written once, when the chunk is processed or when they exceed
+    ``REPLY_BUFFER_SIZE`` bytes. Replies generated outside
+    :meth:`data_received`, to blocked and subscribed clients, are written
+    immediately.
+    '''
 
     def __init__(self, cfg, *args, **kw):
         super().__init__(*args, **kw)
@@ -143,6 +276,9 @@ class PulsarStoreClient(pulsar.Protocol, ClientMixin):
         self.patterns = set()
         self.watched_keys = None
         self.password = b''
+        self.soft_limit_time = None
+        self._buffer = None
+        self._buffer_size = 0
         self.bind_event('connection_lost',
                         partial(self.store._remove_connection, self))
 
@@ -186,35 +322,72 @@ class PulsarStoreClient(pulsar.Protocol, ClientMixin):
     # Protocol Implementaton
     def data_received(self, data):
         self.parser.feed(data)
-        request = self.parser.get()
-        while request is not False:
-            if self.store._monitors:
-                self.store._write_to_monitors(self, request)
-            self.execute(request)
+        self._buffer = []
+        try:
             request = self.parser.get()
+            while request is not False:
+                if self.store._monitors:
+                    self.store._write_to_monitors(self, request)
+                self.execute(request)
+                if self.store._ready_keys:
+                    self.store._serve_blocked()
+                request = self.parser.get()
+        finally:
+            self._flush()
+            self._buffer = None
+
+    def close(self):
+        self._flush()
+        return super().close()
 
     # Internals
     def _write(self, response):
         if self.transaction is not None:
             self.transaction.append(response)
-        elif not self._transport._closing:
-            self._transport.write(response)
+        else:
+            self._send(response)
+
+    def _send(self, data):
+        buffer = self._buffer
+        if buffer is None:
+            if not self._transport._closing:
+                self._transport.write(data)
+        else:
+            buffer.append(data)
+            self._buffer_size += len(data)
+            if self._buffer_size >= self.store.REPLY_BUFFER_SIZE:
+                self._flush()
+
+    def _flush(self):
+        # Write buffered replies
+        buffer = self._buffer
+        if buffer:
+            data = buffer[0] if len(buffer) == 1 else b''.join(buffer)
+            buffer.clear()
+            self._buffer_size = 0
+            if not self._transport._closing:
+                self._transport.write(data)
 
 
 class Blocked:
     '''Handle blocked keys for a client
+
+    Clients blocked on a key wait, in the order they blocked, in the
+    ordered dictionary ``db._blocking_keys[key]``. When elements are
+    added to the key, :meth:`.Storage._serve_blocked` serves one waiting
+    client per element, from the first to block.
     '''
-    def __init__(self, client, command, keys, timeout, dest=None):
-        self.command = command
+    def __init__(self, client, request, keys, timeout, type):
+        self.request = request
         self.keys = set(keys)
-        self.dest = dest
+        self.type = type
         self._called = False
         db = client.db
         for key in self.keys:
             clients = db._blocking_keys.get(key)
             if clients is None:
-                db._blocking_keys[key] = clients = set()
-            clients.add(client)
+                db._blocking_keys[key] = clients = OrderedDict()
+            clients[client] = None
         client.store._bpop_blocked_clients += 1
         if timeout:
             self.handle = client._loop.call_later(
@@ -222,7 +395,14 @@ class Blocked:
         else:
             self.handle = None
 
+    @property
+    def command(self):
+        return self.request[0]
+
     def unblock(self, client, key=None, value=None):
+        '''Unblock ``client`` and serve it from ``value`` at ``key``,
+        reply with a null array when ``value`` is ``None``
+        '''
         if not self._called:
             self._called = True
             if self.handle:
@@ -231,23 +411,20 @@ class Blocked:
             client.blocked = None
             store._bpop_blocked_clients -= 1
             #
-            # make sure to remove the client from the set of blocked
-            # clients in the database associated with key
-            if key is None:
-                bkeys = client.db._blocking_keys
-                for key in self.keys:
-                    clients = bkeys.get(key)
-                    if clients:
-                        clients.discard(client)
-                        if not clients:
-                            bkeys.pop(key)
+            # remove the client from the queues of clients blocked on keys
+            bkeys = client.db._blocking_keys
+            for bkey in self.keys:
+                clients = bkeys.get(bkey)
+                if clients:
+                    clients.pop(client, None)
+                    if not clients:
+                        bkeys.pop(bkey)
             #
             # send the response
             if value is None:
                 client._write(store.NULL_ARRAY)
             else:
-                store._block_callback(client, self.command, key,
-                                      value, self.dest)
+                store._block_callback(client, self.request, key, value)
 
 
 def redis_to_py_pattern(pattern):
@@ -255,26 +432,23 @@ def redis_to_py_pattern(pattern):
 
 
 def _redis_to_py_pattern(pattern):
-    clear, esc = False, False
-    s, q, op, cp, e = '*', '?', '[', ']', '\\'
-
+    brackets, escape = False, False
     for v in pattern:
-        if v == s and not esc:
+        if escape:
+            escape = False
+            yield re.escape(v)
+        elif v == '\\':
+            escape = True
+        elif brackets:
+            brackets = v != ']'
+            yield v
+        elif v == '*':
             yield '(.*)'
-        elif v == q and not esc:
+        elif v == '?':
             yield '.'
-        elif v == op and not esc:
-            esc = True
-            yield v
-        elif v == cp and esc:
-            esc = False
-            yield v
-        elif v == e:
-            clear, esc = True
-            yield v
-        elif clear:
-            clear, esc = False, False
+        elif v == '[':
+            brackets = True
             yield v
         else:
-            yield v
+            yield re.escape(v)
     yield '$'
@@ -0,0 +1,101 @@
+'''Hash slots for sharded pulsar-ds servers.
+
+The keyspace is divided into 16384 hash slots, as in redis cluster.
+The slot of a key is the CRC16 of the key modulo 16384, when the key
+contains a non empty ``{...}`` hash tag only the tag is hashed so that
+related keys can be stored in the same slot.
+
+A sharded :class:`.PulsarDS` server runs a worker per shard, each worker
+listens on its own address and owns a contiguous range of slots. Requests
+for keys owned by another shard are answered with a
+``MOVED <slot> <host>:<port>`` error, requests for keys owned by several
+shards with a ``CROSSSLOT`` error.
+'''
+import os
+from bisect import bisect_right
+from binascii import crc_hqx
+
+
+SLOTS = 16384
+
+
+def key_slot(key):
+    '''The hash slot of ``key``
+    '''
+    if not isinstance(key, (bytes, bytearray)):
+        key = str(key).encode('utf-8')
+    start = key.find(b'{')
+    if start >= 0:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start+1:end]
+    return crc_hqx(key, 0) % SLOTS
+
+
+def slot_ranges(shards):
+    '''The ``(start, end)`` slot ranges of ``shards`` shards
+    '''
+    return [(SLOTS*n//shards, SLOTS*(n+1)//shards - 1)
+            for n in range(shards)]
+
+
+class Cluster:
+    '''The shards of a sharded :class:`.Storage`.
+
+    :param addresses: the addresses of all shards
+    :param shard: the index of the shard served by the :class:`.Storage`
+    '''
+    def __init__(self, addresses, shard):
+        self.addresses = addresses
+        self.shard = shard
+        self.ranges = slot_ranges(len(addresses))
+        self.start, self.end = self.ranges[shard]
+        self._starts = [start for start, _ in self.ranges]
+
+    def owner(self, slot):
+        '''The index of the shard owning ``slot``
+        '''
+        return bisect_right(self._starts, slot) - 1
+
+    def filename(self, filename):
+        '''The name of a persistence file of this shard
+        '''
+        name, ext = os.path.splitext(filename)
+        return '%s-%d%s' % (name, self.shard, ext)
+
+    def check(self, keys):
+        '''Check that ``keys`` are owned by this shard.
+
+        Return ``None`` when they are, otherwise a ``(message, prefix)``
+        error tuple.
+        '''
+        start, end = self.start, self.end
+        slot = shard = None
+        for key in keys:
+            num = key_slot(key)
+            owner = self.shard if start <= num <= end else self.owner(num)
+            if shard is None:
+                slot, shard = num, owner
+            elif owner != shard:
+                return ("Keys in request don't hash to the same shard",
+                        'CROSSSLOT')
+        if shard is not None and shard != self.shard:
+            host, port = self.addresses[shard][:2]
+            return '%d %s:%s' % (slot, host, port), 'MOVED'
+
+    def slots(self):
+        '''The reply of the ``CLUSTER SLOTS`` command
+        '''
+        return [[start, end, [address[0].encode('utf-8'), address[1],
+                              ('shard-%d' % n).encode('utf-8')]]
+                for n, ((start, end), address)
+                in enumerate(zip(self.ranges, self.addresses))]
+
+    def info(self):
+        return {'cluster_enabled': 1,
+                'cluster_state': 'ok',
+                'cluster_slots_assigned': SLOTS,
+                'cluster_known_nodes': len(self.addresses),
+                'cluster_size': len(self.addresses),
+                'cluster_my_shard': self.shard,
+                'cluster_my_slots': '%d-%d' % (self.start, self.end)}
@@ -0,0 +1,896 @@
+'''Compact encodings of pulsar-ds data structures.
+
+As in redis, small hashes, lists and sorted sets are stored in a
+:class:`Listpack`, with all their elements packed in a single bytes object,
+and small sets of integers in a sorted array of 64 bits integers. These
+encodings use a fraction of the memory of the hash table, deque and
+skiplist used by large structures, at the cost of operations which are
+linear in the number of elements.
+
+A structure is converted, in place, to its full encoding once the number
+of its elements, or the size of one of its elements, exceeds the
+:class:`Encodings` thresholds. The conversion is never reversed.
+The encoding of a structure is reported by the ``OBJECT ENCODING``
+command.
+'''
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from itertools import islice
+
+from pulsar.utils.structures import Dict, Deque, Zset
+
+from .streams import Stream
+
+
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+
+class Encodings(namedtuple('Encodings', 'listpack_entries listpack_value '
+                                        'intset_entries')):
+    '''Thresholds of compact encodings.
+
+    .. attribute:: listpack_entries
+
+        Maximum number of entries of listpack encoded hashes, lists and
+        sorted sets. Listpacks are disabled when 0.
+
+    .. attribute:: listpack_value
+
+        Maximum size in bytes of an element of a listpack
+
+    .. attribute:: intset_entries
+
+        Maximum number of members of intset encoded sets. Intsets are
+        disabled when 0.
+    '''
+    __slots__ = ()
+
+
+def as_int(value):
+    '''The 64 bits integer represented by ``value`` or ``None``
+    '''
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    if (INT64_MIN <= number <= INT64_MAX and
+            str(number).encode('utf-8') == value):
+        return number
+
+
+def encode(encodings, value):
+    '''Convert python structures, loaded from a snapshot or restored from
+    a dump, into the data structures of a :class:`.Storage`
+    '''
+    if isinstance(value, (bytearray, Hash, List, Set, SortedSet, Stream)):
+        return value
+    elif isinstance(value, (bytes, str)):
+        return bytearray(value.encode('utf-8') if isinstance(value, str)
+                         else value)
+    elif isinstance(value, dict):
+        return Hash(encodings, value.items())
+    elif isinstance(value, (set, frozenset)):
+        return Set(encodings, value)
+    elif isinstance(value, Zset):
+        return SortedSet(encodings, value.items())
+    elif isinstance(value, (list, tuple, Deque)):
+        return List(encodings, value)
+    raise TypeError('Cannot encode %s' % type(value))
+
+
+class Listpack:
+    '''A sequence of byte strings packed in a single bytes object.
+
+    The start offsets of the entries are stored in an array of unsigned
+    integers. Entries are located with :meth:`bytes.find` rather than with
+    a python loop.
+    '''
+    __slots__ = ('_blob', '_offsets')
+
+    def __init__(self, items=None):
+        self._blob = b''
+        self._offsets = array('I', (0,))
+        if items:
+            self.extend(items)
+
+    def __repr__(self):
+        return 'Listpack(%r)' % list(self)
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        blob = self._blob
+        offsets = self._offsets
+        return (blob[start:end] for start, end in zip(offsets, offsets[1:]))
+
+    def __getitem__(self, index):
+        offsets = self._offsets
+        index = self._index(index)
+        return self._blob[offsets[index]:offsets[index+1]]
+
+    def __setitem__(self, index, value):
+        index = self._index(index)
+        self._replace(index, index + 1, (value,))
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, end, _ = index.indices(len(self))
+            if start < end:
+                self._replace(start, end, ())
+        else:
+            index = self._index(index)
+            self._replace(index, index + 1, ())
+
+    @property
+    def nbytes(self):
+        '''Number of bytes used by the entries and their offsets
+        '''
+        return len(self._blob) + self._offsets.itemsize*len(self._offsets)
+
+    def find(self, value, start=0, step=1):
+        '''The index of the first entry equal to ``value``, among the
+        entries at ``start``, ``start + step``, ..., or -1
+        '''
+        blob = self._blob
+        offsets = self._offsets
+        size = len(value)
+        last = len(offsets) - 1
+        position = blob.find(value)
+        while position >= 0:
+            index = bisect_left(offsets, position)
+            while index < last and offsets[index] == position:
+                if (offsets[index+1] - position == size and
+                        index >= start and not (index - start) % step):
+                    return index
+                index += 1
+            position = blob.find(value, position + 1)
+        return -1
+
+    def insert(self, index, value):
+        index = min(max(index + len(self) if index < 0 else index, 0),
+                    len(self))
+        self._replace(index, index, (value,))
+
+    def append(self, value):
+        size = len(self)
+        self._replace(size, size, (value,))
+
+    def extend(self, values):
+        size = len(self)
+        self._replace(size, size, values)
+
+    def _index(self, index):
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('listpack index out of range')
+        return index
+
+    def _replace(self, start, end, values):
+        # Replace entries from start to end (excluded) with values
+        values = [bytes(value) for value in values]
+        offsets = self._offsets
+        blob = self._blob
+        first, last = offsets[start], offsets[end]
+        chunk = b''.join(values)
+        self._blob = blob[:first] + chunk + blob[last:]
+        result = offsets[:start+1]
+        position = first
+        for value in values:
+            position += len(value)
+            result.append(position)
+        delta = len(chunk) - last + first
+        if delta:
+            result.extend((offset + delta for offset in offsets[end+1:]))
+        else:
+            result.extend(offsets[end+1:])
+        self._offsets = result
+
+
+class Structure:
+    '''Base class of data structures with more than one encoding.
+
+    Subclasses of a structure have the same layout so that an instance
+    can convert itself to the full encoding by changing its class.
+    '''
+    __slots__ = ('_data', '_encodings')
+    encoding = None
+    compact = None
+    full = None
+
+    def __new__(cls, encodings=None, data=None):
+        if cls.encoding is None:
+            cls = cls.compact if cls._compact(encodings) else cls.full
+        return object.__new__(cls)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self._data)
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getstate__(self):
+        return self._data, self._encodings
+
+    def __setstate__(self, state):
+        self._data, self._encodings = state
+
+    @classmethod
+    def _compact(cls, encodings):
+        return encodings.listpack_entries > 0
+
+
+# #############################################################################
+# #    HASHES
+class Hash(Structure):
+    '''A redis hash
+    '''
+    __slots__ = ()
+
+    def mget(self, fields):
+        return [self.get(field) for field in fields]
+
+    def update(self, items):
+        for field, value in items:
+            self[field] = value
+
+
+class ListpackHash(Hash):
+    '''A small hash stored as a listpack of alternating fields and values
+    '''
+    __slots__ = ()
+    encoding = 'listpack'
+
+    def __init__(self, encodings, data=None):
+        self._data = Listpack()
+        self._encodings = encodings
+        if data:
+            self.update(data)
+
+    def __len__(self):
+        return len(self._data) // 2
+
+    def __iter__(self):
+        return islice(self._data, 0, None, 2)
+
+    def __contains__(self, field):
+        return self._data.find(field, 0, 2) >= 0
+
+    def __getitem__(self, field):
+        index = self._data.find(field, 0, 2)
+        if index < 0:
+            raise KeyError(field)
+        return self._data[index+1]
+
+    def __setitem__(self, field, value):
+        data = self._data
+        limit = self._encodings.listpack_value
+        index = data.find(field, 0, 2)
+        if len(field) > limit or len(value) > limit or (
+                index < 0 and
+                len(data) >= 2*self._encodings.listpack_entries):
+            self._convert()
+            self[field] = value
+        elif index < 0:
+            data.extend((field, value))
+        else:
+            data[index+1] = value
+
+    def get(self, field, default=None):
+        index = self._data.find(field, 0, 2)
+        return default if index < 0 else self._data[index+1]
+
+    def pop(self, field, *default):
+        data = self._data
+        index = data.find(field, 0, 2)
+        if index < 0:
+            if default:
+                return default[0]
+            raise KeyError(field)
+        value = data[index+1]
+        del data[index:index+2]
+        return value
+
+    def flat(self):
+        return list(self._data)
+
+    def items(self):
+        data = iter(self._data)
+        return zip(data, data)
+
+    def values(self):
+        return list(islice(self._data, 1, None, 2))
+
+    def _convert(self):
+        data = Dict(self.items())
+        self.__class__ = HashTable
+        self._data = data
+
+
+class HashTable(Hash):
+    '''A hash stored in a dictionary
+    '''
+    __slots__ = ()
+    encoding = 'hashtable'
+
+    def __init__(self, encodings, data=None):
+        self._data = Dict()
+        self._encodings = encodings
+        if data:
+            self._data.update(data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, field):
+        return field in self._data
+
+    def __getitem__(self, field):
+        return self._data[field]
+
+    def __setitem__(self, field, value):
+        self._data[field] = value
+
+    def get(self, field, default=None):
+        return self._data.get(field, default)
+
+    def mget(self, fields):
+        return self._data.mget(fields)
+
+    def pop(self, field, *default):
+        return self._data.pop(field, *default)
+
+    def update(self, items):
+        self._data.update(items)
+
+    def flat(self):
+        return self._data.flat()
+
+    def items(self):
+        return self._data.items()
+
+    def values(self):
+        return self._data.values()
+
+
+Hash.compact = ListpackHash
+Hash.full = HashTable
+
+
+# #############################################################################
+# #    LISTS
+class List(Structure):
+    '''A redis list
+    '''
+    __slots__ = ()
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def extendleft(self, values):
+        for value in values:
+            self.appendleft(value)
+
+
+class ListpackList(List):
+    '''A small list stored in a listpack
+    '''
+    __slots__ = ()
+    encoding = 'listpack'
+
+    def __init__(self, encodings, data=None):
+        self._data = Listpack()
+        self._encodings = encodings
+        if data:
+            self.extend(data)
+
+    def __setitem__(self, index, value):
+        if len(value) > self._encodings.listpack_value:
+            self._convert()
+        self._data[index] = value
+
+    def append(self, value):
+        if self._fits(value):
+            self._data.append(value)
+        else:
+            self._convert()
+            self._data.append(value)
+
+    def appendleft(self, value):
+        if self._fits(value):
+            self._data.insert(0, value)
+        else:
+            self._convert()
+            self._data.appendleft(value)
+
+    def extend(self, values):
+        values = list(values)
+        if self._fits(*values):
+            self._data.extend(values)
+        else:
+            self._convert()
+            self._data.extend(values)
+
+    def pop(self):
+        value = self._data[-1]
+        del self._data[-1]
+        return value
+
+    def popleft(self):
+        value = self._data[0]
+        del self._data[0]
+        return value
+
+    def insert_before(self, pivot, value):
+        self._insert(pivot, value, 0)
+
+    def insert_after(self, pivot, value):
+        self._insert(pivot, value, 1)
+
+    def remove(self, elem, count=1):
+        data = self._data
+        size = len(data)
+        if not count:
+            values = [v for v in data if v != elem]
+        else:
+            values = list(data)
+            if count < 0:
+                values.reverse()
+            for _ in range(abs(count)):
+                try:
+                    values.remove(elem)
+                except ValueError:
+                    break
+            if count < 0:
+                values.reverse()
+        if len(values) < size:
+            self._data = Listpack(values)
+        return size - len(values)
+
+    def trim(self, start, end):
+        data = self._data
+        start = max(start, 0)
+        del data[max(end, start):]
+        del data[:start]
+
+    def _fits(self, *values):
+        limit = self._encodings.listpack_value
+        return (len(self._data) + len(values) <=
+                self._encodings.listpack_entries and
+                all((len(value) <= limit for value in values)))
+
+    def _insert(self, pivot, value, offset):
+        index = self._data.find(pivot)
+        if index >= 0:
+            if not self._fits(value):
+                self._convert()
+            self._data.insert(index + offset, value)
+
+    def _convert(self):
+        data = Deque(self._data)
+        self.__class__ = LinkedList
+        self._data = data
+
+
+class LinkedList(List):
+    '''A list stored in a :class:`.Deque`
+    '''
+    __slots__ = ()
+    encoding = 'linkedlist'
+
+    def __init__(self, encodings, data=None):
+        self._data = Deque(data or ())
+        self._encodings = encodings
+
+    def __setitem__(self, index, value):
+        self._data[index] = value
+
+    def append(self, value):
+        self._data.append(value)
+
+    def appendleft(self, value):
+        self._data.appendleft(value)
+
+    def extend(self, values):
+        self._data.extend(values)
+
+    def extendleft(self, values):
+        self._data.extendleft(values)
+
+    def pop(self):
+        return self._data.pop()
+
+    def popleft(self):
+        return self._data.popleft()
+
+    def insert_before(self, pivot, value):
+        self._data.insert_before(pivot, value)
+
+    def insert_after(self, pivot, value):
+        self._data.insert_after(pivot, value)
+
+    def remove(self, elem, count=1):
+        return self._data.remove(elem, count)
+
+    def trim(self, start, end):
+        self._data.trim(start, end)
+
+
+List.compact = ListpackList
+List.full = LinkedList
+
+
+# #############################################################################
+# #    SETS
+class Set(Structure):
+    '''A redis set
+    '''
+    __slots__ = ()
+
+    def update(self, members):
+        for member in members:
+            self.add(member)
+
+    def difference_update(self, members):
+        for member in members:
+            self.discard(member)
+
+    @classmethod
+    def _compact(cls, encodings):
+        return encodings.intset_entries > 0
+
+
+class IntSet(Set):
+    '''A set of integers stored in a sorted array of 64 bits integers
+    '''
+    __slots__ = ()
+    encoding = 'intset'
+
+    def __init__(self, encodings, data=None):
+        self._data = array('q')
+        self._encodings = encodings
+        if data:
+            self.update(data)
+
+    def __iter__(self):
+        return (str(number).encode('utf-8') for number in self._data)
+
+    def __contains__(self, member):
+        number = as_int(member)
+        if number is None:
+            return False
+        data = self._data
+        index = bisect_left(data, number)
+        return index < len(data) and data[index] == number
+
+    def add(self, member):
+        number = as_int(member)
+        data = self._data
+        if number is None or len(data) >= self._encodings.intset_entries:
+            if member not in self:
+                self._convert()
+                self._data.add(member)
+        else:
+            index = bisect_left(data, number)
+            if index == len(data) or data[index] != number:
+                data.insert(index, number)
+
+    def discard(self, member):
+        number = as_int(member)
+        if number is not None:
+            data = self._data
+            index = bisect_left(data, number)
+            if index < len(data) and data[index] == number:
+                del data[index]
+                return True
+        return False
+
+    def remove(self, member):
+        if not self.discard(member):
+            raise KeyError(member)
+
+    def pop(self):
+        if not self._data:
+            raise KeyError('pop from an empty set')
+        return str(self._data.pop()).encode('utf-8')
+
+    def members(self):
+        '''The members as a python set
+        '''
+        return set(self)
+
+    def _convert(self):
+        data = set(self)
+        self.__class__ = HashSet
+        self._data = data
+
+
+class HashSet(Set):
+    '''A set stored in a python set
+    '''
+    __slots__ = ()
+    encoding = 'hashtable'
+
+    def __init__(self, encodings, data=None):
+        self._data = set(data or ())
+        self._encodings = encodings
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, member):
+        return member in self._data
+
+    def add(self, member):
+        self._data.add(member)
+
+    def discard(self, member):
+        self._data.discard(member)
+
+    def remove(self, member):
+        self._data.remove(member)
+
+    def pop(self):
+        return self._data.pop()
+
+    def update(self, members):
+        self._data.update(members)
+
+    def difference_update(self, members):
+        self._data.difference_update(members)
+
+    def members(self):
+        return self._data
+
+
+Set.compact = IntSet
+Set.full = HashSet
+
+
+# #############################################################################
+# #    SORTED SETS
+class SortedSet(Structure):
+    '''A redis sorted set
+    '''
+    __slots__ = ()
+
+    def update(self, score_vals):
+        for score, member in score_vals:
+            self.add(score, member)
+
+    def remove_items(self, items):
+        removed = 0
+        for item in items:
+            if self.remove(item) is not None:
+                removed += 1
+        return removed
+
+    @classmethod
+    def union(cls, encodings, zsets, weights, oper):
+        scores = {}
+        for zset, weight in zip(zsets, weights):
+            for score, member in zset.items():
+                score *= weight
+                if member in scores:
+                    score = oper((scores[member], score))
+                scores[member] = score
+        return cls(encodings, ((s, m) for m, s in scores.items()))
+
+    @classmethod
+    def inter(cls, encodings, zsets, weights, oper):
+        scores = None
+        for zset, weight in zip(zsets, weights):
+            if scores is None:
+                scores = dict(((member, score*weight)
+                               for score, member in zset.items()))
+            else:
+                get = zset.score
+                scores = dict(((member, oper((value, score*weight)))
+                               for member, value, score in
+                               ((m, v, get(m)) for m, v in scores.items())
+                               if score is not None))
+        return cls(encodings, ((s, m) for m, s in (scores or {}).items()))
+
+
+class ListpackSortedSet(SortedSet):
+    '''A small sorted set stored in a listpack of members and an array of
+    scores, ordered by score
+    '''
+    __slots__ = ()
+    encoding = 'listpack'
+
+    def __init__(self, encodings, data=None):
+        self._data = (Listpack(), array('d'))
+        self._encodings = encodings
+        if data:
+            self.update(data)
+
+    def __len__(self):
+        return len(self._data[1])
+
+    def __iter__(self):
+        return iter(self._data[0])
+
+    def items(self):
+        members, scores = self._data
+        return zip(scores, members)
+
+    def score(self, member, default=None):
+        members, scores = self._data
+        index = members.find(member)
+        return default if index < 0 else scores[index]
+
+    def rank(self, member):
+        index = self._data[0].find(member)
+        if index >= 0:
+            return index
+
+    def count(self, minval, maxval, include_min=True, include_max=True):
+        start, end = self._score_range(minval, maxval, include_min,
+                                       include_max)
+        return max(end - start, 0)
+
+    def range(self, start, end, scores=False):
+        size = len(self)
+        if start < 0:
+            start = max(size + start, 0)
+        end = size if end is None else (
+            max(size + end, 0) if end < 0 else min(end, size))
+        return self._range(start, end, scores)
+
+    def range_by_score(self, minval, maxval, include_min=True,
+                       include_max=True, start=0, num=None, scores=False):
+        first, last = self._score_range(minval, maxval, include_min,
+                                        include_max)
+        first += start
+        if num is not None:
+            last = min(last, first + max(num, 0))
+        return self._range(first, last, scores)
+
+    def add(self, score, member):
+        if score != score:
+            raise ValueError('Cannot insert score {0}'.format(score))
+        members, scores = self._data
+        index = members.find(member)
+        if index >= 0:
+            if scores[index] == score:
+                return 0
+            del members[index]
+            del scores[index]
+        elif (len(member) > self._encodings.listpack_value or
+              len(scores) >= self._encodings.listpack_entries):
+            self._convert()
+            return self._data.add(score, member)
+        position = bisect_right(scores, score)
+        members.insert(position, member)
+        scores.insert(position, score)
+        return int(index < 0)
+
+    def remove(self, item):
+        members, scores = self._data
+        index = members.find(item)
+        if index >= 0:
+            score = scores[index]
+            del members[index]
+            del scores[index]
+            return score
+
+    def remove_range(self, start, end):
+        size = len(self)
+        if start < 0:
+            start = max(size + start, 0)
+        end = size if end is None else (
+            max(size + end, 0) if end < 0 else min(end, size))
+        return self._remove(start, end)
+
+    def remove_range_by_score(self, minval, maxval,
+                              include_min=True, include_max=True):
+        return self._remove(*self._score_range(minval, maxval,
+                                               include_min, include_max))
+
+    def clear(self):
+        self._data = (Listpack(), array('d'))
+
+    def flat(self):
+        return tuple((v for item in self.items() for v in item))
+
+    def _score_range(self, minval, maxval, include_min, include_max):
+        scores = self._data[1]
+        if include_min:
+            start = bisect_left(scores, minval)
+        else:
+            start = bisect_right(scores, minval)
+        if include_max:
+            end = bisect_right(scores, maxval)
+        else:
+            end = bisect_left(scores, maxval)
+        return start, end
+
+    def _range(self, start, end, scores):
+        members, values = self._data
+        if start >= end:
+            return iter(())
+        elif scores:
+            return zip(values[start:end], islice(members, start, end))
+        else:
+            return islice(members, start, end)
+
+    def _remove(self, start, end):
+        if start >= end:
+            return 0
+        members, scores = self._data
+        del members[start:end]
+        del scores[start:end]
+        return end - start
+
+    def _convert(self):
+        data = Zset(self.items())
+        self.__class__ = SkiplistSortedSet
+        self._data = data
+
+
+class SkiplistSortedSet(SortedSet):
+    '''A sorted set stored in a :class:`.Zset`
+    '''
+    __slots__ = ()
+    encoding = 'skiplist'
+
+    def __init__(self, encodings, data=None):
+        self._data = Zset(data)
+        self._encodings = encodings
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def items(self):
+        return self._data.items()
+
+    def score(self, member, default=None):
+        return self._data.score(member, default)
+
+    def rank(self, member):
+        return self._data.rank(member)
+
+    def count(self, minval, maxval, include_min=True, include_max=True):
+        return self._data.count(minval, maxval, include_min, include_max)
+
+    def range(self, start, end, scores=False):
+        return self._data.range(start, end, scores)
+
+    def range_by_score(self, minval, maxval, include_min=True,
+                       include_max=True, start=0, num=None, scores=False):
+        return self._data.range_by_score(minval, maxval, include_min,
+                                         include_max, start, num, scores)
+
+    def add(self, score, member):
+        return self._data.add(score, member)
+
+    def remove(self, item):
+        return self._data.remove(item)
+
+    def remove_range(self, start, end):
+        return self._data.remove_range(start, end)
+
+    def remove_range_by_score(self, minval, maxval,
+                              include_min=True, include_max=True):
+        return self._data.remove_range_by_score(minval, maxval, include_min,
+                                                include_max)
+
+    def clear(self):
+        self._data.clear()
+
+    def flat(self):
+        return self._data.flat()
+
+
+SortedSet.compact = ListpackSortedSet
+SortedSet.full = SkiplistSortedSet
@@ -0,0 +1,264 @@
+'''Memory accounting and eviction of keys for pulsar-ds.
+
+When ``maxmemory`` is set, the memory used by each key and its value is
+estimated from its encoding and stored in the ``_sizes`` dictionary of
+its :class:`.Db`. Estimates are updated whenever a key is written or
+removed and their sum is the ``used_memory`` reported by ``INFO``.
+
+Before executing a write command while ``used_memory`` exceeds
+``maxmemory``, keys are evicted according to the maxmemory policy:
+
+* ``noeviction`` no key is evicted, commands which may use more memory
+  fail with an ``OOM`` error
+* ``allkeys-lru`` evict the least recently used keys
+* ``allkeys-lfu`` evict the least frequently used keys
+* ``volatile-lru`` evict the least recently used keys with a timeout
+* ``volatile-lfu`` evict the least frequently used keys with a timeout
+* ``volatile-ttl`` evict the keys with a timeout closest to expire
+
+As in redis, the best key to evict is approximated by sampling a few keys
+of each database. Candidates are kept in a small pool, sorted by score,
+so that good candidates found by previous samples are not lost.
+Access frequencies are logarithmic counters, incremented with a
+probability which decreases as the counter grows and decremented once
+every ``LFU_DECAY_TIME`` minutes without access.
+
+Evicted keys are deleted from the append only file and replicas, and
+signalled as ``evicted`` keyspace events.
+'''
+import random
+from bisect import insort
+from itertools import islice
+
+from .encodings import Hash, List, Set, SortedSet
+from .streams import Stream
+
+
+POLICIES = ('noeviction', 'allkeys-lru', 'allkeys-lfu', 'volatile-lru',
+            'volatile-lfu', 'volatile-ttl')
+
+# Approximate sizes in bytes of a key and its dictionary entry, of an
+# empty string and of an empty structure
+KEY_SIZE = 80
+STRING_SIZE = 57
+STRUCTURE_SIZE = 200
+
+# Approximate overhead in bytes of an element of fully encoded structures
+ENTRY_SIZES = ((Hash, 140), (List, 45), (Set, 70), (SortedSet, 300))
+
+# Number of elements sampled to estimate the size of fully encoded
+# structures
+ELEMENT_SAMPLES = 5
+
+# Initial access frequency of new keys
+LFU_INIT_VAL = 5
+
+
+def sizeof(value):
+    '''Approximate number of bytes used by ``value``
+    '''
+    if isinstance(value, bytearray):
+        return STRING_SIZE + len(value)
+    elif isinstance(value, Stream):
+        return STRUCTURE_SIZE + value.nbytes
+    data = value._data
+    encoding = value.encoding
+    if encoding == 'listpack':
+        if isinstance(value, SortedSet):
+            members, scores = data
+            return (STRUCTURE_SIZE + members.nbytes +
+                    scores.itemsize*len(scores))
+        return STRUCTURE_SIZE + data.nbytes
+    elif encoding == 'intset':
+        return STRUCTURE_SIZE + data.itemsize*len(data)
+    size = len(value)
+    if not size:
+        return STRUCTURE_SIZE
+    for base, entry in ENTRY_SIZES:
+        if isinstance(value, base):
+            break
+    if isinstance(value, Hash):
+        sample = [len(f) + len(v)
+                  for f, v in islice(data.items(), ELEMENT_SAMPLES)]
+    else:
+        sample = [len(e) for e in islice(data, ELEMENT_SAMPLES)]
+    return STRUCTURE_SIZE + size*(entry + sum(sample)//len(sample))
+
+
+def lfu_increment(counter, factor):
+    '''Increment the logarithmic access ``counter``.
+
+    The probability of an increment is ``1/((counter - LFU_INIT_VAL)*factor
+    + 1)`` and the counter saturates at 255.
+    '''
+    if counter < 255:
+        base = max(counter - LFU_INIT_VAL, 0)
+        if random.random() < 1.0/(base*factor + 1):
+            counter += 1
+    return counter
+
+
+class Memory:
+    '''Memory accounting and eviction of keys of a :class:`.Storage`
+    '''
+    def __init__(self, store, maxmemory, policy, samples):
+        self.store = store
+        self.maxmemory = maxmemory
+        self.policy = policy
+        self.samples = max(samples, 1)
+        self.used = 0
+        self.volatile = policy.startswith('volatile')
+        self.lru = policy.endswith('lru')
+        self.lfu = policy.endswith('lfu')
+        self._loop = store._loop
+        self._pool = []
+        if self.lru:
+            self._score = self._idle
+        elif self.lfu:
+            self._score = self._infrequency
+        else:
+            self._score = self._ttl
+
+    @property
+    def tracking(self):
+        '''``True`` when key accesses are tracked by the policy
+        '''
+        return self.lru or self.lfu
+
+    def info(self):
+        return {'used_memory': self.used,
+                'maxmemory': self.maxmemory,
+                'maxmemory_policy': self.policy}
+
+    def touch(self, db, key):
+        '''Record an access to ``key``
+        '''
+        access = db._access
+        if self.lru:
+            access[key] = self._loop.time()
+        else:
+            minutes = self._minutes()
+            counter = self._counter(access.get(key), minutes)
+            counter = lfu_increment(counter, self.store.LFU_LOG_FACTOR)
+            access[key] = (minutes << 8) | counter
+
+    def idle_time(self, db, key):
+        '''Seconds since the last access to ``key``
+        '''
+        return int(self._loop.time() - db._access.get(key, 0))
+
+    def frequency(self, db, key):
+        '''The logarithmic access frequency of ``key``
+        '''
+        return self._counter(db._access.get(key), self._minutes())
+
+    def resize(self, db, key):
+        '''Update the size of ``key`` after it was written or removed
+        '''
+        sizes = db._sizes
+        value = db._data.get(key)
+        used = self.used - sizes.pop(key, 0)
+        if value is None:
+            if db._access is not None:
+                db._access.pop(key, None)
+        else:
+            size = KEY_SIZE + len(key) + sizeof(value)
+            sizes[key] = size
+            used += size
+        self.used = used
+
+    def flush(self, db):
+        '''All keys of ``db`` were removed
+        '''
+        self.used -= sum(db._sizes.values())
+        db._sizes.clear()
+        if db._access is not None:
+            db._access.clear()
+
+    def free(self):
+        '''Evict keys until the used memory is below ``maxmemory``.
+
+        Return ``False`` when not enough keys could be evicted.
+        '''
+        if self.policy != 'noeviction':
+            while self.used > self.maxmemory:
+                if not self._evict_one():
+                    break
+        return self.used <= self.maxmemory
+
+    def evict(self, db, key):
+        store = self.store
+        if store._snapshot:
+            store._snapshot.before_write(db, (key,))
+        db.pop(key)
+        store._evicted_keys += 1
+        store._propagate(db, b'del', key)
+        store._signal(store.NOTIFY_EVICTED, db, 'del', key, 1,
+                      event='evicted')
+
+    # INTERNALS
+    def _evict_one(self):
+        self._populate()
+        pool = self._pool
+        databases = self.store.databases
+        while pool:
+            _, num, key = pool.pop()
+            db = databases[num]
+            if key in db._data and (not self.volatile or key in db._expires):
+                self.evict(db, key)
+                return True
+        return False
+
+    def _populate(self):
+        # Add sampled keys to the eviction pool, the best candidate
+        # is the last entry
+        pool = self._pool
+        size = self.store.MAXMEMORY_POOL_SIZE
+        for num, db in self.store.databases.items():
+            for key in self._sample(db):
+                entry = (self._score(db, key), num, key)
+                if len(pool) >= size and entry <= pool[0]:
+                    continue
+                if any(e[1] == num and e[2] == key for e in pool):
+                    continue
+                insort(pool, entry)
+                if len(pool) > size:
+                    pool.pop(0)
+
+    def _sample(self, db):
+        data = db._data
+        keys = db._keys
+        samples = self.samples
+        if self.volatile:
+            data = db._expires
+        if len(data) <= samples:
+            return list(data)
+        sample = set(key for key in (random.choice(keys)
+                                     for _ in range(samples))
+                     if key in data)
+        # keys removed since the last compaction of db._keys, or few
+        # volatile keys, may leave the sample empty: fall back to a
+        # random sample of the candidates themselves
+        return sample or random.sample(list(data), samples)
+
+    def _idle(self, db, key):
+        return self._loop.time() - db._access.get(key, 0)
+
+    def _infrequency(self, db, key):
+        return 255 - self.frequency(db, key)
+
+    def _ttl(self, db, key):
+        return -db._expires[key]
+
+    def _minutes(self):
+        return int(self._loop.time()/60) & 0xffffff
+
+    def _counter(self, access, minutes):
+        if access is None:
+            return LFU_INIT_VAL
+        decay = self.store.LFU_DECAY_TIME
+        counter = access & 255
+        if decay:
+            elapsed = (minutes - (access >> 8)) & 0xffffff
+            counter = max(counter - elapsed//decay, 0)
+        return counter
@@ -27,9 +27,23 @@ class NoScriptError(ResponseError):
     pass
 
 
+class MovedError(ResponseError):
+    '''The key of a command is served by another shard of a cluster
+    '''
+    @property
+    def slot(self):
+        return int(self.args[0].split()[0])
+
+    @property
+    def address(self):
+        host, port = self.args[0].split()[1].rsplit(':', 1)
+        return host, int(port)
+
+
 EXCEPTION_CLASSES = {
     'ERR': ResponseError,
     'NOSCRIPT': NoScriptError,
+    'MOVED': MovedError,
 }
 
 
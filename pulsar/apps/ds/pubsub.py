@@ -0,0 +1,154 @@
+'''Index of pattern subscriptions for pulsar-ds.
+
+Matching every pattern against the channel of each published message
+costs one regular expression match per pattern. :class:`PatternIndex`
+classifies patterns so that most of them are found without a match:
+
+* patterns without wildcards are matched by a dictionary lookup
+* other patterns are stored in a trie of their literal prefix, the part
+  before the first wildcard, which is walked once along the bytes of the
+  channel. ``prefix*`` patterns match all channels reaching their node,
+  the other patterns of the nodes reached are matched with regular
+  expressions.
+
+The patterns matching a channel are cached until a pattern is added
+or removed.
+'''
+import re
+from collections import namedtuple
+
+from .client import redis_to_py_pattern
+
+
+pubsub_patterns = namedtuple('pubsub_patterns', 'pattern re clients')
+
+GLOB_CHARS = frozenset(b'*?[\\')
+
+# Kinds of patterns, PREFIX and GLOB are also the keys of trie nodes
+# holding prefix* patterns and other patterns with wildcards
+EXACT, PREFIX, GLOB = 'exact', None, -1
+
+
+class PatternIndex:
+    '''The pattern subscriptions of a :class:`.Storage`, a mapping of
+    patterns to :class:`pubsub_patterns`
+    '''
+    def __init__(self, cache_size=1024):
+        self.cache_size = cache_size
+        self._patterns = {}
+        self._exact = {}
+        self._trie = {}
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __iter__(self):
+        return iter(self._patterns)
+
+    def __contains__(self, pattern):
+        return pattern in self._patterns
+
+    def __getitem__(self, pattern):
+        return self._patterns[pattern]
+
+    def get(self, pattern, default=None):
+        return self._patterns.get(pattern, default)
+
+    def values(self):
+        return self._patterns.values()
+
+    def add(self, pattern):
+        '''Add a new ``pattern`` with no subscribers
+        '''
+        p = pubsub_patterns(pattern,
+                            re.compile(redis_to_py_pattern(
+                                pattern.decode('utf-8')), re.DOTALL),
+                            set())
+        self._patterns[pattern] = p
+        prefix, kind = self._prefix(pattern)
+        if kind == EXACT:
+            self._exact[pattern] = p
+        else:
+            node = self._trie
+            for byte in prefix:
+                node = node.setdefault(byte, {})
+            if kind == PREFIX:
+                node[PREFIX] = p
+            else:
+                node.setdefault(GLOB, {})[pattern] = p
+        self._cache.clear()
+        return p
+
+    def remove(self, pattern):
+        '''Remove ``pattern`` from the index
+        '''
+        p = self._patterns.pop(pattern)
+        prefix, kind = self._prefix(pattern)
+        if kind == EXACT:
+            self._exact.pop(pattern)
+        else:
+            path = [self._trie]
+            for byte in prefix:
+                path.append(path[-1][byte])
+            node = path[-1]
+            if kind == PREFIX:
+                node.pop(PREFIX)
+            else:
+                globs = node[GLOB]
+                globs.pop(pattern)
+                if not globs:
+                    node.pop(GLOB)
+            # prune the branch left empty
+            for depth in range(len(prefix), 0, -1):
+                if path[depth]:
+                    break
+                path[depth - 1].pop(prefix[depth - 1])
+        self._cache.clear()
+        return p
+
+    def match(self, channel):
+        '''Tuple of :class:`pubsub_patterns` matching ``channel``
+        '''
+        matched = self._cache.get(channel)
+        if matched is None:
+            matched = tuple(self._match(channel))
+            cache = self._cache
+            if len(cache) >= self.cache_size:
+                cache.clear()
+            cache[channel] = matched
+        return matched
+
+    # INTERNALS
+    def _match(self, channel):
+        p = self._exact.get(channel)
+        if p is not None:
+            yield p
+        node = self._trie
+        nodes = [node]
+        for byte in channel:
+            node = node.get(byte)
+            if node is None:
+                break
+            nodes.append(node)
+        text = None
+        for node in nodes:
+            p = node.get(PREFIX)
+            if p is not None:
+                yield p
+            globs = node.get(GLOB)
+            if globs:
+                if text is None:
+                    text = channel.decode('utf-8', 'ignore')
+                for p in globs.values():
+                    if p.re.match(text):
+                        yield p
+
+    def _prefix(self, pattern):
+        # The literal prefix of pattern and the kind of pattern
+        for index, byte in enumerate(pattern):
+            if byte in GLOB_CHARS:
+                if byte == 42 and index == len(pattern) - 1:
+                    return pattern[:-1], PREFIX
+                return pattern[:index], GLOB
+        return pattern, EXACT
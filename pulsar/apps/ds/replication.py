@@ -0,0 +1,418 @@
+'''Master/replica replication for pulsar-ds.
+
+A replica connects to its master and sends ``PSYNC <replid> <offset>``.
+When the master still has the requested offset in its
+:class:`.Backlog` it replies ``+CONTINUE`` and streams the missing
+commands. Otherwise it replies ``+FULLRESYNC <replid> <offset>``,
+sends a snapshot as a bulk string and then the commands executed since
+the snapshot was taken.
+
+Commands are streamed in the same encoding used by the append only file
+and the replication offset counts the bytes of the stream. Commands
+executed during a full synchronization are buffered for the replica, a
+replica whose buffer exceeds ``REPL_BUFFER_LIMIT`` bytes is disconnected
+and starts a new full synchronization when it reconnects.
+'''
+import os
+import asyncio
+import binascii
+import tempfile
+
+from .client import ReplayClient
+from .stats import client_address
+from .snapshot import SnapshotWriter, SnapshotReader
+
+
+# Size of the chunks of a snapshot sent to replicas
+SYNC_CHUNK = 65536
+# Replica states on the master
+WAIT_SNAPSHOT = 'wait_bgsave'
+SEND_SNAPSHOT = 'send_bulk'
+ONLINE = 'online'
+
+
+class Backlog:
+    '''A ring buffer with the last ``size`` bytes of the replication
+    stream.
+
+    ``offset`` is the total number of bytes added to the stream.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.offset = 0
+        self._length = 0
+        self._buffer = bytearray(size)
+
+    def append(self, data):
+        size = self.size
+        n = len(data)
+        self.offset += n
+        self._length = min(self._length + n, size)
+        if n > size:
+            data = data[n-size:]
+            n = size
+        start = (self.offset - n) % size
+        end = start + n
+        if end <= size:
+            self._buffer[start:end] = data
+        else:
+            split = size - start
+            self._buffer[start:] = data[:split]
+            self._buffer[:n-split] = data[split:]
+
+    def since(self, offset):
+        '''The stream after ``offset`` or ``None`` if not available
+        '''
+        missing = self.offset - offset
+        if missing < 0 or missing > self._length:
+            return None
+        start = offset % self.size
+        end = start + missing
+        if end <= self.size:
+            return bytes(self._buffer[start:end])
+        return (bytes(self._buffer[start:]) +
+                bytes(self._buffer[:end-self.size]))
+
+
+class Master:
+    '''The replicas of a :class:`.Storage` and its replication backlog
+    '''
+    def __init__(self, store):
+        self.store = store
+        self.replid = binascii.hexlify(os.urandom(20))
+        self.backlog = Backlog(store.REPL_BACKLOG_SIZE)
+        self.replicas = {}
+        self._loop = store._loop
+        self._pack = store._parser.pack_command
+        self._db = None
+        self._writer = None
+
+    @property
+    def offset(self):
+        return self.backlog.offset
+
+    def feed(self, num, data):
+        '''Send ``data``, the encoded commands executed on database ``num``,
+        to replicas
+        '''
+        if num != self._db:
+            self._db = num
+            data = self._pack((b'select', num)) + data
+        self.backlog.append(data)
+        overflow = []
+        for client, replica in self.replicas.items():
+            if replica.state == ONLINE:
+                client._send(data)
+            else:
+                replica.buffer.extend(data)
+                if len(replica.buffer) > self.store.REPL_BUFFER_LIMIT:
+                    overflow.append(client)
+        for client in overflow:
+            self.store.logger.warning('Replica %s exceeded the buffer '
+                                      'limit during synchronization',
+                                      client_address(client))
+            self.remove(client)
+            client.close()
+
+    def sync(self, client, replid, offset):
+        '''Start the synchronization of a new replica
+        '''
+        if replid == self.replid:
+            data = self.backlog.since(offset)
+            if data is not None:
+                self.replicas[client] = ReplicaState(ONLINE)
+                client._send(b'+CONTINUE\r\n')
+                client._send(data)
+                return
+        # Commands after the snapshot start from a select
+        self._db = None
+        client._send(('+FULLRESYNC %s %d\r\n' % (
+            self.replid.decode('utf-8'), self.offset)).encode('utf-8'))
+        self.replicas[client] = ReplicaState(WAIT_SNAPSHOT)
+        self.snapshot()
+
+    def ack(self, client, offset):
+        replica = self.replicas.get(client)
+        if replica:
+            replica.ack = offset
+
+    def remove(self, client):
+        self.replicas.pop(client, None)
+
+    def snapshot(self):
+        '''Start a snapshot for replicas waiting for one
+        '''
+        store = self.store
+        if not store._snapshot:
+            fd, filename = tempfile.mkstemp(suffix='.sync')
+            os.close(fd)
+            self._writer = SnapshotWriter(store, filename)
+            store._snapshot = self._writer
+            self._loop.call_soon(store._save_step)
+            for replica in self.replicas.values():
+                if replica.state == WAIT_SNAPSHOT:
+                    replica.state = SEND_SNAPSHOT
+
+    def saved(self, writer, error=False):
+        '''Called by the :class:`.Storage` when ``writer`` is done
+        '''
+        if writer is self._writer:
+            self._writer = None
+            clients = [client for client, replica in self.replicas.items()
+                       if replica.state == SEND_SNAPSHOT]
+            if error:
+                for client in clients:
+                    self.remove(client)
+                    client.close()
+            elif clients:
+                size = os.path.getsize(writer.filename)
+                for client in clients:
+                    client._send(('$%d\r\n' % size).encode('utf-8'))
+                self._send(writer.filename, open(writer.filename, 'rb'),
+                           clients)
+                return
+            os.remove(writer.filename)
+        if any((r.state == WAIT_SNAPSHOT for r in self.replicas.values())):
+            self.snapshot()
+
+    def info(self):
+        info = {'role': 'master',
+                'connected_slaves': len(self.replicas),
+                'master_replid': self.replid.decode('utf-8'),
+                'master_repl_offset': self.offset}
+        for n, (client, replica) in enumerate(self.replicas.items()):
+            address = client_address(client).decode('utf-8')
+            host, _, port = address.rpartition(':')
+            info['slave%d' % n] = 'ip=%s,port=%s,state=%s,offset=%s' % (
+                host, port, replica.state, replica.ack)
+        return info
+
+    def _send(self, filename, file, clients):
+        clients = [c for c in clients if c in self.replicas]
+        chunk = file.read(SYNC_CHUNK)
+        if chunk and clients:
+            for client in clients:
+                client._send(chunk)
+            self._loop.call_soon(self._send, filename, file, clients)
+        else:
+            file.close()
+            os.remove(filename)
+            for client in clients:
+                replica = self.replicas[client]
+                replica.state = ONLINE
+                client._send(bytes(replica.buffer))
+                replica.buffer = None
+
+
+class ReplicaState:
+    __slots__ = ('state', 'buffer', 'ack')
+
+    def __init__(self, state):
+        self.state = state
+        self.buffer = None if state == ONLINE else bytearray()
+        self.ack = 0
+
+
+class Replica:
+    '''The link of a :class:`.Storage` to its master
+    '''
+    def __init__(self, store, host, port):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.replid = None
+        self.offset = -1
+        self.state = 'connect'
+        self._loop = store._loop
+        self._pack = store._parser.pack_command
+        self._transport = None
+        self._client = None
+        self._sync_file = None
+        self._closed = False
+        self._ack = None
+        self._loop.call_soon(self._connect)
+
+    @property
+    def address(self):
+        return '%s:%s' % (self.host, self.port)
+
+    def close(self):
+        '''Stop replicating
+        '''
+        self._closed = True
+        if self._ack:
+            self._ack.cancel()
+        if self._transport:
+            self._transport.close()
+
+    def loaded(self):
+        '''The snapshot received from the master is loaded
+        '''
+        if self.state == 'loading':
+            self.state = 'online'
+            self._execute()
+
+    def info(self):
+        return {'role': 'slave',
+                'master_host': self.host,
+                'master_port': self.port,
+                'master_link_status': ('up' if self._transport and
+                                       self.state == 'online' else 'down'),
+                'master_sync_in_progress': int(self.state in ('sync',
+                                                              'loading')),
+                'slave_repl_offset': self.offset}
+
+    # INTERNALS
+    def _connect(self):
+        if not self._closed:
+            self.state = 'connect'
+            self._buffer = bytearray()
+            self._parser = self.store._server._parser_class()
+            self._unparsed = 0
+            coro = self._loop.create_connection(lambda: Link(self),
+                                                self.host, self.port)
+            task = asyncio.ensure_future(coro, loop=self._loop)
+            task.add_done_callback(self._connected)
+
+    def _connected(self, task):
+        if task.exception():
+            self.store.logger.warning('Could not connect to master %s: %s',
+                                      self.address, task.exception())
+            self._loop.call_later(self.store.REPL_RETRY, self._connect)
+
+    def _connection_made(self, transport):
+        self._transport = transport
+        self.state = 'handshake'
+        replid = self.replid or b'?'
+        offset = self.offset if self.replid else -1
+        transport.write(self._pack((b'psync', replid, offset)))
+        self._send_ack()
+
+    def _connection_lost(self):
+        self._transport = None
+        if self._sync_file:
+            # the snapshot was not received entirely
+            self._sync_file.close()
+            self._sync_file = None
+            os.remove(self._sync_filename)
+        if self._ack:
+            self._ack.cancel()
+            self._ack = None
+        if not self._closed:
+            self.store.logger.warning('Lost connection with master %s',
+                                      self.address)
+            self._loop.call_later(self.store.REPL_RETRY, self._connect)
+
+    def _send_ack(self):
+        if self._transport:
+            if self.state == 'online':
+                self._transport.write(
+                    self._pack((b'replconf', b'ack', self.offset)))
+            self._ack = self._loop.call_later(1, self._send_ack)
+
+    def _data_received(self, data):
+        if self.state in ('online', 'loading'):
+            self._feed(data)
+            if self.state == 'online':
+                self._execute()
+            return
+        self._buffer.extend(data)
+        if self.state == 'handshake':
+            line = self._line()
+            if line is None:
+                return
+            if line.startswith(b'+FULLRESYNC'):
+                _, replid, offset = line.split()
+                self.replid = replid
+                self.offset = int(offset)
+                self.state = 'sync'
+                self._sync_size = None
+            elif line.startswith(b'+CONTINUE'):
+                self.store.logger.info('Partial resynchronization with '
+                                       'master %s', self.address)
+                self.state = 'online'
+            else:
+                self.store.logger.error('Master %s replied %s',
+                                        self.address, line)
+                self._closed = True
+                return self._transport.close()
+        if self.state == 'sync':
+            if self._sync_size is None:
+                line = self._line()
+                if line is None:
+                    return
+                self._sync_size = int(line[1:])
+                fd, self._sync_filename = tempfile.mkstemp(suffix='.sync')
+                self._sync_file = os.fdopen(fd, 'wb')
+            missing = self._sync_size - self._sync_file.tell()
+            self._sync_file.write(self._buffer[:missing])
+            del self._buffer[:missing]
+            if self._sync_file.tell() < self._sync_size:
+                return
+            self._sync_file.close()
+            self._sync_file = None
+            self._load()
+        if self.state == 'online' and self._buffer:
+            self._feed(bytes(self._buffer))
+            self._buffer.clear()
+            self._execute()
+
+    def _line(self):
+        index = self._buffer.find(b'\r\n')
+        if index >= 0:
+            line = bytes(self._buffer[:index])
+            del self._buffer[:index+2]
+            return line
+
+    def _load(self):
+        store = self.store
+        self.store.logger.info('Full resynchronization with master %s',
+                               self.address)
+        for db in store.databases.values():
+            db.flush()
+        self._client = ReplayClient(store)
+        self._feed(bytes(self._buffer))
+        self._buffer.clear()
+        self.state = 'loading'
+        store._load(SyncReader(self._sync_filename), store._load_record)
+
+    def _execute(self):
+        client = self._client
+        if client is None:
+            self._client = client = ReplayClient(self.store)
+        parser = self._parser
+        request = parser.get()
+        while request is not False:
+            client.execute(request)
+            request = parser.get()
+        # the offset counts the bytes of the stream consumed by the parser
+        unparsed = len(parser.buffer())
+        self.offset += self._unparsed - unparsed
+        self._unparsed = unparsed
+
+    def _feed(self, data):
+        self._unparsed += len(data)
+        self._parser.feed(data)
+
+
+class SyncReader(SnapshotReader):
+    '''Read a snapshot received from the master and remove it when done
+    '''
+    def close(self):
+        super().close()
+        os.remove(self.filename)
+
+
+class Link(asyncio.Protocol):
+
+    def __init__(self, replica):
+        self.replica = replica
+
+    def connection_made(self, transport):
+        self.replica._connection_made(transport)
+
+    def data_received(self, data):
+        self.replica._data_received(data)
+
+    def connection_lost(self, exc):
+        self.replica._connection_lost()
@@ -0,0 +1,244 @@
+'''Lua scripting for pulsar-ds.
+
+Scripts are executed by the Lua interpreter embedded by lupa_, an optional
+dependency. Each script is compiled once into a Lua function and cached
+by the SHA1 of its source. Scripts access the data store via
+``redis.call`` and ``redis.pcall`` which run commands through the same
+handlers used by network clients. A script runs to completion before
+any other command is executed and it is therefore atomic.
+
+Values are converted between Lua and the redis protocol as in redis:
+
+* integer replies are Lua numbers and Lua numbers are integer replies
+* bulk replies are Lua strings and nil bulk replies are ``false``
+* multi bulk replies are Lua arrays
+* status and error replies are tables with a single ``ok`` or ``err``
+  field
+
+.. _lupa: https://pypi.python.org/pypi/lupa
+'''
+from hashlib import sha1
+
+try:
+    import lupa
+except ImportError:     # pragma    nocover
+    lupa = None
+
+from .client import ClientMixin, COMMANDS_INFO
+from .parser import CommandError
+
+
+# Globals removed from the Lua environment
+UNSAFE_GLOBALS = (b'python', b'os', b'io', b'debug', b'package', b'require',
+                  b'dofile', b'loadfile', b'load')
+
+LUA_REDIS = '''
+function(call, log, sha1hex)
+    local function dispatch(raise, ...)
+        local reply = call(...)
+        if raise and type(reply) == 'table' and reply.err then
+            error(reply.err, 2)
+        end
+        return reply
+    end
+    redis = {
+        call = function(...) return dispatch(true, ...) end,
+        pcall = function(...) return dispatch(false, ...) end,
+        status_reply = function(status) return {ok=status} end,
+        error_reply = function(err) return {err=err} end,
+        sha1hex = sha1hex,
+        log = log,
+        LOG_DEBUG = 0,
+        LOG_VERBOSE = 1,
+        LOG_NOTICE = 2,
+        LOG_WARNING = 3
+    }
+end
+'''
+
+
+def script_sha(script):
+    return sha1(script).hexdigest().encode('utf-8')
+
+
+class ScriptClient(ClientMixin):
+    '''Execute commands called by scripts and convert their replies into
+    Lua values
+    '''
+    def __init__(self, store, lua):
+        super().__init__(store)
+        self._loop = store._loop
+        self._lua = lua
+        self.channels = ()
+        self.patterns = ()
+        self.password = store._password
+        self.reply = None
+
+    def reply_ok(self):
+        self.reply = self._lua.table_from({b'ok': b'OK'})
+
+    def reply_status(self, value):
+        self.reply = self._lua.table_from({b'ok': value.encode('utf-8')})
+
+    def reply_error(self, value, prefix=None):
+        error = '%s %s' % (prefix or 'ERR', value)
+        self.reply = self._lua.table_from({b'err': error.encode('utf-8')})
+
+    def reply_wrongtype(self):
+        self.reply = self._lua.table_from({
+            b'err': b'WRONGTYPE Operation against a key holding the wrong '
+                    b'kind of value'})
+
+    def reply_int(self, value):
+        self.reply = value
+
+    def reply_one(self):
+        self.reply = 1
+
+    def reply_zero(self):
+        self.reply = 0
+
+    def reply_bulk(self, value=None):
+        self.reply = False if value is None else bytes(value)
+
+    def reply_multi_bulk(self, value=None):
+        self.reply = False if value is None else self._array(value)
+
+    def _array(self, values):
+        items = []
+        for value in values:
+            if value is None:
+                items.append(False)
+            elif isinstance(value, (bytes, bytearray)):
+                items.append(bytes(value))
+            elif isinstance(value, str):
+                items.append(value.encode('utf-8'))
+            elif isinstance(value, (list, tuple)):
+                items.append(self._array(value))
+            else:
+                items.append(str(value).encode('utf-8'))
+        return self._lua.table(*items)
+
+
+class Scripting:
+    '''The Lua interpreter and the script cache of a :class:`.Storage`
+    '''
+    def __init__(self, store):
+        self.store = store
+        self.scripts = {}
+        self._lua = lua = lupa.LuaRuntime(encoding=None, register_eval=False,
+                                          register_builtins=False)
+        lua.eval(LUA_REDIS)(self._call, self._log, script_sha)
+        env = lua.globals()
+        for name in UNSAFE_GLOBALS:
+            env[name] = None
+        self._env = env
+        self._client = ScriptClient(store, lua)
+
+    def load(self, script):
+        '''Compile ``script`` and return its SHA1
+        '''
+        sha = script_sha(script)
+        if sha not in self.scripts:
+            try:
+                self.scripts[sha] = self._lua.eval(
+                    b'function() ' + script + b'\nend')
+            except lupa.LuaError as exc:
+                raise CommandError('Error compiling script (new function): '
+                                   '%s' % self._message(exc))
+        return sha
+
+    def flush(self):
+        self.scripts.clear()
+
+    def run(self, client, sha, keys, args):
+        '''Run script ``sha`` for ``client`` and reply with its result
+        '''
+        function = self.scripts[sha]
+        env = self._env
+        table = self._lua.table
+        env[b'KEYS'] = table(*keys)
+        env[b'ARGV'] = table(*args)
+        self._client.database = client.database
+        try:
+            result = function()
+        except lupa.LuaError as exc:
+            client.reply_error('Error running script (call to f_%s): %s' %
+                               (sha.decode('utf-8'), self._message(exc)))
+        else:
+            self._reply(client, result)
+
+    # INTERNALS
+    def _call(self, *args):
+        client = self._client
+        request = [arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+                   for arg in args]
+        if not request:
+            client.reply_error('Please specify at least one argument for '
+                               'redis.call()')
+        else:
+            info = COMMANDS_INFO.get(request[0].decode('utf-8').lower())
+            if info is None:
+                client.reply_error('Unknown Redis command called from Lua '
+                                   'script')
+            elif not info.script:
+                client.reply_error('This Redis command is not allowed from '
+                                   'scripts')
+            else:
+                client.execute(request)
+        reply, client.reply = client.reply, None
+        return reply
+
+    def _log(self, level, *args):
+        message = ' '.join((str(arg, 'utf-8') if isinstance(arg, bytes)
+                            else str(arg) for arg in args))
+        logger = self.store.logger
+        if level <= 1:
+            logger.debug(message)
+        elif level == 2:
+            logger.info(message)
+        else:
+            logger.warning(message)
+
+    def _message(self, exc):
+        return str(exc).split('\n')[0]
+
+    def _reply(self, client, result):
+        if lupa.lua_type(result) == 'table':
+            if result[b'err'] is not None:
+                prefix, _, message = result[b'err'].decode('utf-8').partition(
+                    ' ')
+                if message and prefix.isupper():
+                    client.reply_error(message, prefix)
+                else:
+                    client.reply_error(result[b'err'].decode('utf-8'))
+            elif result[b'ok'] is not None:
+                client.reply_status(result[b'ok'].decode('utf-8'))
+            else:
+                client.reply_multi_bulk(self._list(result))
+        elif result is True:
+            client.reply_one()
+        elif result is None or result is False:
+            client.reply_bulk()
+        elif isinstance(result, (int, float)):
+            client.reply_int(int(result))
+        else:
+            client.reply_bulk(result)
+
+    def _list(self, table):
+        # the array part of a Lua table, up to the first nil
+        items = []
+        for index in range(1, len(table) + 1):
+            value = table[index]
+            if value is None:
+                break
+            elif lupa.lua_type(value) == 'table':
+                value = self._list(value)
+            elif value is False:
+                value = None
+            elif value is True:
+                value = 1
+            elif isinstance(value, float):
+                value = int(value)
+            items.append(value)
+        return items
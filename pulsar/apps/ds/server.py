@@ -45,21 +45,41 @@ import re
 import time
 import math
 import pickle
+import socket
+import asyncio
+from array import array
+from bisect import bisect_left
 from random import choice
+from collections import OrderedDict
 from itertools import islice, chain
 from functools import partial, reduce
-from collections import namedtuple
 from itertools import zip_longest
 
 import pulsar
+from pulsar import ImproperlyConfigured
+from pulsar.async.mailbox import create_aid
 from pulsar.apps.socket import SocketServer
-from pulsar.utils.config import Global
-from pulsar.utils.structures import Dict, Zset, Deque
-
-from .parser import redis_parser
-from .utils import sort_command, count_bytes, and_op, or_op, xor_op, save_data
-from .client import (command, PulsarStoreClient, Blocked,
-                     COMMANDS_INFO, check_input, redis_to_py_pattern)
+from pulsar.utils.config import Global, validate_bool
+from pulsar.utils.internet import parse_address
+from pulsar.utils.structures import TimerWheel
+
+from .parser import redis_parser, CommandError
+from .utils import sort_command, count_bytes, and_op, or_op, xor_op
+from .snapshot import SnapshotWriter, SnapshotReader
+from .aof import (AppendOnlyFile, AofRewriter, AofReader, FSYNC_POLICIES,
+                  PROPAGATED, absolute_timeouts)
+from .replication import Master, Replica
+from .cluster import Cluster, key_slot
+from .encodings import Encodings, Hash, List, Set, SortedSet, as_int, encode
+from .streams import (Stream, ConsumerGroup, parse_id, parse_range,
+                      format_id, mstime, MAX_ID, INVALID_ID)
+from .scripting import Scripting, lupa
+from .memory import Memory, POLICIES as MAXMEMORY_POLICIES
+from .pubsub import PatternIndex
+from .stats import CommandStats, SlowLog, client_address
+from .client import (command, PulsarStoreClient, Blocked, numkeys,
+                     store_numkeys, sort_keys, stream_keys, COMMANDS_INFO,
+                     check_input, redis_to_py_pattern)
 
 
 DEFAULT_PULSAR_STORE_ADDRESS = '127.0.0.1:6410'
@@ -77,6 +97,8 @@ def pulsards_url(address=None):
 
 
 # Keyspace changes notification classes
+KEYSPACE_EVENTS = 'KEg$lshzxetA'
+
 STRING_LIMIT = 2**32
 
 nan = float('nan')
@@ -114,6 +136,41 @@ def validate_list_of_pairs(val):
     return new_val
 
 
+def validate_memory(val):
+    '''A number of bytes, optionally followed by a ``kb``, ``mb`` or ``gb``
+    unit
+    '''
+    if isinstance(val, str):
+        number = val.strip().lower()
+        for unit, multiplier in (('kb', 1024), ('mb', 1024**2),
+                                 ('gb', 1024**3), ('b', 1)):
+            if number.endswith(unit):
+                return int(number[:-len(unit)])*multiplier
+    return int(val)
+
+
+def validate_keyspace_events(val):
+    '''A string of keyspace notification classes, as redis'
+    ``notify-keyspace-events``
+    '''
+    val = val or ''
+    invalid = set(val) - set(KEYSPACE_EVENTS)
+    if invalid:
+        raise ValueError('Invalid keyspace event classes %s' %
+                         ''.join(sorted(invalid)))
+    return val
+
+
+def validate_output_buffer_limit(val):
+    '''A hard limit, a soft limit, both in bytes or with a unit, and the
+    number of seconds a client can exceed the soft limit
+    '''
+    if isinstance(val, str):
+        val = val.split()
+    hard, soft, seconds = val
+    return validate_memory(hard), validate_memory(soft), int(seconds)
+
+
 # #############################################################################
 # #    CONFIGURATION PARAMETERS
 class KeyValueDatabases(PulsarDsSetting):
@@ -158,13 +215,230 @@ class KeyValueFileName(PulsarDsSetting):
     desc = '''The filename where to dump the DB.'''
 
 
+class KeyValueAppendOnly(PulsarDsSetting):
+    name = "key_value_appendonly"
+    flags = ["--key-value-appendonly"]
+    validator = validate_bool
+    action = "store_true"
+    default = False
+    desc = '''\
+        Log write commands into an append only file.
+
+        When the append only file exists it is replayed at startup in place
+        of the snapshot in ``key_value_filename``.
+        '''
+
+
+class KeyValueAppendFileName(PulsarDsSetting):
+    name = "key_value_appendfilename"
+    flags = ["--key-value-appendfilename"]
+    default = 'pulsards.aof'
+    desc = '''The filename of the append only file.'''
+
+
+class KeyValueAppendFsync(PulsarDsSetting):
+    name = "key_value_appendfsync"
+    flags = ["--key-value-appendfsync"]
+    choices = FSYNC_POLICIES
+    default = 'everysec'
+    desc = '''\
+        How often the append only file is flushed to disk.
+
+        ``always`` after every write command, ``everysec`` once per second
+        and ``no`` leaves it to the operating system.
+        '''
+
+
+class KeyValueSlaveOf(PulsarDsSetting):
+    name = "key_value_slaveof"
+    flags = ["--key-value-slaveof"]
+    default = ''
+    desc = '''\
+        Address ``host:port`` of a master data store to replicate.
+
+        A replica serves read-only traffic. Replication can also be started
+        and stopped with the ``SLAVEOF`` command.
+        '''
+
+
+class KeyValueShards(PulsarDsSetting):
+    name = "key_value_shards"
+    flags = ["--key-value-shards"]
+    type = int
+    default = 0
+    desc = '''\
+        Number of shards of the key value store.
+
+        Each shard is served by a worker listening on its own address and
+        owns a range of the 16384 hash slots of the keyspace. The first
+        shard listens on the ``bind`` address, the others on the following
+        ports. Requests for keys of another shard are redirected with a
+        ``MOVED`` error.
+        '''
+
+
+class KeyValueListpackEntries(PulsarDsSetting):
+    name = "key_value_listpack_entries"
+    flags = ["--key-value-listpack-entries"]
+    type = int
+    default = 128
+    desc = '''\
+        Maximum number of entries of hashes, lists and sorted sets stored
+        in the compact listpack encoding.
+
+        Larger structures are converted to a hash table, a linked list or
+        a skiplist. Set to 0 to disable the listpack encoding.
+        '''
+
+
+class KeyValueListpackValue(PulsarDsSetting):
+    name = "key_value_listpack_value"
+    flags = ["--key-value-listpack-value"]
+    type = int
+    default = 64
+    desc = '''\
+        Maximum size in bytes of the elements of hashes, lists and sorted
+        sets stored in the compact listpack encoding.
+        '''
+
+
+class KeyValueIntsetEntries(PulsarDsSetting):
+    name = "key_value_intset_entries"
+    flags = ["--key-value-intset-entries"]
+    type = int
+    default = 512
+    desc = '''\
+        Maximum number of members of sets of integers stored in the compact
+        intset encoding.
+
+        Set to 0 to disable the intset encoding.
+        '''
+
+
+class KeyValueStreamNodeMaxEntries(PulsarDsSetting):
+    name = "key_value_stream_node_max_entries"
+    flags = ["--key-value-stream-node-max-entries"]
+    type = int
+    default = 100
+    desc = '''\
+        Maximum number of entries of the nodes of streams.
+
+        Approximate trimming with ``MAXLEN ~`` or ``MINID ~`` only removes
+        whole nodes.
+        '''
+
+
+class KeyValueMaxMemory(PulsarDsSetting):
+    name = "key_value_maxmemory"
+    flags = ["--key-value-maxmemory"]
+    validator = validate_memory
+    default = 0
+    desc = '''\
+        Maximum memory used by the dataset, in bytes or with a ``kb``,
+        ``mb`` or ``gb`` unit.
+
+        The memory is an estimate based on the size and encoding of keys
+        and values. When it exceeds the limit, keys are evicted according
+        to ``key_value_maxmemory_policy``. Set to 0 for no limit.
+        '''
+
+
+class KeyValueMaxMemoryPolicy(PulsarDsSetting):
+    name = "key_value_maxmemory_policy"
+    flags = ["--key-value-maxmemory-policy"]
+    choices = MAXMEMORY_POLICIES
+    default = 'noeviction'
+    desc = '''\
+        How keys are evicted when the memory exceeds
+        ``key_value_maxmemory``.
+
+        ``allkeys-lru`` and ``allkeys-lfu`` evict the least recently or
+        the least frequently used keys, ``volatile-lru``,
+        ``volatile-lfu`` and ``volatile-ttl`` only evict keys with a
+        timeout, the latter the keys closest to expire. With
+        ``noeviction`` write commands fail with an ``OOM`` error.
+        '''
+
+
+class KeyValueMaxMemorySamples(PulsarDsSetting):
+    name = "key_value_maxmemory_samples"
+    flags = ["--key-value-maxmemory-samples"]
+    type = int
+    default = 5
+    desc = '''\
+        Number of keys sampled in each database to find the keys to evict.
+
+        Larger samples approximate the eviction policy more accurately at
+        a higher cost.
+        '''
+
+
+class KeyValueSlowlogLogSlowerThan(PulsarDsSetting):
+    name = "key_value_slowlog_log_slower_than"
+    flags = ["--key-value-slowlog-log-slower-than"]
+    type = int
+    default = 10000
+    desc = '''\
+        Commands taking longer than this number of microseconds are added
+        to the slow log.
+
+        Set to 0 to log all commands, to a negative number to disable the
+        slow log.
+        '''
+
+
+class KeyValueSlowlogMaxLen(PulsarDsSetting):
+    name = "key_value_slowlog_max_len"
+    flags = ["--key-value-slowlog-max-len"]
+    type = int
+    default = 128
+    desc = '''\
+        Maximum number of commands in the slow log, older commands are
+        removed when the log is full.
+        '''
+
+
+class KeyValuePubsubOutputBufferLimit(PulsarDsSetting):
+    name = "key_value_pubsub_output_buffer_limit"
+    flags = ["--key-value-pubsub-output-buffer-limit"]
+    validator = validate_output_buffer_limit
+    default = '32mb 8mb 60'
+    desc = '''\
+        Output buffer limits of subscribed clients, as a hard limit, a
+        soft limit and a number of seconds.
+
+        Clients not reading messages fast enough are disconnected as soon
+        as the data waiting to be sent exceeds the hard limit, or when it
+        exceeds the soft limit for more than the given seconds. Set a
+        limit to 0 to disable it.
+        '''
+
+
+class KeyValueNotifyKeyspaceEvents(PulsarDsSetting):
+    name = "key_value_notify_keyspace_events"
+    flags = ["--key-value-notify-keyspace-events"]
+    validator = validate_keyspace_events
+    default = ''
+    desc = '''\
+        Keyspace notifications published by the server, as redis'
+        ``notify-keyspace-events``.
+
+        ``K`` publishes events on ``__keyspace@<db>__:<key>`` channels
+        and ``E`` on ``__keyevent@<db>__:<event>`` channels. The classes
+        of events are ``g`` generic, ``$`` string, ``l`` list, ``s`` set,
+        ``h`` hash, ``z`` sorted set, ``t`` stream, ``x`` expired and
+        ``e`` evicted commands, ``A`` is an alias for all of them.
+        Empty for no notifications.
+        '''
+
+
 class TcpServer(pulsar.TcpServer):
 
-    def __init__(self, cfg, *args, **kwargs):
+    def __init__(self, cfg, *args, shard=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.cfg = cfg
         self._parser_class = redis_parser(cfg.redis_py_parser)
-        self._key_value_store = Storage(self, cfg)
+        self._key_value_store = Storage(self, cfg, shard)
 
     def info(self):
         info = super().info()
@@ -176,47 +450,121 @@ class PulsarDS(SocketServer):
     '''A :class:`.SocketServer` serving a pulsar datastore.
     '''
     name = 'pulsards'
+    # the data is in the workers, one per shard
+    autoscale = False
     cfg = pulsar.Config(bind=DEFAULT_PULSAR_STORE_ADDRESS,
                         keep_alive=0,
                         apps=['socket', 'pulsards'])
 
     def server_factory(self, *args, **kw):
-        return TcpServer(self.cfg, *args, **kw)
+        shard = getattr(pulsar.get_actor(), 'shard', None)
+        return TcpServer(self.cfg, *args, shard=shard, **kw)
 
     def protocol_factory(self):
         return partial(PulsarStoreClient, self.cfg)
 
-    def monitor_start(self, monitor):
+    def on_config(self, arbiter):
         cfg = self.cfg
-        workers = min(1, cfg.workers)
-        cfg.set('workers', workers)
-        return super().monitor_start(monitor)
+        if cfg.key_value_shards <= 0 and cfg.workers > 1:
+            # independent workers would serve independent data
+            raise ImproperlyConfigured('A pulsar-ds server without shards '
+                                       'has at most one worker, set the '
+                                       'number of shards instead')
+
+    async def monitor_start(self, monitor):
+        cfg = self.cfg
+        shards = cfg.key_value_shards
+        if shards > 0:
+            cfg.set('workers', shards)
+        await super().monitor_start(monitor)
+        if shards > 0:
+            await self.monitor_shards(monitor, shards)
+
+    async def monitor_shards(self, monitor, shards):
+        '''Create the sockets of ``shards`` shards
+        '''
+        cfg = self.cfg
+        if not cfg.workers:
+            raise ImproperlyConfigured('A sharded pulsar-ds server requires '
+                                       'process workers')
+        if cfg.key_value_slaveof:
+            raise ImproperlyConfigured('A sharded pulsar-ds server cannot '
+                                       'be a replica')
+        host, port = parse_address(cfg.address)
+        sockets = [monitor.sockets]
+        loop = monitor._loop
+        for n in range(1, shards):
+            try:
+                server = await loop.create_server(asyncio.Protocol, host,
+                                                  port + n if port else 0)
+            except socket.error as e:
+                raise ImproperlyConfigured(e)
+            for sock in server.sockets:
+                loop.remove_reader(sock.fileno())
+            sockets.append(server.sockets)
+        monitor.shards = sockets
+        monitor.shard_workers = [None]*shards
+        cfg.addresses = [shard[0].getsockname() for shard in sockets]
+
+    def actorparams(self, monitor, params):
+        shards = getattr(monitor, 'shards', None)
+        if shards:
+            # assign the first shard without a running worker
+            workers = monitor.shard_workers
+            shard = next((n for n, aid in enumerate(workers)
+                          if aid not in monitor.managed_actors), None)
+            if shard is None:
+                raise ImproperlyConfigured('All the %d shards of %s have a '
+                                           'worker' % (len(workers), self))
+            workers[shard] = params['aid'] = create_aid()
+            params['shard'] = shard
+            params['sockets'] = shards[shard]
+        else:
+            super().actorparams(monitor, params)
 
 
 # #############################################################################
 # #    DATA STORE
-pubsub_patterns = namedtuple('pubsub_patterns', 're clients')
 
 
 class Storage:
     '''Implement redis commands.
     '''
-    def __init__(self, server, cfg):
+    def __init__(self, server, cfg, shard=None):
         self.cfg = cfg
         self._password = cfg.key_value_password.encode('utf-8')
         self._filename = cfg.key_value_filename
-        self._writer = None
+        self._aof_filename = cfg.key_value_appendfilename
+        # the shards of a sharded store
+        self._cluster = None
+        if shard is not None:
+            self._cluster = Cluster(cfg.addresses, shard)
+            self._filename = self._cluster.filename(self._filename)
+            self._aof_filename = self._cluster.filename(self._aof_filename)
+        self._snapshot = None
+        self._loading = None
+        self._aof = None
+        self._propagated = None
+        # replicas of this store and link to the master of this store
+        self._master = None
+        self._replica = None
         self._server = server
         self._loop = server._loop
         self._parser = server._parser_class()
         self._missed_keys = 0
         self._hit_keys = 0
         self._expired_keys = 0
+        self._evicted_keys = 0
+        self._output_limit_disconnections = 0
         self._dirty = 0
         self._bpop_blocked_clients = 0
+        self._ready_keys = OrderedDict()
         self._last_save = int(time.time())
         self._channels = {}
-        self._patterns = {}
+        self._scan_cursors = OrderedDict()
+        self._scan_cursor_id = 0
+        self._scan_cursors_members = 0
+        self._commandstats = {}
         # The set of clients which are watching keys
         self._watching = set()
         # The set of clients which issued the monitor command
@@ -233,22 +581,108 @@ class Storage:
         self.NOTIFY_ZSET = (1 << 7)
         self.NOTIFY_EXPIRED = (1 << 8)
         self.NOTIFY_EVICTED = (1 << 9)
+        self.NOTIFY_STREAM = (1 << 10)
         self.NOTIFY_ALL = (self.NOTIFY_GENERIC | self.NOTIFY_STRING |
                            self.NOTIFY_LIST | self.NOTIFY_SET |
                            self.NOTIFY_HASH | self.NOTIFY_ZSET |
-                           self.NOTIFY_EXPIRED | self.NOTIFY_EVICTED)
+                           self.NOTIFY_EXPIRED | self.NOTIFY_EVICTED |
+                           self.NOTIFY_STREAM)
+        self._keyspace_classes = {'K': self.NOTIFY_KEYSPACE,
+                                  'E': self.NOTIFY_KEYEVENT,
+                                  'g': self.NOTIFY_GENERIC,
+                                  '$': self.NOTIFY_STRING,
+                                  'l': self.NOTIFY_LIST,
+                                  's': self.NOTIFY_SET,
+                                  'h': self.NOTIFY_HASH,
+                                  'z': self.NOTIFY_ZSET,
+                                  'x': self.NOTIFY_EXPIRED,
+                                  'e': self.NOTIFY_EVICTED,
+                                  't': self.NOTIFY_STREAM,
+                                  'A': self.NOTIFY_ALL}
+        self._set_keyspace_events(cfg.key_value_notify_keyspace_events)
 
         self.MONITOR = (1 << 2)
         self.MULTI = (1 << 3)
         self.BLOCKED = (1 << 4)
         self.DIRTY_CAS = (1 << 5)
+        self.REPLAY = (1 << 6)
+        #
+        # Active expiry of keys runs at every cron cycle and removes at most
+        # EXPIRE_KEYS_PER_CYCLE keys
+        self.EXPIRE_RESOLUTION = 0.1
+        self.EXPIRE_KEYS_PER_CYCLE = 2000
+        #
+        # SCAN family of commands
+        self.SCAN_COUNT = 10
+        self.SCAN_SPAN_BITS = 32
+        self.SCAN_KEYS_SLACK = 1024
+        self.SCAN_SMALL_COLLECTION = 128
+        self.SCAN_CURSORS = 1024
+        self.SCAN_CURSORS_MEMBERS = 1024*1024
+        #
+        # Snapshots are written and loaded in slices of loop time
+        self.SNAPSHOT_SLICE = 0.01
+        self.LOADING_SLICE = 0.05
+        self.LOADING_COMMANDS = ('info', 'ping', 'auth', 'quit')
+        #
+        # The append only file is rewritten when larger than
+        # AOF_REWRITE_MIN_SIZE and AOF_REWRITE_GROWTH times its size after
+        # the last rewrite
+        self.AOF_REWRITE_MIN_SIZE = 64*1024*1024
+        self.AOF_REWRITE_GROWTH = 2
+        #
+        # Replication, commands executed during the full synchronization
+        # of a replica are buffered up to REPL_BUFFER_LIMIT bytes
+        self.REPL_BACKLOG_SIZE = 1024*1024
+        self.REPL_BUFFER_LIMIT = 256*1024*1024
+        self.REPL_RETRY = 1
+        #
+        # Number of channels whose matching patterns are cached
+        self.PUBSUB_PATTERNS_CACHE = 1024
+        self._patterns = PatternIndex(self.PUBSUB_PATTERNS_CACHE)
+        self._pubsub_limit = cfg.key_value_pubsub_output_buffer_limit
+        #
+        # Replies to the requests of a chunk of data received are written
+        # at once, or when they exceed REPLY_BUFFER_SIZE bytes
+        self.REPLY_BUFFER_SIZE = 64*1024
+        #
+        # Command statistics, slow log entries keep at most SLOWLOG_ARGS
+        # arguments of SLOWLOG_ARG_LENGTH bytes
+        self.LATENCY_PERCENTILES = (50, 99, 99.9)
+        self.SLOWLOG_ARGS = 32
+        self.SLOWLOG_ARG_LENGTH = 128
+        self._slowlog = SlowLog(cfg.key_value_slowlog_log_slower_than,
+                                cfg.key_value_slowlog_max_len,
+                                self.SLOWLOG_ARGS, self.SLOWLOG_ARG_LENGTH)
+        #
+        # Eviction of keys above maxmemory. The pool keeps the best
+        # candidates among sampled keys, the access frequency counter of a
+        # key is incremented with a probability decreasing with
+        # LFU_LOG_FACTOR and decremented every LFU_DECAY_TIME minutes
+        self.MAXMEMORY_POOL_SIZE = 16
+        self.LFU_LOG_FACTOR = 10
+        self.LFU_DECAY_TIME = 1
+        #
+        # Streams are stored in nodes of at most STREAM_NODE_MAX_ENTRIES
+        # entries, approximate trimming removes at most STREAM_TRIM_NODES
+        # nodes by default
+        self._stream_node_size = cfg.key_value_stream_node_max_entries
+        self.STREAM_TRIM_NODES = 100
+        self.OOM_COMMANDS = frozenset(('del', 'expire', 'expireat', 'flushall',
+                                       'flushdb', 'hdel', 'lpop', 'lrem',
+                                       'ltrim', 'pexpire', 'pexpireat',
+                                       'persist', 'rpop', 'spop', 'srem',
+                                       'xack', 'xdel', 'xtrim', 'zrem',
+                                       'zremrangebyrank', 'zremrangebyscore'))
         #
         self._event_handlers = {self.NOTIFY_GENERIC: self._generic_event,
                                 self.NOTIFY_STRING: self._string_event,
                                 self.NOTIFY_SET: self._set_event,
                                 self.NOTIFY_HASH: self._hash_event,
                                 self.NOTIFY_LIST: self._list_event,
-                                self.NOTIFY_ZSET: self._zset_event}
+                                self.NOTIFY_ZSET: self._zset_event,
+                                self.NOTIFY_STREAM: self._stream_event,
+                                self.NOTIFY_EVICTED: self._generic_event}
         self._set_options = (b'ex', b'px', b'nx', b'xx')
         self.OK = b'+OK\r\n'
         self.QUEUED = b'+QUEUED\r\n'
@@ -261,40 +695,63 @@ class Storage:
                             'allowed in this context')
         self.INVALID_SCORE = 'Invalid score value'
         self.NOT_SUPPORTED = 'Command not yet supported'
+        self.NO_SCRIPTING = 'Scripting requires the lupa package'
         self.OUT_OF_BOUND = 'Out of bound'
+        self.OOM = "command not allowed when used memory > 'maxmemory'."
         self.SYNTAX_ERROR = 'Syntax error'
+        self.EMBSTR_SIZE = 44
+        self.LIST_ENDS = {b'left': True, b'right': False}
+        self.XGROUP_NO_KEY = ('The XGROUP subcommand requires the key to '
+                              'exist. Note that for CREATE you may want to '
+                              'use the MKSTREAM option to create an empty '
+                              'stream automatically.')
         self.SUBSCRIBE_COMMANDS = ('psubscribe', 'punsubscribe', 'subscribe',
-                                   'unsubscribe', 'quit')
+                                   'unsubscribe', 'ping', 'quit')
         self.encoder = pickle
-        self.hash_type = Dict
-        self.list_type = Deque
-        self.zset_type = Zset
-        self.data_types = (bytearray, set, self.hash_type,
-                           self.list_type, self.zset_type)
+        self.encodings = Encodings(cfg.key_value_listpack_entries,
+                                   cfg.key_value_listpack_value,
+                                   cfg.key_value_intset_entries)
+        self.hash_type = Hash
+        self.list_type = List
+        self.set_type = Set
+        self.zset_type = SortedSet
+        self.stream_type = Stream
+        self.data_types = (bytearray, self.set_type, self.hash_type,
+                           self.list_type, self.zset_type, self.stream_type)
         self.zset_aggregate = {b'min': min,
                                b'max': max,
                                b'sum': sum}
         self._type_event_map = {bytearray: self.NOTIFY_STRING,
-                                self.hash_type: self.NOTIFY_HASH,
-                                self.list_type: self.NOTIFY_LIST,
-                                set: self.NOTIFY_SET,
-                                self.zset_type: self.NOTIFY_ZSET}
+                                self.stream_type: self.NOTIFY_STREAM}
         self._type_name_map = {bytearray: 'string',
-                               self.hash_type: 'hash',
-                               self.list_type: 'list',
-                               set: 'set',
-                               self.zset_type: 'zset'}
+                               self.stream_type: 'stream'}
+        for base, name, event in ((self.hash_type, 'hash', self.NOTIFY_HASH),
+                                  (self.list_type, 'list', self.NOTIFY_LIST),
+                                  (self.set_type, 'set', self.NOTIFY_SET),
+                                  (self.zset_type, 'zset', self.NOTIFY_ZSET)):
+            # the maps are keyed by the classes of all encodings
+            for cls in (base.compact, base.full):
+                self._type_event_map[cls] = event
+                self._type_name_map[cls] = name
+        self._memory = None
+        if cfg.key_value_maxmemory > 0:
+            self._memory = Memory(self, cfg.key_value_maxmemory,
+                                  cfg.key_value_maxmemory_policy,
+                                  cfg.key_value_maxmemory_samples)
         self.databases = dict(((num, Db(num, self))
                                for num in range(cfg.key_value_databases)))
         # Initialise lua
-        self.lua = None
+        self.lua = Scripting(self) if lupa else None
         self.version = '2.4.10'
         self._loaddb()
+        if cfg.key_value_slaveof:
+            host, port = cfg.key_value_slaveof.rsplit(':', 1)
+            self._slaveof(host, int(port))
         self._cron()
 
     # #########################################################################
     # #    KEYS COMMANDS
-    @command('Keys', True, name='del')
+    @command('Keys', True, name='del', keys=(1, -1, 1))
     def delete(self, client, request, N):
         check_input(request, not N)
         rem = client.db.rem
@@ -330,6 +787,8 @@ class Storage:
                 if timeout < 0:
                     return client.reply_error(self.INVALID_TIMEOUT)
                 if client.db.expire(request[1], m*timeout):
+                    self._signal(self.NOTIFY_GENERIC, client.db, request[0],
+                                 request[1], 1)
                     return client.reply_one()
             client.reply_zero()
 
@@ -346,23 +805,19 @@ class Storage:
                     return client.reply_error(self.INVALID_TIMEOUT)
                 timeout = M*timeout - time.time()
                 if client.db.expire(request[1], timeout):
+                    self._signal(self.NOTIFY_GENERIC, client.db, request[0],
+                                 request[1], 1)
                     return client.reply_one()
             client.reply_zero()
 
-    @command('Keys')
+    @command('Keys', keys=())
     def keys(self, client, request, N):
-        err = 'ignore'
         check_input(request, N != 1)
-        pattern = request[1].decode('utf-8', err)
-        allkeys = pattern == '*'
-        gr = None
-        if not allkeys:
-            gr = re.compile(redis_to_py_pattern(pattern))
-        result = [key for key in client.db if allkeys or
-                  gr.search(key.decode('utf-8', err))]
+        match = self._match(request[1])
+        result = [key for key in client.db if not match or match(key)]
         client.reply_multi_bulk(result)
 
-    @command('Keys', supported=False)
+    @command('Keys', supported=False, keys=())
     def migrate(self, client, request, N):
         client.reply_error(self.NOT_SUPPORTED)
 
@@ -383,18 +838,53 @@ class Storage:
         assert value
         db.pop(key)
         self._signal(self.NOTIFY_GENERIC, db, 'del', key, 1)
-        db2._data[key] = value
+        db2.set(key, value)
         self._signal(self._type_event_map[type(value)], db2, 'set', key, 1)
         client.reply_one()
 
-    @command('Keys', supported=False)
+    @command('Keys', keys=(2, 2, 1),
+             subcommands=['encoding', 'refcount', 'idletime', 'freq'])
     def object(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N != 2)
+        subcommand = request[1].decode('utf-8').lower()
+        if subcommand not in ('encoding', 'refcount', 'idletime', 'freq'):
+            return client.reply_error("unknown command 'object %s'" %
+                                      subcommand)
+        memory = self._memory
+        if subcommand == 'idletime' and not (memory and memory.lru):
+            return client.reply_error('An LRU maxmemory policy is not '
+                                      'selected, idle time not tracked.')
+        elif subcommand == 'freq' and not (memory and memory.lfu):
+            return client.reply_error('An LFU maxmemory policy is not '
+                                      'selected, access frequency not '
+                                      'tracked.')
+        # inspecting a key is not an access to it
+        db, key = client.db, request[2]
+        value = db._data.get(key) if db.exists(key) else None
+        if value is None:
+            client.reply_bulk()
+        elif subcommand == 'idletime':
+            client.reply_int(memory.idle_time(db, key))
+        elif subcommand == 'freq':
+            client.reply_int(memory.frequency(db, key))
+        elif subcommand == 'refcount':
+            client.reply_one()
+        elif isinstance(value, bytearray):
+            if as_int(value) is not None:
+                client.reply_bulk(b'int')
+            elif len(value) <= self.EMBSTR_SIZE:
+                client.reply_bulk(b'embstr')
+            else:
+                client.reply_bulk(b'raw')
+        else:
+            client.reply_bulk(value.encoding.encode('utf-8'))
 
     @command('Keys', True)
     def persist(self, client, request, N):
         check_input(request, N != 1)
         if client.db.persist(request[1]):
+            self._signal(self.NOTIFY_GENERIC, client.db, request[0],
+                         request[1], 1)
             client.reply_one()
         else:
             client.reply_zero()
@@ -412,7 +902,7 @@ class Storage:
         check_input(request, N != 1)
         client.reply_int(client.db.ttl(request[1], 1000))
 
-    @command('Keys')
+    @command('Keys', keys=())
     def randomkey(self, client, request, N):
         check_input(request, N)
         keys = list(client.db)
@@ -421,7 +911,7 @@ class Storage:
         else:
             client.reply_bulk()
 
-    @command('Keys', True)
+    @command('Keys', True, keys=(1, 2, 1))
     def rename(self, client, request, N, ex=False):
         check_input(request, N != 2)
         key1, key2 = request[1], request[2]
@@ -444,11 +934,11 @@ class Storage:
             db.pop(key1)
             event = self._type_event_map[type(value)]
             dirty = 1 if event == self.NOTIFY_STRING else len(value)
-            db._data[key2] = value
+            db.set(key2, value)
             self._signal(event, db, request[0], key2, dirty)
             client.reply_one() if result else client.reply_ok()
 
-    @command('Keys', True)
+    @command('Keys', True, keys=(1, 2, 1))
     def renamenx(self, client, request, N):
         self.rename(client, request, N, True)
 
@@ -458,7 +948,7 @@ class Storage:
         key = request[1]
         db = client.db
         try:
-            value = self.encoder.loads(request[3])
+            value = encode(self.encodings, self.encoder.loads(request[3]))
         except Exception:
             value = None
         if not isinstance(value, self.data_types):
@@ -469,27 +959,28 @@ class Storage:
             return client.reply_error(self.INVALID_TIMEOUT)
         if db.pop(key) is not None:
             self._signal(self.NOTIFY_GENERIC, db, 'del', key)
-        db._data[key] = value
+        db.set(key, value)
         if ttl > 0:
             db.expire(key, ttl)
         client.reply_ok()
 
-    @command('Keys', True)
+    @command('Keys', True, keys=sort_keys)
     def sort(self, client, request, N):
         check_input(request, not N)
         value = client.db.get(request[1])
         if value is None:
-            value = self.list_type()
-        elif not isinstance(value, (set, self.list_type, self.zset_type)):
+            value = self.list_type(self.encodings)
+        elif not isinstance(value, (self.set_type, self.list_type,
+                                    self.zset_type)):
             return client.reply_wrongtype()
         sort_command(self, client, request, value)
 
-    @command('Keys', True)
+    @command('Keys')
     def ttl(self, client, request, N):
         check_input(request, N != 1)
         client.reply_int(client.db.ttl(request[1]))
 
-    @command('Keys', True)
+    @command('Keys')
     def type(self, client, request, N):
         check_input(request, N != 1)
         value = client.db.get(request[1])
@@ -499,9 +990,12 @@ class Storage:
             result = self._type_name_map[type(value)]
         client.reply_status(result)
 
-    @command('Keys', supported=False)
+    @command('Keys', keys=())
     def scan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, not N)
+        cursor, count, match, type_name = self._scan_options(request, 1, True)
+        cursor, keys = client.db.scan(cursor, count, match, type_name)
+        client.reply_multi_bulk((str(cursor).encode('utf-8'), keys))
 
     # #########################################################################
     # #    STRING COMMANDS
@@ -513,7 +1007,7 @@ class Storage:
         value = db.get(key)
         if value is None:
             value = bytearray(request[2])
-            db._data[key] = value
+            db.set(key, value)
         elif not isinstance(value, bytearray):
             return client.reply_wrongtype()
         else:
@@ -541,7 +1035,7 @@ class Storage:
                 value = value[start:end]
             client.reply_int(count_bytes(value))
 
-    @command('Strings', True)
+    @command('Strings', True, keys=(2, -1, 1))
     def bitop(self, client, request, N):
         check_input(request, N < 3)
         db = client.db
@@ -578,7 +1072,7 @@ class Storage:
             dest = request[2]
             if db.pop(dest):
                 self._signal(self.NOTIFY_GENERIC, db, 'del', dest)
-            db._data[dest] = result
+            db.set(dest, result)
             self._signal(self.NOTIFY_STRING, db, 'set', dest, 1)
             client.reply_int(len(result))
         else:
@@ -667,12 +1161,12 @@ class Storage:
         db = client.db
         value = db.get(key)
         if value is None:
-            db._data[key] = bytearray(request[2])
+            db.set(key, bytearray(request[2]))
             self._signal(self.NOTIFY_STRING, db, 'set', key, 1)
             client.reply_bulk()
         elif isinstance(value, bytearray):
             db.pop(key)
-            db._data[key] = bytearray(request[2])
+            db.set(key, bytearray(request[2]))
             self._signal(self.NOTIFY_STRING, db, 'set', key, 1)
             client.reply_bulk(bytes(value))
         else:
@@ -696,7 +1190,7 @@ class Storage:
         r = self._incrby(client, request[0], request[1], request[2], float)
         client.reply_bulk(str(r).encode('utf-8'))
 
-    @command('Strings')
+    @command('Strings', keys=(1, -1, 1))
     def mget(self, client, request, N):
         check_input(request, not N)
         get = client.db.get
@@ -711,18 +1205,18 @@ class Storage:
                 return client.reply_wrongtype()
         client.reply_multi_bulk(values)
 
-    @command('Strings', True)
+    @command('Strings', True, keys=(1, -1, 2))
     def mset(self, client, request, N):
         D = N // 2
         check_input(request, N < 2 or D * 2 != N)
         db = client.db
         for key, value in zip(request[1::2], request[2::2]):
             db.pop(key)
-            db._data[key] = bytearray(value)
+            db.set(key, bytearray(value))
             self._signal(self.NOTIFY_STRING, db, 'set', key, 1)
         client.reply_ok()
 
-    @command('Strings', True)
+    @command('Strings', True, keys=(1, -1, 2))
     def msetnx(self, client, request, N):
         D = N // 2
         check_input(request, N < 2 or D * 2 != N)
@@ -737,7 +1231,7 @@ class Storage:
             client.reply_zero()
         else:
             for key, value in zip(keys, request[2::2]):
-                db._data[key] = bytearray(value)
+                db.set(key, bytearray(value))
                 self._signal(self.NOTIFY_STRING, db, 'set', key, 1)
             client.reply_one()
 
@@ -798,7 +1292,7 @@ class Storage:
         string = db.get(key)
         if string is None:
             string = bytearray()
-            db._data[key] = string
+            db.set(key, string)
         elif not isinstance(string, bytearray):
             return client.reply_wrongtype()
         else:
@@ -854,7 +1348,7 @@ class Storage:
         string = db.get(key)
         if string is None:
             string = bytearray(b'')
-            db._data[key] = string
+            db.set(key, string)
         elif not isinstance(string, bytearray):
             return client.reply_wrongtype()
         N = len(string)
@@ -983,8 +1477,8 @@ class Storage:
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.hash_type()
-            db._data[key] = value
+            value = self.hash_type(self.encodings)
+            db.set(key, value)
         elif not isinstance(value, self.hash_type):
             return client.reply_wrongtype()
         it = iter(request[2:])
@@ -999,8 +1493,8 @@ class Storage:
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.hash_type()
-            db._data[key] = value
+            value = self.hash_type(self.encodings)
+            db.set(key, value)
         elif not isinstance(value, self.hash_type):
             return client.reply_wrongtype()
         avail = (field in value)
@@ -1015,8 +1509,8 @@ class Storage:
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.hash_type()
-            db._data[key] = value
+            value = self.hash_type(self.encodings)
+            db.set(key, value)
         elif not isinstance(value, self.hash_type):
             return client.reply_wrongtype()
         if field in value:
@@ -1037,38 +1531,46 @@ class Storage:
         else:
             client.reply_wrongtype()
 
-    @command('Hashes', supported=False)
+    @command('Hashes')
     def hscan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk((b'0', ()))
+        elif isinstance(value, self.hash_type):
+            cursor, fields = self._scan_collection(request, value,
+                                                   value.__contains__)
+            result = []
+            for field in fields:
+                result.extend((field, value[field]))
+            client.reply_multi_bulk((cursor, result))
+        else:
+            client.reply_wrongtype()
 
     # #########################################################################
     # #    LIST COMMANDS
-    @command('Lists', True, script=0)
+    @command('Lists', True, script=0, keys=(1, 2, 1))
+    def blmove(self, client, request, N):
+        check_input(request, N != 5)
+        self._list_ends(request[3:5])
+        timeout = self._block_timeout(request[-1])
+        self._block(client, request, request[1:2], timeout, self.list_type)
+
+    @command('Lists', True, script=0, keys=(1, -2, 1))
     def blpop(self, client, request, N):
         check_input(request, N < 2)
-        try:
-            timeout = max(0, int(request[-1]))
-        except Exception:
-            return client.reply_error(self.SYNTAX_ERROR)
-        keys = request[1:-1]
-        if not self._bpop(client, request, keys):
-            client.blocked = Blocked(client, request[0], keys, timeout)
+        timeout = self._block_timeout(request[-1])
+        self._block(client, request, request[1:-1], timeout, self.list_type)
 
-    @command('Lists', True, script=0)
+    @command('Lists', True, script=0, keys=(1, -2, 1))
     def brpop(self, client, request, N):
         return self.blpop(client, request, N)
 
-    @command('Lists', True, script=0)
+    @command('Lists', True, script=0, keys=(1, 2, 1))
     def brpoplpush(self, client, request, N):
         check_input(request, N != 3)
-        try:
-            timeout = max(0, int(request[-1]))
-        except Exception:
-            return client.reply_error(self.SYNTAX_ERROR)
-        key, dest = request[1:-1]
-        keys = (key,)
-        if not self._bpop(client, request, keys, dest):
-            client.blocked = Blocked(client, request[0], keys, timeout, dest)
+        timeout = self._block_timeout(request[-1])
+        self._block(client, request, request[1:2], timeout, self.list_type)
 
     @command('Lists')
     def lindex(self, client, request, N):
@@ -1127,6 +1629,21 @@ class Storage:
         else:
             client.reply_wrongtype()
 
+    @command('Lists', True, keys=(1, 2, 1))
+    def lmove(self, client, request, N):
+        check_input(request, N != 4)
+        left, dest_left = self._list_ends(request[3:5])
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_bulk()
+        elif not isinstance(value, self.list_type):
+            client.reply_wrongtype()
+        else:
+            elem = self._list_move(client, request[0], request[1], value,
+                                   request[2], left, dest_left)
+            if elem is not None:
+                client.reply_bulk(elem)
+
     @command('Lists', True)
     def lpop(self, client, request, N):
         check_input(request, N != 1)
@@ -1159,8 +1676,8 @@ class Storage:
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.list_type()
-            db._data[key] = value
+            value = self.list_type(self.encodings)
+            db.set(key, value)
         elif not isinstance(value, self.list_type):
             return client.reply_wrongtype()
         else:
@@ -1199,7 +1716,7 @@ class Storage:
     def rpushx(self, client, request, N):
         return self.lpushx(client, request, N)
 
-    @command('Lists', True)
+    @command('Lists')
     def lrange(self, client, request, N):
         check_input(request, N != 3)
         db = client.db
@@ -1288,33 +1805,19 @@ class Storage:
             if db.pop(key, value) is not None:
                 self._signal(self.NOTIFY_GENERIC, db, 'del', key)
 
-    @command('Lists', True)
+    @command('Lists', True, keys=(1, 2, 1))
     def rpoplpush(self, client, request, N):
         check_input(request, N != 2)
-        key1, key2 = request[1], request[2]
-        db = client.db
-        orig = db.get(key1)
-        dest = db.get(key2)
-        if orig is None:
+        value = client.db.get(request[1])
+        if value is None:
             client.reply_bulk()
-        elif not isinstance(orig, self.list_type):
+        elif not isinstance(value, self.list_type):
             client.reply_wrongtype()
         else:
-            assert orig
-            if dest is None:
-                dest = self.list_type()
-                db._data[key2] = dest
-            elif not isinstance(dest, self.list_type):
-                return client.reply_wrongtype()
-            else:
-                assert dest
-            value = orig.pop()
-            self._signal(self.NOTIFY_LIST, db, 'rpop', key1, 1)
-            dest.appendleft(value)
-            self._signal(self.NOTIFY_LIST, db, 'lpush', key2, 1)
-            if db.pop(key1, orig) is not None:
-                self._signal(self.NOTIFY_GENERIC, db, 'del', key1)
-            client.reply_bulk(value)
+            elem = self._list_move(client, request[0], request[1], value,
+                                   request[2], False, True)
+            if elem is not None:
+                client.reply_bulk(elem)
 
     # #########################################################################
     # #    SETS COMMANDS
@@ -1325,9 +1828,9 @@ class Storage:
         db = client.db
         value = db.get(key)
         if value is None:
-            value = set()
-            db._data[key] = value
-        elif not isinstance(value, set):
+            value = self.set_type(self.encodings)
+            db.set(key, value)
+        elif not isinstance(value, self.set_type):
             return client.reply_wrongtype()
         n = len(value)
         value.update(request[2:])
@@ -1341,27 +1844,27 @@ class Storage:
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             client.reply_int(len(value))
 
-    @command('Sets')
+    @command('Sets', keys=(1, -1, 1))
     def sdiff(self, client, request, N):
         check_input(request, N < 1)
         self._setoper(client, 'difference', request[1:])
 
-    @command('Sets', True)
+    @command('Sets', True, keys=(1, -1, 1))
     def sdiffstore(self, client, request, N):
         check_input(request, N < 2)
         self._setoper(client, 'difference', request[2:], request[1])
 
-    @command('Sets')
+    @command('Sets', keys=(1, -1, 1))
     def sinter(self, client, request, N):
         check_input(request, N < 1)
         self._setoper(client, 'intersection', request[1:])
 
-    @command('Sets', True)
+    @command('Sets', True, keys=(1, -1, 1))
     def sinterstore(self, client, request, N):
         check_input(request, N < 2)
         self._setoper(client, 'intersection', request[2:], request[1])
@@ -1372,7 +1875,7 @@ class Storage:
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             client.reply_int(int(request[2] in value))
@@ -1383,12 +1886,12 @@ class Storage:
         value = client.db.get(request[1])
         if value is None:
             client.reply_multi_bulk(())
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             client.reply_multi_bulk(value)
 
-    @command('Sets', True)
+    @command('Sets', True, keys=(1, 2, 1))
     def smove(self, client, request, N):
         check_input(request, N != 3)
         db = client.db
@@ -1398,16 +1901,16 @@ class Storage:
         dest = db.get(key2)
         if orig is None:
             client.reply_zero()
-        elif not isinstance(orig, set):
+        elif not isinstance(orig, self.set_type):
             client.reply_wrongtype()
         else:
             member = request[3]
             if member in orig:
                 # we my be able to move
                 if dest is None:
-                    dest = set()
-                    db._data[request[2]] = dest
-                elif not isinstance(dest, set):
+                    dest = self.set_type(self.encodings)
+                    db.set(key2, dest)
+                elif not isinstance(dest, self.set_type):
                     return client.reply_wrongtype()
                 orig.remove(member)
                 dest.add(member)
@@ -1427,10 +1930,11 @@ class Storage:
         value = db.get(key)
         if value is None:
             client.reply_bulk()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             result = value.pop()
+            self._propagate(db, b'srem', key, result)
             self._signal(self.NOTIFY_SET, db, request[0], key, 1)
             if db.pop(key, value) is not None:
                 self._signal(self.NOTIFY_GENERIC, db, 'del', key)
@@ -1440,7 +1944,7 @@ class Storage:
     def srandmember(self, client, request, N):
         check_input(request, N < 1 or N > 2)
         value = client.db.get(request[1])
-        if value is not None and not isinstance(value, set):
+        if value is not None and not isinstance(value, self.set_type):
             return client.reply_wrongtype()
         if N == 2:
             try:
@@ -1488,7 +1992,7 @@ class Storage:
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             start = len(value)
@@ -1499,22 +2003,40 @@ class Storage:
                 self._signal(self.NOTIFY_GENERIC, db, 'del', key)
             client.reply_int(removed)
 
-    @command('Sets')
+    @command('Sets', keys=(1, -1, 1))
     def sunion(self, client, request, N):
         check_input(request, N < 1)
         self._setoper(client, 'union', request[1:])
 
-    @command('Sets', True)
+    @command('Sets', True, keys=(1, -1, 1))
     def sunionstore(self, client, request, N):
         check_input(request, N < 2)
         self._setoper(client, 'union', request[2:], request[1])
 
-    @command('Sets', supported=False)
+    @command('Sets')
     def sscan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk((b'0', ()))
+        elif isinstance(value, self.set_type):
+            client.reply_multi_bulk(self._scan_collection(
+                request, value, value.__contains__))
+        else:
+            client.reply_wrongtype()
 
     # #########################################################################
     # #    SORTED SETS COMMANDS
+    @command('Sorted Sets', True, script=0, keys=(1, -2, 1))
+    def bzpopmax(self, client, request, N):
+        check_input(request, N < 2)
+        timeout = self._block_timeout(request[-1])
+        self._block(client, request, request[1:-1], timeout, self.zset_type)
+
+    @command('Sorted Sets', True, script=0, keys=(1, -2, 1))
+    def bzpopmin(self, client, request, N):
+        return self.bzpopmax(client, request, N)
+
     @command('Sorted Sets', True)
     def zadd(self, client, request, N):
         D = (N - 1) // 2
@@ -1523,8 +2045,8 @@ class Storage:
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.zset_type()
-            db._data[key] = value
+            value = self.zset_type(self.encodings)
+            db.set(key, value)
         elif not isinstance(value, self.zset_type):
             return client.reply_wrongtype()
         start = len(value)
@@ -1577,7 +2099,8 @@ class Storage:
         db = client.db
         value = db.get(key)
         if value is None:
-            db._data[key] = value = self.zset_type()
+            value = self.zset_type(self.encodings)
+            db.set(key, value)
         elif not isinstance(value, self.zset_type):
             return client.reply_wrongtype()
         try:
@@ -1591,10 +2114,39 @@ class Storage:
             self._signal(self.NOTIFY_ZSET, db, request[0], key, 1)
             client.reply_bulk(str(score).encode('utf-8'))
 
-    @command('Sorted Sets', True)
+    @command('Sorted Sets', True, keys=store_numkeys)
     def zinterstore(self, client, request, N):
         self._zsetoper(client, request, N)
 
+    @command('Sorted Sets', True)
+    def zpopmax(self, client, request, N):
+        check_input(request, N < 1 or N > 2)
+        count = 1
+        if N == 2:
+            try:
+                count = int(request[2])
+                if count < 0:
+                    raise ValueError
+            except ValueError:
+                return client.reply_error(
+                    'value is out of range, must be positive')
+        db = client.db
+        value = db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk(())
+        elif not isinstance(value, self.zset_type):
+            client.reply_wrongtype()
+        else:
+            result = []
+            for score, member in self._zpop(db, request[0], request[1],
+                                            value, count):
+                result.extend((member, score))
+            client.reply_multi_bulk(result)
+
+    @command('Sorted Sets', True)
+    def zpopmin(self, client, request, N):
+        return self.zpopmax(client, request, N)
+
     @command('Sorted Sets')
     def zrange(self, client, request, N):
         check_input(request, N < 3 or N > 4)
@@ -1768,13 +2320,551 @@ class Storage:
                 score = str(score).encode('utf-8')
             client.reply_bulk(score)
 
-    @command('Sorted Sets', True)
+    @command('Sorted Sets', True, keys=store_numkeys)
     def zunionstore(self, client, request, N):
         self._zsetoper(client, request, N)
 
-    @command('Sorted Sets', supported=False)
+    @command('Sorted Sets')
     def zscan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk((b'0', ()))
+        elif isinstance(value, self.zset_type):
+            score = value.score
+            cursor, members = self._scan_collection(
+                request, value, lambda member: score(member) is not None)
+            result = []
+            for member in members:
+                result.extend((member, str(score(member)).encode('utf-8')))
+            client.reply_multi_bulk((cursor, result))
+        else:
+            client.reply_wrongtype()
+
+    # #########################################################################
+    # #    STREAMS COMMANDS
+    @command('Streams', True)
+    def xack(self, client, request, N):
+        check_input(request, N < 3)
+        db = client.db
+        key = request[1]
+        ids = [parse_id(id) for id in request[3:]]
+        value = db.get(key)
+        if value is None:
+            client.reply_zero()
+        elif not isinstance(value, self.stream_type):
+            client.reply_wrongtype()
+        else:
+            group = value.groups.get(request[2])
+            acked = sum(group.ack(id) for id in ids) if group else 0
+            if acked:
+                self._signal(self.NOTIFY_STREAM, db, request[0], key, acked)
+            client.reply_int(acked)
+
+    @command('Streams', True)
+    def xadd(self, client, request, N):
+        check_input(request, N < 4)
+        key = request[1]
+        mkstream = True
+        trim = None
+        index = 2
+        while index < N:
+            option = request[index].lower()
+            if option == b'nomkstream':
+                mkstream = False
+                index += 1
+            elif option in (b'maxlen', b'minid'):
+                trim, index = self._stream_trim_options(request, index)
+            else:
+                break
+        pairs = request[index+1:]
+        check_input(request, not pairs or len(pairs) % 2)
+        db = client.db
+        value = db.get(key)
+        if value is None:
+            if not mkstream:
+                return client.reply_bulk()
+            stream = self.stream_type(self._stream_node_size)
+        elif not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        else:
+            stream = value
+        id = self._stream_new_id(stream, request[index])
+        if value is None:
+            db.set(key, stream)
+        stream.add(id, pairs)
+        self._signal(self.NOTIFY_STREAM, db, request[0], key, 1)
+        self._propagate(db, b'xadd', key, format_id(id), *pairs)
+        if trim:
+            self._xtrim(db, key, stream, trim)
+        client.reply_bulk(format_id(id))
+
+    @command('Streams', True)
+    def xclaim(self, client, request, N):
+        check_input(request, N < 5)
+        key, name, consumer_name = request[1:4]
+        try:
+            min_idle = int(request[4])
+        except ValueError:
+            raise CommandError(
+                'Invalid min-idle-time argument for XCLAIM') from None
+        ids = []
+        index = 5
+        for arg in request[5:]:
+            try:
+                ids.append(parse_id(arg))
+            except CommandError:
+                break
+            index += 1
+        idle = when = retrycount = lastid = None
+        force = justid = False
+        try:
+            while index <= N:
+                option = request[index].lower()
+                if option == b'force':
+                    force = True
+                elif option == b'justid':
+                    justid = True
+                elif option == b'idle':
+                    index += 1
+                    idle = int(request[index])
+                elif option == b'time':
+                    index += 1
+                    when = int(request[index])
+                elif option == b'retrycount':
+                    index += 1
+                    retrycount = int(request[index])
+                elif option == b'lastid':
+                    index += 1
+                    lastid = parse_id(request[index])
+                else:
+                    raise CommandError('Unrecognized XCLAIM option %r' %
+                                       option.decode('utf-8'))
+                index += 1
+        except IndexError:
+            raise CommandError(self.SYNTAX_ERROR) from None
+        except ValueError:
+            raise CommandError(
+                'value is not an integer or out of range') from None
+        db = client.db
+        value = db.get(key)
+        if value is not None and not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        group = value.groups.get(name) if value is not None else None
+        if group is None:
+            return client.reply_error(self._no_group(key, name), 'NOGROUP')
+        now = mstime()
+        if idle is not None:
+            when = now - idle
+        elif when is None:
+            when = now
+        consumer = self._stream_consumer(db, key, group, consumer_name, now)
+        claimed = []
+        deleted = []
+        for id in ids:
+            entry = group.pending.get(id)
+            if entry is None:
+                if not force:
+                    continue
+            elif min_idle and now - entry.delivery_time < min_idle:
+                continue
+            pairs = value.get(id)
+            if pairs is None:
+                # the entry was deleted from the stream
+                if entry is not None:
+                    group.ack(id)
+                    deleted.append(id)
+                continue
+            if retrycount is None:
+                count = (entry.delivery_count if entry else 1) + (not justid)
+            else:
+                count = retrycount
+            group.deliver(id, consumer, when, count)
+            claimed.append((id, pairs))
+        if claimed:
+            consumer.active_time = now
+        if lastid is not None and lastid > group.last_id:
+            group.last_id = lastid
+            self._propagate(db, b'xgroup', b'setid', key, name,
+                            format_id(lastid),
+                            *self._entries_read_args(group))
+        for id, _ in claimed:
+            self._propagate_claim(db, key, group, id)
+        for id in deleted:
+            self._propagate(db, b'xack', key, name, format_id(id))
+        if claimed or deleted:
+            self._signal(self.NOTIFY_STREAM, db, request[0], key,
+                         len(claimed) + len(deleted))
+        if justid:
+            client.reply_multi_bulk([format_id(id) for id, _ in claimed])
+        else:
+            client.reply_multi_bulk(self._stream_reply(claimed))
+
+    @command('Streams', True)
+    def xdel(self, client, request, N):
+        check_input(request, N < 2)
+        db = client.db
+        key = request[1]
+        ids = [parse_id(id) for id in request[2:]]
+        value = db.get(key)
+        if value is None:
+            client.reply_zero()
+        elif not isinstance(value, self.stream_type):
+            client.reply_wrongtype()
+        else:
+            removed = sum(value.delete(id) for id in ids)
+            if removed:
+                self._signal(self.NOTIFY_STREAM, db, request[0], key, removed)
+            client.reply_int(removed)
+
+    @command('Streams', True, keys=(2, 2, 1),
+             subcommands=['create', 'createconsumer', 'delconsumer',
+                          'destroy', 'setid'])
+    def xgroup(self, client, request, N):
+        check_input(request, N < 3)
+        subcommand = request[1].lower()
+        if subcommand not in (b'create', b'createconsumer', b'delconsumer',
+                              b'destroy', b'setid'):
+            return client.reply_error("unknown command 'xgroup %s'" %
+                                      subcommand.decode('utf-8'))
+        db = client.db
+        key, name = request[2:4]
+        value = db.get(key)
+        if value is not None and not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        if subcommand == b'create':
+            check_input(request, N < 4)
+            mkstream, entries_read = self._xgroup_options(request, True)
+            id, entries_read = self._xgroup_id(value, request[4],
+                                               entries_read)
+            if value is None:
+                if not mkstream:
+                    return client.reply_error(self.XGROUP_NO_KEY)
+                value = self.stream_type(self._stream_node_size)
+                db.set(key, value)
+            elif name in value.groups:
+                return client.reply_error(
+                    'Consumer Group name already exists', 'BUSYGROUP')
+            group = value.groups[name] = ConsumerGroup(name, id, entries_read)
+            self._signal(self.NOTIFY_STREAM, db, request[0], key, 1)
+            self._propagate(db, b'xgroup', b'create', key, name, format_id(id),
+                            b'mkstream', *self._entries_read_args(group))
+            return client.reply_ok()
+        elif value is None:
+            return client.reply_error(self.XGROUP_NO_KEY)
+        group = value.groups.get(name)
+        if subcommand == b'destroy':
+            check_input(request, N != 3)
+            if group is None:
+                return client.reply_zero()
+            del value.groups[name]
+            self._signal(self.NOTIFY_STREAM, db, request[0], key, 1)
+            self._propagate(db, b'xgroup', b'destroy', key, name)
+            return client.reply_one()
+        elif group is None:
+            return client.reply_error(self._no_group(key, name), 'NOGROUP')
+        elif subcommand == b'setid':
+            check_input(request, N < 4)
+            _, entries_read = self._xgroup_options(request)
+            group.last_id, group.entries_read = self._xgroup_id(
+                value, request[4], entries_read)
+            self._signal(self.NOTIFY_STREAM, db, request[0], key, 1)
+            self._propagate(db, b'xgroup', b'setid', key, name,
+                            format_id(group.last_id),
+                            *self._entries_read_args(group))
+            client.reply_ok()
+        elif subcommand == b'createconsumer':
+            check_input(request, N != 4)
+            if request[4] in group.consumers:
+                return client.reply_zero()
+            self._stream_consumer(db, key, group, request[4], mstime())
+            client.reply_one()
+        else:
+            check_input(request, N != 4)
+            pending = group.delete_consumer(request[4])
+            if pending is None:
+                return client.reply_zero()
+            self._signal(self.NOTIFY_STREAM, db, request[0], key, 1)
+            self._propagate(db, b'xgroup', b'delconsumer', key, name,
+                            request[4])
+            client.reply_int(pending)
+
+    @command('Streams', keys=(2, 2, 1),
+             subcommands=['consumers', 'groups', 'stream'])
+    def xinfo(self, client, request, N):
+        check_input(request, N < 2)
+        subcommand = request[1].lower()
+        if subcommand not in (b'consumers', b'groups', b'stream'):
+            return client.reply_error("unknown command 'xinfo %s'" %
+                                      subcommand.decode('utf-8'))
+        key = request[2]
+        value = client.db.get(key)
+        if value is None:
+            return client.reply_error('no such key')
+        elif not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        elif subcommand == b'stream':
+            check_input(request, N != 2)
+            first = next(value.range(), None)
+            last = next(value.range(reverse=True), None)
+            client.reply_multi_bulk((
+                b'length', value.length,
+                b'nodes', value.nodes,
+                b'last-generated-id', format_id(value.last_id),
+                b'max-deleted-entry-id', format_id(value.max_deleted_id),
+                b'entries-added', value.entries_added,
+                b'recorded-first-entry-id', format_id(first[0] if first
+                                                      else 0),
+                b'groups', len(value.groups),
+                b'first-entry', self._stream_reply((first,))[0] if first
+                else None,
+                b'last-entry', self._stream_reply((last,))[0] if last
+                else None))
+        elif subcommand == b'groups':
+            check_input(request, N != 2)
+            result = []
+            for group in value.groups.values():
+                entries_read = group.entries_read
+                lag = (None if entries_read is None else
+                       value.entries_added - entries_read)
+                result.append((b'name', group.name,
+                               b'consumers', len(group.consumers),
+                               b'pending', len(group.pending),
+                               b'last-delivered-id', format_id(group.last_id),
+                               b'entries-read', entries_read,
+                               b'lag', lag))
+            client.reply_multi_bulk(result)
+        else:
+            check_input(request, N != 3)
+            group = value.groups.get(request[3])
+            if group is None:
+                return client.reply_error(self._no_group(key, request[3]),
+                                          'NOGROUP')
+            now = mstime()
+            client.reply_multi_bulk([
+                (b'name', consumer.name,
+                 b'pending', len(consumer.pending),
+                 b'idle', now - consumer.seen_time,
+                 b'inactive', (now - consumer.active_time
+                               if consumer.active_time >= 0 else -1))
+                for consumer in group.consumers.values()])
+
+    @command('Streams')
+    def xlen(self, client, request, N):
+        check_input(request, N != 1)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_zero()
+        elif isinstance(value, self.stream_type):
+            client.reply_int(len(value))
+        else:
+            client.reply_wrongtype()
+
+    @command('Streams')
+    def xpending(self, client, request, N):
+        check_input(request, N < 2)
+        key, name = request[1:3]
+        args = request[3:]
+        min_idle = 0
+        try:
+            if args and args[0].lower() == b'idle':
+                min_idle = int(args[1])
+                args = args[2:]
+                if not args:
+                    raise IndexError
+            if args:
+                if len(args) > 4:
+                    raise IndexError
+                start = parse_range(args[0])
+                end = parse_range(args[1], True)
+                count = int(args[2])
+        except IndexError:
+            raise CommandError(self.SYNTAX_ERROR) from None
+        except ValueError:
+            raise CommandError(
+                'value is not an integer or out of range') from None
+        value = client.db.get(key)
+        if value is not None and not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        group = value.groups.get(name) if value is not None else None
+        if group is None:
+            return client.reply_error(self._no_group(key, name), 'NOGROUP')
+        if not args:
+            if not group.pending:
+                return client.reply_multi_bulk((0, None, None, None))
+            first, last = group.pending_bounds()
+            client.reply_multi_bulk((
+                len(group.pending), format_id(first), format_id(last),
+                [(consumer.name, len(consumer.pending))
+                 for consumer in group.consumers.values()
+                 if consumer.pending]))
+        else:
+            consumer = None
+            if len(args) == 4:
+                consumer = group.consumers.get(args[3])
+                if consumer is None:
+                    return client.reply_multi_bulk(())
+            now = mstime()
+            pending = ((id, entry) for id, entry in
+                       group.pending_range(start, end, consumer)
+                       if now - entry.delivery_time >= min_idle)
+            client.reply_multi_bulk([
+                (format_id(id), entry.consumer.name,
+                 now - entry.delivery_time, entry.delivery_count)
+                for id, entry in islice(pending, max(count, 0))])
+
+    @command('Streams')
+    def xrange(self, client, request, N):
+        check_input(request, N != 3 and N != 5)
+        reverse = request[0] == 'xrevrange'
+        start, end = request[2:4]
+        if reverse:
+            start, end = end, start
+        start = parse_range(start)
+        end = parse_range(end, True)
+        count = None
+        if N == 5:
+            if request[4].lower() != b'count':
+                raise CommandError(self.SYNTAX_ERROR)
+            try:
+                count = max(int(request[5]), 0)
+            except ValueError:
+                raise CommandError(
+                    'value is not an integer or out of range') from None
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk(())
+        elif not isinstance(value, self.stream_type):
+            client.reply_wrongtype()
+        else:
+            entries = islice(value.range(start, end, reverse), count)
+            client.reply_multi_bulk(self._stream_reply(entries))
+
+    @command('Streams', keys=stream_keys)
+    def xread(self, client, request, N):
+        count, timeout, _, _, _, keys, ids = self._xread_options(request)
+        db = client.db
+        values = []
+        starts = []
+        for key, id in zip(keys, ids):
+            value = db.get(key)
+            if value is not None and not isinstance(value, self.stream_type):
+                return client.reply_wrongtype()
+            elif id == b'$':
+                starts.append(value.last_id if value is not None else 0)
+            else:
+                starts.append(parse_id(id))
+            values.append(value)
+        result = []
+        for key, value, start in zip(keys, values, starts):
+            entries = self._xread(value, start, count)
+            if entries:
+                result.append((key, entries))
+        if result or timeout is None:
+            client.reply_multi_bulk(result or None)
+        else:
+            # block with the IDs of $ resolved
+            request = request[:len(request)-len(ids)]
+            request.extend(format_id(start) for start in starts)
+            client.blocked = Blocked(client, request, keys, timeout,
+                                     self.stream_type)
+
+    @command('Streams', True, keys=stream_keys)
+    def xreadgroup(self, client, request, N):
+        count, timeout, noack, name, consumer, keys, ids = (
+            self._xread_options(request))
+        db = client.db
+        for key, id in zip(keys, ids):
+            value = db.get(key)
+            if value is not None and not isinstance(value, self.stream_type):
+                return client.reply_wrongtype()
+            elif value is None or name not in value.groups:
+                return client.reply_error(self._no_group(key, name),
+                                          'NOGROUP')
+            elif id != b'>':
+                parse_id(id)
+        result = []
+        for key, id in zip(keys, ids):
+            value = db.get(key)
+            entries = self._xreadgroup(db, key, value, value.groups[name],
+                                       consumer, id, count, noack)
+            if entries or id != b'>':
+                result.append((key, entries))
+        if result or timeout is None:
+            client.reply_multi_bulk(result or None)
+        else:
+            client.blocked = Blocked(client, request, keys, timeout,
+                                     self.stream_type)
+
+    @command('Streams')
+    def xrevrange(self, client, request, N):
+        return self.xrange(client, request, N)
+
+    @command('Streams', True)
+    def xsetid(self, client, request, N):
+        check_input(request, N < 2)
+        key = request[1]
+        id = parse_id(request[2])
+        entries_added = max_deleted_id = None
+        try:
+            options = iter(request[3:])
+            for option in options:
+                option = option.lower()
+                if option == b'entriesadded':
+                    entries_added = int(next(options))
+                    if entries_added < 0:
+                        raise ValueError
+                elif option == b'maxdeletedid':
+                    max_deleted_id = parse_id(next(options))
+                else:
+                    raise StopIteration
+        except StopIteration:
+            raise CommandError(self.SYNTAX_ERROR) from None
+        except ValueError:
+            raise CommandError(
+                'value is not an integer or out of range') from None
+        db = client.db
+        value = db.get(key)
+        if value is None:
+            return client.reply_error('no such key')
+        elif not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        last = next(value.range(reverse=True), None)
+        if last and id < last[0]:
+            return client.reply_error('The ID specified in XSETID is '
+                                      'smaller than the target stream top '
+                                      'item')
+        elif entries_added is not None and entries_added < len(value):
+            return client.reply_error('The entries_added specified in '
+                                      'XSETID is smaller than the target '
+                                      'stream length')
+        elif max_deleted_id is not None and id < max_deleted_id:
+            return client.reply_error('The ID specified in XSETID is '
+                                      'smaller than the provided '
+                                      'max_deleted_entry_id')
+        value.last_id = id
+        if entries_added is not None:
+            value.entries_added = entries_added
+        if max_deleted_id is not None:
+            value.max_deleted_id = max_deleted_id
+        self._signal(self.NOTIFY_STREAM, db, request[0], key, 1)
+        client.reply_ok()
+
+    @command('Streams', True)
+    def xtrim(self, client, request, N):
+        check_input(request, N < 3)
+        trim, index = self._stream_trim_options(request, 2)
+        if index != len(request):
+            raise CommandError(self.SYNTAX_ERROR)
+        db = client.db
+        key = request[1]
+        value = db.get(key)
+        if value is None:
+            client.reply_zero()
+        elif not isinstance(value, self.stream_type):
+            client.reply_wrongtype()
+        else:
+            client.reply_int(self._xtrim(db, key, value, trim))
 
     # #########################################################################
     # #    PUBSUB COMMANDS
@@ -1784,14 +2874,11 @@ class Storage:
         for pattern in request[1:]:
             p = self._patterns.get(pattern)
             if not p:
-                pre = redis_to_py_pattern(pattern.decode('utf-8'))
-                p = pubsub_patterns(re.compile(pre), set())
-                self._patterns[pattern] = p
+                p = self._patterns.add(pattern)
             p.clients.add(client)
             client.patterns.add(pattern)
-            count = reduce(lambda x, y: x + int(client in y.clients),
-                           self._patterns.values())
-            client.reply_multi_bulk((b'psubscribe', pattern, count))
+            client.reply_multi_bulk((b'psubscribe', pattern,
+                                     len(client.patterns)))
 
     @command('Pub/Sub')
     def pubsub(self, client, request, N):
@@ -1817,8 +2904,7 @@ class Storage:
             client.reply_multi_bulk(count)
         elif subcommand == 'numpat':
             check_input(request, N > 1)
-            count = reduce(lambda x, y: x + len(y.clients),
-                           self._patterns.values())
+            count = sum(len(p.clients) for p in self._patterns.values())
             client.reply_int(count)
         else:
             client.reply_error("Unknown command 'pubsub %s'" % subcommand)
@@ -1826,19 +2912,11 @@ class Storage:
     @command('Pub/Sub')
     def publish(self, client, request, N):
         check_input(request, N != 2)
-        channel, message = request[1:]
-        ch = channel.decode('utf-8')
-        msg = self._parser.multi_bulk((b'message', channel, message))
-        count = self._publish_clients(msg, self._channels.get(channel, ()))
-        for pattern in self._patterns.values():
-            g = pattern.re.match(ch)
-            if g:
-                count += self._publish_clients(msg, pattern.clients)
-        client.reply_int(count)
+        client.reply_int(self._publish(*request[1:]))
 
     @command('Pub/Sub', script=0)
     def punsubscribe(self, client, request, N):
-        patterns = request[1:] if N else list(self._patterns)
+        patterns = request[1:] if N else list(client.patterns)
         for pattern in patterns:
             if pattern in self._patterns:
                 p = self._patterns[pattern]
@@ -1846,7 +2924,7 @@ class Storage:
                     client.patterns.discard(pattern)
                     p.clients.remove(client)
                     if not p.clients:
-                        self._patterns.pop(pattern)
+                        self._patterns.remove(pattern)
                     client.reply_multi_bulk((b'punsubscribe', pattern))
 
     @command('Pub/Sub', script=0)
@@ -1862,7 +2940,7 @@ class Storage:
 
     @command('Pub/Sub', script=0)
     def unsubscribe(self, client, request, N):
-        channels = request[1:] if N else list(self._channels)
+        channels = request[1:] if N else list(client.channels)
         for channel in channels:
             if channel in self._channels:
                 clients = self._channels[channel]
@@ -1909,7 +2987,7 @@ class Storage:
         else:
             self.error_replay("MULTI calls can not be nested")
 
-    @command('Transactions', script=0)
+    @command('Transactions', script=0, keys=(1, -1, 1))
     def watch(self, client, request, N):
         check_input(request, not N)
         if client.transaction is not None:
@@ -1932,17 +3010,45 @@ class Storage:
 
     # #########################################################################
     # #    SCRIPTING
-    @command('Scripting', supported=False)
+    @command('Scripting', script=0, keys=numkeys)
     def eval(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        if not self.lua:
+            return client.reply_error(self.NO_SCRIPTING)
+        self._eval(client, self.lua.load(request[1]), request)
 
-    @command('Scripting', supported=False)
+    @command('Scripting', script=0, keys=numkeys)
     def evalsha(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
-
-    @command('Scripting', supported=False)
+        check_input(request, N < 2)
+        if not self.lua:
+            return client.reply_error(self.NO_SCRIPTING)
+        sha = request[1].lower()
+        if sha not in self.lua.scripts:
+            return client.reply_error('No matching script. Please use EVAL.',
+                                      'NOSCRIPT')
+        self._eval(client, sha, request)
+
+    @command('Scripting', script=0, subcommands=['exists', 'flush', 'load'])
     def script(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, not N)
+        if not self.lua:
+            return client.reply_error(self.NO_SCRIPTING)
+        subcommand = request[1].decode('utf-8').lower()
+        if subcommand == 'exists':
+            check_input(request, N < 2)
+            scripts = self.lua.scripts
+            client.reply_multi_bulk_len(N - 1)
+            for sha in request[2:]:
+                client.reply_int(int(sha.lower() in scripts))
+        elif subcommand == 'flush':
+            check_input(request, N != 1)
+            self.lua.flush()
+            client.reply_ok()
+        elif subcommand == 'load':
+            check_input(request, N != 2)
+            client.reply_bulk(self.lua.load(request[2]))
+        else:
+            client.reply_error("unknown command 'script %s'" % subcommand)
 
     # #########################################################################
     # #    CONNECTION COMMANDS
@@ -1963,7 +3069,10 @@ class Storage:
     @command('Connections')
     def ping(self, client, request, N):
         check_input(request, N)
-        client.reply_status('PONG')
+        if client.channels or client.patterns:
+            client.reply_multi_bulk((b'pong', b''))
+        else:
+            client.reply_status('PONG')
 
     @command('Connections', script=0)
     def quit(self, client, request, N):
@@ -1988,9 +3097,13 @@ class Storage:
 
     # #########################################################################
     # #    SERVER COMMANDS
-    @command('Server', supported=False)
+    @command('Server')
     def bgrewriteaof(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N)
+        if self._snapshot:
+            return client.reply_error('Background saving in progress')
+        self._rewrite_aof()
+        client.reply_status('Background append only file rewriting started')
 
     @command('Server')
     def bgsave(self, client, request, N):
@@ -2009,6 +3122,27 @@ class Storage:
         else:
             client.reply_error("unknown command 'client %s'" % subcommand)
 
+    @command('Server', subcommands=['info', 'keyslot', 'slots'])
+    def cluster(self, client, request, N):
+        check_input(request, not N)
+        if not self._cluster:
+            return client.reply_error('This instance has cluster support '
+                                      'disabled')
+        subcommand = request[1].decode('utf-8').lower()
+        if subcommand == 'info':
+            check_input(request, N != 1)
+            info = '\n'.join(('%s:%s' % item
+                              for item in self._cluster.info().items()))
+            client.reply_bulk(info.encode('utf-8'))
+        elif subcommand == 'keyslot':
+            check_input(request, N != 2)
+            client.reply_int(key_slot(request[2]))
+        elif subcommand == 'slots':
+            check_input(request, N != 1)
+            client.reply_multi_bulk(self._cluster.slots())
+        else:
+            client.reply_error("unknown command 'cluster %s'" % subcommand)
+
     @command('Server')
     def config(self, client, request, N):
         check_input(request, not N)
@@ -2025,7 +3159,7 @@ class Storage:
             try:
                 if N != 3:
                     raise ValueError("'config set' no argument")
-                self._set_config(request[2].decode('utf-8'))
+                self._set_config(request[2].decode('utf-8'), request[3])
             except Exception as e:
                 client.reply_error(str(e))
             else:
@@ -2034,6 +3168,9 @@ class Storage:
             self._hit_keys = 0
             self._missed_keys = 0
             self._expired_keys = 0
+            self._evicted_keys = 0
+            self._output_limit_disconnections = 0
+            self._commandstats.clear()
             server = client._producer
             server._received = 0
             server._requests_processed = 0
@@ -2065,8 +3202,9 @@ class Storage:
 
     @command('Server')
     def info(self, client, request, N):
-        check_input(request, N)
-        info = '\n'.join(self._flat_info())
+        check_input(request, N > 1)
+        section = request[1].decode('utf-8').lower() if N else 'default'
+        info = '\n'.join(self._flat_info(section))
         client.reply_bulk(info.encode('utf-8'))
 
     @command('Server')
@@ -2091,17 +3229,71 @@ class Storage:
     def shutdown(self, client, request, N):
         client.reply_error(self.NOT_SUPPORTED)
 
-    @command('Server', supported=False)
+    @command('Server', script=0)
+    def psync(self, client, request, N):
+        check_input(request, N != 2)
+        try:
+            offset = int(request[2])
+        except ValueError:
+            return client.reply_error('invalid offset')
+        self._sync(client, request[1], offset)
+
+    @command('Server', script=0)
+    def replconf(self, client, request, N):
+        check_input(request, not N or N % 2)
+        if request[1].lower() == b'ack':
+            if self._master:
+                try:
+                    self._master.ack(client, int(request[2]))
+                except ValueError:
+                    pass
+        else:
+            client.reply_ok()
+
+    @command('Server', script=0)
     def slaveof(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N != 2)
+        host, port = request[1].decode('utf-8'), request[2].decode('utf-8')
+        if host.lower() == 'no' and port.lower() == 'one':
+            if self._replica:
+                self.logger.info('Stop replicating %s', self._replica.address)
+                self._replica.close()
+                self._replica = None
+        else:
+            try:
+                port = int(port)
+            except ValueError:
+                return client.reply_error('invalid master port')
+            self._slaveof(host, port)
+        client.reply_ok()
 
-    @command('Server', supported=False)
+    @command('Server', subcommands=['get', 'len', 'reset'])
     def slowlog(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, not N)
+        subcommand = request[1].decode('utf-8').lower()
+        if subcommand == 'get':
+            check_input(request, N > 2)
+            try:
+                count = int(request[2]) if N == 2 else 10
+            except ValueError:
+                return client.reply_error('value is not an integer or out '
+                                          'of range')
+            client.reply_multi_bulk(self._slowlog.get(count))
+        elif subcommand == 'len':
+            check_input(request, N != 1)
+            client.reply_int(len(self._slowlog))
+        elif subcommand == 'reset':
+            check_input(request, N != 1)
+            self._slowlog.reset()
+            client.reply_ok()
+        else:
+            client.reply_error("Unknown SLOWLOG subcommand or wrong number "
+                               "of arguments for '%s'" % subcommand)
 
-    @command('Server', supported=False)
+    @command('Server', script=0)
     def sync(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N)
+        self._sync(client, None, -1)
 
     @command('Server')
     def time(self, client, request, N):
@@ -2114,15 +3306,31 @@ class Storage:
     # #########################################################################
     # #    INTERNALS
     def _cron(self):
+        self._active_expire()
+        aof = self._aof
+        if aof:
+            aof.flush()
+            size = aof.size
+            if (not self._snapshot and size > self.AOF_REWRITE_MIN_SIZE and
+                    size > self.AOF_REWRITE_GROWTH*aof.base_size):
+                self._rewrite_aof()
         dirty = self._dirty
-        if dirty:
+        if dirty and not self._loading:
             now = time.time()
             gap = now - self._last_save
             for interval, changes in self.cfg.key_value_save:
                 if gap >= interval and dirty >= changes:
                     self._save()
                     break
-        self._loop.call_later(1, self._cron)
+        self._loop.call_later(self.EXPIRE_RESOLUTION, self._cron)
+
+    def _active_expire(self):
+        now = self._loop.time()
+        limit = self.EXPIRE_KEYS_PER_CYCLE
+        for db in self.databases.values():
+            limit -= db.active_expire(now, limit)
+            if limit <= 0:
+                break
 
     def _set(self, client, key, value, seconds=0, milliseconds=0,
              nx=False, xx=False):
@@ -2141,11 +3349,10 @@ class Storage:
         if not skip:
             if exists:
                 db.pop(key)
+            db.set(key, bytearray(value))
             if timeout > 0:
-                db._timer(timeout, key, bytearray(value))
+                db.expire(key, timeout)
                 self._signal(self.NOTIFY_STRING, db, 'expire', key)
-            else:
-                db._data[key] = bytearray(value)
             self._signal(self.NOTIFY_STRING, db, 'set', key, 1)
             return True
 
@@ -2157,56 +3364,459 @@ class Storage:
         db = client.db
         cur = db.get(key)
         if cur is None:
-            db._data[key] = bytearray(value)
+            db.set(key, bytearray(value))
         elif isinstance(cur, bytearray):
             try:
                 tv += type(cur)
             except Exception:
                 return client.reply_error('invalid increment')
-            db._data[key] = bytearray(str(tv).encode('utf-8'))
+            db.set(key, bytearray(str(tv).encode('utf-8')))
         else:
             return client.reply_wrongtype()
         self._signal(self.NOTIFY_STRING, db, name, key, 1)
         return tv
 
-    def _bpop(self, client, request, keys, dest=None):
-        list_type = self.list_type
+    def _block_timeout(self, value):
+        try:
+            timeout = float(value)
+        except ValueError:
+            raise CommandError('timeout is not a float or out of '
+                               'range') from None
+        if timeout < 0:
+            raise CommandError('timeout is negative')
+        return timeout
+
+    def _list_ends(self, ends):
+        # The LEFT or RIGHT ends of LMOVE and BLMOVE as booleans
+        try:
+            return tuple(self.LIST_ENDS[end.lower()] for end in ends)
+        except KeyError:
+            raise CommandError(self.SYNTAX_ERROR) from None
+
+    def _block(self, client, request, keys, timeout, type):
+        # Serve request from the first key with elements or block client
         db = client.db
         for key in keys:
             value = db.get(key)
-            if isinstance(value, list_type):
-                self._block_callback(client, request[0], key, value, dest)
-                return True
+            if isinstance(value, type):
+                return self._block_callback(client, request, key, value)
             elif value is not None:
-                client.reply_wrongtype()
-                return True
-        return False
+                return client.reply_wrongtype()
+        client.blocked = Blocked(client, request, keys, timeout, type)
 
-    def _block_callback(self, client, command, key, value, dest):
+    def _block_callback(self, client, request, key, value):
+        # Serve a blocking request from value at key
         db = client.db
-        if command[:2] == 'br':
-            if dest is not None:
-                dval = db.get(dest)
-                if dval is None:
-                    dval = self.list_type()
-                    db._data[dest] = dval
-                elif not isinstance(dval, self.list_type):
-                    return client.reply_wrongtype()
+        command = request[0]
+        if command == 'xread':
+            count, _, _, _, _, keys, ids = self._xread_options(request)
+            start = parse_id(ids[keys.index(key)])
+            client.reply_multi_bulk(((key, self._xread(value, start, count)),))
+        elif command == 'xreadgroup':
+            count, _, noack, name, consumer, _, _ = (
+                self._xread_options(request))
+            group = value.groups.get(name)
+            if group is None:
+                client.reply_error(self._no_group(key, name), 'NOGROUP')
+            else:
+                entries = self._xreadgroup(db, key, value, group, consumer,
+                                           b'>', count, noack)
+                client.reply_multi_bulk(((key, entries),))
+        elif command[:2] == 'bz':
+            [(score, member)] = self._zpop(db, command[1:], key, value, 1)
+            self._propagate(db, command[1:].encode('utf-8'), key)
+            client.reply_multi_bulk((key, member, score))
+        elif command in ('blmove', 'brpoplpush'):
+            if command == 'blmove':
+                ends = self._list_ends(request[3:5])
+            else:
+                ends = (False, True)
+            dest = request[2]
+            elem = self._list_move(client, command, key, value, dest, *ends)
+            if elem is not None:
+                self._propagate(db, b'lmove', key, dest,
+                                *(b'left' if end else b'right'
+                                  for end in ends))
+                client.reply_bulk(elem)
+        else:
+            elem = self._list_move(client, command, key, value,
+                                   left=command == 'blpop')
+            self._propagate(db, command[1:].encode('utf-8'), key)
+            client.reply_multi_bulk((key, elem))
+
+    def _list_move(self, client, command, key, value, dest=None, left=True,
+                   dest_left=True):
+        # Pop an element from the list value at key and push it to dest.
+        # Return the element or None when dest is not a list
+        db = client.db
+        if self._snapshot:
+            self._snapshot.before_write(db, (key, dest))
+        if dest is not None:
+            dval = db.get(dest)
+            if dval is None:
+                dval = self.list_type(self.encodings)
+                db.set(dest, dval)
+            elif not isinstance(dval, self.list_type):
+                return client.reply_wrongtype()
+        if left:
+            elem = value.popleft()
+            self._signal(self.NOTIFY_LIST, db, 'lpop', key, 1)
+        else:
             elem = value.pop()
             self._signal(self.NOTIFY_LIST, db, 'rpop', key, 1)
-            if dest is not None:
+        if dest is not None:
+            if dest_left:
                 dval.appendleft(elem)
                 self._signal(self.NOTIFY_LIST, db, 'lpush', dest, 1)
+            else:
+                dval.append(elem)
+                self._signal(self.NOTIFY_LIST, db, 'rpush', dest, 1)
+        if db.pop(key, value) is not None:
+            self._signal(self.NOTIFY_GENERIC, db, 'del', key)
+        return elem
+
+    def _zpop(self, db, command, key, value, count):
+        # Remove and return count (score, member) pairs with the lowest or
+        # highest scores from the sorted set value at key
+        size = len(value)
+        count = min(count, size)
+        if command == 'zpopmax':
+            start, end = size - count, size
         else:
-            elem = value.popleft()
-            self._signal(self.NOTIFY_LIST, db, 'lpop', key, 1)
-        if not value:
-            db.pop(key)
-            self._signal(self.NOTIFY_GENERIC, db, 'del', key, 1)
-        if dest is None:
-            client.reply_multi_bulk((key, elem))
+            start, end = 0, count
+        result = list(value.range(start, end, scores=True))
+        if command == 'zpopmax':
+            result.reverse()
+        if result:
+            value.remove_range(start, end)
+            self._signal(self.NOTIFY_ZSET, db, command, key, len(result))
+            if db.pop(key, value) is not None:
+                self._signal(self.NOTIFY_GENERIC, db, 'del', key)
+        return result
+
+    def _stream_new_id(self, stream, value):
+        # The ID of a new entry of stream from the ID argument of XADD
+        if value in (b'-', b'+') or value[:-2] in (b'-', b'+'):
+            raise CommandError(INVALID_ID)
+        elif value == b'*':
+            id = stream.next_id()
+        elif value[-2:] == b'-*':
+            id = stream.next_id(parse_id(value[:-2]) >> 64)
+        else:
+            id = parse_id(value)
+            if not id:
+                raise CommandError('The ID specified in XADD must be '
+                                   'greater than 0-0')
+            elif id <= stream.last_id:
+                id = None
+        if id is None:
+            raise CommandError('The ID specified in XADD is equal or '
+                               'smaller than the target stream top item')
+        return id
+
+    def _stream_trim_options(self, request, index):
+        # Parse MAXLEN|MINID [=|~] threshold [LIMIT count] at index. Return
+        # the arguments of Stream.trim and the index of the next argument
+        strategy = request[index].lower()
+        if strategy not in (b'maxlen', b'minid'):
+            raise CommandError(self.SYNTAX_ERROR)
+        approx = False
+        limit = None
+        try:
+            index += 1
+            if request[index] in (b'=', b'~'):
+                approx = request[index] == b'~'
+                index += 1
+            if strategy == b'maxlen':
+                maxlen, minid = int(request[index]), None
+                if maxlen < 0:
+                    raise CommandError('The MAXLEN argument must be >= 0.')
+            else:
+                maxlen, minid = None, parse_id(request[index])
+            index += 1
+            if index < len(request) and request[index].lower() == b'limit':
+                limit = int(request[index+1])
+                index += 2
+                if not approx:
+                    raise CommandError('syntax error, LIMIT cannot be used '
+                                       'without the special ~ option')
+        except IndexError:
+            raise CommandError(self.SYNTAX_ERROR) from None
+        except ValueError:
+            raise CommandError(
+                'value is not an integer or out of range') from None
+        if approx and limit is None:
+            limit = self.STREAM_TRIM_NODES*self._stream_node_size
+        return (maxlen, minid, approx, limit), index
+
+    def _xtrim(self, db, key, value, trim):
+        # Trim the stream value at key. Approximate trimming depends on
+        # the nodes of the stream, an exact trim is propagated
+        removed = value.trim(*trim)
+        if removed:
+            self._signal(self.NOTIFY_STREAM, db, 'xtrim', key, removed)
+            if value:
+                self._propagate(db, b'xtrim', key, b'minid',
+                                format_id(value.first_id()))
+            else:
+                self._propagate(db, b'xtrim', key, b'maxlen', b'0')
+        return removed
+
+    def _stream_reply(self, entries):
+        return [(format_id(id), pairs) for id, pairs in entries]
+
+    def _xread_options(self, request):
+        # Options, keys and IDs of XREAD and XREADGROUP
+        group = request[0] == 'xreadgroup'
+        count = timeout = name = consumer = None
+        noack = False
+        index = 1
+        try:
+            while request[index].lower() != b'streams':
+                option = request[index].lower()
+                if option == b'count':
+                    count = max(int(request[index+1]), 0) or None
+                    index += 2
+                elif option == b'block':
+                    timeout = int(request[index+1])
+                    if timeout < 0:
+                        raise CommandError('timeout is negative')
+                    timeout = 0.001*timeout
+                    index += 2
+                elif option == b'group' and group:
+                    name, consumer = request[index+1], request[index+2]
+                    index += 3
+                elif option == b'noack' and group:
+                    noack = True
+                    index += 1
+                else:
+                    raise CommandError(self.SYNTAX_ERROR)
+        except IndexError:
+            raise CommandError(self.SYNTAX_ERROR) from None
+        except ValueError:
+            raise CommandError(
+                'value is not an integer or out of range') from None
+        if group and name is None:
+            raise CommandError('Missing GROUP option for XREADGROUP')
+        args = request[index+1:]
+        if not args or len(args) % 2:
+            raise CommandError(
+                "Unbalanced '%s' list of streams: for each stream key an "
+                "ID or '%s' must be specified." % (request[0],
+                                                   '>' if group else '$'))
+        half = len(args)//2
+        return count, timeout, noack, name, consumer, args[:half], args[half:]
+
+    def _xread(self, value, start, count):
+        # At most count entries of the stream value after the start ID
+        if value is None or start == MAX_ID:
+            return []
+        return self._stream_reply(islice(value.range(start + 1), count))
+
+    def _xreadgroup(self, db, key, value, group, name, id, count, noack):
+        # Deliver entries of the stream value at key to the consumer name
+        # of group, new entries when id is > and pending entries otherwise
+        now = mstime()
+        if self._snapshot:
+            self._snapshot.before_write(db, (key,))
+        consumer = self._stream_consumer(db, key, group, name, now)
+        entries = []
+        if id == b'>':
+            if group.last_id < MAX_ID:
+                entries = list(islice(value.range(group.last_id + 1), count))
+            if entries:
+                consumer.active_time = now
+                group.last_id = entries[-1][0]
+                if group.entries_read is not None:
+                    group.entries_read += len(entries)
+                if not noack:
+                    for id, _ in entries:
+                        group.deliver(id, consumer, now)
+                        self._propagate_claim(db, key, group, id)
+                self._propagate(db, b'xgroup', b'setid', key, group.name,
+                                format_id(group.last_id),
+                                *self._entries_read_args(group))
+        else:
+            start = parse_id(id)
+            pending = group.pending_range(start + 1, consumer=consumer)
+            for id, entry in islice(pending if start < MAX_ID else (), count):
+                pairs = value.get(id)
+                entries.append((id, pairs))
+                entry.delivery_time = now
+                entry.delivery_count += 1
+                if pairs is not None:
+                    self._propagate_claim(db, key, group, id)
+        if entries:
+            self._signal(self.NOTIFY_STREAM, db, 'xreadgroup', key,
+                         len(entries))
+        return self._stream_reply(entries)
+
+    def _xgroup_options(self, request, create=False):
+        # MKSTREAM and ENTRIESREAD options of XGROUP CREATE and SETID
+        mkstream = False
+        entries_read = None
+        options = iter(request[5:])
+        try:
+            for option in options:
+                option = option.lower()
+                if option == b'mkstream' and create:
+                    mkstream = True
+                elif option == b'entriesread':
+                    entries_read = int(next(options))
+                    if entries_read < 0:
+                        raise ValueError
+                else:
+                    raise StopIteration
+        except StopIteration:
+            raise CommandError(self.SYNTAX_ERROR) from None
+        except ValueError:
+            raise CommandError(
+                'value is not an integer or out of range') from None
+        return mkstream, entries_read
+
+    def _xgroup_id(self, value, id, entries_read):
+        # The last delivered ID and the entries read of a consumer group
+        if id == b'$':
+            id = value.last_id if value is not None else 0
+            if entries_read is None and value is not None:
+                entries_read = value.entries_added
+        else:
+            id = parse_id(id)
+        if entries_read is None and not id:
+            entries_read = 0
+        return id, entries_read
+
+    def _entries_read_args(self, group):
+        if group.entries_read is None:
+            return ()
+        return (b'entriesread', group.entries_read)
+
+    def _stream_consumer(self, db, key, group, name, now):
+        # The consumer name of group, created when missing
+        consumer = group.consumers.get(name)
+        if consumer is None:
+            consumer = group.consumer(name, now)
+            self._signal(self.NOTIFY_STREAM, db, 'xgroup', key, 1)
+            self._propagate(db, b'xgroup', b'createconsumer', key,
+                            group.name, name)
+        consumer.seen_time = now
+        return consumer
+
+    def _propagate_claim(self, db, key, group, id):
+        # Propagate the pending entry id of group as a forced XCLAIM
+        entry = group.pending[id]
+        self._propagate(db, b'xclaim', key, group.name, entry.consumer.name,
+                        0, format_id(id), b'time', entry.delivery_time,
+                        b'retrycount', entry.delivery_count, b'force',
+                        b'justid')
+
+    def _no_group(self, key, name):
+        return "No such key '%s' or consumer group '%s'" % (
+            key.decode('utf-8', 'replace'), name.decode('utf-8', 'replace'))
+
+    def _serve_blocked(self):
+        # Serve clients blocked on keys which received elements, one client
+        # per element in the order clients blocked
+        ready = self._ready_keys
+        while ready:
+            (_, key), db = ready.popitem(last=False)
+            clients = db._blocking_keys.get(key)
+            for client in list(clients or ()):
+                value = db.get(key)
+                if value is None:
+                    break
+                elif (isinstance(value, client.blocked.type) and
+                      self._block_ready(client.blocked.request, key, value)):
+                    client.blocked.unblock(client, key, value)
+
+    def _block_ready(self, request, key, value):
+        # Whether a blocking request can be served from value at key, the
+        # blocked XREADGROUP of a destroyed group replies with an error
+        if not isinstance(value, self.stream_type):
+            return True
+        _, _, _, name, _, keys, ids = self._xread_options(request)
+        if name is None:
+            start = parse_id(ids[keys.index(key)])
         else:
-            client.reply_bulk(elem)
+            group = value.groups.get(name)
+            if group is None:
+                return True
+            start = group.last_id
+        if start == MAX_ID:
+            return False
+        return next(value.range(start + 1), None) is not None
+
+    def _match(self, pattern):
+        # A callable matching bytes against a glob-style pattern or None
+        if pattern != b'*':
+            pattern = redis_to_py_pattern(pattern.decode('latin-1'))
+            return re.compile(pattern.encode('latin-1'), re.DOTALL).match
+
+    def _scan_options(self, request, start, types=False):
+        try:
+            cursor = int(request[start])
+            if cursor < 0:
+                raise ValueError
+        except ValueError:
+            raise CommandError('invalid cursor') from None
+        count = self.SCAN_COUNT
+        match = type_name = None
+        options = request[start+1:]
+        if len(options) % 2:
+            raise CommandError(self.SYNTAX_ERROR)
+        for name, value in zip(options[::2], options[1::2]):
+            name = name.lower()
+            if name == b'match':
+                match = self._match(value)
+            elif name == b'count':
+                try:
+                    count = int(value)
+                    if count < 1:
+                        raise ValueError
+                except ValueError:
+                    raise CommandError(
+                        'value is not an integer or out of range') from None
+            elif name == b'type' and types:
+                type_name = value.decode('utf-8').lower()
+            else:
+                raise CommandError(self.SYNTAX_ERROR)
+        return cursor, count, match, type_name
+
+    def _scan_collection(self, request, value, contains):
+        # Iterate over a collection. Small collections are returned in one
+        # go, otherwise a snapshot of the members is taken and stored in the
+        # _scan_cursors dictionary so that members present for the whole
+        # iteration are returned at least once. The oldest snapshots are
+        # dropped when there are more than SCAN_CURSORS of them or they
+        # hold more than SCAN_CURSORS_MEMBERS members, their iterations
+        # start again from the first member
+        cursor, count, match, _ = self._scan_options(request, 2)
+        cursors = self._scan_cursors
+        cid, position = cursor >> 32, cursor & 0xffffffff
+        entry = cursors.pop(cid, None) if cursor else None
+        if entry is not None:
+            self._scan_cursors_members -= len(entry[1])
+        if entry is None or entry[0] is not value:
+            if len(value) <= max(count, self.SCAN_SMALL_COLLECTION):
+                members = [m for m in value if not match or match(m)]
+                return b'0', members
+            self._scan_cursor_id = self._scan_cursor_id % 0x7fffffff + 1
+            cid, position = self._scan_cursor_id, 0
+            entry = (value, list(value))
+        snapshot = entry[1]
+        end = position + count
+        members = [m for m in snapshot[position:end]
+                   if contains(m) and (not match or match(m))]
+        if end >= len(snapshot):
+            return b'0', members
+        cursors[cid] = entry
+        self._scan_cursors_members += len(snapshot)
+        while len(cursors) > 1 and (
+                len(cursors) > self.SCAN_CURSORS or
+                self._scan_cursors_members > self.SCAN_CURSORS_MEMBERS):
+            _, (_, dropped) = cursors.popitem(last=False)
+            self._scan_cursors_members -= len(dropped)
+        return str(cid << 32 | end).encode('utf-8'), members
 
     def _range_values(self, value, start, end):
         start = int(start)
@@ -2220,34 +3830,65 @@ class Storage:
                 end += 1
         return start, end
 
+    def _eval(self, client, sha, request):
+        try:
+            num = int(request[2])
+        except ValueError:
+            return client.reply_error('value is not an integer or out of '
+                                      'range')
+        if num < 0:
+            return client.reply_error("Number of keys can't be negative")
+        elif num > len(request) - 3:
+            return client.reply_error("Number of keys can't be greater "
+                                      "than number of args")
+        self.lua.run(client, sha, request[3:3+num], request[3+num:])
+
     def _close_transaction(self, client):
         client.transaction = None
         client.watched_keys = None
         client.flag &= ~self.DIRTY_CAS
         self._watching.discard(client)
 
-    def _flat_info(self):
+    def _flat_info(self, section='default'):
         info = self._server.info()
         info['server']['redis_version'] = self.version
+        # command statistics are not part of the default sections
+        everything = section in ('all', 'everything')
+        if everything or section == 'commandstats':
+            info['commandstats'] = self._commandstats_info()
+        if everything or section == 'latencystats':
+            info['latencystats'] = self._latencystats_info()
         e = self._encode_info_value
         for k, values in info.items():
             if isinstance(values, dict):
+                if not (everything or section in ('default', k)):
+                    continue
                 yield '#%s' % k
                 for key, value in values.items():
                     if isinstance(value, (list, tuple)):
                         value = ', '.join((e(v) for v in value))
                     elif isinstance(value, dict):
-                        value = ', '.join(('%s=%s' % (k, e(v))
-                                           for k, v in value.items()))
+                        value = ','.join(('%s=%s' % (k, e(v))
+                                          for k, v in value.items()))
                     else:
                         value = e(value)
                     yield '%s:%s' % (key, value)
 
     def _get_config(self, name):
+        if name == 'notify-keyspace-events':
+            return self._keyspace_events.encode('utf-8')
         return b''
 
     def _set_config(self, name, value):
-        pass
+        if name == 'notify-keyspace-events':
+            self._set_keyspace_events(value.decode('utf-8'))
+
+    def _set_keyspace_events(self, events):
+        flags = 0
+        for event in validate_keyspace_events(events):
+            flags |= self._keyspace_classes[event]
+        self._keyspace_events = events
+        self._notify_flags = flags
 
     def _encode_info_value(self, value):
         return str(value).replace('=',
@@ -2265,8 +3906,8 @@ class Storage:
         db = client.db
         hash = db.get(key)
         if hash is None:
-            hash = self.hash_type()
-            db._data[key] = hash
+            hash = self.hash_type(self.encodings)
+            db.set(key, hash)
         elif not isinstance(hash, self.hash_type):
             return client.reply_wrongtype()
         if field in hash:
@@ -2276,7 +3917,7 @@ class Storage:
                 return client.reply_error(
                     'hash value is not an %s' % type.__name__)
             increment += value
-        hash[field] = increment
+        hash[field] = str(increment).encode('utf-8')
         self._signal(self.NOTIFY_HASH, db, request[0], key, 1)
         return increment
 
@@ -2286,17 +3927,19 @@ class Storage:
         for key in keys:
             value = db.get(key)
             if value is None:
-                value = set()
-            elif not isinstance(value, set):
+                value = ()
+            elif not isinstance(value, self.set_type):
                 return client.reply_wrongtype()
+            else:
+                value = value.members()
             if result is None:
-                result = value
+                result = set(value)
             else:
                 result = getattr(result, oper)(value)
         if dest is not None:
             db.pop(dest)
             if result:
-                db._data[dest] = result
+                db.set(dest, self.set_type(self.encodings, result))
                 client.reply_int(len(result))
             else:
                 client.reply_zero()
@@ -2320,7 +3963,7 @@ class Storage:
             for key in request[3:3+numkeys]:
                 value = db.get(key)
                 if value is None:
-                    value = self.zset_type()
+                    value = self.zset_type(self.encodings)
                 elif not isinstance(value, self.zset_type):
                     return client.reply_wrongtype()
                 sets.append(value)
@@ -2351,12 +3994,14 @@ class Storage:
         except Exception as e:
             return client.reply_error(str(e))
         if cmnd == b'zunionstore':
-            result = self.zset_type.union(sets, weights, aggregate)
+            result = self.zset_type.union(self.encodings, sets, weights,
+                                          aggregate)
         else:
-            result = self.zset_type.inter(sets, weights, aggregate)
+            result = self.zset_type.inter(self.encodings, sets, weights,
+                                          aggregate)
         if db.pop(des) is not None:
             self._signal(self.NOTIFY_GENERIC, db, 'del', des, 1)
-        db._data[des] = result
+        db.set(des, result)
         self._signal(self.NOTIFY_ZSET, db, cmnd, des, len(result))
         client.reply_int(len(result))
 
@@ -2375,18 +4020,70 @@ class Storage:
         stats = {'keyspace_hits': self._hit_keys,
                  'keyspace_misses': self._missed_keys,
                  'expired_keys': self._expired_keys,
+                 'evicted_keys': self._evicted_keys,
+                 'client_output_buffer_limit_disconnections':
+                     self._output_limit_disconnections,
                  'keys_changed': self._dirty,
                  'pubsub_channels': len(self._channels),
                  'pubsub_patterns': len(self._patterns),
                  'blocked_clients': self._bpop_blocked_clients}
-        persistance = {'rdb_changes_since_last_save': self._dirty,
-                       'rdb_last_save_time': self._last_save}
+        writer = self._snapshot
+        rewriting = isinstance(writer, AofRewriter)
+        persistance = {'loading': int(bool(self._loading)),
+                       'rdb_changes_since_last_save': self._dirty,
+                       'rdb_bgsave_in_progress': int(bool(writer) and
+                                                     not rewriting),
+                       'rdb_last_save_time': self._last_save,
+                       'aof_enabled': int(bool(self._aof)),
+                       'aof_rewrite_in_progress': int(rewriting)}
+        if self._aof:
+            persistance['aof_current_size'] = self._aof.size
+            persistance['aof_base_size'] = self._aof.base_size
         for db in self.databases.values():
             if len(db):
                 keyspace[str(db)] = db.info()
+        if self._replica:
+            replication = self._replica.info()
+        elif self._master:
+            replication = self._master.info()
+        else:
+            replication = {'role': 'master', 'connected_slaves': 0}
+        if self._cluster:
+            cluster = self._cluster.info()
+        else:
+            cluster = {'cluster_enabled': 0}
+        if self._memory:
+            memory = self._memory.info()
+        else:
+            # memory is accounted only when limited
+            memory = {'maxmemory': 0,
+                      'maxmemory_policy': self.cfg.key_value_maxmemory_policy}
         return {'keyspace': keyspace,
+                'memory': memory,
                 'stats': stats,
-                'persistance': persistance}
+                'persistance': persistance,
+                'replication': replication,
+                'cluster': cluster}
+
+    def _commandstats_info(self):
+        return dict((('cmdstat_%s' % name, stats.info())
+                     for name, stats in sorted(self._commandstats.items())))
+
+    def _latencystats_info(self):
+        percentiles = self.LATENCY_PERCENTILES
+        return dict((('latency_percentiles_usec_%s' % name,
+                      stats.percentiles(percentiles))
+                     for name, stats in sorted(self._commandstats.items())))
+
+    def _executed(self, client, request, seconds):
+        # Record the duration of a command
+        usec = int(1000000*seconds)
+        stats = self._commandstats.get(request[0])
+        if stats is None:
+            self._commandstats[request[0]] = stats = CommandStats()
+        stats.add(usec)
+        if 0 <= self._slowlog.threshold <= usec:
+            self._slowlog.add(client, request, usec)
 
     def _client_list(self, client):
         for client in client._producer._concurrent_connections:
@@ -2399,60 +4096,287 @@ class Storage:
         yield 'db=%s' % client.database
         yield 'sub=%s' % len(client.channels)
         yield 'psub=%s' % len(client.patterns)
+        yield 'omem=%s' % client._transport.get_write_buffer_size()
         yield 'cmd=%s' % client.last_command
 
-    def _save(self, async=True):
-        writer = self._writer
-        if writer and writer.is_alive():
-            self.logger.warning('Cannot save, background saving in progress')
-        else:
-            from multiprocessing import Process
-            data = self._dbs()
+    def _save(self, background=True):
+        writer = self._snapshot
+        if writer and background:
+            return self.logger.warning(
+                'Cannot save, background saving in progress')
+        if writer and writer.filename != self._filename:
+            writer.step()
+            self._save_done()
+            writer = None
+        if not writer:
             self._dirty = 0
             self._last_save = int(time.time())
-            if async:
-                self.logger.debug('Saving database in background process')
-                self._writer = Process(target=save_data,
-                                       args=(self.cfg, self._filename, data))
-                self._writer.start()
+            writer = SnapshotWriter(self, self._filename)
+            self._snapshot = writer
+        if background:
+            self.logger.debug('Saving database in background')
+            self._loop.call_soon(self._save_step)
+        else:
+            self.logger.debug('Saving database')
+            writer.step()
+            self._save_done()
+
+    def _rewrite_aof(self):
+        filename = self._aof_filename
+        self._snapshot = AofRewriter(self, filename, self._aof)
+        self.logger.debug('Rewriting append only file in background')
+        self._loop.call_soon(self._save_step)
+
+    def _save_step(self):
+        writer = self._snapshot
+        if writer:
+            try:
+                done = writer.step(self.SNAPSHOT_SLICE)
+            except Exception:
+                self._snapshot = None
+                writer.abort()
+                self.logger.exception('Could not save data into "%s"',
+                                      writer.filename)
+                if self._master:
+                    self._master.saved(writer, True)
             else:
-                self.logger.debug('Saving database')
-                save_data(self.cfg, self._filename, data)
+                if done:
+                    self._save_done()
+                else:
+                    self._loop.call_soon(self._save_step)
 
-    def _dbs(self):
-        data = [(db._num, db._data) for db in self.databases.values()
-                if len(db._data)]
-        return (1, data)
+    def _save_done(self):
+        writer = self._snapshot
+        self._snapshot = None
+        writer.close()
+        self.logger.info('wrote %d keys into "%s"', writer.keys,
+                         writer.filename)
+        if self._master:
+            self._master.saved(writer)
 
     def _loaddb(self):
-        filename = self._filename
-        if self.cfg.key_value_save and os.path.isfile(filename):
-            self.logger.info('loading data from "%s"', filename)
-            with open(filename, 'rb') as file:
-                data = pickle.load(file)
-            version, dbs = data
-            for num, data in dbs:
-                db = self.databases.get(num)
-                if db is not None:
-                    db._data = data
-
-    def _signal(self, type, db, command, key=None, dirty=0):
+        cfg = self.cfg
+        filename = self._aof_filename
+        if cfg.key_value_appendonly and os.path.isfile(filename):
+            reader = AofReader(self, filename)
+            load = reader.client.execute
+        elif cfg.key_value_save and os.path.isfile(self._filename):
+            reader = SnapshotReader(self._filename)
+            load = self._load_record
+        else:
+            return self._loaded()
+        self._load(reader, load)
+
+    def _load(self, reader, load):
+        self.logger.info('loading data from "%s"', reader.filename)
+        self._loading = (reader, iter(reader), load, 0)
+        self._loop.call_soon(self._load_step)
+
+    def _load_step(self):
+        reader, records, load, progress = self._loading
+        end = self._loop.time() + self.LOADING_SLICE
+        try:
+            for record in records:
+                load(record)
+                if self._loop.time() > end:
+                    done = int(100*reader.position/reader.size)
+                    if done >= progress + 10:
+                        self.logger.info('loaded %d%% of "%s"', done,
+                                         reader.filename)
+                        progress = done
+                    self._loading = (reader, records, load, progress)
+                    return self._loop.call_soon(self._load_step)
+        except Exception:
+            self.logger.exception('Could not load data from "%s"',
+                                  reader.filename)
+        else:
+            self.logger.info('loaded data from "%s"', reader.filename)
+        reader.close()
+        self._loaded()
+
+    def _load_record(self, record):
+        num, key, value, when = record
+        db = self.databases.get(num)
+        if db is not None:
+            db.set(key, encode(self.encodings, value))
+            if when is None:
+                db._persist(key)
+            else:
+                db.expire(key, when - time.time())
+
+    def _loaded(self):
+        self._loading = None
+        self._dirty = 0
+        cfg = self.cfg
+        if self._replica:
+            self._replica.loaded()
+            if self._aof and not self._snapshot:
+                self._rewrite_aof()
+        elif cfg.key_value_appendonly and not self._aof:
+            filename = self._aof_filename
+            exists = os.path.isfile(filename)
+            self._aof = AppendOnlyFile(self, filename,
+                                       cfg.key_value_appendfsync)
+            if not exists and any(self.databases.values()):
+                self._rewrite_aof()
+
+    def _execute_write(self, client, handle, request):
+        # Execute a write command and feed it to the append only file and
+        # replicas when it changes the dataset
+        dirty = self._dirty
+        self._propagated = propagated = []
+        try:
+            handle(client, request, len(request) - 1)
+        finally:
+            self._propagated = None
+        if self._dirty != dirty and request[0] not in PROPAGATED:
+            propagated.insert(0, (client.database, request))
+        for num, args in propagated:
+            self._feed(num, args)
+        if self._aof and self._aof.fsync == 'always':
+            self._aof.flush()
+
+    def _propagate(self, db, *args):
+        # Feed args in place of the command being executed
+        if self._propagated is not None:
+            self._propagated.append((db._num, args))
+        elif self._aof or self._master:
+            self._feed(db._num, args)
+
+    def _feed(self, num, request):
+        pack = self._parser.pack_command
+        data = b''.join(pack(args) for args in absolute_timeouts(request))
+        if self._aof:
+            self._aof.feed(num, data)
+        if self._master:
+            self._master.feed(num, data)
+
+    def _sync(self, client, replid, offset):
+        if self._master is None:
+            self._master = Master(self)
+        self._master.sync(client, replid, offset)
+
+    def _slaveof(self, host, port):
+        if self._replica:
+            self._replica.close()
+        if self._master:
+            # replicas of this store need a full resynchronization
+            for client in list(self._master.replicas):
+                client.close()
+            self._master = None
+        self.logger.info('Replicating %s:%s', host, port)
+        self._replica = Replica(self, host, port)
+
+    def _signal(self, type, db, command, key=None, dirty=0, event=None):
         self._dirty += dirty
+        if key is not None:
+            if self._memory:
+                self._memory.resize(db, key)
+            if key in db._blocking_keys:
+                self._ready_keys[(db._num, key)] = db
         self._event_handlers[type](db, key, COMMANDS_INFO[command])
-
-    def _publish_clients(self, msg, clients):
-        remove = set()
+        if self._notify_flags & type and key is not None:
+            self._notify(type, db, event or command, key)
+
+    def _notify(self, type, db, event, key):
+        # Publish the keyspace and keyevent notifications of ``event`` on
+        # ``key`` enabled by notify-keyspace-events
+        flags = self._notify_flags
+        if flags & type:
+            event = event.encode('utf-8')
+            if flags & self.NOTIFY_KEYSPACE:
+                self._publish(b'__keyspace@%d__:%s' % (db._num, key), event)
+            if flags & self.NOTIFY_KEYEVENT:
+                self._publish(b'__keyevent@%d__:%s' % (db._num, event), key)
+
+    def _publish(self, channel, message):
+        # Publish ``message`` to the clients subscribed to ``channel`` and
+        # return the number of messages delivered
+        multi_bulk = self._parser.multi_bulk
+        messages = []
+        clients = self._channels.get(channel)
+        if clients:
+            messages.append((multi_bulk((b'message', channel, message)),
+                             clients))
+        for p in self._patterns.match(channel):
+            messages.append((multi_bulk((b'pmessage', p.pattern, channel,
+                                         message)), p.clients))
+        return self._publish_clients(messages) if messages else 0
+
+    def _publish_clients(self, messages):
+        # Write (message, clients) pairs and return the number of messages
+        # delivered. Clients receiving more than one message, because
+        # they subscribe to several matching patterns, get a single write
         count = 0
-        for client in clients:
-            try:
-                client._transport.write(msg)
-                count += 1
-            except Exception:
-                remove.add(client)
-        if remove:
-            clients.difference_update(remove)
+        failed = []
+        if len(messages) == 1:
+            msg, clients = messages[0]
+            for client in clients:
+                try:
+                    client._send(msg)
+                    count += 1
+                except Exception:
+                    failed.append(client)
+                else:
+                    if self._output_limit_reached(client):
+                        failed.append(client)
+        else:
+            batches = {}
+            for msg, clients in messages:
+                for client in clients:
+                    batch = batches.get(client)
+                    if batch is None:
+                        batches[client] = [msg]
+                    else:
+                        batch.append(msg)
+            for client, batch in batches.items():
+                try:
+                    client._send(b''.join(batch))
+                    count += len(batch)
+                except Exception:
+                    failed.append(client)
+                else:
+                    if self._output_limit_reached(client):
+                        failed.append(client)
+        for client in failed:
+            self._unsubscribe_client(client)
         return count
 
+    def _output_limit_reached(self, client):
+        # Disconnect a subscribed client exceeding the output buffer limits
+        hard, soft, seconds = self._pubsub_limit
+        size = client._transport.get_write_buffer_size()
+        reached = hard and size >= hard
+        if soft and size > soft:
+            now = self._loop.time()
+            if client.soft_limit_time is None:
+                client.soft_limit_time = now
+            elif now - client.soft_limit_time > seconds:
+                reached = True
+        else:
+            client.soft_limit_time = None
+        if reached:
+            self.logger.warning('Closing client %s exceeding the pubsub '
+                                'output buffer limits, %d bytes waiting',
+                                client_address(client).decode('utf-8'), size)
+            self._output_limit_disconnections += 1
+            client.abort()
+        return reached
+
+    def _unsubscribe_client(self, client):
+        for channel in client.channels:
+            clients = self._channels.get(channel)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    self._channels.pop(channel)
+        for pattern in client.patterns:
+            p = self._patterns.get(pattern)
+            if p is not None:
+                p.clients.discard(client)
+                if not p.clients:
+                    self._patterns.remove(pattern)
+
     # EVENT HANDLERS
     def _modified_key(self, key):
         for client in self._watching:
@@ -2464,36 +4388,21 @@ class Storage:
             self._modified_key(key)
 
     _string_event = _generic_event
+    _list_event = _generic_event
     _set_event = _generic_event
     _hash_event = _generic_event
     _zset_event = _generic_event
-
-    def _list_event(self, db, key, command):
-        if command.write:
-            self._modified_key(key)
-        # the key is blocking clients
-        if key in db._blocking_keys:
-            if key in db._data:
-                value = db._data[key]
-            elif key in self._expires:
-                value = db._expires[key]
-            else:
-                value = None
-            for client in db._blocking_keys.pop(key):
-                client.blocked.unblock(client, key, value)
+    _stream_event = _generic_event
 
     def _remove_connection(self, client, _, **kw):
         # Remove a client from the server
+        if self._master:
+            self._master.remove(client)
         self._monitors.discard(client)
         self._watching.discard(client)
-        for channel, clients in list(self._channels.items()):
-            clients.discard(client)
-            if not clients:
-                self._channels.pop(channel)
-        for pattern, p in list(self._patterns.items()):
-            p.clients.discard(client)
-            if not p.clients:
-                self._patterns.pop(pattern)
+        self._unsubscribe_client(client)
+        if client.blocked:
+            client.blocked.unblock(client)
 
     def _write_to_monitors(self, client, request):
         # addr = '%s:%s' % self._transport.get_extra_info('addr')
@@ -2502,7 +4411,7 @@ class Storage:
         remove = set()
         for m in self._monitors:
             try:
-                m._transport.write(message)
+                m._send(message)
             except Exception:
                 remove.add(m)
         if remove:
@@ -2511,84 +4420,140 @@ class Storage:
 
 class Db:
     '''A database.
+
+    Keys with a timeout are stored in ``_data`` together with all other
+    keys, their deadline is stored in the ``_expires`` dictionary and in
+    a :class:`.TimerWheel`. Expired keys are removed lazily when accessed
+    and actively by the :meth:`active_expire` method which is invoked
+    by the :class:`.Storage` cron.
+
+    New keys are appended to the ``_keys`` list, used by :meth:`scan`
+    to iterate over the keyspace in bounded steps, and their position
+    in the log of all keys ever added to the ``_positions`` array.
+    Removed keys are left in the list until it is compacted, keys
+    which survive a compaction keep their position and cursors remain
+    valid.
+
+    When the memory of the store is limited, the estimated size of keys
+    is stored in ``_sizes`` and, for the LRU and LFU eviction policies,
+    their last access time or access frequency in ``_access``.
     '''
     def __init__(self, num, store):
         self.store = store
         self._num = num
         self._loop = store._loop
         self._data = {}
+        self._keys = []
+        self._positions = array('Q')
+        self._next_position = 0
         self._expires = {}
+        self._wheel = TimerWheel(store.EXPIRE_RESOLUTION, self._loop.time())
         self._events = {}
         self._blocking_keys = {}
+        memory = store._memory
+        self._sizes = {} if memory else None
+        self._access = {} if memory and memory.tracking else None
 
     def __repr__(self):
         return 'db%s' % self._num
     __str__ = __repr__
 
     def __len__(self):
-        return len(self._data) + len(self._expires)
+        return len(self._data)
 
     def __iter__(self):
-        return chain(self._data, self._expires)
+        expires = self._expires
+        if not expires:
+            return iter(self._data)
+        now = self._loop.time()
+        return (key for key in self._data
+                if key not in expires or expires[key] > now)
 
     # #########################################################################
     # #    INTERNALS
     def flush(self):
+        if self.store._snapshot:
+            self.store._snapshot.flush(self)
         removed = len(self._data)
         self._data.clear()
-        [t.handle.cancel() for t in self._expires.values()]
+        if self._sizes is not None:
+            self.store._memory.flush(self)
+        self._compact_keys()
         self._expires.clear()
+        self._wheel.clear()
         self.store._signal(self.store.NOTIFY_GENERIC, self, 'flushdb',
                            dirty=removed)
 
     def get(self, key, default=None):
-        if key in self._data:
+        if key in self._data and not self._expired(key):
             self.store._hit_keys += 1
+            if self._access is not None:
+                self.store._memory.touch(self, key)
             return self._data[key]
-        elif key in self._expires:
-            self.store._hit_keys += 1
-            return self._expires[key].value
         else:
             self.store._missed_keys += 1
             return default
 
     def exists(self, key):
-        return key in self._data or key in self._expires
+        return key in self._data and not self._expired(key)
+
+    def set(self, key, value):
+        data = self._data
+        if key not in data:
+            if self.store._snapshot:
+                self.store._snapshot.created(self, key)
+            if len(self._keys) > 2*len(data) + self.store.SCAN_KEYS_SLACK:
+                self._compact_keys()
+            self._keys.append(key)
+            self._positions.append(self._next_position)
+            self._next_position += 1
+        data[key] = value
+        memory = self.store._memory
+        if memory:
+            memory.resize(self, key)
+            if self._access is not None:
+                memory.touch(self, key)
+
+    def load(self, data):
+        self._data = data
+        self._keys = list(data)
+        self._positions = array('Q', range(self._next_position,
+                                           self._next_position + len(data)))
+        self._next_position += len(data)
+        memory = self.store._memory
+        if memory:
+            memory.flush(self)
+            for key in data:
+                memory.resize(self, key)
 
     def expire(self, key, timeout):
-        if key in self._expires:
-            t = self._expires.pop(key)
-            t.handle.cancel()
-            value = t.value
-        elif key in self._data:
-            value = self._data.pop(key)
-        else:
+        if not self.exists(key):
             return False
+        self._persist(key)
         if timeout > 0:
-            self._timer(timeout, key, value)
+            when = self._loop.time() + timeout
+            self._expires[key] = when
+            self._wheel.add(key, when)
+        else:
+            self._data.pop(key)
+            self._forget(key)
         return True
 
     def persist(self, key):
-        if key in self._expires:
-            self.store._hit_keys += 1
-            t = self._expires.pop(key)
-            t.handle.cancel()
-            self._data[key] = t.value
-            return True
-        elif key in self._data:
+        if self.exists(key):
             self.store._hit_keys += 1
+            return self._persist(key)
         else:
             self.store._missed_keys += 1
         return False
 
     def ttl(self, key, m=1):
-        if key in self._expires:
-            self.store._hit_keys += 1
-            t = self._expires[key]
-            return max(0, int(m*(t.when - self._loop.time())))
-        elif key in self._data:
+        if self.exists(key):
             self.store._hit_keys += 1
-            return -1
+            when = self._expires.get(key)
+            if when is None:
+                return -1
+            return max(0, int(m*(when - self._loop.time())))
         else:
             self.store._missed_keys += 1
             return -2
@@ -2600,45 +4565,116 @@ class Db:
     def pop(self, key, value=None):
         if not value:
             if key in self._data:
+                self._persist(key)
                 value = self._data.pop(key)
+                self._forget(key)
                 return value
-            elif key in self._expires:
-                t = self._expires.pop(key)
-                t.handle.cancel()
-                return t.value
 
     def rem(self, key):
-        if key in self._data:
+        if self.exists(key):
             self.store._hit_keys += 1
+            self._persist(key)
             self._data.pop(key)
-            self.store._signal(self.store.NOTIFY_GENERIC, self, 'del', key, 1)
-            return 1
-        elif key in self._expires:
-            self.store._hit_keys += 1
-            t = self._expires.pop(key)
-            t.handle.cancel()
+            self._forget(key)
             self.store._signal(self.store.NOTIFY_GENERIC, self, 'del', key, 1)
             return 1
         else:
             self.store._missed_keys += 1
             return 0
 
-    def _do_expire(self, key):
-        if key in self._expires:
-            t = self._expires.pop(key)
-            t.handle.cancel()
-            self.store._expired_keys += 1
-
-    def _timer(self, timeout, key, value):
-        loop = self._loop
-        when = loop.time() + timeout
-        handle = loop.call_at(when, self._do_expire, key)
-        self._expires[key] = Timer(handle, value, when)
-
+    def scan(self, cursor, count, match=None, type_name=None):
+        '''Iterate over at most ``count`` keys starting from ``cursor``.
+
+        Return a two elements tuple containing the next cursor
+        (0 when the iteration is over) and the list of keys found.
+        Keys which exist for the whole duration of an iteration are
+        returned at least once, keys added during the iteration may not
+        be returned.
+
+        The cursor holds the position of the next key in the log of keys
+        and, in its lower ``SCAN_SPAN_BITS`` bits, the number of keys
+        from there to the end of the log when the iteration started, so
+        that an iteration terminates regardless of keys added to the
+        database.
+        '''
+        bits = self.store.SCAN_SPAN_BITS
+        mask = (1 << bits) - 1
+        position, span = cursor >> bits, cursor & mask
+        if not cursor:
+            span = self._next_position
+        bound = position + span
+        keys, positions = self._keys, self._positions
+        start = bisect_left(positions, position)
+        stop = bisect_left(positions, bound, start)
+        end = min(start + count, stop)
+        result = []
+        for key in keys[start:end]:
+            if self.exists(key):
+                if match and not match(key):
+                    continue
+                if type_name and type_name != self.store._type_name_map[
+                        type(self._data[key])]:
+                    continue
+                result.append(key)
+        if end >= stop:
+            return 0, result
+        position = positions[end]
+        return (position << bits) + min(bound - position, mask), result
+
+    def active_expire(self, now, limit):
+        '''Remove at most ``limit`` keys which expired before ``now``.
+
+        Return the number of keys removed.
+        '''
+        expires = self._expires
+        removed = 0
+        for key in self._wheel.advance(now, limit):
+            when = expires.get(key)
+            if when is not None and when <= now:
+                self._do_expire(key)
+                removed += 1
+        return removed
+
+    def _expired(self, key):
+        when = self._expires.get(key)
+        if when is not None and when <= self._loop.time():
+            self._do_expire(key)
+            return True
+        return False
 
-class Timer:
+    def _compact_keys(self):
+        # keep the last entry of each key in the log, with its position
+        data = self._data
+        keys, positions = self._keys, self._positions
+        kept = set()
+        compacted = []
+        for index in range(len(keys) - 1, -1, -1):
+            key = keys[index]
+            if key in data and key not in kept:
+                kept.add(key)
+                compacted.append(index)
+        compacted.reverse()
+        self._keys = [keys[index] for index in compacted]
+        self._positions = array('Q', (positions[index]
+                                      for index in compacted))
+
+    def _persist(self, key):
+        when = self._expires.pop(key, None)
+        if when is not None:
+            self._wheel.remove(key, when)
+            return True
+        return False
 
-    def __init__(self, handle, value, when):
-        self.handle = handle
-        self.value = value
-        self.when = when
+    def _do_expire(self, key):
+        store = self.store
+        if store._snapshot:
+            store._snapshot.before_write(self, (key,))
+        self._persist(key)
+        self._data.pop(key, None)
+        self._forget(key)
+        store._expired_keys += 1
+        store._notify(store.NOTIFY_EXPIRED, self, 'expired', key)
+
+    def _forget(self, key):
+        if self._sizes is not None:
+            self.store._memory.resize(self, key)
@@ -0,0 +1,413 @@
+'''Binary snapshot format for pulsar-ds.
+
+A snapshot is a stream of records preceded by a header and terminated by
+an end of file record containing the CRC32 checksum of the stream.
+Values are encoded according to their type:
+
+* strings are stored as raw bytes
+* lists, sets and hashes are stored as an array of lengths followed by
+  the concatenated items (fields and values for hashes)
+* sorted sets are stored as an array of scores followed by the members
+  encoded as a list
+* streams are stored as the IDs of their entries, the number of fields
+  and values of each entry and their concatenation, followed by the
+  metadata of the stream and its consumer groups with their pending
+  entries
+
+Integers are little-endian unsigned 32 bits, scores and timeouts
+little-endian doubles. Stream IDs are stored as their milliseconds and
+sequence numbers, little-endian unsigned 64 bits integers.
+'''
+import os
+import sys
+import time
+import zlib
+import pickle
+from array import array
+from struct import Struct
+from itertools import accumulate
+
+from pulsar.utils.structures import Dict, Zset, Deque
+
+from .streams import Stream, ConsumerGroup, SEQ_MASK
+
+
+MAGIC = b'PULSARDS'
+VERSION = 3
+
+OP_SELECTDB = 0xfe
+OP_EXPIRE = 0xfd
+OP_EOF = 0xff
+
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_SET = 2
+TYPE_HASH = 3
+TYPE_ZSET = 4
+TYPE_STREAM = 5
+
+UINT = Struct('<I')
+DOUBLE = Struct('<d')
+BYTE = Struct('<B')
+SWAP = sys.byteorder != 'little'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def to_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value
+    return str(value).encode('utf-8')
+
+
+def pack_array(typecode, values):
+    data = array(typecode, values)
+    if SWAP:
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack_array(typecode, chunk):
+    data = array(typecode)
+    data.frombytes(chunk)
+    if SWAP:
+        data.byteswap()
+    return data
+
+
+def pack_items(items):
+    '''Encode a sequence of bytes as an array of lengths followed by
+    the concatenated items.
+    '''
+    items = [to_bytes(item) for item in items]
+    return (UINT.pack(len(items)) + pack_array('I', map(len, items)) +
+            b''.join(items))
+
+
+def pack_ids(ids):
+    '''Encode a sequence of stream IDs as an array of milliseconds
+    followed by an array of sequence numbers.
+    '''
+    ids = list(ids)
+    return (UINT.pack(len(ids)) + pack_array('Q', (id >> 64 for id in ids)) +
+            pack_array('Q', (id & SEQ_MASK for id in ids)))
+
+
+def pack_stream(stream):
+    ids, lengths, items = [], [], []
+    for id, pairs in stream.range():
+        ids.append(id)
+        lengths.append(len(pairs))
+        items.extend(pairs)
+    chunks = [pack_ids(ids), pack_array('I', lengths), pack_items(items),
+              pack_ids((stream.last_id, stream.max_deleted_id)),
+              pack_array('Q', (stream.entries_added,)),
+              UINT.pack(len(stream.groups))]
+    for group in stream.groups.values():
+        consumers = list(group.consumers.values())
+        index = dict((consumer, n) for n, consumer in enumerate(consumers))
+        pending = list(group.pending_range())
+        entries_read = group.entries_read
+        chunks.extend((
+            pack_items((group.name,)), pack_ids((group.last_id,)),
+            pack_array('q', (-1 if entries_read is None else entries_read,)),
+            pack_items(consumer.name for consumer in consumers),
+            pack_array('q', (t for consumer in consumers
+                             for t in (consumer.seen_time,
+                                       consumer.active_time))),
+            pack_ids(id for id, _ in pending),
+            pack_array('I', (index[entry.consumer] for _, entry in pending)),
+            pack_array('q', (entry.delivery_time for _, entry in pending)),
+            pack_array('I', (entry.delivery_count for _, entry in pending))))
+    return b''.join(chunks)
+
+
+class SnapshotWriter:
+    '''Write a snapshot of a :class:`.Storage` into ``filename``.
+
+    The snapshot is written incrementally by calling :meth:`step`.
+    A write command must call :meth:`before_write` before modifying keys
+    so that the snapshot contains the values at the time the writer
+    was created.
+    '''
+    def __init__(self, store, filename):
+        self.store = store
+        self.filename = filename
+        self.keys = 0
+        self._loop = store._loop
+        self._temp = '%s.temp' % filename
+        self._file = open(self._temp, 'wb')
+        self._crc = 0
+        self._db = None
+        # keys expired when the snapshot started are not written
+        self._started = self._loop.time()
+        # wall clock minus loop clock, timeouts are stored as timestamps
+        self._delta = time.time() - self._started
+        self._dbs = [(db, db._keys, len(db._keys))
+                     for db in store.databases.values() if len(db)]
+        self._position = 0
+        self._written = dict(((db._num, set()) for db, _, _ in self._dbs))
+        self._created = dict(((db._num, set()) for db, _, _ in self._dbs))
+        self._header()
+
+    @property
+    def done(self):
+        return not self._dbs
+
+    def step(self, budget=None):
+        '''Write keys for at most ``budget`` seconds of loop time.
+
+        Return ``True`` when all keys have been written.
+        '''
+        loop = self._loop
+        end = loop.time() + budget if budget else None
+        while self._dbs:
+            db, keys, size = self._dbs[0]
+            position = self._position
+            written = self._written[db._num]
+            created = self._created[db._num]
+            for key in keys[position:min(position+100, size)]:
+                if (key in db._data and key not in written and
+                        key not in created):
+                    self._write_key(db, key)
+            self._position = position = position + 100
+            if position >= size:
+                self._dbs.pop(0)
+                self._position = 0
+            if end and loop.time() > end:
+                break
+        return self.done
+
+    def before_write(self, db, keys):
+        '''Write ``keys`` of ``db`` before they are modified
+        '''
+        written = self._written.get(db._num)
+        if written is not None:
+            created = self._created[db._num]
+            for key in keys:
+                if key in db._data and key not in written:
+                    if key not in created:
+                        self._write_key(db, key)
+                    written.add(key)
+
+    def created(self, db, key):
+        '''A new ``key`` was added to ``db``, it is not part of the snapshot
+        '''
+        created = self._created.get(db._num)
+        if created is not None:
+            created.add(key)
+
+    def flush(self, db):
+        '''``db`` is about to be flushed, write all its keys
+        '''
+        for index, (other, keys, size) in enumerate(self._dbs):
+            if other is db:
+                start = self._position if index == 0 else 0
+                self.before_write(db, keys[start:size])
+                self._dbs.pop(index)
+                if not index:
+                    self._position = 0
+                break
+
+    def close(self):
+        '''Terminate the snapshot and move it into ``filename``
+        '''
+        self._write(BYTE.pack(OP_EOF))
+        self._file.write(UINT.pack(self._crc & 0xffffffff))
+        self._file.close()
+        os.replace(self._temp, self.filename)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._temp)
+
+    def _header(self):
+        self._write(MAGIC, BYTE.pack(VERSION))
+
+    def _write(self, *chunks):
+        for chunk in chunks:
+            self._crc = zlib.crc32(chunk, self._crc)
+            self._file.write(chunk)
+
+    def _write_key(self, db, key):
+        value = db._data[key]
+        when = db._expires.get(key)
+        if when is not None and when <= self._started:
+            return
+        chunks = []
+        if db is not self._db:
+            self._db = db
+            chunks.append(BYTE.pack(OP_SELECTDB) + UINT.pack(db._num))
+        if when is not None:
+            when += self._delta
+            chunks.append(BYTE.pack(OP_EXPIRE) + DOUBLE.pack(when))
+        store = self.store
+        if isinstance(value, bytearray):
+            chunks.extend((BYTE.pack(TYPE_STRING), UINT.pack(len(key)), key,
+                           UINT.pack(len(value)), value))
+        else:
+            if isinstance(value, store.list_type):
+                payload = pack_items(value)
+                vtype = TYPE_LIST
+            elif isinstance(value, store.set_type):
+                payload = pack_items(value)
+                vtype = TYPE_SET
+            elif isinstance(value, store.hash_type):
+                payload = pack_items(value) + pack_items(value.values())
+                vtype = TYPE_HASH
+            elif isinstance(value, store.zset_type):
+                scores, members = [], []
+                for score, member in value.items():
+                    scores.append(score)
+                    members.append(member)
+                payload = (UINT.pack(len(scores)) + pack_array('d', scores) +
+                           pack_items(members))
+                vtype = TYPE_ZSET
+            elif isinstance(value, Stream):
+                payload = pack_stream(value)
+                vtype = TYPE_STREAM
+            else:
+                raise SnapshotError('Cannot encode %s' % type(value))
+            chunks.extend((BYTE.pack(vtype), UINT.pack(len(key)), key,
+                           payload))
+        self._write(*chunks)
+        self.keys += 1
+
+
+class SnapshotReader:
+    '''Read a snapshot written by :class:`.SnapshotWriter`.
+
+    Iterating over the reader yields ``(db, key, value, timestamp)``
+    tuples, where ``timestamp`` is ``None`` for keys without timeout.
+    Snapshots written with pickle by previous versions are also supported.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.size = os.path.getsize(filename)
+        self._file = open(filename, 'rb')
+        self._crc = 0
+
+    @property
+    def position(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+    def __iter__(self):
+        header = self._file.read(len(MAGIC))
+        if header != MAGIC:
+            self._file.seek(0)
+            return self._legacy()
+        return self._records()
+
+    def _legacy(self):
+        version, dbs = pickle.load(self._file)
+        for num, data, *expires in dbs:
+            expires = expires[0] if expires else {}
+            for key, value in data.items():
+                yield num, key, value, expires.get(key)
+
+    def _records(self):
+        self._crc = zlib.crc32(MAGIC)
+        version = self._byte()
+        if version != VERSION:
+            raise SnapshotError('Unsupported snapshot version %s' % version)
+        read = self._read
+        num = 0
+        when = None
+        while True:
+            op = self._byte()
+            if op == OP_EOF:
+                crc = self._crc & 0xffffffff
+                if UINT.unpack(self._file.read(4))[0] != crc:
+                    raise SnapshotError('Snapshot checksum failed')
+                break
+            elif op == OP_SELECTDB:
+                num = self._uint()
+            elif op == OP_EXPIRE:
+                when = DOUBLE.unpack(read(8))[0]
+            else:
+                key = read(self._uint())
+                if op == TYPE_STRING:
+                    value = bytearray(read(self._uint()))
+                elif op == TYPE_LIST:
+                    value = Deque(self._items())
+                elif op == TYPE_SET:
+                    value = set(self._items())
+                elif op == TYPE_HASH:
+                    fields = self._items()
+                    value = Dict(zip(fields, self._items()))
+                elif op == TYPE_ZSET:
+                    size = self._uint()
+                    scores = unpack_array('d', read(8*size))
+                    value = Zset(zip(scores, self._items()))
+                elif op == TYPE_STREAM:
+                    value = self._stream()
+                else:
+                    raise SnapshotError('Unknown record type %s' % op)
+                yield num, key, value, when
+                when = None
+
+    def _read(self, size):
+        chunk = self._file.read(size)
+        if len(chunk) != size:
+            raise SnapshotError('Unexpected end of snapshot')
+        self._crc = zlib.crc32(chunk, self._crc)
+        return chunk
+
+    def _byte(self):
+        return self._read(1)[0]
+
+    def _uint(self):
+        return UINT.unpack(self._read(4))[0]
+
+    def _items(self):
+        size = self._uint()
+        lengths = unpack_array('I', self._read(4*size))
+        blob = self._read(sum(lengths))
+        offsets = [0]
+        offsets.extend(accumulate(lengths))
+        return [blob[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def _ids(self):
+        size = self._uint()
+        ms = unpack_array('Q', self._read(8*size))
+        seq = unpack_array('Q', self._read(8*size))
+        return [m << 64 | s for m, s in zip(ms, seq)]
+
+    def _stream(self):
+        stream = Stream()
+        ids = self._ids()
+        lengths = unpack_array('I', self._read(4*len(ids)))
+        items = self._items()
+        start = 0
+        for id, length in zip(ids, lengths):
+            stream.add(id, items[start:start+length])
+            start += length
+        stream.last_id, stream.max_deleted_id = self._ids()
+        stream.entries_added = unpack_array('Q', self._read(8))[0]
+        for _ in range(self._uint()):
+            name = self._items()[0]
+            last_id = self._ids()[0]
+            entries_read = unpack_array('q', self._read(8))[0]
+            group = ConsumerGroup(name, last_id,
+                                  None if entries_read < 0 else entries_read)
+            consumers = [group.consumer(consumer_name)
+                         for consumer_name in self._items()]
+            times = unpack_array('q', self._read(16*len(consumers)))
+            for consumer, seen_time, active_time in zip(
+                    consumers, times[::2], times[1::2]):
+                consumer.seen_time = seen_time
+                consumer.active_time = active_time
+            ids = self._ids()
+            size = len(ids)
+            indexes = unpack_array('I', self._read(4*size))
+            times = unpack_array('q', self._read(8*size))
+            counts = unpack_array('I', self._read(4*size))
+            for id, index, when, count in zip(ids, indexes, times, counts):
+                group.deliver(id, consumers[index], when, count)
+            stream.groups[name] = group
+        return stream
@@ -0,0 +1,93 @@
+'''Command statistics and slow log for pulsar-ds.
+
+The duration of every command executed by :meth:`.ClientMixin._execute_command`
+is recorded, in microseconds, in the :class:`CommandStats` of the command,
+reported by the ``commandstats`` and ``latencystats`` sections of
+``INFO``. Commands slower than a threshold are added to the
+:class:`SlowLog` read by the ``SLOWLOG`` command.
+
+Latencies are counted in a :class:`Histogram` with logarithmic buckets
+subdivided linearly, as in HDR histograms, so that percentiles are
+reported with a bounded relative error and a fixed memory cost.
+'''
+import time
+from collections import deque
+
+from pulsar.utils.structures import Histogram
+
+
+class CommandStats:
+    '''Calls and latencies of a command
+    '''
+    __slots__ = ('calls', 'usec', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.usec = 0
+        self.histogram = Histogram()
+
+    def add(self, usec):
+        self.calls += 1
+        self.usec += usec
+        self.histogram.add(usec)
+
+    def info(self):
+        return {'calls': self.calls,
+                'usec': self.usec,
+                'usec_per_call': round(self.usec/self.calls, 2)}
+
+    def percentiles(self, percents):
+        return dict((('p%s' % p, self.histogram.percentile(p))
+                     for p in percents))
+
+
+class SlowLog:
+    '''The most recent commands slower than ``threshold`` microseconds
+
+    A negative ``threshold`` disables the log.
+    '''
+    def __init__(self, threshold, max_len, max_args=32, max_arg_len=128):
+        self.threshold = threshold
+        self.max_args = max_args
+        self.max_arg_len = max_arg_len
+        self._entries = deque(maxlen=max(max_len, 0))
+        self._id = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, client, request, usec):
+        max_args = self.max_args
+        max_len = self.max_arg_len
+        args = []
+        for index, arg in enumerate(request):
+            if isinstance(arg, str):
+                arg = arg.encode('utf-8')
+            if index == max_args - 1 and len(request) > max_args:
+                args.append(('... (%d more arguments)' % (
+                    len(request) - index)).encode('utf-8'))
+                break
+            if len(arg) > max_len:
+                arg = b'%s... (%d more bytes)' % (arg[:max_len],
+                                                  len(arg) - max_len)
+            args.append(arg)
+        self._entries.appendleft((self._id, int(time.time()), usec, args,
+                                  client_address(client), b''))
+        self._id += 1
+
+    def get(self, count=10):
+        entries = self._entries
+        if count < 0 or count >= len(entries):
+            return list(entries)
+        return [entries[index] for index in range(count)]
+
+    def reset(self):
+        self._entries.clear()
+
+
+def client_address(client):
+    transport = getattr(client, '_transport', None)
+    address = transport.get_extra_info('peername') if transport else None
+    if address:
+        return ('%s:%s' % address[:2]).encode('utf-8')
+    return b''
@@ -0,0 +1,455 @@
+'''Streams data type for pulsar-ds.
+
+A :class:`Stream` is an append only log of entries, sequences of
+field-value pairs identified by unique IDs ``<milliseconds>-<sequence>``
+increasing with each entry. IDs are stored as integers,
+``milliseconds << 64 | sequence``, which are compact and sort as IDs do.
+
+As in redis, entries are stored in nodes of at most
+``STREAM_NODE_MAX_ENTRIES`` entries. Nodes are indexed by their first ID
+so that the entries of a range are found with a binary search of the
+nodes and of the IDs of a node. Entries with the same fields as the
+first entry of their node only store their values. Deleted entries are
+marked in their node, which is removed once all its entries are deleted.
+Trimming removes whole nodes from the head of the stream, exact trimming
+also removes the first entries of a node.
+
+A :class:`ConsumerGroup` tracks the last ID delivered to its consumers and
+its pending entries list, the entries delivered but not yet acknowledged.
+'''
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from itertools import chain
+
+from .parser import CommandError
+
+
+STREAM_NODE_MAX_ENTRIES = 100
+
+SEQ_MASK = (1 << 64) - 1
+MAX_ID = (1 << 128) - 1
+
+# Approximate overhead in bytes of an entry and of a node
+ENTRY_SIZE = 64
+NODE_SIZE = 400
+
+INVALID_ID = 'Invalid stream ID specified as stream command argument'
+
+
+def mstime():
+    '''Milliseconds since the epoch
+    '''
+    return int(time.time()*1000)
+
+
+def parse_id(value, seq=0):
+    '''Parse the stream ID ``value``.
+
+    ``seq`` is the sequence of IDs with milliseconds only, ``-`` and ``+``
+    are the smallest and largest IDs.
+    '''
+    if value == b'-':
+        return 0
+    elif value == b'+':
+        return MAX_ID
+    ms, sep, sequence = value.partition(b'-')
+    try:
+        ms = int(ms)
+        if sep:
+            seq = int(sequence)
+        if not (0 <= ms <= SEQ_MASK and 0 <= seq <= SEQ_MASK):
+            raise ValueError
+    except ValueError:
+        raise CommandError(INVALID_ID) from None
+    return ms << 64 | seq
+
+
+def parse_range(value, end=False):
+    '''Parse the ``start`` or ``end`` ID of a range, exclusive when
+    prefixed by ``(``
+    '''
+    if value[:1] == b'(':
+        if value in (b'(-', b'(+'):
+            raise CommandError('invalid %s ID for the interval' %
+                               ('end' if end else 'start'))
+        id = parse_id(value[1:], SEQ_MASK if end else 0)
+        if end:
+            if not id:
+                raise CommandError('invalid end ID for the interval')
+            return id - 1
+        elif id == MAX_ID:
+            raise CommandError('invalid start ID for the interval')
+        return id + 1
+    return parse_id(value, SEQ_MASK if end else 0)
+
+
+def format_id(id):
+    return ('%d-%d' % (id >> 64, id & SEQ_MASK)).encode('utf-8')
+
+
+class Node:
+    '''Consecutive entries of a :class:`Stream`.
+
+    Entries with the same fields as the first entry are tuples of values,
+    other entries lists of fields and values, deleted entries ``None``.
+    '''
+    __slots__ = ('ids', 'fields', 'entries', 'live', 'nbytes')
+
+    def __init__(self, fields):
+        self.ids = []
+        self.fields = fields
+        self.entries = []
+        self.live = 0
+        self.nbytes = NODE_SIZE + sum(map(len, fields))
+
+    def append(self, id, pairs):
+        values = pairs[1::2]
+        if pairs[::2] == self.fields:
+            entry = values
+            size = ENTRY_SIZE + sum(map(len, values))
+        else:
+            entry = list(pairs)
+            size = ENTRY_SIZE + sum(map(len, pairs))
+        self.ids.append(id)
+        self.entries.append(entry)
+        self.live += 1
+        self.nbytes += size
+        return size
+
+    def pairs(self, index):
+        '''Flat list of fields and values of the entry at ``index``
+        '''
+        entry = self.entries[index]
+        if isinstance(entry, tuple):
+            return list(chain.from_iterable(zip(self.fields, entry)))
+        return entry
+
+    def size(self, index):
+        entry = self.entries[index]
+        if entry is None:
+            return 0
+        return ENTRY_SIZE + sum(map(len, entry))
+
+    def delete(self, index):
+        size = self.size(index)
+        if size:
+            self.entries[index] = None
+            self.live -= 1
+            self.nbytes -= size
+        return size
+
+    def trim(self, index):
+        '''Remove the entries before ``index``, return the number of
+        entries removed
+        '''
+        removed = 0
+        for i in range(index):
+            size = self.size(i)
+            if size:
+                removed += 1
+                self.nbytes -= size
+        del self.ids[:index]
+        del self.entries[:index]
+        self.live -= removed
+        return removed
+
+
+class Stream:
+    '''An append only log of entries
+    '''
+    __slots__ = ('node_size', 'length', 'last_id', 'entries_added',
+                 'max_deleted_id', 'groups', 'nbytes', '_nodes', '_firsts')
+    encoding = 'stream'
+
+    def __init__(self, node_size=STREAM_NODE_MAX_ENTRIES):
+        self.node_size = node_size
+        self.length = 0
+        self.last_id = 0
+        self.entries_added = 0
+        self.max_deleted_id = 0
+        self.groups = OrderedDict()
+        self.nbytes = 0
+        self._nodes = []
+        self._firsts = []
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return 'Stream(%d entries, last id %s)' % (
+            self.length, format_id(self.last_id).decode('utf-8'))
+
+    @property
+    def nodes(self):
+        '''Number of nodes
+        '''
+        return len(self._nodes)
+
+    def next_id(self, ms=None):
+        '''The ID of a new entry, the next sequence of ``ms`` milliseconds
+        when given. Return ``None`` when no ID is available.
+        '''
+        last_ms = self.last_id >> 64
+        if ms is None:
+            ms = mstime()
+            if ms > last_ms:
+                return ms << 64
+        elif ms < last_ms:
+            return None
+        elif ms > last_ms:
+            return ms << 64
+        if self.last_id == MAX_ID or (
+                ms is not None and self.last_id & SEQ_MASK == SEQ_MASK):
+            return None
+        return self.last_id + 1
+
+    def add(self, id, pairs):
+        '''Append the entry ``id`` with ``pairs``, a tuple of fields and
+        values. ``id`` must be larger than :attr:`last_id`.
+        '''
+        pairs = tuple(pairs)
+        nodes = self._nodes
+        if not nodes or len(nodes[-1].ids) >= self.node_size:
+            node = Node(pairs[::2])
+            nodes.append(node)
+            self._firsts.append(id)
+            self.nbytes += node.nbytes
+        self.nbytes += nodes[-1].append(id, pairs)
+        self.length += 1
+        self.last_id = id
+        self.entries_added += 1
+
+    def get(self, id):
+        '''Fields and values of entry ``id`` or ``None``
+        '''
+        node, index = self._find(id)
+        if node is not None:
+            return node.pairs(index)
+
+    def first_id(self):
+        for id, _ in self.range():
+            return id
+        return 0
+
+    def range(self, start=0, end=MAX_ID, reverse=False):
+        '''Iterator over ``(id, pairs)`` of entries with IDs between
+        ``start`` and ``end`` included
+        '''
+        if start > end:
+            return iter(())
+        elif reverse:
+            return self._reverse_range(start, end)
+        else:
+            return self._range(start, end)
+
+    def delete(self, id):
+        '''Delete entry ``id``, return ``True`` if it existed
+        '''
+        node, index = self._find(id)
+        if node is None:
+            return False
+        self.nbytes -= node.delete(index)
+        self.length -= 1
+        self.max_deleted_id = max(self.max_deleted_id, id)
+        if not node.live:
+            position = self._nodes.index(node)
+            del self._nodes[position]
+            del self._firsts[position]
+            self.nbytes -= node.nbytes
+        return True
+
+    def trim(self, maxlen=None, minid=None, approx=False, limit=None):
+        '''Remove entries from the head of the stream until at most
+        ``maxlen`` entries are left or no ID is smaller than ``minid``.
+
+        When ``approx`` only whole nodes are removed, at most ``limit``
+        entries. Return the number of entries removed.
+        '''
+        nodes = self._nodes
+        removed = 0
+        while nodes:
+            node = nodes[0]
+            if maxlen is not None:
+                excess = self.length - maxlen
+                if excess <= 0:
+                    break
+                whole = node.live <= excess
+            else:
+                whole = node.ids[-1] < minid
+                if not whole and node.ids[0] >= minid:
+                    break
+            if whole:
+                if approx and limit and removed + node.live > limit:
+                    break
+                removed += node.live
+                self.length -= node.live
+                self.nbytes -= node.nbytes
+                self.max_deleted_id = max(self.max_deleted_id, node.ids[-1])
+                del nodes[0]
+                del self._firsts[0]
+                continue
+            elif approx:
+                break
+            # remove the first entries of node
+            if maxlen is not None:
+                index = 0
+                while excess:
+                    if node.entries[index] is not None:
+                        excess -= 1
+                    index += 1
+            else:
+                index = bisect_left(node.ids, minid)
+            self.max_deleted_id = max(self.max_deleted_id,
+                                      node.ids[index - 1])
+            nbytes = node.nbytes
+            count = node.trim(index)
+            removed += count
+            self.length -= count
+            self.nbytes -= nbytes - node.nbytes
+            self._firsts[0] = node.ids[0]
+            break
+        return removed
+
+    # INTERNALS
+    def _find(self, id):
+        position = bisect_right(self._firsts, id) - 1
+        if position >= 0:
+            node = self._nodes[position]
+            index = bisect_left(node.ids, id)
+            if (index < len(node.ids) and node.ids[index] == id and
+                    node.entries[index] is not None):
+                return node, index
+        return None, None
+
+    def _range(self, start, end):
+        nodes = self._nodes
+        position = max(bisect_right(self._firsts, start) - 1, 0)
+        for node in nodes[position:]:
+            ids = node.ids
+            entries = node.entries
+            for index in range(bisect_left(ids, start), len(ids)):
+                id = ids[index]
+                if id > end:
+                    return
+                if entries[index] is not None:
+                    yield id, node.pairs(index)
+
+    def _reverse_range(self, start, end):
+        nodes = self._nodes
+        position = bisect_right(self._firsts, end) - 1
+        for node in nodes[position::-1] if position >= 0 else ():
+            ids = node.ids
+            entries = node.entries
+            for index in range(bisect_right(ids, end) - 1, -1, -1):
+                id = ids[index]
+                if id < start:
+                    return
+                if entries[index] is not None:
+                    yield id, node.pairs(index)
+
+
+class PendingEntry:
+    '''An entry delivered to a consumer and not yet acknowledged
+    '''
+    __slots__ = ('consumer', 'delivery_time', 'delivery_count')
+
+    def __init__(self, consumer, delivery_time, delivery_count=1):
+        self.consumer = consumer
+        self.delivery_time = delivery_time
+        self.delivery_count = delivery_count
+
+
+class Consumer:
+    '''A consumer of a :class:`ConsumerGroup` and its pending entries
+    '''
+    __slots__ = ('name', 'seen_time', 'active_time', 'pending')
+
+    def __init__(self, name, now=None):
+        self.name = name
+        self.seen_time = mstime() if now is None else now
+        self.active_time = -1
+        self.pending = {}
+
+
+class ConsumerGroup:
+    '''A consumer group of a :class:`Stream`
+    '''
+    __slots__ = ('name', 'last_id', 'entries_read', 'consumers',
+                 'pending', '_pending_ids')
+
+    def __init__(self, name, last_id, entries_read=None):
+        self.name = name
+        self.last_id = last_id
+        self.entries_read = entries_read
+        self.consumers = OrderedDict()
+        self.pending = {}
+        self._pending_ids = []
+
+    def consumer(self, name, now=None):
+        '''The consumer ``name``, created when missing
+        '''
+        consumer = self.consumers.get(name)
+        if consumer is None:
+            consumer = self.consumers[name] = Consumer(name, now)
+        return consumer
+
+    def delete_consumer(self, name):
+        '''Delete consumer ``name``, return the number of its pending
+        entries or ``None`` when it does not exist
+        '''
+        consumer = self.consumers.pop(name, None)
+        if consumer is not None:
+            ids = list(consumer.pending)
+            for id in ids:
+                self.ack(id)
+            return len(ids)
+
+    def deliver(self, id, consumer, now, count=1):
+        '''Add entry ``id`` to the pending entries of ``consumer``
+        '''
+        entry = self.pending.get(id)
+        if entry is None:
+            ids = self._pending_ids
+            if not ids or ids[-1] < id:
+                ids.append(id)
+            else:
+                insort(ids, id)
+        else:
+            entry.consumer.pending.pop(id, None)
+        entry = PendingEntry(consumer, now, count)
+        self.pending[id] = entry
+        consumer.pending[id] = entry
+        return entry
+
+    def ack(self, id):
+        '''Remove ``id`` from the pending entries
+        '''
+        entry = self.pending.pop(id, None)
+        if entry is not None:
+            entry.consumer.pending.pop(id, None)
+            ids = self._pending_ids
+            del ids[bisect_left(ids, id)]
+            return True
+        return False
+
+    def pending_bounds(self):
+        '''The smallest and largest IDs of pending entries, ``None`` when
+        there are no pending entries
+        '''
+        ids = self._pending_ids
+        return (ids[0], ids[-1]) if ids else (None, None)
+
+    def pending_range(self, start=0, end=MAX_ID, consumer=None):
+        '''Iterator over ``(id, entry)`` of pending entries with IDs
+        between ``start`` and ``end``
+        '''
+        ids = self._pending_ids
+        pending = consumer.pending if consumer is not None else self.pending
+        for index in range(bisect_left(ids, start), len(ids)):
+            id = ids[index]
+            if id > end:
+                break
+            entry = pending.get(id)
+            if entry is not None:
+                yield id, entry
@@ -1,18 +1,4 @@
-import shutil
-import pickle
-
-
-def save_data(cfg, filename, data):
-    logger = cfg.configured_logger('pulsar.ds')
-    temp = 'temp_%s' % filename
-    with open(temp, 'wb') as file:
-        pickle.dump(data, file, protocol=2)
-    shutil.move(temp, filename)
-    logger.info('wrote data into "%s"', filename)
-
-
 def sort_command(store, client, request, value):
-    sort_type = type(value)
     right = 0
     desc = False
     alpha = None
@@ -57,7 +43,7 @@ def sort_command(store, client, request, value):
         j += 1
 
     db = client.db
-    if sort_type is store.zset_type and dontsort:
+    if isinstance(value, store.zset_type) and dontsort:
         dontsort = False
         alpha = True
         sortby = None
@@ -103,18 +89,18 @@ def sort_command(store, client, request, value):
         client.reply_multi_bulk(vector)
     else:
         if getops:
-            vals = store.list_type()
+            vals = store.list_type(store.encodings)
             empty = b''
             for val in vector:
                 for getv in getops:
                     vals.append(lookup(store, db, getv, val) or empty)
         else:
-            vals = store.list_type(vector)
+            vals = store.list_type(store.encodings, vector)
         if db.pop(storekey) is not None:
             store._signal(store.NOTIFY_GENERIC, db, 'del', storekey)
         result = len(vals)
         if result:
-            db._data[storekey] = vals
+            db.set(storekey, vals)
             store._signal(store.NOTIFY_LIST, db, 'sort', storekey, result)
         client.reply_int(result)
 
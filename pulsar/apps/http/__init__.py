@@ -767,6 +767,13 @@ class HttpClient(AbstractClient):
 
         The size of a pool of connection for a given host.
 
+    .. attribute:: pool_options
+
+        Additional parameters of the connection pools, the ``min_size``,
+        ``idle_timeout`` and ``max_lifetime`` of the :class:`.Pool`
+        given by the ``pool_min_size``, ``pool_idle_timeout`` and
+        ``pool_max_lifetime`` parameters
+
     .. attribute:: connection_pools
 
         Dictionary of connection pools for different hosts
@@ -818,12 +825,16 @@ class HttpClient(AbstractClient):
                  websocket_handler=None, parser=None, trust_env=True,
                  loop=None, client_version=None, timeout=None, stream=False,
                  pool_size=10, frame_parser=None, logger=None,
-                 close_connections=False, keep_alive=None):
+                 close_connections=False, keep_alive=None, pool_min_size=0,
+                 pool_idle_timeout=None, pool_max_lifetime=None):
         super().__init__(loop)
         self._logger = logger or LOGGER
         self.client_version = client_version or self.client_version
         self.connection_pools = {}
         self.pool_size = pool_size
+        self.pool_options = dict(min_size=pool_min_size,
+                                 idle_timeout=pool_idle_timeout,
+                                 max_lifetime=pool_max_lifetime)
         self.trust_env = trust_env
         self.timeout = timeout
         self.store_cookies = store_cookies
@@ -949,6 +960,12 @@ class HttpClient(AbstractClient):
         else:
             return response
 
+    def pool_stats(self):
+        """The :meth:`.Pool.stats` of the :attr:`connection_pools`
+        """
+        return dict(((key, pool.stats())
+                     for key, pool in self.connection_pools.items()))
+
     def close(self):
         """Close all connections
         """
@@ -982,7 +999,7 @@ class HttpClient(AbstractClient):
                                 (host, port),
                                 ssl=request.ssl)
             pool = self.connection_pool(connector, pool_size=self.pool_size,
-                                        loop=self._loop)
+                                        loop=self._loop, **self.pool_options)
             self.connection_pools[request.key] = pool
         try:
             conn = await pool.connect()
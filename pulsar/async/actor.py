@@ -1,6 +1,7 @@
 import sys
 import os
 import pickle
+import asyncio
 from itertools import chain
 from threading import current_thread
 
@@ -398,6 +399,9 @@ class Actor(EventHandler, Coverage):
         * ``events`` a dictionary of information about the
           :ref:`event loop <asyncio-event-loop>` running the actor.
         * ``extra`` the :attr:`extra` attribute (you can use it to add stuff).
+        * ``load`` the number of ``connections`` open with the :attr:`servers`,
+          of pending ``tasks`` and the ``lag`` of the event loop, used by
+          :mod:`autoscaling <pulsar.async.autoscale>` monitors.
         * ``system`` system info.
 
         This method is invoked when you run the
@@ -414,8 +418,15 @@ class Actor(EventHandler, Coverage):
                  'process_id': self.pid,
                  'is_process': isp,
                  'age': self.impl.age}
+        connections = sum(getattr(server, 'connections', 0)
+                          for server in self.servers.values())
+        tasks = sum(1 for task in asyncio.Task.all_tasks(self._loop)
+                    if not task.done())
         data = {'actor': actor,
-                'extra': self.extra}
+                'extra': self.extra,
+                'load': {'connections': connections,
+                         'tasks': tasks,
+                         'lag': self.impl.lag}}
         if isp:
             data['system'] = system.process_info(self.pid)
         self.fire_event('on_info', info=data)
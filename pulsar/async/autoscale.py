@@ -0,0 +1,117 @@
+'''Elastic number of workers of a :class:`.Monitor`.
+
+When the :ref:`max_workers <setting-max_workers>` setting is positive the
+number of workers of a monitor follows their load, between
+:ref:`min_workers <setting-min_workers>` and ``max_workers``, starting
+from :ref:`workers <setting-workers>`.
+
+Workers report their load in the ``load`` entry of the information sent
+to the monitor with the ``notify`` command:
+
+* ``connections`` the number of connections open with the servers of the
+  worker
+* ``tasks`` the number of pending tasks in the worker event loop
+* ``lag`` the delay, in seconds, of the last notification callback of the
+  worker event loop
+
+The :ref:`autoscale_metric <setting-autoscale_metric>` entry, averaged
+over the workers, is compared with the
+:ref:`autoscale_target <setting-autoscale_target>` value per worker and
+the number of workers is changed in proportion, as long as the ratio is
+off by more than :data:`TOLERANCE` and no change happened during the
+last :ref:`autoscale_cooldown <setting-autoscale_cooldown>` seconds.
+Workers are stopped gracefully, youngest first.
+
+Applications whose workers are not interchangeable, for example because
+each worker holds part of the data, set their ``autoscale`` attribute to
+``False`` and keep :ref:`workers <setting-workers>` workers.
+'''
+from collections import deque
+from math import ceil
+
+
+# default load per worker of each metric
+TARGETS = {'connections': 50, 'tasks': 100, 'lag': 0.1}
+# relative deviation of the load from the target ignored
+TOLERANCE = 0.1
+# number of decisions kept in the monitor info
+HISTORY = 10
+
+
+class Autoscaler:
+    '''Number of workers of a monitor following the load of its workers
+
+    .. attribute:: workers
+
+        The number of workers the monitor should have
+
+    .. attribute:: decisions
+
+        The latest scaling decisions
+    '''
+    def __init__(self, cfg):
+        self.min_workers = max(cfg.min_workers, 1)
+        self.max_workers = max(cfg.max_workers, self.min_workers)
+        self.metric = cfg.autoscale_metric
+        self.target = cfg.autoscale_target or TARGETS[self.metric]
+        self.cooldown = cfg.autoscale_cooldown
+        self.workers = self._bound(cfg.workers)
+        self.last_scaled = None
+        self.decisions = deque(maxlen=HISTORY)
+
+    @classmethod
+    def create(cls, cfg, app=None):
+        '''The :class:`Autoscaler` of a monitor configuration, ``None``
+        if autoscaling is disabled, the monitor has no workers or the
+        ``autoscale`` attribute of its application ``app`` is ``False``
+        '''
+        if cfg.max_workers and cfg.workers and getattr(app, 'autoscale',
+                                                       True):
+            return cls(cfg)
+
+    def load(self, infos):
+        '''Average load of workers with information ``infos``, ``None``
+        when no worker reported its load
+        '''
+        values = [info['load'][self.metric] for info in infos
+                  if info and 'load' in info]
+        if values:
+            return sum(values) / len(values)
+
+    def scale(self, infos, now):
+        '''Update :attr:`workers` from the ``infos`` of the workers at
+        time ``now`` and return the decision, ``None`` if unchanged
+        '''
+        if self.last_scaled is not None:
+            if now - self.last_scaled < self.cooldown:
+                return
+        load = self.load(infos)
+        if load is None:
+            return
+        ratio = load / self.target
+        if abs(ratio - 1) <= TOLERANCE:
+            return
+        workers = self._bound(ceil(self.workers*ratio))
+        if workers == self.workers:
+            return
+        decision = {'time': now,
+                    'from': self.workers,
+                    'to': workers,
+                    'metric': self.metric,
+                    'load': load}
+        self.workers = workers
+        self.last_scaled = now
+        self.decisions.append(decision)
+        return decision
+
+    def info(self):
+        return {'workers': self.workers,
+                'min_workers': self.min_workers,
+                'max_workers': self.max_workers,
+                'metric': self.metric,
+                'target': self.target,
+                'cooldown': self.cooldown,
+                'decisions': list(self.decisions)}
+
+    def _bound(self, workers):
+        return min(max(workers, self.min_workers), self.max_workers)
@@ -1,11 +1,12 @@
 import logging
-from functools import reduce
+from collections import deque
 
 from pulsar.utils.internet import is_socket_closed
+from pulsar.utils.structures import Histogram
 
 import asyncio
 
-from .futures import AsyncObject
+from .futures import AsyncObject, ensure_future
 from .protocols import Producer
 
 
@@ -13,17 +14,33 @@ __all__ = ['Pool', 'PoolConnection', 'AbstractClient', 'AbstractUdpClient']
 
 
 logger = logging.getLogger('pulsar.pool')
+# seconds before opening connections in the background again after a
+# failure, doubled after each consecutive failure up to MAX_WARM_BACKOFF
+WARM_BACKOFF = 0.1
+MAX_WARM_BACKOFF = 30
 
 
 class Pool(AsyncObject):
     '''An asynchronous pool of open connections.
 
     Open connections are either :attr:`in_use` or :attr:`available`
-    to be used. Available connection are placed in an :class:`asyncio.Queue`.
+    to be used. Available connections are reused last in first out, so
+    that the most recently used connections are kept busy while the
+    others stay idle and are closed after ``idle_timeout`` seconds, down
+    to ``min_size`` connections. Connections older than ``max_lifetime``
+    seconds are closed rather than reused. When a connection is released
+    to the pool, it is handed over to the coroutine waiting the longest
+    for one. When the ``min_size`` connections cannot be opened, the pool
+    backs off exponentially before trying again in the background.
+
+    The time coroutines wait for a connection is counted, in
+    microseconds, in the :attr:`wait_time` histogram and reported, with
+    the other gauges of the pool, by :meth:`stats`.
 
     This class is not thread safe.
     '''
-    def __init__(self, creator, pool_size=10, loop=None, timeout=None, **kw):
+    def __init__(self, creator, pool_size=10, loop=None, timeout=None,
+                 min_size=0, idle_timeout=None, max_lifetime=None, **kw):
         '''
         Construct an asynchronous Pool.
 
@@ -37,15 +54,38 @@ class Pool(AsyncObject):
 
         :param timeout: The number of seconds to wait before giving up
           on returning a connection. Defaults to 30.
+
+        :param min_size: The number of connections opened in the
+          background, once the pool is used, and kept open when idle.
+
+        :param idle_timeout: The number of seconds after which idle
+          connections are closed, ``None`` to keep them open.
+
+        :param max_lifetime: The number of seconds after which connections
+          are closed rather than reused, ``None`` for no limit.
         '''
         self._creator = creator
         self._closed = False
         self._timeout = timeout
-        self._queue = asyncio.Queue(maxsize=pool_size, loop=loop)
-        self._connecting = 0
-        self._loop = self._queue._loop
+        self._pool_size = pool_size
+        self._min_size = min(min_size or 0, pool_size)
+        self._idle_timeout = idle_timeout
+        self._max_lifetime = max_lifetime
+        self._loop = loop or asyncio.get_event_loop()
         self._logger = logger
+        self._idle = deque()
+        self._created = {}
+        self._waiters = deque()
+        self._connecting = 0
+        self._warming = 0
         self._in_use_connections = set()
+        self._started = False
+        self._reaper = None
+        self._warm_failures = 0
+        self._warm_after = 0
+        self.wait_time = Histogram()
+        self.opened = 0
+        self.recycled = 0
 
     @property
     def pool_size(self):
@@ -55,7 +95,13 @@ class Pool(AsyncObject):
         is queued and a connection returned as soon as one becomes
         available.
         '''
-        return self._queue._maxsize
+        return self._pool_size
+
+    @property
+    def min_size(self):
+        '''The number of connections kept open
+        '''
+        return self._min_size
 
     @property
     def in_use(self):
@@ -70,7 +116,13 @@ class Pool(AsyncObject):
     def available(self):
         '''Number of available connections in the pool.
         '''
-        return reduce(self._count_connections, self._queue._queue, 0)
+        return len(self._idle)
+
+    @property
+    def waiters(self):
+        '''Number of coroutines waiting for a connection
+        '''
+        return len(self._waiters)
 
     @property
     def closed(self):
@@ -78,9 +130,15 @@ class Pool(AsyncObject):
         """
         return bool(self._closed)
 
+    def idle_connections(self):
+        '''List of :attr:`available` connections, from the least recently
+        used
+        '''
+        return [connection for connection, _ in self._idle]
+
     def __contains__(self, connection):
         if connection not in self._in_use_connections:
-            return connection in self._queue._queue
+            return any(c is connection for c, _ in self._idle)
         return True
 
     async def connect(self):
@@ -92,6 +150,8 @@ class Pool(AsyncObject):
         :return: a :class:`~asyncio.Future` resulting in the connection.
         '''
         assert not self.closed
+        if not self._started:
+            self._start()
         connection = await self._get()
         return PoolConnection(self, connection)
 
@@ -102,56 +162,44 @@ class Pool(AsyncObject):
         have closed
         '''
         if not self.closed:
+            if self._reaper:
+                self._reaper.cancel()
+                self._reaper = None
             waiters = []
-            queue = self._queue
-            while queue.qsize():
-                connection = queue.get_nowait()
-                if connection:
-                    waiters.append(connection.close())
+            idle, self._idle = self._idle, deque()
+            for connection, _ in idle:
+                waiters.append(connection.close())
             in_use = self._in_use_connections
             self._in_use_connections = set()
             for connection in in_use:
                 if connection:
                     waiters.append(connection.close())
+            self._created.clear()
+            while self._waiters:
+                self._waiters.popleft().cancel()
             self._closed = asyncio.gather(*waiters, loop=self._loop)
         return self._closed
 
-    async def _get(self):
-        queue = self._queue
-        # grab the connection without waiting, important!
-        if queue.qsize():
-            connection = queue.get_nowait()
-        # wait for one to be available
-        elif self.in_use + self._connecting >= queue._maxsize:
-            connection = await asyncio.wait_for(queue.get(), self._timeout,
-                                                loop=self._loop)
-        else:   # must create a new connection
-            self._connecting += 1
-            try:
-                connection = await self._creator()
-            finally:
-                self._connecting -= 1
-        # None signal that a connection was removed form the queue
-        # Go again
-        if connection is None:
-            connection = await self._get()
-        else:
-            if self.is_connection_closed(connection):
-                connection = await self._get()
-            else:
-                self._in_use_connections.add(connection)
-        return connection
+    def stats(self):
+        '''Gauges and counters of the pool
+        '''
+        wait = self.wait_time
+        return {'pool_size': self._pool_size,
+                'min_size': self._min_size,
+                'in_use': self.in_use,
+                'available': self.available,
+                'connecting': self._connecting,
+                'waiters': self.waiters,
+                'opened': self.opened,
+                'recycled': self.recycled,
+                'checkouts': wait.count,
+                'wait_time': dict((('p%s' % p, wait.percentile(p))
+                                   for p in (50, 90, 99, 100)))}
 
-    def _put(self, conn, discard=False):
-        if not self.closed:
-            try:
-                # None signal that a connection was removed form the queue
-                self._queue.put_nowait(None if discard else conn)
-            except asyncio.QueueFull:
-                # The queue of available connection is already full
-                if conn:
-                    conn.close()
-        self._in_use_connections.discard(conn)
+    def status(self, message=None, level=None):
+        return ('Pool size: %d  Connections in pool: %d '
+                'Current Checked out connections: %d' %
+                (self._pool_size, self.available, self.in_use))
 
     def is_connection_closed(self, connection):
         is_closing = getattr(connection.transport, 'is_closing', None)
@@ -168,13 +216,190 @@ class Pool(AsyncObject):
             return False
         return True
 
-    def status(self, message=None, level=None):
-        return ('Pool size: %d  Connections in pool: %d '
-                'Current Checked out connections: %d' %
-                (self._queue._maxsize, self.available, self.in_use))
+    # INTERNALS
+    async def _get(self):
+        connection = self._pop()
+        if connection is None:
+            loop = self._loop
+            start = loop.time()
+            while connection is None:
+                if (self._warming <= len(self._waiters) and
+                        len(self._created) + self._connecting <
+                        self._pool_size):
+                    connection = await self._create()
+                else:
+                    connection = await self._wait(start)
+                if connection is not None and self._stale(connection):
+                    self._recycle(connection)
+                    connection = None
+                connection = connection or self._pop()
+            wait = int(1000000*(loop.time() - start))
+        else:
+            wait = 0
+        self._in_use_connections.add(connection)
+        self.wait_time.add(wait)
+        return connection
+
+    def _pop(self):
+        # The most recently used connection, stale connections are closed
+        idle = self._idle
+        while idle:
+            connection, _ = idle.pop()
+            if not self._stale(connection):
+                return connection
+            self._recycle(connection)
+
+    async def _create(self, counted=False):
+        if not counted:
+            self._connecting += 1
+        try:
+            connection = await self._creator()
+        except Exception:
+            # let a waiting coroutine try again
+            self._wake()
+            raise
+        finally:
+            self._connecting -= 1
+        self._created[connection] = self._loop.time()
+        self._warm_failures = 0
+        self._warm_after = 0
+        self.opened += 1
+        return connection
+
+    async def _wait(self, start):
+        # Wait for a connection released to the pool or for None, the
+        # signal that a connection can be created
+        waiter = self._loop.create_future()
+        self._waiters.append(waiter)
+        handle = None
+        if self._timeout:
+            handle = self._loop.call_later(
+                max(self._timeout - self._loop.time() + start, 0),
+                self._wait_timeout, waiter)
+        try:
+            return await waiter
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            if (waiter.done() and not waiter.cancelled() and
+                    waiter.exception() is None):
+                # handed over while cancelled
+                if waiter.result():
+                    self._put(waiter.result())
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    # removed by close
+                    pass
+            raise
+        finally:
+            if handle:
+                handle.cancel()
+
+    def _wait_timeout(self, waiter):
+        if not waiter.done():
+            waiter.set_exception(asyncio.TimeoutError())
+
+    def _wake(self, connection=None):
+        # Hand over a connection, or None, to the first waiting coroutine
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(connection)
+                return True
+        return False
+
+    def _put(self, conn, discard=False):
+        self._in_use_connections.discard(conn)
+        if self.closed or conn is None:
+            return
+        if discard:
+            # the connection is detached from the pool
+            self._created.pop(conn, None)
+            self._wake()
+        elif self._max_lifetime and self._stale(conn):
+            self._recycle(conn)
+            self._wake()
+        elif self._wake(conn):
+            self._in_use_connections.add(conn)
+        else:
+            self._idle.append((conn, self._loop.time()))
+        if self._min_size:
+            self._prewarm()
+
+    def _stale(self, connection, now=None):
+        if self._max_lifetime:
+            now = now or self._loop.time()
+            created = self._created.get(connection, now)
+            if now - created >= self._max_lifetime:
+                return True
+        return self.is_connection_closed(connection)
+
+    def _recycle(self, connection):
+        self._created.pop(connection, None)
+        self.recycled += 1
+        connection.close()
+
+    def _start(self):
+        self._started = True
+        self._prewarm()
+        interval = min(t for t in (self._idle_timeout, self._max_lifetime,
+                                   float('inf')) if t)
+        if interval < float('inf'):
+            self._reaper = self._loop.call_later(interval/2, self._reap,
+                                                 interval/2)
+
+    def _prewarm(self):
+        if self._loop.time() < self._warm_after:
+            return
+        missing = self._min_size - len(self._created) - self._connecting
+        for _ in range(missing):
+            # waiting coroutines get the connection once opened
+            self._connecting += 1
+            self._warming += 1
+            ensure_future(self._warm(), loop=self._loop)
 
-    def _count_connections(self, x, y):
-        return x + int(y is not None)
+    async def _warm(self):
+        try:
+            connection = await self._create(True)
+        except Exception as exc:
+            now = self._loop.time()
+            if now >= self._warm_after:
+                # first failure of a round of background connections
+                delay = min(WARM_BACKOFF * 2 ** self._warm_failures,
+                            MAX_WARM_BACKOFF)
+                self._warm_failures += 1
+                self._warm_after = now + delay
+                self._logger.warning('Could not open a connection of %s: '
+                                     '%s. Backing off for %.1f seconds',
+                                     self, exc, delay)
+            return
+        finally:
+            self._warming -= 1
+        if not self.closed:
+            self._put(connection)
+        else:
+            # the pool was closed while the connection was opening
+            connection.close()
+
+    def _reap(self, interval):
+        # Close idle connections, from the least recently used
+        if self.closed:
+            return
+        now = self._loop.time()
+        idle_timeout = self._idle_timeout
+        keep = deque()
+        while self._idle:
+            connection, since = self._idle.popleft()
+            if self._stale(connection, now) or (
+                    idle_timeout and now - since >= idle_timeout and
+                    len(self._created) > self._min_size):
+                self._recycle(connection)
+            else:
+                keep.append((connection, since))
+        self._idle = keep
+        self._prewarm()
+        self._reaper = self._loop.call_later(interval, self._reap, interval)
 
 
 class PoolConnection:
@@ -268,6 +493,10 @@ class AbstractClient(Producer, ClientMixin):
             _, protocol = await self._loop.create_connection(
                 protocol_factory, host, port, **kw)
             await protocol.event('connection_made')
+        elif isinstance(address, str):
+            _, protocol = await self._loop.create_unix_connection(
+                protocol_factory, address, **kw)
+            await protocol.event('connection_made')
         else:
             raise NotImplementedError('Could not connect to %s' %
                                       str(address))
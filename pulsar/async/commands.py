@@ -78,6 +78,34 @@ def notify(request, info):
     return t
 
 
+@command()
+async def peer_address(request, aid):
+    '''Address of the peer mailbox of actor ``aid``.
+
+    This command is sent to the arbiter by actors before sending messages
+    directly to ``aid``. Return ``None`` if ``aid`` is not a running actor
+    managed by the arbiter or a monitor, in which case messages are routed
+    by the arbiter.
+    '''
+    arbiter = request.actor
+    if not arbiter.is_arbiter():
+        return
+    proxy = arbiter.get_actor(aid)
+    if not isinstance(proxy, ActorProxyMonitor) or not proxy.mailbox:
+        return
+    if proxy.peer_address is None:
+        proxy.peer_address = await arbiter.send(proxy, 'peer_listen')
+    return proxy.peer_address
+
+
+@command()
+async def peer_listen(request):
+    '''Start the peer mailbox of the actor and return its address.'''
+    listen = getattr(request.actor.mailbox, 'listen', None)
+    if listen:
+        return await listen()
+
+
 @command()
 def spawn(request, **kwargs):
     '''Spawn a new actor.'''
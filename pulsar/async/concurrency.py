@@ -20,6 +20,8 @@ from .threads import Thread
 from .mailbox import MailboxClient, MailboxProtocol, ProxyMailbox, create_aid
 from .futures import ensure_future, add_errback, chain_future, create_future
 from .protocols import TcpServer
+from .shared import SharedMemory, shared_directory
+from .autoscale import Autoscaler
 from .actor import Actor
 from .consts import (ACTOR_STATES, ACTOR_TIMEOUT_TOLE, MIN_NOTIFY, MAX_NOTIFY,
                      MONITOR_TASK_PERIOD)
@@ -66,6 +68,9 @@ class Concurrency:
     managed_actors = None
     registered = None
     actor_class = Actor
+    # delay of the last periodic task, a measure of the event loop load
+    lag = 0
+    notify_due = None
 
     @classmethod
     def make(cls, kind, cfg, name, aid, **kw):
@@ -186,6 +191,9 @@ class Concurrency:
         back with the acknowledgement from the monitor.
         '''
         actor.next_periodic_task = None
+        loop = actor._loop
+        if self.notify_due is not None:
+            self.lag = max(loop.time() - self.notify_due, 0)
         ack = None
         if actor.is_running():
             if actor.cfg.debug:
@@ -197,8 +205,10 @@ class Concurrency:
             next = max(ACTOR_TIMEOUT_TOLE*actor.cfg.timeout, MIN_NOTIFY)
         else:
             next = 0
-        actor.next_periodic_task = actor._loop.call_later(
-            min(next, MAX_NOTIFY), self.periodic_task, actor)
+        next = min(next, MAX_NOTIFY)
+        self.notify_due = loop.time() + next
+        actor.next_periodic_task = loop.call_later(next, self.periodic_task,
+                                                   actor)
         return ack
 
     def stop(self, actor, exc=None, exit_code=None):
@@ -251,6 +261,10 @@ class Concurrency:
             self._remove_signals(actor)
             return True
         #
+        directory = shared_directory(actor.cfg.exc_id)
+        if directory:
+            # shared memory sent to the actor and not received
+            SharedMemory(directory, 0).remove(actor.aid)
         if actor._loop.is_running():
             actor.logger.debug('Closing mailbox')
             actor.mailbox.close()
@@ -278,14 +292,20 @@ class Concurrency:
 
 
 class MonitorMixin:
+    autoscaler = None
 
     def identity(self, actor):
         return actor.name
 
     def create_actor(self):
         self.managed_actors = {}
+        app = self.params.get('app')
+        self.autoscaler = Autoscaler.create(self.cfg, app)
         actor = self.actor_class(self)
         actor.bind_event('on_info', self._info_monitor)
+        if self.cfg.max_workers and not getattr(app, 'autoscale', True):
+            actor.logger.warning('%s does not support autoscaling, '
+                                 'max_workers is ignored', app)
         return actor
 
     def start(self):
@@ -375,26 +395,47 @@ class MonitorMixin:
                 actor.stop()
         return 1
 
+    def workers(self, monitor):
+        '''The number of workers the monitor should have
+        '''
+        if self.autoscaler:
+            return self.autoscaler.workers
+        return monitor.cfg.workers
+
+    def autoscale(self, monitor):
+        '''Change the number of workers following their load when
+        autoscaling.
+        '''
+        if self.autoscaler:
+            infos = [worker.info for worker in self.managed_actors.values()
+                     if not worker.stopping_start]
+            decision = self.autoscaler.scale(infos, time())
+            if decision:
+                monitor.logger.info('Scaling from %d to %d workers, %s %s '
+                                    'per worker', decision['from'],
+                                    decision['to'], decision['metric'],
+                                    round(decision['load'], 3))
+
     def spawn_actors(self, monitor):
         '''Spawn new actors if needed.
         '''
-        to_spawn = monitor.cfg.workers - len(self.managed_actors)
-        if monitor.cfg.workers and to_spawn > 0:
+        workers = self.workers(monitor)
+        to_spawn = workers - len(self.managed_actors)
+        if workers and to_spawn > 0:
             for _ in range(to_spawn):
                 monitor.spawn()
 
     def stop_actors(self, monitor):
-        """Maintain the number of workers by spawning or killing as required
+        """Maintain the number of workers by stopping the youngest workers
+        as required
         """
-        if monitor.cfg.workers:
-            num_to_kill = len(self.managed_actors) - monitor.cfg.workers
-            for i in range(num_to_kill, 0, -1):
-                w, kage = 0, sys.maxsize
-                for worker in self.managed_actors.values():
-                    age = worker.impl.age
-                    if age < kage:
-                        w, kage = w, age
-                self.manage_actor(monitor, w, True)
+        workers = self.workers(monitor)
+        if workers:
+            running = [worker for worker in self.managed_actors.values()
+                       if not worker.stopping_start]
+            running.sort(key=lambda worker: worker.impl.age)
+            for worker in running[workers:]:
+                self.manage_actor(monitor, worker, True)
 
     def _close_actors(self, monitor):
         #
@@ -428,6 +469,8 @@ class MonitorMixin:
                                   'workers': len(self.managed_actors)})
             info['workers'] = [a.info for a in self.managed_actors.values()
                                if a.info]
+            if self.autoscaler:
+                info['autoscale'] = self.autoscaler.info()
         return info
 
     def _register(self, arbiter):
@@ -469,6 +512,7 @@ class MonitorConcurrency(MonitorMixin, Concurrency):
             self.manage_actors(monitor)
             #
             if monitor.is_running():
+                self.autoscale(monitor)
                 self.spawn_actors(monitor)
                 self.stop_actors(monitor)
             elif monitor.cfg.debug:
@@ -516,6 +560,10 @@ class ArbiterConcurrency(MonitorMixin, ProcessMixin, Concurrency):
                 cfg.set('pid_file', 'pulsar.pid')
             system.daemonize(keep_fds=logger_fds())
         self.aid = self.name
+        # actors can enable shared memory even if the arbiter does not
+        directory = shared_directory(cfg.exc_id)
+        self.shared_memory = directory and SharedMemory(
+            directory, cfg.shared_memory_threshold)
         actor = super().create_actor()
         self.monitors = OrderedDict()
         self.registered = {self.identity(actor): actor}
@@ -640,6 +688,9 @@ class ArbiterConcurrency(MonitorMixin, ProcessMixin, Concurrency):
         b = self.registered.pop(self.identity(actor), None)
         c = self.monitors.pop(self.identity(actor), None)
         removed = a or b or c
+        # shared memory the actor did not receive
+        if self.shared_memory:
+            self.shared_memory.remove(actor.aid)
         if removed and log:
             arbiter.logger.warning('Removed %s', actor)
         return removed
@@ -647,6 +698,8 @@ class ArbiterConcurrency(MonitorMixin, ProcessMixin, Concurrency):
     def _stop_arbiter(self, actor):     # pragma    nocover
         actor.stop_coverage()
         self._remove_signals(actor)
+        if self.shared_memory:
+            self.shared_memory.clear()
         p = self.pid_file
         if p is not None:
             actor.logger.debug('Removing %s' % p.fname)
@@ -25,8 +25,23 @@ The implementation details are outlined below:
   as a proxy server by routing the message to the targeted actor.
 * Communication is bidirectional and there is **only one connection** between
   the arbiter and any given actor.
-* Messages are encoded and decoded using the unmasked websocket protocol
-  implemented in :func:`.frame_parser`.
+* Unless the :ref:`mailbox_peers <setting-mailbox_peers>` setting is off,
+  the first message from an actor to another actor asks the arbiter for
+  the address of the peer mailbox of the target, a socket the target
+  starts listening on when the arbiter asks for it (a unix domain socket
+  when available). The message and the following ones are then sent
+  directly to the target, bypassing the arbiter. Messages are routed by
+  the arbiter when the target has no peer mailbox, for example when it is
+  the arbiter or a monitor.
+* Messages are tuples with a fixed layout, encoded by a :class:`.MessageCodec`
+  and preceded by their length as a four bytes unsigned integer. The codec
+  is selected by the :ref:`mailbox_codec <setting-mailbox_codec>` setting,
+  ``pickle`` with the highest protocol by default.
+* Large buffers are not encoded in messages but transferred via
+  :mod:`shared memory <pulsar.async.shared>`.
+* Messages, and their callbacks, sent to a connection during the same
+  iteration of the event loop are written together, in one write to the
+  socket, at the next iteration. The receiver splits them by length.
 * If, for some reasons, the connection between an actor and the arbiter
   get broken, the actor will eventually stop running and garbaged collected.
 
@@ -49,24 +64,49 @@ Client
   :members:
   :member-order: bysource
 
+Codec
+~~~~~~~~~~~~
+
+.. autoclass:: MessageCodec
+  :members:
+  :member-order: bysource
+
 '''
+import os
 import socket
+import struct
 import pickle
+import marshal
+import tempfile
+from itertools import count
+from functools import partial
 from collections import namedtuple
 
-from pulsar import ProtocolError, CommandError
+try:
+    import msgpack
+except ImportError:     # pragma    nocover
+    msgpack = None
+
+from pulsar import ProtocolError, CommandError, ImproperlyConfigured
 from pulsar.utils.internet import nice_address
-from pulsar.utils.websocket import frame_parser
 from pulsar.utils.string import gen_unique_id
 
 from .access import get_actor, isawaitable, create_future, ensure_future
 from .futures import task
 from .proxy import actor_identity, get_proxy, get_command, ActorProxy
-from .protocols import Protocol
+from .protocols import Protocol, TcpServer
 from .clients import AbstractClient
+from .shared import SharedMemory, shared_loads
 
 
 CommandRequest = namedtuple('CommandRequest', 'actor caller connection')
+# targets always reached via the arbiter
+ROUTED = frozenset(('arbiter', 'monitor'))
+# first byte of a frame body, the codec of the message
+PICKLE, MARSHAL, MSGPACK, SHARED = b'\x00', b'\x01', b'\x02', b'\x03'
+_acks = count(1)
+# length of a message
+HEADER = struct.Struct('!I')
 
 
 def create_aid():
@@ -112,49 +152,135 @@ class ProxyMailbox:
         pass
 
 
+class MessageCodec:
+    '''Encode and decode messages for the wire.
+
+    Messages are encoded with the ``name`` codec, one of ``pickle``,
+    ``marshal`` and ``msgpack``, and with pickle when the codec cannot
+    serialise them, for example when they contain an :class:`.ActorProxy`
+    or a function to run. The first byte of an encoded message is the
+    codec used, therefore actors with different codecs can communicate.
+    Note that ``msgpack`` decodes tuples as lists.
+
+    Messages with large buffers are pickled with the ``shared``
+    :class:`.SharedMemory`, if given.
+    '''
+    def __init__(self, name='pickle', shared=None):
+        if name == 'pickle':
+            self._tag, self._dumps = None, None
+        elif name == 'marshal':
+            self._tag, self._dumps = MARSHAL, marshal.dumps
+        elif name == 'msgpack':
+            if msgpack is None:
+                raise ImproperlyConfigured('msgpack codec requires msgpack')
+            self._tag = MSGPACK
+            self._dumps = partial(msgpack.packb, use_bin_type=True)
+        else:
+            raise ImproperlyConfigured('Unknown mailbox codec "%s"' % name)
+        self.name = name
+        self.shared = shared
+
+    def __repr__(self):
+        return self.name
+    __str__ = __repr__
+
+    def encode(self, message, target=None):
+        shared = self.shared
+        if shared is not None and target:
+            values = ((message[2],) if message[0] == 'callback' else
+                      tuple(message[3]) + tuple(message[4].values()))
+            if shared.large(values):
+                return SHARED + shared.dumps(message, target)
+        if self._tag:
+            try:
+                return self._tag + self._dumps(message)
+            except (TypeError, ValueError):
+                pass
+        return PICKLE + pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, body):
+        tag = body[:1]
+        body = memoryview(body)[1:]
+        if tag == PICKLE:
+            return pickle.loads(body)
+        elif tag == MARSHAL:
+            return marshal.loads(body)
+        elif tag == MSGPACK and msgpack:
+            return msgpack.unpackb(body, raw=False)
+        elif tag == SHARED:
+            return shared_loads(body)
+        raise ValueError('unknown codec %r' % tag)
+
+
 class Message:
     '''A message which travels from actor to actor.
+
+    The :attr:`data` of a command is the tuple ``(command, sender, target,
+    args, kwargs, ack)``, the one of a callback ``('callback', ack,
+    result)``. The :attr:`target` is the id of the receiving actor.
     '''
-    def __init__(self, data, waiter=None):
+    def __init__(self, data, ack=None, waiter=None, target=None):
         self.data = data
+        self.ack = ack
         self.waiter = waiter
+        self.target = target
 
     def __repr__(self):
-        return self.data.get('command', 'unknown')
+        return self.data[0]
     __str__ = __repr__
 
     @classmethod
     def command(cls, command, sender, target, args, kwargs):
         command = get_command(command)
-        data = {'command': command.__name__,
-                'sender': actor_identity(sender),
-                'target': actor_identity(target),
-                'args': args if args is not None else (),
-                'kwargs': kwargs if kwargs is not None else {}}
         waiter = create_future()
         if command.ack:
-            data['ack'] = create_aid()
+            ack = next(_acks)
         else:
+            ack = None
             waiter.set_result(None)
-        return cls(data, waiter)
+        target = actor_identity(target)
+        data = (command.__name__,
+                actor_identity(sender),
+                target,
+                args if args is not None else (),
+                kwargs if kwargs is not None else {},
+                ack)
+        return cls(data, ack, waiter, target)
 
     @classmethod
-    def callback(cls, result, ack):
-        data = {'command': 'callback', 'result': result, 'ack': ack}
-        return cls(data)
+    def callback(cls, result, ack, target=None):
+        return cls(('callback', ack, result), target=target)
 
 
 class MailboxProtocol(Protocol):
     '''The :class:`.Protocol` for internal message passing between actors.
 
-    Encoding and decoding uses the unmasked websocket protocol.
+    Messages are encoded with the :class:`.MessageCodec` of the actor and
+    preceded by their length. Callbacks and commands returning
+    a result straight away are processed as soon as they are received,
+    others are processed in a task.
+
+    Messages written during an iteration of the event loop are batched
+    and sent with a single write at the next iteration.
+
+    .. attribute:: peer
+
+        ``True`` for a direct connection between two actors, whose loss
+        fails the pending requests rather than stopping the actor
     '''
-    def __init__(self, **kw):
+    def __init__(self, peer=False, **kw):
         super().__init__(**kw)
+        self.peer = peer
         self._pending_responses = {}
-        self._parser = frame_parser(kind=2, pyparser=True)
+        self._buffer = bytearray()
+        self._batch = None
+        self._batch_acks = None
         actor = get_actor()
-        if actor.is_arbiter():
+        self._codec = MessageCodec(actor.cfg.mailbox_codec,
+                                   SharedMemory.create(actor.cfg))
+        if peer:
+            self.bind_event('connection_lost', self._peer_lost)
+        elif actor.is_arbiter():
             self.bind_event('connection_lost', self._connection_lost)
 
     def request(self, command, sender, target, args, kwargs):
@@ -165,23 +291,33 @@ class MailboxProtocol(Protocol):
 
     def data_received(self, data):
         # Feed data into the parser
-        msg = self._parser.decode(data)
-        while msg:
+        buffer = self._buffer
+        buffer.extend(data)
+        size = HEADER.size
+        start = 0
+        while len(buffer) - start >= size:
+            end = start + size + HEADER.unpack_from(buffer, start)[0]
+            if len(buffer) < end:
+                break
+            body = buffer[start + size:end]
+            start = end
             try:
-                message = pickle.loads(msg.body)
+                message = self._codec.decode(body)
             except Exception as e:
+                del buffer[:start]
                 raise ProtocolError('Could not decode message body: %s' % e)
-            ensure_future(self._on_message(message), loop=self._loop)
-            msg = self._parser.decode()
+            self._on_message(message)
+        del buffer[:start]
 
     ########################################################################
     #    INTERNALS
     def _start(self, req):
-        if req.waiter and 'ack' in req.data:
-            self._pending_responses[req.data['ack']] = req.waiter
+        if req.waiter and req.ack:
+            self._pending_responses[req.ack] = req.waiter
             try:
                 self._write(req)
             except Exception as exc:
+                self._pending_responses.pop(req.ack, None)
                 req.waiter.set_exception(exc)
         else:
             self._write(req)
@@ -192,56 +328,89 @@ class MailboxProtocol(Protocol):
             if actor.is_running():
                 actor.logger.warning('Connection lost with actor')
 
-    async def _on_message(self, message):
-        actor = get_actor()
-        command = message.get('command')
-        ack = message.get('ack')
+    def _peer_lost(self, _, exc=None):
+        pending, self._pending_responses = self._pending_responses, {}
+        for waiter in pending.values():
+            if not waiter.done():
+                waiter.set_exception(
+                    ConnectionResetError('Connection lost with peer actor'))
+
+    def _on_message(self, message):
+        command = message[0]
         if command == 'callback':
-            if not ack:
-                raise ProtocolError('A callback without id')
-            try:
-                pending = self._pending_responses.pop(ack)
-            except KeyError:
-                raise KeyError('Callback %s not in pending callbacks' % ack)
-            pending.set_result(message.get('result'))
+            _, ack, result = message
+            pending = self._pending_responses.pop(ack, None)
+            if pending is None:
+                self.logger.warning('Callback %s not in pending callbacks',
+                                    ack)
+            elif not pending.done():
+                pending.set_result(result)
+            return
+        _, sender, target, args, kwargs, ack = message
+        actor = get_actor()
+        try:
+            target = actor.get_actor(target)
+            if target is None:
+                raise CommandError('cannot execute "%s", unknown actor '
+                                   '"%s"' % (command, message[2]))
+            # Get the caller proxy without throwing
+            caller = get_proxy(actor.get_actor(sender), safe=True)
+            if isinstance(target, ActorProxy):
+                # route the message to the actor proxy
+                if caller is None:
+                    raise CommandError("'%s' got message from unknown '%s'"
+                                       % (actor, sender))
+                result = actor.send(target, command, *args, **kwargs)
+            else:
+                request = CommandRequest(target, caller, self)
+                result = get_command(command)(request, args, kwargs)
+        except Exception as exc:
+            result = self._command_error(exc)
+        if isawaitable(result):
+            ensure_future(self._respond(result, ack, sender), loop=self._loop)
+        elif ack:
+            self._start(Message.callback(result, ack, sender))
+
+    async def _respond(self, result, ack, sender):
+        try:
+            result = await result
+        except Exception as exc:
+            result = self._command_error(exc)
+        if ack:
+            self._start(Message.callback(result, ack, sender))
+
+    def _command_error(self, exc):
+        if isinstance(exc, CommandError):
+            self.logger.warning('Command error: %s' % exc)
         else:
-            try:
-                target = actor.get_actor(message['target'])
-                if target is None:
-                    raise CommandError('cannot execute "%s", unknown actor '
-                                       '"%s"' % (command, message['target']))
-                # Get the caller proxy without throwing
-                caller = get_proxy(actor.get_actor(message['sender']),
-                                   safe=True)
-                if isinstance(target, ActorProxy):
-                    # route the message to the actor proxy
-                    if caller is None:
-                        raise CommandError(
-                            "'%s' got message from unknown '%s'"
-                            % (actor, message['sender']))
-                    result = await actor.send(target, command,
-                                              *message['args'],
-                                              **message['kwargs'])
-                else:
-                    result = await command_in_context(command, caller, target,
-                                                      message['args'],
-                                                      message['kwargs'],
-                                                      self)
-            except CommandError as exc:
-                self.logger.warning('Command error: %s' % exc)
-                result = None
-            except Exception as exc:
-                self.logger.exception('Unhandled exception')
-                result = None
-            if ack:
-                self._start(Message.callback(result, ack))
+            self.logger.exception('Unhandled exception')
 
     def _write(self, req):
-        obj = pickle.dumps(req.data, protocol=2)
-        data = self._parser.encode(obj, opcode=2)
+        obj = self._codec.encode(req.data, req.target)
+        if self._batch is None:
+            self._batch = []
+            self._batch_acks = []
+            self._loop.call_soon(self._flush)
+        self._batch.append(HEADER.pack(len(obj)))
+        self._batch.append(obj)
+        if req.waiter and req.ack:
+            self._batch_acks.append(req.ack)
+
+    def _flush(self):
+        batch, self._batch = self._batch, None
+        acks, self._batch_acks = self._batch_acks, None
         try:
-            self._transport.write(data)
-        except (socket.error, RuntimeError):
+            self._transport.write(b''.join(batch))
+        except (socket.error, RuntimeError) as exc:
+            # the requests of the batch were not sent
+            for ack in acks:
+                waiter = self._pending_responses.pop(ack, None)
+                if waiter and not waiter.done():
+                    waiter.set_exception(exc)
+            if self.peer:
+                # fails the pending responses
+                self._transport.close()
+                return
             actor = get_actor()
             if actor.is_running() and not actor.is_arbiter():
                 actor.logger.warning('Lost connection with arbiter')
@@ -249,7 +418,8 @@ class MailboxProtocol(Protocol):
 
 
 class MailboxClient(AbstractClient):
-    '''Used by actors to send messages to other actors via the arbiter.
+    '''Used by actors to send messages to other actors via the arbiter,
+    or directly via their peer mailboxes.
     '''
     protocol_factory = MailboxProtocol
 
@@ -257,7 +427,16 @@ class MailboxClient(AbstractClient):
         super().__init__(loop)
         self.address = address
         self.name = 'Mailbox for %s' % actor
+        self._aid = actor.aid
         self._connection = None
+        self._use_peers = actor.cfg.mailbox_peers
+        self._routed = set(ROUTED)
+        if actor.monitor:
+            self._routed.add(actor.monitor.aid)
+        self._peers = {}
+        self._peer_server = None
+        self._peer_path = None
+        self._listening = None
 
     def connect(self):
         return self.create_connection(self.address)
@@ -265,18 +444,57 @@ class MailboxClient(AbstractClient):
     def __repr__(self):
         return '%s %s' % (self.name, nice_address(self.address))
 
+    @property
+    def peers(self):
+        '''List of ids of actors receiving messages directly
+        '''
+        return [aid for aid, peer in self._peers.items()
+                if peer.done() and not peer.cancelled() and peer.result()]
+
+    @property
+    def peer_address(self):
+        '''Address of the peer mailbox, ``None`` when not listening
+        '''
+        if self._peer_server:
+            return self._peer_server.address
+
     @task
     async def request(self, command, sender, target, args, kwargs):
         # the request method
-        if self._connection is None:
-            self._connection = await self.connect()
-            self._connection.bind_event('connection_lost', self._lost)
+        connection = None
+        if self._use_peers:
+            connection = await self._peer(actor_identity(target))
+        if connection is None:
+            connection = await self._arbiter()
         req = Message.command(command, sender, target, args, kwargs)
-        self._connection._start(req)
+        connection._start(req)
         response = await req.waiter
         return response
 
+    async def listen(self):
+        '''Start the peer mailbox, if not already started, and return
+        its address
+
+        The peer mailbox listens on a unix domain socket when available,
+        on a local TCP socket otherwise.
+        '''
+        if self._listening is None:
+            self._listening = ensure_future(self._listen(), loop=self._loop)
+        return await self._listening
+
     def close(self):
+        for peer in self._peers.values():
+            if peer.done() and not peer.cancelled() and peer.result():
+                peer.result().close()
+        self._peers.clear()
+        if self._peer_server:
+            ensure_future(self._peer_server.close(), loop=self._loop)
+            self._peer_server = None
+            if self._peer_path:
+                try:
+                    os.unlink(self._peer_path)
+                except OSError:     # pragma    nocover
+                    pass
         if self._connection:
             self._connection.close()
 
@@ -287,3 +505,67 @@ class MailboxClient(AbstractClient):
         # When the connection is lost, stop the event loop
         if self._loop.is_running():
             self._loop.stop()
+
+    # INTERNALS
+    async def _arbiter(self):
+        # The connection with the arbiter
+        if self._connection is None:
+            self._connection = await self.connect()
+            self._connection.bind_event('connection_lost', self._lost)
+        return self._connection
+
+    async def _peer(self, aid):
+        # The direct connection with actor aid, None when messages are
+        # routed by the arbiter
+        if not isinstance(aid, str) or aid in self._routed:
+            return
+        peer = self._peers.get(aid)
+        if peer is None:
+            peer = ensure_future(self._connect_peer(aid), loop=self._loop)
+            self._peers[aid] = peer
+        return await peer
+
+    async def _connect_peer(self, aid):
+        try:
+            connection = await self._arbiter()
+            req = Message.command('peer_address', self._aid, 'arbiter',
+                                  (aid,), None)
+            connection._start(req)
+            address = await req.waiter
+            if address is None:
+                return
+            connection = await self.create_connection(
+                address, protocol_factory=partial(self.create_protocol,
+                                                  peer=True))
+        except Exception:
+            # try again with the next message
+            self._peers.pop(aid, None)
+            self.logger.exception('Could not connect with peer %s', aid)
+            return
+        connection.bind_event('connection_lost',
+                              partial(self._peer_lost, aid))
+        return connection
+
+    def _peer_lost(self, aid, connection, exc=None):
+        peer = self._peers.get(aid)
+        if peer and peer.done() and peer.result() is connection:
+            self._peers.pop(aid)
+
+    async def _listen(self):
+        factory = partial(MailboxProtocol, peer=True)
+        name = 'peer mailbox'
+        if hasattr(socket, 'AF_UNIX'):
+            path = os.path.join(tempfile.gettempdir(),
+                                'pulsar-%s-%s.sock' % (os.getpid(), self._aid))
+            if os.path.exists(path):
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(path)
+            self._peer_path = path
+            server = TcpServer(factory, self._loop, sockets=[sock], name=name)
+        else:   # pragma    nocover
+            server = TcpServer(factory, self._loop, ('127.0.0.1', 0),
+                               name=name)
+        await server.start_serving()
+        self._peer_server = server
+        return server.address
@@ -615,6 +615,12 @@ class TcpServer(Producer):
             return self.__class__.__name__
     __str_ = __repr__
 
+    @property
+    def connections(self):
+        """Number of connections currently open.
+        """
+        return len(self._concurrent_connections)
+
     @property
     def address(self):
         """Socket address of this server.
@@ -151,6 +151,12 @@ class ActorProxyMonitor(ActorProxy):
         has completed. The :attr:`mailbox` is a server-side
         :class:`.MailboxProtocol` instance and it is used
         by the :func:`.send` function to send messages to the remote actor.
+
+    .. attribute:: peer_address
+
+        Address of the peer mailbox of the remote actor, used by other
+        actors to send messages to it directly. Available once the
+        first actor asked for it.
     '''
     monitor = None
 
@@ -158,6 +164,7 @@ class ActorProxyMonitor(ActorProxy):
         self.impl = impl
         self.info = {}
         self.mailbox = None
+        self.peer_address = None
         self.callback = None
         self.spawning_start = None
         self.stopping_start = None
@@ -0,0 +1,191 @@
+'''Transfer of large message payloads via shared memory.
+
+Buffers larger than the :ref:`shared_memory_threshold
+<setting-shared_memory_threshold>` setting (``bytes``, ``bytearray``,
+``memoryview`` and numpy arrays) passed as arguments of a command, or
+returned by it, are not encoded in the message. They are written in a
+file of the memory backed ``/dev/shm`` directory and the message carries
+the file name only. Without ``/dev/shm`` buffers are sent in messages.
+The setting is 0, and shared memory transfer disabled, by default.
+
+The receiving actor maps the file and removes it straight away, the
+memory is then released by the operating system once the objects using
+the mapping are garbage collected. Memory views and numpy arrays are
+received without copying the mapped memory.
+
+Files are named after the receiving actor. Those never received are
+removed by the actor when it stops and, if it died, by the arbiter.
+'''
+import os
+import sys
+import mmap
+import pickle
+import shutil
+from io import BytesIO
+from uuid import uuid4
+
+
+BUFFER_TYPES = (bytes, bytearray, memoryview)
+
+
+def shared_directory(name):
+    '''Directory of the shared memory files of the actors of an arbiter,
+    ``None`` when ``/dev/shm`` is not available
+    '''
+    base = '/dev/shm'
+    if os.path.isdir(base) and os.access(base, os.W_OK):
+        return os.path.join(base, 'pulsar-%s' % name)
+
+
+def shared_loads(body):
+    '''Decode a message encoded with :meth:`SharedMemory.dumps`
+    '''
+    return _Unpickler(BytesIO(body)).load()
+
+
+class SharedMemory:
+    '''Write buffers larger than ``threshold`` bytes in files of
+    ``directory``
+
+    .. attribute:: written
+
+        Number of buffers written in shared memory
+    '''
+    def __init__(self, directory, threshold):
+        self.directory = directory
+        self.threshold = threshold
+        self.written = 0
+
+    @classmethod
+    def create(cls, cfg):
+        '''The :class:`SharedMemory` of an actor configuration, ``None``
+        if shared memory transfer is disabled
+        '''
+        directory = shared_directory(cfg.exc_id)
+        if directory and cfg.shared_memory_threshold:
+            return cls(directory, cfg.shared_memory_threshold)
+
+    def __repr__(self):
+        return self.directory
+    __str__ = __repr__
+
+    def large(self, values):
+        '''``True`` if ``values``, or the items of lists and tuples in it,
+        contain a buffer larger than the threshold
+        '''
+        for value in values:
+            if isinstance(value, (list, tuple)):
+                if self.large(value):
+                    return True
+            elif self._size(value) >= self.threshold:
+                return True
+        return False
+
+    def dumps(self, obj, target):
+        '''Pickle ``obj`` writing its large buffers in files for the
+        ``target`` actor
+        '''
+        file = BytesIO()
+        _Pickler(file, self, target).dump(obj)
+        return file.getvalue()
+
+    def write(self, target, buffer):
+        '''Write ``buffer`` in a file for ``target`` and return its path
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory,
+                            '%s.%s' % (target, uuid4().hex))
+        try:
+            with open(path, 'wb') as file:
+                file.write(buffer)
+        except OSError:
+            if os.path.exists(path):
+                os.unlink(path)
+            raise
+        self.written += 1
+        return path
+
+    def remove(self, target):
+        '''Remove files not yet received by ``target``
+        '''
+        prefix = '%s.' % target
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.startswith(prefix):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:   # pragma    nocover
+                    pass
+
+    def clear(self):
+        '''Remove the directory and all its files
+        '''
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _size(self, value):
+        if isinstance(value, memoryview):
+            return value.nbytes
+        elif isinstance(value, (bytes, bytearray)):
+            return len(value)
+        ndarray = _ndarray()
+        if ndarray and isinstance(value, ndarray):
+            return 0 if value.dtype.hasobject else value.nbytes
+        return 0
+
+
+class _Pickler(pickle.Pickler):
+
+    def __init__(self, file, shared, target):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.shared = shared
+        self.target = target
+
+    def persistent_id(self, obj):
+        shared = self.shared
+        size = shared._size(obj)
+        if size < shared.threshold:
+            return
+        if isinstance(obj, BUFFER_TYPES):
+            kind, extra = type(obj).__name__, None
+            if isinstance(obj, memoryview):
+                obj = obj.cast('B') if obj.c_contiguous else obj.tobytes()
+        else:
+            import numpy
+            kind, extra = 'ndarray', (obj.dtype.str, obj.shape)
+            obj = memoryview(numpy.ascontiguousarray(obj)).cast('B')
+        try:
+            path = shared.write(self.target, obj)
+        except OSError:
+            # not enough shared memory, pickle the buffer
+            return
+        return kind, path, size, extra
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        kind, path, size, extra = pid
+        with open(path, 'r+b') as file:
+            buffer = mmap.mmap(file.fileno(), size)
+        os.unlink(path)
+        if kind == 'memoryview':
+            return memoryview(buffer)
+        elif kind == 'ndarray':
+            import numpy
+            dtype, shape = extra
+            return numpy.frombuffer(buffer, dtype=dtype).reshape(shape)
+        elif kind == 'bytearray':
+            value = bytearray(buffer)
+        else:
+            value = buffer[:]
+        buffer.close()
+        return value
+
+
+def _ndarray():
+    # numpy arrays can only be sent by actors which imported numpy
+    numpy = sys.modules.get('numpy')
+    return getattr(numpy, 'ndarray', None)
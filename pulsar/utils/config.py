@@ -1054,6 +1054,125 @@ class Timeout(Setting):
         killed and restarted."""
 
 
+class MaxWorkers(Setting):
+    name = "max_workers"
+    section = "Worker Processes"
+    flags = ["--max-workers"]
+    validator = validate_pos_int
+    type = int
+    default = 0
+    desc = """\
+        The maximum number of workers when autoscaling.
+
+        Any value greater than zero enables autoscaling: the number of
+        workers, starting from ``workers``, is changed between
+        ``min_workers`` and this value following the load of the workers.
+        """
+
+
+class MinWorkers(Setting):
+    name = "min_workers"
+    section = "Worker Processes"
+    flags = ["--min-workers"]
+    validator = validate_pos_int
+    type = int
+    default = 1
+    desc = """\
+        The minimum number of workers when autoscaling."""
+
+
+class AutoscaleMetric(Setting):
+    name = "autoscale_metric"
+    section = "Worker Processes"
+    choices = ('connections', 'tasks', 'lag')
+    flags = ["--autoscale-metric"]
+    default = "connections"
+    desc = """\
+        The load of workers followed when autoscaling.
+
+        ``connections`` is the number of open client connections,
+        ``tasks`` the number of pending tasks and ``lag`` the delay, in
+        seconds, of the event loop of a worker.
+        """
+
+
+class AutoscaleTarget(Setting):
+    name = "autoscale_target"
+    section = "Worker Processes"
+    flags = ["--autoscale-target"]
+    validator = validate_pos_float
+    type = float
+    default = 0
+    desc = """\
+        The load per worker the autoscaling aims at.
+
+        Workers are added when the average load of workers is above
+        this value and removed when below. If zero (the default), 50
+        connections, 100 tasks or 0.1 seconds of lag.
+        """
+
+
+class AutoscaleCooldown(Setting):
+    name = "autoscale_cooldown"
+    section = "Worker Processes"
+    flags = ["--autoscale-cooldown"]
+    validator = validate_pos_float
+    type = float
+    default = 30
+    desc = """\
+        Minimum number of seconds between two changes of the number of
+        workers when autoscaling."""
+
+
+class MailboxPeers(Setting):
+    name = "mailbox_peers"
+    section = "Worker Processes"
+    flags = ["--no-mailbox-peers"]
+    validator = validate_bool
+    action = "store_false"
+    default = True
+    desc = """\
+        Send messages between actors directly.
+
+        When on, the first message an actor sends to another actor
+        asks the arbiter for the address of the peer mailbox of the target
+        and following messages bypass the arbiter. Use
+        ``--no-mailbox-peers`` to route all messages via the arbiter.
+        """
+
+
+class MailboxCodec(Setting):
+    name = "mailbox_codec"
+    section = "Worker Processes"
+    choices = ('pickle', 'marshal', 'msgpack')
+    flags = ["--mailbox-codec"]
+    default = "pickle"
+    desc = """\
+        Codec of the messages sent by actors.
+
+        ``marshal`` and ``msgpack`` (which requires the msgpack package)
+        are faster than ``pickle`` for messages of basic types, other
+        messages are always pickled.
+        """
+
+
+class SharedMemoryThreshold(Setting):
+    name = "shared_memory_threshold"
+    section = "Worker Processes"
+    flags = ["--shared-memory-threshold"]
+    validator = validate_pos_int
+    type = int
+    default = 0
+    desc = """\
+        Size in bytes above which buffers are sent via shared memory.
+
+        ``bytes``, ``bytearray``, ``memoryview`` and numpy arrays larger
+        than this size, passed to or returned by actor commands, are
+        written in ``/dev/shm`` rather than in messages. Disabled when 0,
+        the default, or when ``/dev/shm`` is not available.
+        """
+
+
 class ThreadWorkers(Setting):
     name = "thread_workers"
     section = "Worker Processes"
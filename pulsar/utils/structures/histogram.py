@@ -0,0 +1,49 @@
+class Histogram:
+    '''Counts of non negative integer values.
+
+    Values smaller than ``2**precision`` have their own bucket, larger
+    values share a bucket with values within a relative distance of
+    ``2**(1 - precision)``.
+    '''
+    __slots__ = ('precision', 'count', '_counts')
+
+    def __init__(self, precision=5):
+        self.precision = precision
+        self.count = 0
+        self._counts = []
+
+    def add(self, value):
+        index = self._index(value)
+        counts = self._counts
+        if index >= len(counts):
+            counts.extend([0]*(index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+
+    def percentile(self, percent):
+        '''The largest value of the bucket holding the ``percent``
+        percentile
+        '''
+        if not self.count:
+            return 0
+        rank = max(percent*self.count/100, 1)
+        total = 0
+        for index, count in enumerate(self._counts):
+            total += count
+            if total >= rank:
+                return self._upper(index)
+        return self._upper(len(self._counts) - 1)
+
+    def _index(self, value):
+        precision = self.precision
+        shift = value.bit_length() - precision
+        if shift <= 0:
+            return value
+        return (shift << (precision - 1)) + (value >> shift)
+
+    def _upper(self, index):
+        half = 1 << (self.precision - 1)
+        if index < 2*half:
+            return index
+        shift = index//half - 1
+        return ((index - shift*half + 1) << shift) - 1
@@ -0,0 +1,90 @@
+class TimerWheel:
+    '''A hashed timer wheel for a large number of coarse grained timeouts.
+
+    Deadlines are rounded up to a multiple of ``resolution`` seconds and
+    keys sharing the same tick are stored in the same slot. Adding and
+    removing a key is ``O(1)`` and no callback handle is created, which
+    makes this structure suitable for millions of timeouts which would
+    otherwise overload the event loop scheduler.
+
+    The wheel does not keep track of time, the owner is responsible for
+    calling the :meth:`advance` method periodically.
+    '''
+    __slots__ = ('resolution', '_slots', '_tick', '_size')
+
+    def __init__(self, resolution=0.1, now=0):
+        self.resolution = resolution
+        self._slots = {}
+        self._tick = int(now / resolution)
+        self._size = 0
+
+    def __repr__(self):
+        return '%s(%d)' % (self.__class__.__name__, self._size)
+    __str__ = __repr__
+
+    def __len__(self):
+        return self._size
+
+    def tick(self, when):
+        '''The wheel tick at which a deadline ``when`` is reached'''
+        return max(int(when / self.resolution) + 1, self._tick)
+
+    def add(self, key, when):
+        '''Add ``key`` with deadline ``when``
+        '''
+        tick = self.tick(when)
+        keys = self._slots.get(tick)
+        if keys is None:
+            self._slots[tick] = keys = set()
+        n = len(keys)
+        keys.add(key)
+        self._size += len(keys) - n
+
+    def remove(self, key, when):
+        '''Remove ``key`` with deadline ``when``.
+
+        Return ``True`` if the key was found in the wheel.
+        '''
+        tick = self.tick(when)
+        keys = self._slots.get(tick)
+        if keys and key in keys:
+            keys.discard(key)
+            self._size -= 1
+            if not keys:
+                self._slots.pop(tick)
+            return True
+        return False
+
+    def advance(self, now, limit=None):
+        '''Advance the wheel to time ``now``.
+
+        Return a list of keys with deadline on or before ``now``.
+        If ``limit`` is given, at most ``limit`` keys are returned and
+        the remaining ones are returned by the next call.
+        '''
+        slots = self._slots
+        target = int(now / self.resolution)
+        tick = self._tick
+        expired = []
+        if not slots:
+            self._tick = max(tick, target + 1)
+            return expired
+        while tick <= target:
+            keys = slots.get(tick)
+            if keys:
+                if limit is not None:
+                    while keys and len(expired) < limit:
+                        expired.append(keys.pop())
+                    if keys:
+                        break
+                else:
+                    expired.extend(keys)
+                slots.pop(tick)
+            tick += 1
+        self._tick = tick
+        self._size -= len(expired)
+        return expired
+
+    def clear(self):
+        self._slots.clear()
+        self._size = 0
@@ -1,8 +1,11 @@
 import signal
+import asyncio
+import resource
 from time import time
 
 import pulsar
 from pulsar import send, spawn, get_application
+from pulsar.async.shared import SharedMemory
 
 
 def add(actor, a, b):
@@ -52,6 +55,46 @@ async def spawn_actor_from_actor(actor, name):
     return actor2.aid
 
 
+async def send_to_peer(actor, aid):
+    assert await send(aid, 'echo', 'hello') == 'hello'
+    assert await send(aid, 'ping') == 'pong'
+    return actor.mailbox.peers
+
+
+async def ping_peer(actor, aid, number):
+    for _ in range(number):
+        await send(aid, 'ping')
+
+
+async def ping_peer_concurrent(actor, aid, number):
+    # pings in batches of 100 concurrent messages
+    for start in range(0, number, 100):
+        await asyncio.gather(*[send(aid, 'ping')
+                               for _ in range(min(100, number - start))])
+
+
+async def send_bulk(actor, aid, size, number):
+    data = b'x'*size
+    for _ in range(number):
+        assert len(await send(aid, 'echo', data)) == size
+
+
+def cpu_time(actor):
+    # CPU time of the thread running the actor
+    who = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def echo_buffer(actor, buffer):
+    return memoryview(buffer)
+
+
+def write_shared(actor):
+    # a buffer in shared memory never received by the actor
+    return SharedMemory.create(actor.cfg).write(actor.aid, b'x')
+
+
 def cause_timeout(actor):
     if actor.next_periodic_task:
         actor.next_periodic_task.cancel()
@@ -1,9 +1,13 @@
+import os
+
 import pulsar
 from pulsar.apps.test import ActorTestMixin
 from pulsar import send, async_while
+from pulsar.async.shared import shared_directory
 
 from tests.async import (add, get_test, spawn_actor_from_actor, close_mailbox,
-                         wait_for_stop, check_environ)
+                         wait_for_stop, check_environ, send_to_peer,
+                         echo_buffer, write_shared)
 
 
 class ActorTest(ActorTestMixin):
@@ -111,3 +115,63 @@ class ActorTest(ActorTestMixin):
         proxy = await self.spawn_actor(name=name)
         value = await send(proxy, 'run', check_environ, 'PULSAR_TEST_ENVIRON')
         self.assertEqual(value, 'yes')
+
+    async def test_peer_mailbox(self):
+        proxy1 = await self.spawn_actor(
+            name='actor-test-peer1-%s' % self.concurrency)
+        proxy2 = await self.spawn_actor(
+            name='actor-test-peer2-%s' % self.concurrency)
+        peers = await send(proxy1, 'run', send_to_peer, proxy2.aid)
+        self.assertEqual(peers, [proxy2.aid])
+        arbiter = pulsar.get_actor()
+        address = arbiter.get_actor(proxy2.aid).peer_address
+        self.assertTrue(address)
+        self.assertEqual(await send(proxy2, 'peer_listen'), address)
+        # messages to the arbiter and monitors are routed
+        self.assertEqual(await send(proxy1, 'run', send_to_peer, 'arbiter'),
+                         [proxy2.aid])
+
+    async def test_no_mailbox_peers(self):
+        proxy1 = await self.spawn_actor(
+            name='actor-test-nopeer1-%s' % self.concurrency,
+            mailbox_peers=False)
+        proxy2 = await self.spawn_actor(
+            name='actor-test-nopeer2-%s' % self.concurrency)
+        peers = await send(proxy1, 'run', send_to_peer, proxy2.aid)
+        self.assertEqual(peers, [])
+        arbiter = pulsar.get_actor()
+        self.assertEqual(arbiter.get_actor(proxy2.aid).peer_address, None)
+
+    async def test_mailbox_codec(self):
+        proxy = await self.spawn_actor(
+            name='actor-test-codec-%s' % self.concurrency,
+            mailbox_codec='marshal')
+        self.assertEqual(await send(proxy, 'echo', [b'a', 1]), [b'a', 1])
+        self.assertEqual(await send(proxy, 'config', 'get', 'mailbox_codec'),
+                         'marshal')
+        peers = await send(proxy, 'run', send_to_peer, 'arbiter')
+        self.assertEqual(peers, [])
+
+    async def test_shared_memory(self):
+        if not shared_directory(pulsar.get_actor().cfg.exc_id):
+            self.skipTest('Requires /dev/shm')
+        proxy = await self.spawn_actor(
+            name='actor-test-shared-%s' % self.concurrency,
+            shared_memory_threshold=1024)
+        data = bytes(range(256))*8192
+        # memoryviews cannot be pickled, the result is in shared memory
+        result = await send(proxy, 'run', echo_buffer, data)
+        self.assertIsInstance(result, memoryview)
+        self.assertEqual(result.tobytes(), data)
+
+    async def test_shared_memory_orphans(self):
+        if not shared_directory(pulsar.get_actor().cfg.exc_id):
+            self.skipTest('Requires /dev/shm')
+        proxy = await self.spawn_actor(
+            name='actor-test-orphans-%s' % self.concurrency,
+            shared_memory_threshold=1024)
+        path = await send(proxy, 'run', write_shared)
+        self.assertTrue(os.path.exists(path))
+        await send(proxy, 'stop')
+        await wait_for_stop(self, proxy.aid)
+        self.assertFalse(os.path.exists(path))
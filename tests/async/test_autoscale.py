@@ -0,0 +1,98 @@
+import asyncio
+import unittest
+
+from pulsar import Config, send
+from pulsar.apps.ds import PulsarDS
+from pulsar.apps.wsgi import WSGIServer
+from pulsar.async.autoscale import Autoscaler, TARGETS
+
+from tests.apps import dummy
+
+
+def infos(*values, metric='connections'):
+    return [{'load': {metric: value}} for value in values]
+
+
+class TestAutoscaler(unittest.TestCase):
+
+    def autoscaler(self, **params):
+        params.setdefault('max_workers', 8)
+        params.setdefault('autoscale_cooldown', 10)
+        return Autoscaler.create(Config(**params))
+
+    def test_create(self):
+        self.assertEqual(Autoscaler.create(Config()), None)
+        self.assertEqual(Autoscaler.create(Config(workers=0, max_workers=4)),
+                         None)
+        self.assertEqual(Autoscaler.create(Config(max_workers=4),
+                                           PulsarDS(load_config=False)),
+                         None)
+        self.assertTrue(Autoscaler.create(Config(max_workers=4),
+                                          WSGIServer(load_config=False)))
+        scaler = self.autoscaler(workers=12, min_workers=0)
+        self.assertEqual(scaler.workers, 8)
+        self.assertEqual(scaler.min_workers, 1)
+        self.assertEqual(scaler.target, TARGETS['connections'])
+        scaler = self.autoscaler(autoscale_metric='lag',
+                                 autoscale_target=0.5)
+        self.assertEqual(scaler.target, 0.5)
+
+    def test_scale(self):
+        scaler = self.autoscaler(workers=2, autoscale_target=10)
+        # no load reported yet
+        self.assertEqual(scaler.scale([None, {}], 0), None)
+        # within tolerance
+        self.assertEqual(scaler.scale(infos(9, 11), 0), None)
+        decision = scaler.scale(infos(30, 20) + [None], 0)
+        self.assertEqual(decision['from'], 2)
+        self.assertEqual(decision['to'], 5)
+        self.assertEqual(decision['load'], 25)
+        self.assertEqual(scaler.workers, 5)
+        # cooldown
+        self.assertEqual(scaler.scale(infos(0, 0), 9), None)
+        self.assertEqual(scaler.scale(infos(100), 10)['to'], 8)
+        self.assertEqual(scaler.scale(infos(100), 20), None)
+        self.assertEqual(scaler.scale(infos(0), 30)['to'], 1)
+        info = scaler.info()
+        self.assertEqual(info['workers'], 1)
+        self.assertEqual([d['to'] for d in info['decisions']], [5, 8, 1])
+
+    def test_metric(self):
+        scaler = self.autoscaler(autoscale_metric='lag')
+        self.assertAlmostEqual(scaler.load(infos(0.2, 0.4, metric='lag')), 0.3)
+        self.assertEqual(scaler.scale(infos(0.3, metric='lag'), 0)['to'], 3)
+
+
+class TestAutoscaleServer(unittest.TestCase):
+    app_cfg = None
+
+    @classmethod
+    async def setUpClass(cls):
+        server = WSGIServer(callable=dummy, name='autoscale',
+                            bind='127.0.0.1:0', workers=2, max_workers=3,
+                            autoscale_cooldown=0,
+                            concurrency=cls.cfg.concurrency)
+        cls.app_cfg = await send('arbiter', 'run', server)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg:
+            return send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    async def test_scale_down(self):
+        # without connections the youngest worker is stopped
+        for _ in range(100):
+            info = await send(self.app_cfg.name, 'info')
+            if len(info['workers']) == 1:
+                break
+            await asyncio.sleep(0.1)
+        self.assertEqual(len(info['workers']), 1)
+        autoscale = info['autoscale']
+        self.assertEqual(autoscale['workers'], 1)
+        decision = autoscale['decisions'][0]
+        self.assertEqual((decision['from'], decision['to']), (2, 1))
+        self.assertEqual(decision['metric'], 'connections')
+        worker = info['workers'][0]
+        self.assertEqual(worker['load']['connections'], 0)
+        info = await send('arbiter', 'info')
+        self.assertTrue(info['monitors'][self.app_cfg.name]['autoscale'])
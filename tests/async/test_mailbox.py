@@ -0,0 +1,202 @@
+import os
+import asyncio
+import tempfile
+import unittest
+
+from pulsar import (Config, ImproperlyConfigured, ProtocolError, get_actor,
+                    create_future)
+from pulsar.async.mailbox import (MessageCodec, Message, MailboxProtocol,
+                                  HEADER, msgpack)
+from pulsar.async.shared import SharedMemory, shared_directory
+
+
+class WriteTransport(asyncio.WriteTransport):
+
+    def __init__(self, writes):
+        super().__init__()
+        self.writes = writes
+
+    def write(self, data):
+        if isinstance(self.writes, Exception):
+            raise self.writes
+        self.writes.append(data)
+
+    def close(self):
+        self.writes = None
+
+
+class TestMessageCodec(unittest.TestCase):
+
+    def message(self):
+        return ('echo', 'abc', 'def', (1, 'a', b'b', [2.5]), {'x': None}, 4)
+
+    def codec(self, name):
+        codec = MessageCodec(name)
+        self.assertEqual(str(codec), name)
+        message = self.message()
+        body = codec.encode(message)
+        self.assertEqual(codec.decode(body), message)
+        self.assertEqual(MessageCodec().decode(bytearray(body)), message)
+        return codec
+
+    def test_pickle(self):
+        codec = self.codec('pickle')
+        proxy = get_actor().proxy
+        message = codec.decode(codec.encode(('run', 'abc', proxy, (), {}, 1)))
+        self.assertEqual(message[2], proxy)
+
+    def test_marshal(self):
+        codec = self.codec('marshal')
+        self.assertEqual(codec.encode(self.message())[:1], b'\x01')
+        # messages marshal cannot serialise are pickled
+        body = codec.encode(('run', 'abc', 'def', (len,), {}, 1))
+        self.assertEqual(body[:1], b'\x00')
+        self.assertEqual(codec.decode(body)[3], (len,))
+
+    @unittest.skipUnless(msgpack, 'Requires msgpack')
+    def test_msgpack(self):
+        codec = MessageCodec('msgpack')
+        body = codec.encode(self.message())
+        self.assertEqual(body[:1], b'\x02')
+        self.assertEqual(codec.decode(body)[4], {'x': None})
+
+    def test_bad_codec(self):
+        self.assertRaises(ImproperlyConfigured, MessageCodec, 'json')
+        self.assertRaises(ValueError, MessageCodec().decode, b'\x09abc')
+
+    def test_message(self):
+        message = Message.callback('pong', 5)
+        self.assertEqual(message.data, ('callback', 5, 'pong'))
+        self.assertEqual(str(message), 'callback')
+
+
+class TestMailboxProtocol(unittest.TestCase):
+
+    def frame(self, protocol, message):
+        body = protocol._codec.encode(message.data)
+        return HEADER.pack(len(body)) + body
+
+    def test_partial_frames(self):
+        protocol = MailboxProtocol(loop=get_actor()._loop)
+        waiters = [create_future(), create_future()]
+        protocol._pending_responses.update(((7, waiters[0]),
+                                            (8, waiters[1])))
+        data = (self.frame(protocol, Message.callback('a', 7)) +
+                self.frame(protocol, Message.callback(['b'], 8)))
+        protocol.data_received(data[:3])
+        protocol.data_received(data[3:-5])
+        # callbacks are processed straight away
+        self.assertEqual(waiters[0].result(), 'a')
+        self.assertFalse(waiters[1].done())
+        protocol.data_received(data[-5:])
+        self.assertEqual(waiters[1].result(), ['b'])
+        self.assertFalse(protocol._pending_responses)
+        self.assertFalse(protocol._buffer)
+
+    async def test_batch(self):
+        protocol = MailboxProtocol(loop=get_actor()._loop)
+        writes = []
+        protocol._transport = WriteTransport(writes)
+        waiters = [protocol.request('ping', 'abc', 'def', (), {})
+                   for _ in range(3)]
+        protocol._start(Message.callback('a', 7))
+        self.assertEqual(writes, [])
+        await asyncio.sleep(0)
+        # messages of the same loop iteration are written together
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(protocol._batch, None)
+        data, messages = writes[0], []
+        while data:
+            end = HEADER.size + HEADER.unpack_from(data)[0]
+            messages.append(protocol._codec.decode(data[HEADER.size:end]))
+            data = data[end:]
+        self.assertEqual([m[0] for m in messages], ['ping']*3 + ['callback'])
+        self.assertEqual(messages[3], ('callback', 7, 'a'))
+        self.assertEqual(len(protocol._pending_responses), 3)
+        for waiter in waiters:
+            waiter.cancel()
+
+    async def test_batch_error(self):
+        protocol = MailboxProtocol(peer=True, loop=get_actor()._loop)
+        protocol._transport = transport = WriteTransport(
+            ConnectionResetError('broken'))
+        waiters = [protocol.request('ping', 'abc', 'def', (), {})
+                   for _ in range(3)]
+        protocol._start(Message.callback('a', 7))
+        await asyncio.sleep(0)
+        # the requests of the batch fail and the connection is closed
+        for waiter in waiters:
+            with self.assertRaises(ConnectionResetError):
+                await waiter
+        self.assertFalse(protocol._pending_responses)
+        self.assertEqual(transport.writes, None)
+
+    def test_bad_frame(self):
+        protocol = MailboxProtocol(loop=get_actor()._loop)
+        self.assertRaises(ProtocolError, protocol.data_received,
+                          HEADER.pack(3) + b'\x05ab')
+        self.assertFalse(protocol._buffer)
+
+
+class TestSharedMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shared = SharedMemory(self.directory, 100)
+
+    def tearDown(self):
+        self.shared.clear()
+        self.assertFalse(os.path.exists(self.directory))
+
+    def test_create(self):
+        self.assertEqual(SharedMemory.create(Config()), None)
+        cfg = Config(shared_memory_threshold=100)
+        shared = SharedMemory.create(cfg)
+        directory = shared_directory(cfg.exc_id)
+        if directory:
+            self.assertEqual(shared.directory, directory)
+            self.assertEqual(shared.threshold, 100)
+        else:
+            # without /dev/shm buffers are sent in messages
+            self.assertEqual(shared, None)
+
+    def test_large(self):
+        large = self.shared.large
+        self.assertFalse(large((b'x'*99, 'x'*200, [bytearray(10)])))
+        self.assertTrue(large((1, b'x'*100)))
+        self.assertTrue(large(([(memoryview(bytearray(200)),)],)))
+
+    def test_transfer(self):
+        codec = MessageCodec('marshal', self.shared)
+        data = b'0123456789'*100
+        args = (data, bytearray(data), memoryview(data), b'small')
+        body = codec.encode(('echo', 'abc', 'def', args, {}, 1), 'def')
+        self.assertEqual(body[:1], b'\x03')
+        self.assertTrue(len(body) < len(data))
+        self.assertEqual(self.shared.written, 3)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        message = codec.decode(body)
+        # files are removed once received
+        self.assertEqual(os.listdir(self.directory), [])
+        received = message[3]
+        self.assertEqual(received[0], data)
+        self.assertIsInstance(received[1], bytearray)
+        self.assertEqual(received[1], data)
+        self.assertIsInstance(received[2], memoryview)
+        self.assertEqual(received[2].tobytes(), data)
+        self.assertEqual(received[3], b'small')
+        # results of callbacks
+        body = codec.encode(('callback', 1, [data]), 'abc')
+        self.assertEqual(codec.decode(body), ('callback', 1, [data]))
+        # without target buffers are in the message
+        body = codec.encode(('callback', 1, data))
+        self.assertEqual(body[:1], b'\x01')
+
+    def test_remove(self):
+        codec = MessageCodec('pickle', self.shared)
+        data = b'x'*100
+        codec.encode(('echo', 'abc', 'def', (data,), {}, 1), 'def')
+        codec.encode(('echo', 'abc', 'ghi', (data,), {}, 2), 'ghi')
+        self.shared.remove('def')
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertTrue(os.listdir(self.directory)[0].startswith('ghi.'))
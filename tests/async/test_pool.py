@@ -0,0 +1,180 @@
+import unittest
+import asyncio
+
+from pulsar import Pool
+
+
+class Transport:
+
+    def __init__(self):
+        self.closing = False
+
+    def is_closing(self):
+        return self.closing
+
+
+class Connection:
+
+    def __init__(self):
+        self.transport = Transport()
+
+    def close(self):
+        self.transport.closing = True
+        closed = asyncio.get_event_loop().create_future()
+        closed.set_result(None)
+        return closed
+
+
+class TestPool(unittest.TestCase):
+
+    def pool(self, **kw):
+        async def creator():
+            await asyncio.sleep(0)
+            return Connection()
+        return Pool(creator, **kw)
+
+    async def test_lifo(self):
+        pool = self.pool(pool_size=3)
+        conns = [await pool.connect() for _ in range(3)]
+        self.assertEqual(pool.in_use, 3)
+        connections = [c.connection for c in conns]
+        for conn in conns:
+            conn.close()
+        self.assertEqual(pool.available, 3)
+        conn = await pool.connect()
+        self.assertTrue(conn.connection is connections[-1])
+        self.assertTrue(connections[0] in pool)
+        conn.close()
+        await pool.close()
+
+    async def test_stale_connections(self):
+        pool = self.pool(pool_size=3)
+        conns = [await pool.connect() for _ in range(3)]
+        for conn in conns:
+            conn.close()
+        # closed connections are skipped without recursion
+        for connection in pool.idle_connections()[1:]:
+            connection.close()
+        conn = await pool.connect()
+        self.assertFalse(conn.connection.transport.closing)
+        self.assertEqual(pool.available, 0)
+        self.assertEqual(pool.recycled, 2)
+        conn.close()
+        await pool.close()
+
+    async def test_waiters(self):
+        pool = self.pool(pool_size=1)
+        conn = await pool.connect()
+        waiter = asyncio.ensure_future(pool.connect())
+        await asyncio.sleep(0)
+        self.assertEqual(pool.waiters, 1)
+        connection = conn.connection
+        conn.close()
+        conn = await waiter
+        # handed over to the waiting coroutine
+        self.assertTrue(conn.connection is connection)
+        self.assertEqual(pool.waiters, 0)
+        stats = pool.stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['in_use'], 1)
+        self.assertTrue(stats['wait_time']['p100'] > 0)
+        conn.close()
+        await pool.close()
+
+    async def test_timeout(self):
+        pool = self.pool(pool_size=1, timeout=0.1)
+        conn = await pool.connect()
+        with self.assertRaises(asyncio.TimeoutError):
+            await pool.connect()
+        self.assertEqual(pool.waiters, 0)
+        conn.close(discard=True)
+        # a detached connection frees its place in the pool
+        conn = await pool.connect()
+        self.assertEqual(pool.opened, 2)
+        conn.close()
+        await pool.close()
+
+    async def test_min_size_and_idle_timeout(self):
+        pool = self.pool(pool_size=4, min_size=2, idle_timeout=0.1)
+        conns = [await pool.connect() for _ in range(4)]
+        for conn in conns:
+            conn.close()
+        self.assertEqual(pool.available, 4)
+        await asyncio.sleep(0.3)
+        # idle connections are closed down to min_size
+        self.assertEqual(pool.available, 2)
+        self.assertEqual(pool.recycled, 2)
+        await pool.close()
+
+    async def test_prewarm(self):
+        pool = self.pool(pool_size=4, min_size=2)
+        conn = await pool.connect()
+        await asyncio.sleep(0.01)
+        self.assertEqual(pool.in_use + pool.available, 2)
+        self.assertEqual(pool.opened, 2)
+        conn.close()
+        await pool.close()
+
+    async def test_prewarm_closed(self):
+        connections = []
+
+        async def creator():
+            await asyncio.sleep(0.01)
+            connections.append(Connection())
+            return connections[-1]
+
+        pool = Pool(creator, pool_size=4, min_size=2)
+        pool._prewarm()
+        await pool.close()
+        await asyncio.sleep(0.02)
+        self.assertEqual(len(connections), 2)
+        for connection in connections:
+            self.assertTrue(connection.transport.closing)
+        self.assertEqual(pool.available, 0)
+
+    async def test_prewarm_backoff(self):
+        attempts = []
+
+        async def creator():
+            attempts.append(None)
+            raise ConnectionRefusedError
+
+        pool = Pool(creator, pool_size=4, min_size=2)
+        with self.assertRaises(ConnectionRefusedError):
+            await pool.connect()
+        self.assertEqual(len(attempts), 3)
+        # no connection is opened in the background before the backoff
+        pool._prewarm()
+        await asyncio.sleep(0)
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(pool._warm_failures, 1)
+        await asyncio.sleep(0.15)
+        pool._prewarm()
+        await asyncio.sleep(0)
+        self.assertEqual(len(attempts), 5)
+        self.assertEqual(pool._warm_failures, 2)
+        await pool.close()
+
+    async def test_cancelled_waiter(self):
+        pool = self.pool(pool_size=1)
+        conn = await pool.connect()
+        waiter = asyncio.ensure_future(pool.connect())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        self.assertTrue(waiter.cancelled())
+        self.assertEqual(pool.waiters, 0)
+        conn.close()
+        self.assertEqual(pool.available, 1)
+        await pool.close()
+
+    async def test_max_lifetime(self):
+        pool = self.pool(pool_size=2, max_lifetime=0.05)
+        conn = await pool.connect()
+        connection = conn.connection
+        await asyncio.sleep(0.06)
+        conn.close()
+        self.assertTrue(connection.transport.closing)
+        self.assertEqual(pool.available, 0)
+        self.assertEqual(pool.recycled, 1)
+        await pool.close()
@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+
+import pulsar
+from pulsar.utils.string import random_string
+from pulsar.apps.ds import PulsarDS
+from pulsar.apps.data import create_store
+
+
+class ClusterThroughput(unittest.TestCase):
+    '''Commands sent by a cluster store to the shards of a pulsar-ds
+    server, ``MSET`` and ``MGET`` are split into one command per shard
+    '''
+    __benchmark__ = True
+    __number__ = 1
+    _sizes = {'tiny': 100,
+              'small': 1000,
+              'normal': 5000,
+              'big': 20000,
+              'huge': 100000}
+    shards = 3
+    app_cfg = None
+
+    @classmethod
+    async def setUpClass(cls):
+        params = {}
+        if cls.shards:
+            if cls.cfg.concurrency != 'process':
+                raise unittest.SkipTest('sharding requires process workers')
+            params['key_value_shards'] = cls.shards
+        server = PulsarDS(name='cluster%s' % random_string(6, 6).lower(),
+                          bind='127.0.0.1:0',
+                          concurrency=cls.cfg.concurrency,
+                          **params)
+        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        cls.store = create_store('pulsar://%s:%s/5' % cls.app_cfg.addresses[0],
+                                 cluster=1 if cls.shards else 0)
+        cls.client = cls.store.client()
+        cls.size = cls._sizes[cls.cfg.size]
+        cls.keys = ['key%d' % n for n in range(cls.size)]
+        cls.items = [v for key in cls.keys for v in (key, 'x'*20)]
+        await cls.client.mset(*cls.items)
+
+    @classmethod
+    async def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            await cls.store.close()
+            await pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    def test_mset(self):
+        return self.client.mset(*self.items)
+
+    def test_mget(self):
+        return self.client.mget(*self.keys)
+
+    def test_get(self):
+        return asyncio.gather(*[self.client.get(key)
+                                for key in self.keys[:1000]])
+
+
+class SingleServerThroughput(ClusterThroughput):
+    '''The same commands sent to a pulsar-ds server without shards
+    '''
+    shards = 0
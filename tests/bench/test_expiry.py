@@ -0,0 +1,136 @@
+import unittest
+import tracemalloc
+
+from pulsar import get_event_loop, create_future
+from pulsar.apps.test.plugins.bench import BENCHMARK_TEMPLATE
+from pulsar.utils.structures import TimerWheel
+
+
+class TestExpiry(unittest.TestCase):
+    '''Compare key expiry with a timer wheel against one event loop
+    handle per key
+    '''
+    __benchmark__ = True
+    __number__ = 100
+    _sizes = {'tiny': 10,
+              'small': 100,
+              'normal': 1000,
+              'big': 10000,
+              'huge': 100000}
+
+    @classmethod
+    def setUpClass(cls):
+        size = cls._sizes[cls.cfg.size]
+        cls.keys = ['key%d' % n for n in range(size)]
+
+    def test_timer_wheel(self):
+        loop = get_event_loop()
+        now = loop.time()
+        wheel = TimerWheel(0.1, now)
+        for n, key in enumerate(self.keys):
+            wheel.add(key, now + 0.001*n)
+        wheel.advance(now + 0.001*len(self.keys))
+
+    def test_loop_handles(self):
+        loop = get_event_loop()
+        now = loop.time()
+        handles = [loop.call_at(now + 0.001*n, None, key)
+                   for n, key in enumerate(self.keys)]
+        for handle in handles:
+            handle.cancel()
+
+
+class ExpiryLatency(unittest.TestCase):
+    '''Delay between the deadline of keys and their removal, and memory
+    used per key, with a timer wheel advanced by a cron, as in pulsar-ds,
+    and with one event loop handle per key. Keys expire at a rate of
+    10000 per second.
+    '''
+    __benchmark__ = True
+    __number__ = 1
+    _sizes = {'tiny': 1000,
+              'small': 5000,
+              'normal': 10000,
+              'big': 50000,
+              'huge': 200000}
+    benchmark_template = (BENCHMARK_TEMPLATE +
+                          ', latency mean {0[latency]} max {0[max_latency]}'
+                          ' secs, {0[memory]} bytes per key')
+    # as the pulsar-ds cron
+    resolution = 0.1
+    keys_per_cycle = 2000
+    rate = 10000
+
+    @classmethod
+    def setUpClass(cls):
+        size = cls._sizes[cls.cfg.size]
+        cls.keys = ['key%d' % n for n in range(size)]
+        cls.latencies = {}
+        cls.memory = {}
+
+    def getSummary(self, info, repeat, total_time, total_time2):
+        latencies = self.latencies[self._testMethodName]
+        info['latency'] = '%.4f' % (sum(latencies) / len(latencies))
+        info['max_latency'] = '%.4f' % max(latencies)
+        info['memory'] = self.memory[self._testMethodName]
+        return info
+
+    def deadlines(self, now):
+        rate = self.rate
+        return [(key, now + n/rate) for n, key in enumerate(self.keys)]
+
+    def traced(self, build):
+        # memory allocated by build and kept alive
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            kept = build()
+            memory = tracemalloc.get_traced_memory()[0] - start
+        finally:
+            tracemalloc.stop()
+        self.memory[self._testMethodName] = int(memory / len(self.keys))
+        return kept
+
+    async def test_timer_wheel(self):
+        loop = get_event_loop()
+        latencies = self.latencies.setdefault(self._testMethodName, [])
+        deadlines = dict(self.deadlines(loop.time()))
+        now = loop.time()
+
+        def build():
+            wheel = TimerWheel(self.resolution, now)
+            for key, when in deadlines.items():
+                wheel.add(key, when)
+            return wheel
+
+        wheel = self.traced(build)
+        done = create_future(loop)
+
+        def cron():
+            now = loop.time()
+            for key in wheel.advance(now, self.keys_per_cycle):
+                latencies.append(now - deadlines[key])
+            if wheel:
+                loop.call_later(self.resolution, cron)
+            else:
+                done.set_result(None)
+
+        loop.call_later(self.resolution, cron)
+        await done
+
+    async def test_loop_handles(self):
+        loop = get_event_loop()
+        latencies = self.latencies.setdefault(self._testMethodName, [])
+        remaining = [len(self.keys)]
+        done = create_future(loop)
+
+        def expire(when):
+            latencies.append(loop.time() - when)
+            remaining[0] -= 1
+            if not remaining[0]:
+                done.set_result(None)
+
+        deadlines = self.deadlines(loop.time())
+        self.traced(lambda: [loop.call_at(when, expire, when)
+                             for _, when in deadlines])
+        await done
@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+
+import pulsar
+from pulsar.utils.string import random_string
+from pulsar.apps.ds import PulsarDS
+from pulsar.apps.ds.scripting import lupa
+from pulsar.apps.data import create_store
+
+
+@unittest.skipUnless(lupa, 'Requires lupa')
+class LockContention(unittest.TestCase):
+    '''Coroutines competing for a lock of a pulsar-ds server, each one
+    acquiring and releasing it a few times
+    '''
+    __benchmark__ = True
+    __number__ = 1
+    _sizes = {'tiny': 2,
+              'small': 5,
+              'normal': 10,
+              'big': 50,
+              'huge': 100}
+    acquisitions = 2
+    sleep = None
+    app_cfg = None
+
+    @classmethod
+    async def setUpClass(cls):
+        server = PulsarDS(name='lock%s' % random_string(6, 6).lower(),
+                          bind='127.0.0.1:0',
+                          concurrency=cls.cfg.concurrency)
+        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        cls.store = create_store('pulsar://%s:%s/5' % cls.app_cfg.addresses[0])
+        cls.client = cls.store.client()
+        cls.size = cls._sizes[cls.cfg.size]
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    async def _hold(self, name):
+        lock = self.client.lock(name, timeout=10, sleep=self.sleep)
+        for _ in range(self.acquisitions):
+            async with lock:
+                pass
+
+    async def test_contention(self):
+        name = random_string()
+        await asyncio.gather(*[self._hold(name) for _ in range(self.size)])
+
+
+class LockContentionPolling(LockContention):
+    '''Contention when polling the store every 200 milliseconds, as
+    locks did before release notifications
+    '''
+    sleep = 0.2
+
+    async def _hold(self, name):
+        lock = self.client.lock(name, timeout=10, sleep=self.sleep)
+        # wait for the lock without subscribing to its releases
+        lock.blocking = False
+        for _ in range(self.acquisitions):
+            while not await lock.acquire():
+                await asyncio.sleep(self.sleep)
+            await lock.release()
@@ -0,0 +1,151 @@
+import asyncio
+import unittest
+
+import pulsar
+from pulsar import send
+from pulsar.apps.test.plugins.bench import BENCHMARK_TEMPLATE
+
+from tests.async import (ping_peer, ping_peer_concurrent, send_bulk,
+                         cpu_time)
+
+
+class MailboxRing(unittest.TestCase):
+    '''Sixteen actors in a ring, each one pinging the next one
+    directly via its peer mailbox
+    '''
+    __benchmark__ = True
+    __number__ = 1
+    _sizes = {'tiny': 10,
+              'small': 20,
+              'normal': 50,
+              'big': 200,
+              'huge': 1000}
+    benchmark_template = (BENCHMARK_TEMPLATE + ', latency {0[latency]} secs'
+                          ', arbiter cpu {0[arbiter_cpu]} secs')
+    mailbox_peers = True
+    workers = 16
+    actors = ()
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.size = cls._sizes[cls.cfg.size]
+        cls.arbiter_cpu = 0
+        cls.actors = await asyncio.gather(*[
+            pulsar.spawn(name='ring%d' % n,
+                         concurrency=cls.cfg.concurrency,
+                         mailbox_peers=cls.mailbox_peers)
+            for n in range(cls.workers)])
+        # connect the peers before timing
+        await cls.ring(1)
+
+    @classmethod
+    def tearDownClass(cls):
+        return asyncio.gather(*[send(actor, 'stop') for actor in cls.actors])
+
+    @classmethod
+    def ring(cls, number):
+        actors = cls.actors
+        return asyncio.gather(*[
+            send(actor, 'run', ping_peer,
+                 actors[(n + 1) % len(actors)].aid, number)
+            for n, actor in enumerate(actors)])
+
+    def getSummary(self, info, repeat, total_time, total_time2):
+        info['latency'] = '%.6f' % (total_time / repeat / self.size)
+        info['arbiter_cpu'] = '%.5f' % (self.arbiter_cpu / repeat)
+        return info
+
+    async def test_ring(self):
+        start = await send('arbiter', 'run', cpu_time)
+        await self.ring(self.size)
+        cpu = await send('arbiter', 'run', cpu_time) - start
+        self.__class__.arbiter_cpu += cpu
+
+
+class MailboxRingRouted(MailboxRing):
+    '''The ring of :class:`MailboxRing` with messages routed by the arbiter
+    '''
+    mailbox_peers = False
+
+
+class MailboxPing(unittest.TestCase):
+    '''Round trips of ping messages between two actors
+    '''
+    __benchmark__ = True
+    __number__ = 1
+    _sizes = {'tiny': 100,
+              'small': 500,
+              'normal': 2000,
+              'big': 10000,
+              'huge': 50000}
+    benchmark_template = (BENCHMARK_TEMPLATE +
+                          ', {0[throughput]} round trips per sec')
+    actors = ()
+    params = {}
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.size = cls._sizes[cls.cfg.size]
+        cls.actors = await asyncio.gather(*[
+            pulsar.spawn(name='ping%d' % n,
+                         concurrency=cls.cfg.concurrency,
+                         **cls.params)
+            for n in range(2)])
+        await cls.ping(1)
+
+    @classmethod
+    def tearDownClass(cls):
+        return asyncio.gather(*[send(actor, 'stop') for actor in cls.actors])
+
+    @classmethod
+    def ping(cls, number):
+        return send(cls.actors[0], 'run', ping_peer, cls.actors[1].aid,
+                    number)
+
+    def getSummary(self, info, repeat, total_time, total_time2):
+        info['throughput'] = int(self.size*repeat/total_time)
+        return info
+
+    async def test_ping(self):
+        await self.ping(self.size)
+
+
+class MailboxPingMarshal(MailboxPing):
+    '''The round trips of :class:`MailboxPing` with the marshal codec
+    '''
+    params = {'mailbox_codec': 'marshal'}
+
+
+class MailboxPingConcurrent(MailboxPing):
+    '''Ping messages sent by an actor to another in batches of 100
+    concurrent messages
+    '''
+    @classmethod
+    def ping(cls, number):
+        return send(cls.actors[0], 'run', ping_peer_concurrent,
+                    cls.actors[1].aid, number)
+
+
+class MailboxBulk(MailboxPing):
+    '''Echo of 8MB payloads between two actors via shared memory
+    '''
+    _sizes = {'tiny': 2,
+              'small': 3,
+              'normal': 5,
+              'big': 20,
+              'huge': 50}
+    benchmark_template = (BENCHMARK_TEMPLATE +
+                          ', {0[throughput]} payloads per sec')
+    params = {'shared_memory_threshold': 1024*1024}
+    payload = 8*1024*1024
+
+    @classmethod
+    def ping(cls, number):
+        return send(cls.actors[0], 'run', send_bulk, cls.actors[1].aid,
+                    cls.payload, number)
+
+
+class MailboxBulkPickled(MailboxBulk):
+    '''The payloads of :class:`MailboxBulk` pickled in messages
+    '''
+    params = {'shared_memory_threshold': 0}
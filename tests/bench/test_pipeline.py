@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+
+import pulsar
+from pulsar import HAS_C_EXTENSIONS
+from pulsar.utils.string import random_string
+from pulsar.apps.ds import PulsarDS, redis_parser
+
+
+class PipelinePyParser(unittest.TestCase):
+    '''Throughput of pipelined requests sent to a pulsar-ds server
+    in a single write, on a new connection
+    '''
+    __benchmark__ = True
+    __number__ = 20
+    _sizes = {'tiny': 10,
+              'small': 100,
+              'normal': 1000,
+              'big': 10000,
+              'huge': 100000}
+    redis_py_parser = True
+    app_cfg = None
+
+    @classmethod
+    async def setUpClass(cls):
+        server = PulsarDS(name='pipeline%s' % random_string(6, 6).lower(),
+                          bind='127.0.0.1:0',
+                          redis_py_parser=cls.redis_py_parser,
+                          concurrency=cls.cfg.concurrency)
+        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        cls.size = cls._sizes[cls.cfg.size]
+        pack = redis_parser(cls.redis_py_parser)().pack_command
+        cls.set_pipeline = b''.join(pack(('set', 'key%d' % n, 'x'*20))
+                                    for n in range(cls.size))
+        cls.get_pipeline = b''.join(pack(('get', 'key%d' % n))
+                                    for n in range(cls.size))
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    async def _pipeline(self, data):
+        reader, writer = await asyncio.open_connection(
+            *self.app_cfg.addresses[0])
+        parser = redis_parser(self.redis_py_parser)()
+        writer.write(data)
+        replies = 0
+        while replies < self.size:
+            parser.feed(await reader.read(65536))
+            while parser.get() is not False:
+                replies += 1
+        writer.close()
+
+    def test_set(self):
+        return self._pipeline(self.set_pipeline)
+
+    def test_get(self):
+        return self._pipeline(self.get_pipeline)
+
+
+@unittest.skipUnless(HAS_C_EXTENSIONS, 'Requires C extensions')
+class PipelineCParser(PipelinePyParser):
+    redis_py_parser = False
@@ -0,0 +1,50 @@
+import re
+import unittest
+
+from pulsar.apps.ds import redis_to_py_pattern
+from pulsar.apps.ds.pubsub import PatternIndex
+
+
+class TestPatternMatch(unittest.TestCase):
+    '''Compare the patterns matching a published channel found with a
+    :class:`.PatternIndex` against matching every pattern
+    '''
+    __benchmark__ = True
+    __number__ = 100
+    _sizes = {'tiny': 100,
+              'small': 1000,
+              'normal': 10000,
+              'big': 50000,
+              'huge': 100000}
+
+    @classmethod
+    def setUpClass(cls):
+        size = cls._sizes[cls.cfg.size]
+        patterns = [('room.%d.*' % n).encode('utf-8') for n in range(size)]
+        patterns.extend(('user.%d.?' % n).encode('utf-8')
+                        for n in range(size//10))
+        cls.channels = [('room.%d.message' % n).encode('utf-8')
+                        for n in range(0, size, max(size//10, 1))]
+        cls.index = PatternIndex()
+        cls.regexes = []
+        for pattern in patterns:
+            cls.index.add(pattern)
+            cls.regexes.append(re.compile(redis_to_py_pattern(
+                pattern.decode('utf-8'))))
+
+    def test_pattern_index(self):
+        index = self.index
+        for channel in self.channels:
+            index._cache.clear()
+            index.match(channel)
+
+    def test_pattern_index_cached(self):
+        index = self.index
+        for channel in self.channels:
+            index.match(channel)
+
+    def test_regex_scan(self):
+        regexes = self.regexes
+        for channel in self.channels:
+            channel = channel.decode('utf-8')
+            [r for r in regexes if r.match(channel)]
@@ -0,0 +1,98 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from pulsar import get_event_loop
+from pulsar.utils.structures import Dict, Zset, Deque
+from pulsar.apps.ds.snapshot import SnapshotWriter, SnapshotReader
+
+
+class Db:
+
+    def __init__(self, num, data):
+        self._num = num
+        self._data = data
+        self._keys = list(data)
+        self._expires = {}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Store:
+    list_type = Deque
+    hash_type = Dict
+    zset_type = Zset
+
+    def __init__(self, db):
+        self._loop = get_event_loop()
+        self.databases = {db._num: db}
+
+
+class TestSnapshot(unittest.TestCase):
+    '''Compare the binary snapshot format against pickle protocol 2
+    '''
+    __benchmark__ = True
+    __number__ = 10
+    _sizes = {'tiny': 10,
+              'small': 100,
+              'normal': 1000,
+              'big': 10000,
+              'huge': 100000}
+
+    @classmethod
+    def setUpClass(cls):
+        size = cls._sizes[cls.cfg.size]
+        data = {}
+        for n in range(size):
+            members = [('member%d:%d' % (n, m)).encode('utf-8')
+                       for m in range(20)]
+            data[('string%d' % n).encode('utf-8')] = bytearray(members[0])
+            data[('list%d' % n).encode('utf-8')] = Deque(members)
+            data[('set%d' % n).encode('utf-8')] = set(members)
+            data[('zset%d' % n).encode('utf-8')] = Zset(
+                (0.5*m, member) for m, member in enumerate(members))
+        cls.store = Store(Db(0, data))
+        cls.data = (2, [(0, data, {})])
+        cls.pickle_file = cls.temp()
+        cls.snapshot_file = cls.temp()
+        with open(cls.pickle_file, 'wb') as file:
+            pickle.dump(cls.data, file, protocol=2)
+        writer = SnapshotWriter(cls.store, cls.snapshot_file)
+        writer.step()
+        writer.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.pickle_file)
+        os.remove(cls.snapshot_file)
+
+    @classmethod
+    def temp(cls):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        return filename
+
+    def test_pickle_save(self):
+        with open(self.pickle_file, 'wb') as file:
+            pickle.dump(self.data, file, protocol=2)
+
+    def test_pickle_load(self):
+        with open(self.pickle_file, 'rb') as file:
+            pickle.load(file)
+
+    def test_snapshot_save(self):
+        writer = SnapshotWriter(self.store, self.snapshot_file)
+        writer.step()
+        writer.close()
+
+    def test_snapshot_load(self):
+        reader = SnapshotReader(self.snapshot_file)
+        for record in reader:
+            pass
+        reader.close()
+
+    def test_size(self):
+        self.assertTrue(os.path.getsize(self.snapshot_file) <
+                        os.path.getsize(self.pickle_file))
@@ -0,0 +1,42 @@
+import unittest
+
+from pulsar.utils.string import random_string
+from pulsar.apps.ds.streams import Stream
+
+
+class StreamBench(unittest.TestCase):
+    '''Append entries to a stream and read them back
+    '''
+    __benchmark__ = True
+    __number__ = 20
+    _sizes = {'tiny': 100,
+              'small': 1000,
+              'normal': 10000,
+              'big': 100000,
+              'huge': 1000000}
+
+    @classmethod
+    def setUpClass(cls):
+        size = cls._sizes[cls.cfg.size]
+        value = random_string(20, 20).encode('utf-8')
+        cls.entries = [(b'sensor', str(n % 100).encode('utf-8'),
+                        b'value', value) for n in range(size)]
+        cls.stream = cls.populate()
+
+    @classmethod
+    def populate(cls):
+        stream = Stream()
+        for entry in cls.entries:
+            stream.add(stream.next_id(), entry)
+        return stream
+
+    def test_add(self):
+        self.populate()
+
+    def test_range(self):
+        for _ in self.stream.range():
+            pass
+
+    def test_reverse_range(self):
+        for _ in self.stream.range(reverse=True):
+            pass
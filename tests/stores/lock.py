@@ -15,6 +15,7 @@ class RedisLockTests:
         eq = self.assertEqual
         lock = self.client.lock(key)
         self.assertEqual(lock.name, key)
+        self.assertEqual(lock.key, key)
         self.assertFalse(lock._token)
 
         eq(await lock.acquire(), True)
@@ -41,7 +42,7 @@ class RedisLockTests:
         eq = self.assertEqual
         lock = self.client.lock(key, timeout=10)
         eq(await lock.acquire(), True)
-        ttl = await self.client.ttl(lock.name)
+        ttl = await self.client.ttl(key)
         self.assertTrue(2 < ttl <= 10)
         eq(await lock.release(), True)
 
@@ -50,7 +51,7 @@ class RedisLockTests:
         eq = self.assertEqual
         lock = self.client.lock(key, timeout=9.5)
         eq(await lock.acquire(), True)
-        ttl = await self.client.pttl(lock.name)
+        ttl = await self.client.pttl(key)
         self.assertTrue(4000 < ttl <= 9500)
         eq(await lock.release(), True)
 
@@ -77,6 +78,66 @@ class RedisLockTests:
         self.assertTrue(5 > lock2._loop.time() - start > 0.5)
         eq(await lock2.release(), True)
 
+    async def test_release_notified(self):
+        key = self.randomkey()
+        eq = self.assertEqual
+        lock1 = self.client.lock(key)
+        lock2 = self.client.lock(key, blocking=5)
+        eq(await lock1.acquire(), True)
+        ensure_future(self._release(lock1, 0.3))
+        start = lock2._loop.time()
+        eq(await lock2.acquire(), True)
+        # woken by the release, not by polling
+        self.assertTrue(0.3 <= lock2._loop.time() - start < 0.5)
+        eq(await lock2.release(), True)
+
+    async def test_lease_expiry(self):
+        key = self.randomkey()
+        eq = self.assertEqual
+        lock1 = self.client.lock(key, timeout=0.3)
+        lock2 = self.client.lock(key, blocking=5)
+        eq(await lock1.acquire(), True)
+        start = lock2._loop.time()
+        eq(await lock2.acquire(), True)
+        self.assertTrue(0.2 < lock2._loop.time() - start < 1)
+        eq(await lock2.release(), True)
+
+    async def test_fencing_token(self):
+        key = self.randomkey()
+        eq = self.assertEqual
+        lock = self.client.lock(key, blocking=False)
+        eq(lock.fencing_token, None)
+        tokens = []
+        for _ in range(3):
+            eq(await lock.acquire(), True)
+            tokens.append(lock.fencing_token)
+            eq(await lock.release(), True)
+            eq(lock.fencing_token, None)
+        eq(tokens, sorted(set(tokens)))
+
+    async def test_auto_extend(self):
+        key = self.randomkey()
+        eq = self.assertEqual
+        lock = self.client.lock(key, timeout=0.3, auto_extend=True)
+        eq(await lock.acquire(), True)
+        await asyncio.sleep(0.6)
+        eq(await self.client.get(key), lock._token)
+        self.assertTrue(await lock.extend(10))
+        self.assertTrue(await self.client.pttl(key) > 1000)
+        eq(await lock.release(), True)
+        eq(await self.client.get(key), None)
+
+    async def test_auto_extend_lost(self):
+        key = self.randomkey()
+        lock = self.client.lock(key, timeout=0.3, auto_extend=True)
+        self.assertEqual(await lock.acquire(), True)
+        # another holder took the lock
+        await self.client.set(key, 'a')
+        await asyncio.sleep(0.3)
+        self.assertFalse(lock.locked())
+        self.assertEqual(lock.fencing_token, None)
+        self.assertEqual(await self.client.get(key), b'a')
+
     def test_high_sleep_min(self):
         lock = self.client.lock('foo', blocking=1, sleep=2)
         self.assertEqual(lock.sleep, 1)
@@ -0,0 +1,128 @@
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+from pulsar.utils.structures import Zset
+from pulsar.apps.ds.aof import absolute_timeouts
+
+from tests.stores.test_pulsards import ServerMixin
+
+
+class TestAbsoluteTimeouts(unittest.TestCase):
+
+    def test_expire(self):
+        now = 1000*time.time()
+        (command,) = absolute_timeouts(['expire', b'a', b'10'])
+        self.assertEqual(command[:2], (b'pexpireat', b'a'))
+        self.assertTrue(now + 9000 < command[2] < now + 11000)
+        (command,) = absolute_timeouts(['pexpire', b'a', b'10'])
+        self.assertTrue(now < command[2] < now + 1000)
+
+    def test_set(self):
+        set, expire = absolute_timeouts(['set', b'a', b'b', b'EX', b'10',
+                                         b'NX'])
+        self.assertEqual(set, [b'set', b'a', b'b', b'NX'])
+        self.assertEqual(expire[:2], (b'pexpireat', b'a'))
+        set, expire = absolute_timeouts(['setex', b'a', b'10', b'b'])
+        self.assertEqual(set, (b'set', b'a', b'b'))
+        self.assertEqual(expire[:2], (b'pexpireat', b'a'))
+        (set,) = absolute_timeouts(['set', b'a', b'b'])
+        self.assertEqual(set, [b'set', b'a', b'b'])
+
+    def test_other(self):
+        request = ['rpush', b'a', b'b']
+        self.assertEqual(absolute_timeouts(request), (request,))
+
+
+class TestAppendOnlyFile(ServerMixin, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+
+    @classmethod
+    async def tearDownClass(cls):
+        await super().tearDownClass()
+        shutil.rmtree(cls.dir)
+
+    async def client(self, filename):
+        cfg = await self.run_server('aof',
+                                    key_value_appendonly=True,
+                                    key_value_appendfilename=filename,
+                                    key_value_appendfsync='always')
+        return self.server_store(cfg, 3).client()
+
+    async def loaded(self, client):
+        while (await client.info())['loading']:
+            await asyncio.sleep(0.05)
+
+    async def populate(self, c):
+        eq = self.assertEqual
+        eq(await c.set('a', 'foo'), True)
+        eq(await c.append('a', 'bar'), 6)
+        self.assertTrue(await c.setex('b', 100, 'foo'))
+        eq(await c.set('c', 'foo'), True)
+        eq(await c.pexpire('c', 50), True)
+        eq(await c.rpush('l', 'a', 'b', 'c'), 3)
+        eq(await c.lpop('l'), b'a')
+        eq(await c.sadd('s', 'a', 'b'), 2)
+        eq(await c.spop('s') in (b'a', b'b'), True)
+        eq(await c.hmset('h', {'a': '1', 'b': '2'}), True)
+        eq(await c.zadd('z', 1, 'a', 2.5, 'b'), 2)
+        eq(await c.xadd('x', {'a': 1}, id='1-1'), b'1-1')
+        eq(await c.xadd('x', {'a': 2}, id='1-*'), b'1-2')
+        eq(await c.xadd('x', {'a': 3}, id='2', maxlen=2, approximate=False),
+           b'2-0')
+        eq(await c.execute('xgroup', 'create', 'x', 'g', '0'), b'OK')
+        eq(await c.xreadgroup('g', 'c1', {'x': '>'}, count=1),
+           [(b'x', [(b'1-2', {b'a': b'2'})])])
+        eq(await c.setnx('a', 'bla'), False)
+        await asyncio.sleep(0.1)
+
+    async def check(self, c, members):
+        eq = self.assertEqual
+        eq(await c.get('a'), b'foobar')
+        self.assertTrue(90 < await c.ttl('b') <= 100)
+        eq(await c.exists('c'), False)
+        eq(await c.lrange('l', 0, -1), [b'b', b'c'])
+        eq(await c.smembers('s'), members)
+        eq(await c.hgetall('h'), {b'a': b'1', b'b': b'2'})
+        eq(await c.zrange('z', 0, -1, withscores=True),
+           Zset(((1.0, b'a'), (2.5, b'b'))))
+        eq(await c.xrange('x'), [(b'1-2', {b'a': b'2'}),
+                                 (b'2-0', {b'a': b'3'})])
+        [[id, consumer, _, count]] = await c.execute('xpending', 'x', 'g',
+                                                     '-', '+', 10)
+        eq((id, consumer, int(count)), (b'1-2', b'c1', 1))
+        eq(await c.xreadgroup('g', 'c2', {'x': '>'}),
+           [(b'x', [(b'2-0', {b'a': b'3'})])])
+
+    async def test_replay(self):
+        filename = os.path.join(self.dir, 'replay.aof')
+        c = await self.client(filename)
+        await self.populate(c)
+        members = await c.smembers('s')
+        self.assertEqual(len(members), 1)
+        self.assertTrue(os.path.getsize(filename))
+        c = await self.client(filename)
+        await self.loaded(c)
+        await self.check(c, members)
+
+    async def test_rewrite(self):
+        filename = os.path.join(self.dir, 'rewrite.aof')
+        c = await self.client(filename)
+        await self.populate(c)
+        members = await c.smembers('s')
+        size = os.path.getsize(filename)
+        self.assertTrue(await c.execute('bgrewriteaof'))
+        self.assertEqual(await c.set('d', 'foo'), True)
+        while (await c.info())['aof_rewrite_in_progress']:
+            await asyncio.sleep(0.05)
+        self.assertTrue(os.path.getsize(filename) < size)
+        c = await self.client(filename)
+        await self.loaded(c)
+        await self.check(c, members)
+        self.assertEqual(await c.get('d'), b'foo')
@@ -0,0 +1,159 @@
+import asyncio
+import unittest
+
+from pulsar.utils.string import random_string
+from pulsar.apps.ds import ResponseError
+from pulsar.apps.ds.server import validate_keyspace_events
+
+from tests.stores.test_pulsards import Listener, ServerMixin
+
+
+class TestKeyspaceEvents(unittest.TestCase):
+
+    def test_validate(self):
+        self.assertEqual(validate_keyspace_events('KEA'), 'KEA')
+        self.assertEqual(validate_keyspace_events(None), '')
+        self.assertRaises(ValueError, validate_keyspace_events, 'Kq')
+
+
+class CacheMixin(ServerMixin):
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.app_cfg = await cls.run_server(
+            'cache', key_value_notify_keyspace_events='Kx')
+        cls.store = cls.server_store(cls.app_cfg, 6)
+        cls.client = cls.store.client()
+
+
+class TestKeyspaceNotifications(CacheMixin, unittest.TestCase):
+
+    async def test_notifications(self):
+        key = random_string()
+        pubsub = self.store.pubsub()
+        listener = Listener()
+        pubsub.add_client(listener)
+        await pubsub.psubscribe('__keyspace@6__:%s' % key,
+                                '__keyevent@6__:set')
+        await self.client.execute('config', 'set',
+                                  'notify-keyspace-events', 'KEA')
+        events = await self.client.execute('config', 'get',
+                                           'notify-keyspace-events')
+        self.assertEqual(events, b'KEA')
+        await self.client.set(key, 'a')
+        self.assertEqual(set([await listener.get(), await listener.get()]),
+                         set([('__keyspace@6__:%s' % key, b'set'),
+                              ('__keyevent@6__:set', key.encode('utf-8'))]))
+        await self.client.execute('config', 'set',
+                                  'notify-keyspace-events', 'Kx')
+        await self.client.pexpire(key, 10)
+        self.assertEqual(await listener.get(),
+                         ('__keyspace@6__:%s' % key, b'expired'))
+        await pubsub.close()
+
+
+class TestClientCache(CacheMixin, unittest.TestCase):
+
+    def create_client(self, size=100, ttl=None, db=6):
+        store = self.server_store(self.app_cfg, db, cache=size,
+                                  cache_ttl=ttl)
+        return store.client()
+
+    async def invalidated(self, cache, key):
+        for _ in range(100):
+            if key not in cache._keys:
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    async def test_cache(self):
+        client = self.create_client()
+        cache = client.store.cache
+        key = random_string()
+        await self.client.set(key, 'a')
+        self.assertEqual(await client.get(key), b'a')
+        self.assertTrue(cache.subscribed)
+        self.assertEqual(await client.get(key), b'a')
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        # the cache enabled the notifications it needs
+        events = await self.client.execute('config', 'get',
+                                           'notify-keyspace-events')
+        self.assertTrue(b'K' in events and b'A' in events)
+        # a write of another client is notified
+        await self.client.set(key, 'b')
+        self.assertTrue(await self.invalidated(cache, key.encode('utf-8')))
+        self.assertEqual(await client.get(key), b'b')
+        # a write of the store invalidates immediately
+        await client.set(key, 'c')
+        self.assertEqual(await client.get(key), b'c')
+        info = cache.info()
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], 3)
+        await client.store.close()
+
+    async def test_config_refused(self):
+        client = self.create_client()
+        store = client.store
+        cache = store.cache
+        execute = store._execute
+        refused = []
+
+        async def _execute(*args, **options):
+            if args[0] == 'config':
+                refused.append(args)
+                raise ResponseError('ERR unknown command CONFIG')
+            return await execute(*args, **options)
+
+        store._execute = _execute
+        key = random_string()
+        await self.client.set(key, 'a')
+        self.assertEqual(await client.get(key), b'a')
+        self.assertFalse(cache.enabled)
+        self.assertFalse(cache.subscribed)
+        await self.client.set(key, 'b')
+        self.assertEqual(await client.get(key), b'b')
+        self.assertEqual(len(refused), 1)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.misses, 0)
+        await store.close()
+
+    async def test_mutable_replies(self):
+        client = self.create_client()
+        key = random_string()
+        await self.client.hmset(key, {'a': 1})
+        value = await client.hgetall(key)
+        value['b'] = 2
+        self.assertEqual(await client.hgetall(key), {b'a': b'1'})
+        await client.store.close()
+
+    async def test_size_and_ttl(self):
+        client = self.create_client(size=2, ttl=0.05)
+        cache = client.store.cache
+        keys = [random_string() for _ in range(3)]
+        for key in keys:
+            await client.get(key)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        await client.get(keys[2])
+        self.assertEqual(cache.hits, 1)
+        await asyncio.sleep(0.06)
+        await client.get(keys[2])
+        self.assertEqual(cache.hits, 1)
+        await client.store.close()
+
+    async def test_flush_and_pipeline(self):
+        client = self.create_client(db=7)
+        cache = client.store.cache
+        key = random_string()
+        await client.get(key)
+        await client.exists(key)
+        self.assertEqual(len(cache), 2)
+        pipe = client.pipeline()
+        pipe.set(key, 'a')
+        await pipe.commit()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(await client.get(key), b'a')
+        await client.store.flush()
+        self.assertEqual(len(cache), 0)
+        await client.store.close()
@@ -0,0 +1,205 @@
+import unittest
+
+import pulsar
+from pulsar import ImproperlyConfigured
+from pulsar.utils.string import random_string
+from pulsar.apps.ds import COMMANDS_INFO, PulsarDS, ResponseError, MovedError
+from pulsar.apps.ds.cluster import SLOTS, Cluster, key_slot, slot_ranges
+from pulsar.apps.ds.scripting import lupa
+from pulsar.apps.data import create_store
+
+from tests.stores.test_pulsards import ServerMixin
+
+
+class TestSlots(unittest.TestCase):
+
+    def test_key_slot(self):
+        self.assertEqual(key_slot(b'123456789'), 12739)
+        self.assertEqual(key_slot('123456789'), 12739)
+        self.assertEqual(key_slot(b'{user1000}.following'),
+                         key_slot(b'{user1000}.followers'))
+        self.assertEqual(key_slot(b'foo{}{bar}'), key_slot(b'foo{}{bar}'))
+        self.assertNotEqual(key_slot(b'foo{}{bar}'), key_slot(b'bar'))
+        self.assertEqual(key_slot(b'foo{{bar}}zap'), key_slot(b'{bar'))
+
+    def test_slot_ranges(self):
+        self.assertEqual(slot_ranges(1), [(0, SLOTS - 1)])
+        ranges = slot_ranges(3)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], SLOTS - 1)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end + 1, start)
+
+    def test_request_keys(self):
+        def keys(*request):
+            return list(COMMANDS_INFO[request[0]].request_keys(request))
+        self.assertEqual(keys('get', b'a'), [b'a'])
+        self.assertEqual(keys('del', b'a', b'b'), [b'a', b'b'])
+        self.assertEqual(keys('mset', b'a', b'1', b'b', b'2'), [b'a', b'b'])
+        self.assertEqual(keys('blpop', b'a', b'b', b'0'), [b'a', b'b'])
+        self.assertEqual(keys('rpoplpush', b'a', b'b'), [b'a', b'b'])
+        self.assertEqual(keys('zunionstore', b'd', b'2', b'a', b'b',
+                              b'weights', b'1', b'2'), [b'd', b'a', b'b'])
+        self.assertEqual(keys('sort', b'a', b'by', b'store', b'limit',
+                              b'0', b'5', b'store', b'd'), [b'a', b'd'])
+        self.assertEqual(keys('sort', b'a', b'get', b'#', b'desc'), [b'a'])
+        self.assertEqual(keys('ping'), [])
+        self.assertEqual(keys('keys', b'*'), [])
+
+    def test_check(self):
+        cluster = Cluster([('127.0.0.1', 6410), ('127.0.0.1', 6411)], 0)
+        local = [key for key in map(str, range(100))
+                 if key_slot(key) < SLOTS//2]
+        remote = [key for key in map(str, range(100))
+                  if key_slot(key) >= SLOTS//2]
+        self.assertEqual(cluster.check(local), None)
+        self.assertEqual(cluster.check(()), None)
+        message, prefix = cluster.check(remote[:2])
+        self.assertEqual(prefix, 'MOVED')
+        self.assertEqual(message, '%d 127.0.0.1:6411' % key_slot(remote[0]))
+        self.assertEqual(cluster.check([local[0], remote[0]])[1],
+                         'CROSSSLOT')
+        self.assertEqual(cluster.check([remote[0], local[0]])[1],
+                         'CROSSSLOT')
+
+
+class TestWorkers(unittest.TestCase):
+
+    async def test_workers_without_shards(self):
+        server = PulsarDS(name='workers%s' % random_string(6, 6).lower(),
+                          bind='127.0.0.1:0', workers=2,
+                          concurrency=self.cfg.concurrency)
+        with self.assertRaises(ImproperlyConfigured):
+            await pulsar.send('arbiter', 'run', server)
+
+
+class TestShardedServer(ServerMixin, unittest.TestCase):
+    app_cfg = None
+
+    @classmethod
+    async def setUpClass(cls):
+        if cls.cfg.concurrency != 'process':
+            raise unittest.SkipTest('sharding requires process workers')
+        # autoscaling does not change the number of shards
+        cls.app_cfg = await cls.run_server('cluster', key_value_shards=3,
+                                           max_workers=6,
+                                           autoscale_cooldown=0)
+        cls.addresses = cls.app_cfg.addresses
+        cls.store = cls.server_store(cls.app_cfg, 9, cluster=1)
+        cls.client = cls.store.client()
+
+    @classmethod
+    async def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            await cls.store.close()
+        await super().tearDownClass()
+
+    def keys(self, shard, number=1):
+        start, end = slot_ranges(len(self.addresses))[shard]
+        keys = []
+        while len(keys) < number:
+            key = self.randomkey()
+            if start <= key_slot(key) <= end:
+                keys.append(key)
+        return keys
+
+    def node(self, shard):
+        store = create_store('pulsar://%s:%s/9' % self.addresses[shard])
+        return store.client()
+
+    async def test_addresses(self):
+        self.assertEqual(len(self.addresses), 3)
+        self.assertEqual(len(set(self.addresses)), 3)
+        info = await pulsar.send(self.app_cfg.name, 'info')
+        self.assertEqual(info['actor']['workers'], 3)
+        self.assertFalse('autoscale' in info)
+
+    async def test_moved(self):
+        key, = self.keys(1)
+        node = self.node(0)
+        with self.assertRaises(MovedError) as cm:
+            await node.set(key, 'foo')
+        self.assertEqual(cm.exception.slot, key_slot(key))
+        self.assertEqual(cm.exception.address, tuple(self.addresses[1]))
+        self.assertEqual(await self.node(1).set(key, 'foo'), True)
+        self.assertEqual(await self.client.get(key), b'foo')
+
+    async def test_cross_slot(self):
+        key0, = self.keys(0)
+        key2, = self.keys(2)
+        with self.assertRaises(ResponseError):
+            await self.client.sunionstore(key0, key2)
+
+    async def test_pipeline(self):
+        key0, = self.keys(0)
+        key2, = self.keys(2)
+        pipe = self.client.pipeline()
+        pipe.set(key0, 'a')
+        pipe.set(key2, 'b')
+        with self.assertRaises(ResponseError) as cm:
+            await pipe.commit()
+        self.assertTrue(str(cm.exception).startswith('CROSSSLOT'))
+        self.assertEqual(await self.client.get(key0), None)
+        tag = '{%s}' % key2
+        pipe = self.client.pipeline()
+        pipe.set(tag + 'a', 'a')
+        pipe.set(tag + 'b', 'b')
+        self.assertEqual(await pipe.commit(), [True, True])
+        self.assertEqual(await self.node(2).get(tag + 'b'), b'b')
+
+    async def test_routing(self):
+        c = self.client
+        keys = [key for shard in range(3) for key in self.keys(shard, 3)]
+        for key in keys:
+            self.assertEqual(await c.set(key, key), True)
+        for key in keys:
+            self.assertEqual(await c.get(key), key.encode('utf-8'))
+        for shard, key in zip((0, 1, 2), keys[::3]):
+            self.assertEqual(await self.node(shard).get(key),
+                             key.encode('utf-8'))
+
+    async def test_multi_keys(self):
+        c = self.client
+        keys = [key for shard in range(3) for key in self.keys(shard, 2)]
+        keys.sort()
+        self.assertEqual(await c.mset(*[v for key in keys
+                                        for v in (key, key + 'v')]), True)
+        self.assertEqual(await c.mget(*(keys + ['missing'])),
+                         [(key + 'v').encode('utf-8') for key in keys] +
+                         [None])
+        self.assertEqual(await c.delete(*keys[:4]), 4)
+        self.assertEqual(await c.mget(*keys[3:5]), [None, b'%sv' % (
+            keys[4].encode('utf-8'))])
+
+    @unittest.skipUnless(lupa, 'Requires lupa')
+    async def test_lock(self):
+        name = self.randomkey()
+        lock = self.client.lock(name, blocking=False)
+        self.assertEqual(lock.key, '{%s}' % name)
+        self.assertEqual(await lock.acquire(), True)
+        self.assertEqual(await self.client.get(lock.key), lock._token)
+        self.assertEqual(await self.client.get('%s:fencing' % lock.key),
+                         b'%d' % lock.fencing_token)
+        self.assertEqual(await lock.release(), True)
+
+    async def test_close(self):
+        store = self.server_store(self.app_cfg, 9, cluster=1)
+        waiters = store.lock_waiters()
+        await waiters.subscribe(self.randomkey())
+        self.assertTrue(waiters._pubsub)
+        self.assertTrue(await store.client().ping())
+        await store.close()
+        self.assertEqual(waiters._pubsub, None)
+        self.assertTrue(all(pool.closed
+                            for pool in store._cluster._pools.values()))
+
+    async def test_cluster_slots(self):
+        slots = await self.store._cluster.slots()
+        self.assertEqual(len(slots), 3)
+        self.assertEqual([address for _, _, address in slots],
+                         [tuple(a) for a in self.addresses])
+        self.assertEqual(await self.client.execute('cluster', 'keyslot',
+                                                   '123456789'), 12739)
+        info = await self.node(2).info()
+        self.assertEqual(info['cluster_enabled'], 1)
+        self.assertEqual(info['cluster_my_shard'], 2)
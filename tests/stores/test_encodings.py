@@ -0,0 +1,228 @@
+import pickle
+import unittest
+
+from pulsar.apps.ds import ResponseError
+from pulsar.apps.ds.encodings import (Encodings, Listpack, Hash, List, Set,
+                                      SortedSet, as_int, encode)
+from pulsar.utils.structures import Dict, Deque, Zset
+
+from tests.stores import test_pulsards
+
+
+ENCODINGS = Encodings(4, 8, 4)
+
+
+class TestListpack(unittest.TestCase):
+
+    def test_items(self):
+        lp = Listpack((b'a', b'', b'bc', b'a'))
+        self.assertEqual(len(lp), 4)
+        self.assertEqual(list(lp), [b'a', b'', b'bc', b'a'])
+        self.assertEqual(lp[-1], b'a')
+        self.assertRaises(IndexError, lambda: lp[4])
+        lp[1] = b'xyz'
+        lp.insert(0, b'0')
+        lp.append(b'')
+        self.assertEqual(list(lp), [b'0', b'a', b'xyz', b'bc', b'a', b''])
+        del lp[1:3]
+        del lp[0]
+        self.assertEqual(list(lp), [b'bc', b'a', b''])
+        self.assertEqual(lp.nbytes, 3 + 4*4)
+
+    def test_find(self):
+        lp = Listpack((b'ab', b'b', b'', b'a', b'b'))
+        self.assertEqual(lp.find(b'b'), 1)
+        self.assertEqual(lp.find(b'a'), 3)
+        self.assertEqual(lp.find(b''), 2)
+        self.assertEqual(lp.find(b'ab'), 0)
+        self.assertEqual(lp.find(b'abb'), -1)
+        self.assertEqual(lp.find(b'b', 0, 2), 4)
+        self.assertEqual(lp.find(b'a', 0, 2), -1)
+
+
+class TestStructures(unittest.TestCase):
+
+    def test_as_int(self):
+        self.assertEqual(as_int(b'-35'), -35)
+        self.assertEqual(as_int(b'035'), None)
+        self.assertEqual(as_int(b' 3'), None)
+        self.assertEqual(as_int(b'a'), None)
+        self.assertEqual(as_int(str(2**63).encode('utf-8')), None)
+
+    def test_hash(self):
+        h = Hash(ENCODINGS, ((b'a', b'1'), (b'b', b'2')))
+        self.assertEqual(h.encoding, 'listpack')
+        h[b'a'] = b'3'
+        self.assertEqual(h.mget((b'a', b'c')), [b'3', None])
+        self.assertEqual(h.pop(b'b'), b'2')
+        self.assertEqual(h.pop(b'b', None), None)
+        h.update(((b'c', b'3'), (b'd', b'4'), (b'e', b'5')))
+        self.assertEqual(h.encoding, 'listpack')
+        h[b'f'] = b'6'
+        self.assertEqual(h.encoding, 'hashtable')
+        self.assertEqual(dict(h.items()), {b'a': b'3', b'c': b'3',
+                                           b'd': b'4', b'e': b'5',
+                                           b'f': b'6'})
+        h = Hash(ENCODINGS)
+        h[b'f'] = b'123456789'
+        self.assertEqual(h.encoding, 'hashtable')
+        self.assertEqual(h[b'f'], b'123456789')
+
+    def test_list(self):
+        li = List(ENCODINGS, (b'a', b'b'))
+        li.extendleft((b'c', b'd'))
+        self.assertEqual(list(li), [b'd', b'c', b'a', b'b'])
+        self.assertEqual(li.encoding, 'listpack')
+        li.insert_after(b'c', b'e')
+        self.assertEqual(li.encoding, 'linkedlist')
+        self.assertEqual(list(li), [b'd', b'c', b'e', b'a', b'b'])
+        li = List(ENCODINGS, (b'a', b'b', b'a', b'c'))
+        self.assertEqual(li.remove(b'a', -1), 1)
+        self.assertEqual(list(li), [b'a', b'b', b'c'])
+        li.trim(1, 3)
+        self.assertEqual(list(li), [b'b', b'c'])
+        self.assertEqual((li.pop(), li.popleft(), len(li)), (b'c', b'b', 0))
+
+    def test_set(self):
+        s = Set(ENCODINGS, (b'3', b'-1', b'3'))
+        self.assertEqual(s.encoding, 'intset')
+        self.assertEqual(list(s), [b'-1', b'3'])
+        self.assertTrue(b'3' in s)
+        self.assertFalse(b'03' in s)
+        s.difference_update((b'3', b'4'))
+        self.assertEqual(len(s), 1)
+        s.add(b'x')
+        self.assertEqual(s.encoding, 'hashtable')
+        self.assertEqual(s.members(), set((b'-1', b'x')))
+        s = Set(ENCODINGS, map(str.encode, map(str, range(5))))
+        self.assertEqual(s.encoding, 'hashtable')
+        self.assertEqual(len(s), 5)
+
+    def test_sorted_set(self):
+        z = SortedSet(ENCODINGS, ((2, b'b'), (1, b'a'), (2, b'c')))
+        self.assertEqual(z.encoding, 'listpack')
+        self.assertEqual(list(z.items()), [(1, b'a'), (2, b'b'), (2, b'c')])
+        self.assertEqual(z.add(3, b'a'), 0)
+        self.assertEqual(list(z), [b'b', b'c', b'a'])
+        self.assertEqual(z.count(2, 3, False, True), 1)
+        self.assertEqual(list(z.range_by_score(2, 3, start=1, num=1)),
+                         [b'c'])
+        self.assertEqual(z.rank(b'c'), 1)
+        self.assertEqual(z.remove_range(0, 1), 1)
+        self.assertEqual(z.add(4, b'd'), 1)
+        self.assertEqual(z.add(5, b'e'), 1)
+        self.assertEqual(z.encoding, 'listpack')
+        self.assertEqual(z.add(6, b'f'), 1)
+        self.assertEqual(z.encoding, 'skiplist')
+        self.assertEqual(list(z), [b'c', b'a', b'd', b'e', b'f'])
+
+    def test_aggregate(self):
+        z1 = SortedSet(ENCODINGS, ((1, b'a'), (2, b'b')))
+        z2 = SortedSet(ENCODINGS, ((3, b'b'), (4, b'c')))
+        union = SortedSet.union(ENCODINGS, (z1, z2), (1, 2), sum)
+        self.assertEqual(list(union.items()),
+                         [(1, b'a'), (8, b'b'), (8, b'c')])
+        inter = SortedSet.inter(ENCODINGS, (z1, z2), (1, 1), max)
+        self.assertEqual(list(inter.items()), [(3, b'b')])
+
+    def test_encode(self):
+        h = encode(ENCODINGS, Dict(((b'a', b'1'),)))
+        self.assertEqual((h.encoding, h[b'a']), ('listpack', b'1'))
+        self.assertEqual(encode(ENCODINGS, Deque((b'a',))).encoding,
+                         'listpack')
+        self.assertEqual(encode(ENCODINGS, set((b'a',))).encoding,
+                         'hashtable')
+        z = encode(ENCODINGS, Zset(((1, b'a'),)))
+        self.assertEqual(z.score(b'a'), 1)
+        self.assertEqual(encode(ENCODINGS, h), h)
+
+    def test_pickle(self):
+        for value in (Hash(ENCODINGS, ((b'a', b'1'),)),
+                      List(ENCODINGS, (b'a', b'b')),
+                      Set(ENCODINGS, (b'1',)),
+                      SortedSet(ENCODINGS, ((1, b'a'),))):
+            copy = pickle.loads(pickle.dumps(value))
+            self.assertEqual(type(copy), type(value))
+            self.assertEqual(list(copy), list(value))
+
+
+class TestObjectEncoding(test_pulsards.ServerMixin, test_pulsards.StoreMixin,
+                         unittest.TestCase):
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.app_cfg = await cls.run_server(key_value_listpack_entries=4,
+                                           key_value_listpack_value=8,
+                                           key_value_intset_entries=4)
+        cls.store = cls.create_store(cls.server_url(cls.app_cfg, 9))
+        cls.client = cls.store.client()
+
+    def encoding(self, key):
+        return self.client.execute('object', 'encoding', key)
+
+    async def test_strings(self):
+        key = self.randomkey()
+        self.assertEqual(await self.encoding(key), None)
+        await self.client.set(key, 100)
+        self.assertEqual(await self.encoding(key), b'int')
+        await self.client.set(key, 'foo')
+        self.assertEqual(await self.encoding(key), b'embstr')
+        await self.client.set(key, 'x'*45)
+        self.assertEqual(await self.encoding(key), b'raw')
+        self.assertEqual(await self.client.execute('object', 'refcount',
+                                                   key), 1)
+        with self.assertRaises(ResponseError):
+            await self.client.execute('object', 'foo', key)
+
+    async def test_hash(self):
+        c = self.client
+        key = self.randomkey()
+        await c.hmset(key, {'a': 1, 'b': 2})
+        self.assertEqual(await self.encoding(key), b'listpack')
+        self.assertEqual(await c.hincrby(key, 'a', 5), 6)
+        await c.hset(key, 'c', 'x'*9)
+        self.assertEqual(await self.encoding(key), b'hashtable')
+        self.assertEqual(await c.hgetall(key), {b'a': b'6', b'b': b'2',
+                                                b'c': b'x'*9})
+
+    async def test_list(self):
+        c = self.client
+        key = self.randomkey()
+        await c.rpush(key, 'a', 'b', 'c', 'd')
+        self.assertEqual(await self.encoding(key), b'listpack')
+        await c.lpush(key, 'e')
+        self.assertEqual(await self.encoding(key), b'linkedlist')
+        self.assertEqual(await c.lrange(key, 0, -1),
+                         [b'e', b'a', b'b', b'c', b'd'])
+
+    async def test_set(self):
+        c = self.client
+        key = self.randomkey()
+        await c.sadd(key, 1, 2, 3)
+        self.assertEqual(await self.encoding(key), b'intset')
+        await c.sadd(key, 'a')
+        self.assertEqual(await self.encoding(key), b'hashtable')
+        self.assertEqual(await c.smembers(key),
+                         set((b'1', b'2', b'3', b'a')))
+
+    async def test_sorted_set(self):
+        c = self.client
+        key = self.randomkey()
+        await c.zadd(key, 1, 'a', 2, 'b')
+        self.assertEqual(await self.encoding(key), b'listpack')
+        await c.zadd(key, 3, 'c', 4, 'd', 5, 'e')
+        self.assertEqual(await self.encoding(key), b'skiplist')
+        self.assertEqual(await c.zrange(key, 0, -1),
+                         [b'a', b'b', b'c', b'd', b'e'])
+
+
+class TestPulsarStoreFullEncodings(test_pulsards.TestPulsarStore):
+    '''Run the command tests with compact encodings disabled
+    '''
+    @classmethod
+    async def setUpClass(cls):
+        cls.app_cfg = await cls.run_server(key_value_listpack_entries=0,
+                                           key_value_intset_entries=0)
+        cls.pulsards_uri = 'pulsar://%s:%s' % cls.app_cfg.addresses[0]
+        cls.store = cls.create_store('%s/9' % cls.pulsards_uri)
+        cls.client = cls.store.client()
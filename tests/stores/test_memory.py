@@ -0,0 +1,131 @@
+import unittest
+
+from pulsar.apps.ds import ResponseError
+from pulsar.apps.ds.encodings import Encodings, Hash
+from pulsar.apps.ds.memory import (LFU_INIT_VAL, STRING_SIZE, sizeof,
+                                   lfu_increment)
+from pulsar.apps.ds.server import validate_memory
+from tests.stores.test_pulsards import ServerMixin, Listener
+
+
+class TestAccounting(unittest.TestCase):
+
+    def test_sizeof(self):
+        self.assertEqual(sizeof(bytearray(b'foo')), STRING_SIZE + 3)
+        h = Hash(Encodings(4, 8, 4), ((b'a', b'1'),))
+        size = sizeof(h)
+        h[b'b'] = b'2'
+        self.assertTrue(sizeof(h) > size)
+        h[b'c'] = b'x'*20
+        self.assertEqual(h.encoding, 'hashtable')
+        size = sizeof(h)
+        h[b'd'] = b'4'
+        self.assertTrue(sizeof(h) > size)
+
+    def test_lfu_increment(self):
+        self.assertEqual(lfu_increment(LFU_INIT_VAL, 10), LFU_INIT_VAL + 1)
+        self.assertEqual(lfu_increment(255, 0), 255)
+        counter = LFU_INIT_VAL
+        for _ in range(1000):
+            counter = lfu_increment(counter, 10)
+        self.assertTrue(LFU_INIT_VAL < counter < 40)
+
+    def test_validate_memory(self):
+        self.assertEqual(validate_memory('100'), 100)
+        self.assertEqual(validate_memory('2kb'), 2048)
+        self.assertEqual(validate_memory('1MB'), 1024*1024)
+        self.assertEqual(validate_memory(0), 0)
+        self.assertRaises(ValueError, validate_memory, 'foo')
+
+
+class TestEviction(ServerMixin, unittest.TestCase):
+
+    async def server(self, policy, maxmemory='4kb', **params):
+        cfg = await self.run_server('memory',
+                                    key_value_maxmemory=maxmemory,
+                                    key_value_maxmemory_policy=policy,
+                                    **params)
+        return self.server_store(cfg, 3).client()
+
+    async def fill(self, client, prefix, number, **params):
+        for i in range(number):
+            await client.set('%s%s' % (prefix, i), 'x'*100, **params)
+
+    async def test_allkeys_lru(self):
+        c = await self.server('allkeys-lru', key_value_maxmemory_samples=100)
+        await self.fill(c, 'a', 15)
+        self.assertEqual(await c.get('a0'), b'x'*100)
+        await self.fill(c, 'b', 5)
+        info = await c.info()
+        self.assertTrue(info['evicted_keys'] > 0)
+        self.assertEqual(info['maxmemory'], 4096)
+        self.assertEqual(info['maxmemory_policy'], 'allkeys-lru')
+        self.assertTrue(await c.dbsize() < 20)
+        self.assertEqual(await c.get('a1'), None)
+        self.assertEqual(await c.get('a0'), b'x'*100)
+        self.assertEqual(await c.get('b4'), b'x'*100)
+        self.assertEqual(await c.execute('object', 'idletime', 'a0'), 0)
+        with self.assertRaises(ResponseError):
+            await c.execute('object', 'freq', 'a0')
+
+    async def test_allkeys_lfu(self):
+        c = await self.server('allkeys-lfu', key_value_maxmemory_samples=100)
+        await self.fill(c, 'a', 10)
+        for _ in range(100):
+            await c.get('a5')
+        self.assertTrue(await c.execute('object', 'freq', 'a5') >
+                        LFU_INIT_VAL + 1)
+        await self.fill(c, 'b', 20)
+        self.assertTrue((await c.info())['evicted_keys'] > 0)
+        self.assertEqual(await c.get('a5'), b'x'*100)
+        with self.assertRaises(ResponseError):
+            await c.execute('object', 'idletime', 'a5')
+
+    async def test_volatile_ttl(self):
+        c = await self.server('volatile-ttl', key_value_maxmemory_samples=100)
+        await c.set('persistent', 'x'*100)
+        for i in range(10):
+            await c.set('v%s' % i, 'x'*100, ex=100 + i)
+        await self.fill(c, 'a', 8)
+        self.assertEqual(await c.get('persistent'), b'x'*100)
+        self.assertEqual(await c.get('v0'), None)
+        self.assertEqual(await c.get('v9'), b'x'*100)
+        # no key with a timeout left
+        with self.assertRaises(ResponseError):
+            await self.fill(c, 'b', 20)
+        self.assertEqual(await c.get('persistent'), b'x'*100)
+
+    async def test_evicted_notification(self):
+        cfg = await self.run_server('memory',
+                                    key_value_maxmemory='4kb',
+                                    key_value_maxmemory_policy='allkeys-lru',
+                                    key_value_notify_keyspace_events='KEA')
+        store = self.server_store(cfg, 0)
+        c = store.client()
+        pubsub = store.pubsub()
+        listener = Listener()
+        pubsub.add_client(listener)
+        await pubsub.psubscribe('__keyspace@0__:*')
+        await self.fill(c, 'a', 30)
+        events = []
+        while len(events) < 31:
+            channel, event = await listener.get()
+            events.append(event)
+            if event == b'evicted':
+                break
+        self.assertEqual(events[-1], b'evicted')
+        self.assertFalse(b'del' in events)
+        await pubsub.close()
+
+    async def test_noeviction(self):
+        c = await self.server('noeviction')
+        with self.assertRaises(ResponseError) as cm:
+            await self.fill(c, 'a', 30)
+        self.assertTrue('maxmemory' in str(cm.exception))
+        self.assertEqual((await c.info())['evicted_keys'], 0)
+        # commands freeing memory are allowed
+        self.assertEqual(await c.delete('a0', 'a1', 'a2'), 3)
+        await c.flushdb()
+        info = await c.info()
+        self.assertEqual(info['used_memory'], 0)
+        self.assertEqual(await c.set('a', 'foo'), True)
@@ -0,0 +1,56 @@
+import unittest
+
+from pulsar.apps.ds.pubsub import PatternIndex
+
+
+class TestPatternIndex(unittest.TestCase):
+
+    def index(self, *patterns):
+        index = PatternIndex(cache_size=2)
+        for pattern in patterns:
+            index.add(pattern)
+        return index
+
+    def matched(self, index, channel):
+        return sorted(p.pattern for p in index.match(channel))
+
+    def test_match(self):
+        index = self.index(b'news.*', b'news.sport', b'n*s', b'*',
+                           b'news.s*', b'h[ae]llo')
+        self.assertEqual(len(index), 6)
+        self.assertEqual(self.matched(index, b'news.sport'),
+                         [b'*', b'news.*', b'news.s*', b'news.sport'])
+        self.assertEqual(self.matched(index, b'newsXsport'), [b'*'])
+        self.assertEqual(self.matched(index, b'news'), [b'*', b'n*s'])
+        self.assertEqual(self.matched(index, b'hallo'), [b'*', b'h[ae]llo'])
+        self.assertEqual(self.matched(index, b''), [b'*'])
+
+    def test_escape(self):
+        index = self.index(b'a\\*b', b'a?b')
+        self.assertEqual(self.matched(index, b'a*b'), [b'a?b', b'a\\*b'])
+        self.assertEqual(self.matched(index, b'axb'), [b'a?b'])
+
+    def test_remove(self):
+        index = self.index(b'news.*', b'news.sport*', b'news', b'n?ws')
+        self.assertEqual(self.matched(index, b'news.sport'),
+                         [b'news.*', b'news.sport*'])
+        index.remove(b'news.*')
+        self.assertEqual(self.matched(index, b'news.sport'),
+                         [b'news.sport*'])
+        index.remove(b'news.sport*')
+        self.assertEqual(self.matched(index, b'news'), [b'n?ws', b'news'])
+        index.remove(b'news')
+        index.remove(b'n?ws')
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index._trie, {})
+        self.assertEqual(self.matched(index, b'news'), [])
+
+    def test_cache(self):
+        index = self.index(b'a*')
+        first = index.match(b'ab')
+        self.assertTrue(index.match(b'ab') is first)
+        index.match(b'ac')
+        index.match(b'ad')
+        self.assertTrue(len(index._cache) <= 2)
+        index.add(b'ab')
+        self.assertEqual(self.matched(index, b'ab'), [b'a*', b'ab'])
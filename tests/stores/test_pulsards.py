@@ -9,6 +9,7 @@ from pulsar.utils.string import random_string
 from pulsar.utils.structures import Zset
 from pulsar.apps.ds import PulsarDS, redis_parser, ResponseError
 from pulsar.apps.data import create_store
+from pulsar.apps.data.redis.pubsub import PubSubFanIn
 
 
 class Listener:
@@ -34,11 +35,17 @@ class StringProtocol:
 
 class StoreMixin:
     redis_py_parser = False
+    multiplex = 0
+    shared_pubsub = False
 
     @classmethod
     def create_store(cls, address, namespace=None, pool_size=2, **kw):
         if cls.redis_py_parser:
             kw['parser_class'] = redis_parser(True)
+        if cls.multiplex:
+            kw.setdefault('multiplex', cls.multiplex)
+        if cls.shared_pubsub:
+            kw.setdefault('shared_pubsub', cls.shared_pubsub)
         if not namespace:
             namespace = cls.randomkey(6).lower()
         return create_store(address, namespace=namespace,
@@ -59,12 +66,73 @@ class StoreMixin:
         self.assertEqual(await c.sadd(key, 'bla'), 1)
 
 
+class ServerMixin:
+    '''Run :class:`.PulsarDS` servers for a test class, they are killed
+    when the class is torn down
+    '''
+    app_cfgs = None
+
+    @classmethod
+    def randomkey(cls, length=None):
+        return random_string(min_length=length, max_length=length)
+
+    @classmethod
+    async def run_server(cls, prefix=None, **params):
+        '''Run a server named after ``prefix``, the class name by default,
+        and return its configuration
+        '''
+        if cls.__dict__.get('app_cfgs') is None:
+            cls.app_cfgs = []
+        params.setdefault('bind', '127.0.0.1:0')
+        params.setdefault('concurrency', cls.cfg.concurrency)
+        name = '%s%s' % (prefix or cls.__name__.lower(),
+                         cls.randomkey(6).lower())
+        cfg = await pulsar.send('arbiter', 'run', PulsarDS(name=name,
+                                                           **params))
+        cls.app_cfgs.append(cfg)
+        return cfg
+
+    @classmethod
+    def server_url(cls, cfg, db):
+        return 'pulsar://%s:%s/%s' % (cfg.addresses[0] + (db,))
+
+    @classmethod
+    def server_store(cls, cfg, db, **kw):
+        '''A store connected to database ``db`` of the server ``cfg``
+        '''
+        return create_store(cls.server_url(cfg, db), **kw)
+
+    @classmethod
+    async def tearDownClass(cls):
+        app_cfgs = cls.__dict__.get('app_cfgs')
+        cls.app_cfgs = None
+        if app_cfgs:
+            await asyncio.gather(*[pulsar.send('arbiter', 'kill_actor',
+                                               cfg.name)
+                                   for cfg in app_cfgs])
+
+
 class RedisCommands(StoreMixin):
 
     def test_store(self):
         store = self.store
         self.assertTrue(store.namespace)
 
+    async def test_pool_stats(self):
+        store = self.create_store(self.store.dns, pool_min_size=2,
+                                  pool_idle_timeout=30)
+        self.assertTrue('pool_min_size=2' in store.dns)
+        self.assertEqual(store.pool.min_size, 2)
+        pipe = store.pipeline()
+        pipe.ping()
+        self.assertEqual(await pipe.commit(), [True])
+        stats = list(store.pool_stats().values())
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['checkouts'], 1)
+        self.assertEqual(stats[0]['in_use'], 0)
+        self.assertTrue(stats[0]['opened'] >= 1)
+        await store.close()
+
     ###########################################################################
     #    KEYS
     async def test_dump_restore(self):
@@ -103,6 +171,23 @@ class RedisCommands(StoreMixin):
         eq(await c.ttl(key), -1)
         eq(await c.persist(key), False)
 
+    async def test_expire_remove_key(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.set(key, 'hello', px=100), True)
+        eq(await c.exists(key), True)
+        await asyncio.sleep(0.2)
+        eq(await c.exists(key), False)
+        eq(await c.get(key), None)
+        eq(await c.ttl(key), -2)
+        eq(await c.set(key, 'hello'), True)
+        eq(await c.pexpire(key, 100), True)
+        eq(await c.persist(key), True)
+        await asyncio.sleep(0.2)
+        eq(await c.get(key), b'hello')
+        eq(await c.delete(key), 1)
+
     async def test_expireat(self):
         key = self.randomkey()
         c = self.client
@@ -135,6 +220,67 @@ class RedisCommands(StoreMixin):
         self.assertEqual(set(k1), keys_with_underscores)
         self.assertEqual(set(k2), keys)
 
+    async def test_scan(self):
+        key = self.randomkey()
+        c = self.client
+        keys = set(('%s_%d' % (key, n)).encode('utf-8') for n in range(30))
+        for k in keys:
+            await c.set(k, 'x')
+        await c.sadd('%s_set' % key, 'a')
+        found = []
+        cursor = None
+        while cursor != 0:
+            cursor, result = await c.scan(cursor or 0, match='%s_*' % key,
+                                          count=7)
+            found.extend(result)
+        self.assertEqual(len(found), 31)
+        self.assertTrue(keys.issubset(set(found)))
+        cursor, result = await c.scan(0, match='%s_set' % key, count=10000,
+                                      type='set')
+        self.assertEqual(cursor, 0)
+        self.assertEqual(result, [('%s_set' % key).encode('utf-8')])
+        await self.wait.assertRaises(ResponseError, c.scan, 'bla')
+
+    async def test_scan_delete_keys(self):
+        key = self.randomkey()
+        c = self.client
+        keys = [('%s_%d' % (key, n)).encode('utf-8') for n in range(20)]
+        for k in keys:
+            await c.set(k, 'x')
+        found = set()
+        cursor, result = await c.scan(0, match='%s_*' % key, count=5)
+        found.update(result)
+        for k in keys[:10]:
+            if k not in found:
+                await c.delete(k)
+        await c.set('%s_new' % key, 'x')
+        while cursor != 0:
+            cursor, result = await c.scan(cursor, match='%s_*' % key,
+                                          count=5)
+            found.update(result)
+        self.assertTrue(set(keys[10:]).issubset(found))
+
+    async def test_scan_churn(self):
+        # the key log is compacted during the iteration
+        key = self.randomkey()
+        c = self.client
+        keys = set(('%s_%d' % (key, n)).encode('utf-8') for n in range(20))
+        for k in keys:
+            await c.set(k, 'x')
+        found = set()
+        cursor, result = await c.scan(0, match='%s_*' % key, count=5)
+        found.update(result)
+        while cursor != 0:
+            pipe = c.pipeline()
+            for n in range(1500):
+                pipe.set('%s:churn%d' % (key, n), 'x')
+                pipe.delete('%s:churn%d' % (key, n))
+            await pipe.commit()
+            cursor, result = await c.scan(cursor, match='%s_*' % key,
+                                          count=5)
+            found.update(result)
+        self.assertEqual(found, keys)
+
     async def test_move(self):
         key = self.randomkey()
         c = self.client
@@ -571,6 +717,23 @@ class RedisCommands(StoreMixin):
         await self.wait.assertRaises(ResponseError, c.hlen, key)
         await self.wait.assertRaises(ResponseError, c.hmget, key, 'f1', 'f2')
 
+    async def test_hscan(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.hscan(key), (0, {}))
+        await c.hmset(key, dict((('f%d' % n, n) for n in range(200))))
+        data = {}
+        cursor = None
+        while cursor != 0:
+            cursor, result = await c.hscan(key, cursor or 0, count=30)
+            data.update(result)
+        eq(len(data), 200)
+        eq(data[b'f5'], b'5')
+        cursor, result = await c.hscan(key, match='f1?', count=1000)
+        eq(cursor, 0)
+        eq(len(result), 10)
+
     async def test_hsetnx(self):
         key = self.randomkey()
         eq = self.assertEqual
@@ -640,6 +803,60 @@ class RedisCommands(StoreMixin):
         eq(await c.rpush(key1, ''), 1)
         eq(await c.brpoplpush(key1, key2), b'')
 
+    async def test_blpop_fifo(self):
+        key = self.randomkey()
+        bkey = key.encode('utf-8')
+        eq = self.assertEqual
+        store = self.create_store(self.store.dns, pool_size=4)
+        c = store.client()
+        waiters = []
+        for _ in range(3):
+            waiters.append(asyncio.ensure_future(c.blpop(key, 5)))
+            await asyncio.sleep(0.1)
+        # one element for each of the first two clients to block
+        eq(await self.client.rpush(key, 'a', 'b'), 2)
+        eq(await waiters[0], (bkey, b'a'))
+        eq(await waiters[1], (bkey, b'b'))
+        self.assertFalse(waiters[2].done())
+        eq(await self.client.rpush(key, 'c'), 1)
+        eq(await waiters[2], (bkey, b'c'))
+        eq(await self.client.exists(key), False)
+
+    async def test_blmove(self):
+        key1 = self.randomkey()
+        key2 = key1 + 'x'
+        eq = self.assertEqual
+        c = self.client
+        eq(await c.rpush(key1, 1, 2), 2)
+        eq(await c.blmove(key1, key2, 'left', 'right', 1), b'1')
+        eq(await c.blmove(key1, key2, 'RIGHT', 'LEFT', 1), b'2')
+        eq(await c.blmove(key1, key2, 'left', 'left', 0.1), None)
+        eq(await c.lrange(key2, 0, -1), [b'2', b'1'])
+        await self.wait.assertRaises(ResponseError, c.blmove, key1, key2,
+                                     'up', 'left', 1)
+        waiter = asyncio.ensure_future(
+            self.create_store(self.store.dns).client().blmove(
+                key1, key2, 'left', 'right', 5))
+        await asyncio.sleep(0.1)
+        eq(await c.rpush(key1, 3), 1)
+        eq(await waiter, b'3')
+        eq(await c.lrange(key2, 0, -1), [b'2', b'1', b'3'])
+
+    async def test_lmove(self):
+        key1 = self.randomkey()
+        key2 = key1 + 'x'
+        eq = self.assertEqual
+        c = self.client
+        eq(await c.lmove(key1, key2, 'left', 'left'), None)
+        eq(await c.rpush(key1, 1, 2, 3), 3)
+        eq(await c.lmove(key1, key2, 'left', 'left'), b'1')
+        eq(await c.lmove(key1, key2, 'right', 'right'), b'3')
+        eq(await c.lmove(key1, key1, 'left', 'right'), b'2')
+        eq(await c.lrange(key1, 0, -1), [b'2'])
+        eq(await c.lrange(key2, 0, -1), [b'1', b'3'])
+        await self.wait.assertRaises(ResponseError, c.lmove, key1, key2,
+                                     'left', 'middle')
+
     async def test_lindex_llen(self):
         key = self.randomkey()
         c = self.client
@@ -935,6 +1152,24 @@ class RedisCommands(StoreMixin):
         eq(await c.srem(key, 2, 4), 2)
         eq(await c.smembers(key), set([b'1', b'3']))
 
+    async def test_sscan(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        members = set((str(n).encode('utf-8') for n in range(300)))
+        await c.sadd(key, *members)
+        found = set()
+        cursor, result = await c.sscan(key, count=100)
+        found.update(result)
+        await c.srem(key, *(m for m in list(members)[:100]
+                            if m not in found))
+        await c.sadd(key, 'new')
+        while cursor != 0:
+            cursor, result = await c.sscan(key, cursor, count=100)
+            found.update(result)
+        self.assertTrue(found.issuperset(await c.smembers(key) - {b'new'}))
+        eq(await c.sscan(key + 'x'), (0, []))
+
     async def test_sunion(self):
         key = self.randomkey()
         key2 = key + '2'
@@ -960,6 +1195,39 @@ class RedisCommands(StoreMixin):
 
     ###########################################################################
     #    SORTED SETS
+    async def test_bzpopmin_bzpopmax(self):
+        key1 = self.randomkey()
+        key2 = key1 + 'x'
+        bk1 = key1.encode('utf-8')
+        bk2 = key2.encode('utf-8')
+        eq = self.assertEqual
+        c = self.client
+        eq(await c.zadd(key2, a1=1, a2=2, a3=3), 3)
+        eq(await c.bzpopmin((key1, key2), 1), (bk2, b'a1', 1.0))
+        eq(await c.bzpopmax((key1, key2), 1), (bk2, b'a3', 3.0))
+        eq(await c.bzpopmax((key1, key2), 1), (bk2, b'a2', 2.0))
+        eq(await c.bzpopmin((key1, key2), 0.1), None)
+        waiter = asyncio.ensure_future(
+            self.create_store(self.store.dns).client().bzpopmin(key1, 5))
+        await asyncio.sleep(0.1)
+        eq(await c.zadd(key1, a4=4, a5=5), 2)
+        eq(await waiter, (bk1, b'a4', 4.0))
+        eq(await c.zrange(key1, 0, -1), [b'a5'])
+        await self._remove_and_push(key1)
+        await self.wait.assertRaises(ResponseError, c.bzpopmin, key1, 1)
+
+    async def test_zpopmin_zpopmax(self):
+        key = self.randomkey()
+        eq = self.assertEqual
+        c = self.client
+        eq(await c.zpopmin(key), [])
+        eq(await c.zadd(key, a1=1, a2=2, a3=3, a4=4), 4)
+        eq(await c.zpopmin(key), [(b'a1', 1.0)])
+        eq(await c.zpopmax(key, 2), [(b'a4', 4.0), (b'a3', 3.0)])
+        eq(await c.zpopmax(key, 5), [(b'a2', 2.0)])
+        eq(await c.exists(key), False)
+        await self.wait.assertRaises(ResponseError, c.zpopmin, key, -1)
+
     async def test_zadd_zcard(self):
         key = self.randomkey()
         eq = self.assertEqual
@@ -1045,6 +1313,17 @@ class RedisCommands(StoreMixin):
         eq(await c.zrange(des, 0, -1, withscores=True),
            Zset(((20.0, b'a3'), (23.0, b'a1'))))
 
+    async def test_zscan(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.zadd(key, 1, 'a', 2, 'b', 3.5, 'c'), 3)
+        cursor, result = await c.zscan(key)
+        eq(cursor, 0)
+        eq(sorted(result), [(b'a', 1.0), (b'b', 2.0), (b'c', 3.5)])
+        cursor, result = await c.zscan(key, match='[ab]')
+        eq(sorted(result), [(b'a', 1.0), (b'b', 2.0)])
+
     async def test_zrange(self):
         key = self.randomkey()
         eq = self.assertEqual
@@ -1110,6 +1389,146 @@ class RedisCommands(StoreMixin):
         eq(await c.zremrangebyscore(key, 2, 4), 0)
         eq(await c.zrange(key, 0, -1), [b'a1', b'a5'])
 
+    ###########################################################################
+    #    STREAMS
+    async def test_xadd_xrange(self):
+        key = self.randomkey()
+        eq = self.assertEqual
+        c = self.client
+        eq(await c.xadd(key, {'a': 1}, id='1-1'), b'1-1')
+        eq(await c.xadd(key, {'a': 2}, id='1-*'), b'1-2')
+        eq(await c.xadd(key, [('b', 3), ('c', 4)], id='2'), b'2-0')
+        await self.wait.assertRaises(ResponseError, c.xadd, key, {'a': 5},
+                                     id='2-0')
+        await self.wait.assertRaises(ResponseError, c.xadd, key, {'a': 5},
+                                     id='0-0')
+        eq(await c.execute('xlen', key), 3)
+        eq(await c.xrange(key), [(b'1-1', {b'a': b'1'}),
+                                 (b'1-2', {b'a': b'2'}),
+                                 (b'2-0', {b'b': b'3', b'c': b'4'})])
+        eq(await c.xrange(key, '(1-1', '+', count=1),
+           [(b'1-2', {b'a': b'2'})])
+        eq(await c.xrange(key, '1-2', '1'), [(b'1-2', {b'a': b'2'})])
+        eq(await c.xrevrange(key, count=2),
+           [(b'2-0', {b'b': b'3', b'c': b'4'}), (b'1-2', {b'a': b'2'})])
+        eq(await c.execute('xdel', key, '1-2', '5-0'), 1)
+        eq(await c.xrange(key, '1', '1'), [(b'1-1', {b'a': b'1'})])
+        eq(await c.xadd(key + 'x', {'a': 1}, nomkstream=True), None)
+        eq(await c.exists(key + 'x'), False)
+        eq(await c.type(key), 'stream')
+        await self._remove_and_push(key)
+        await self.wait.assertRaises(ResponseError, c.xadd, key, {'a': 1})
+
+    async def test_xtrim(self):
+        key = self.randomkey()
+        eq = self.assertEqual
+        c = self.client
+        for n in range(1, 11):
+            await c.xadd(key, {'n': n}, id=n)
+        eq(await c.execute('xtrim', key, 'maxlen', 8), 2)
+        eq(await c.execute('xtrim', key, 'minid', '5'), 2)
+        eq(await c.execute('xlen', key), 6)
+        eq(await c.xadd(key, {'n': 11}, id=11, maxlen=3, approximate=False),
+           b'11-0')
+        eq([id for id, _ in await c.xrange(key)], [b'9-0', b'10-0', b'11-0'])
+        # approximate trimming only removes whole nodes
+        eq(await c.execute('xtrim', key, 'maxlen', '~', 1), 0)
+        await self.wait.assertRaises(ResponseError, c.execute, 'xtrim', key,
+                                     'maxlen', 1, 'limit', 10)
+
+    async def test_xread(self):
+        key1 = self.randomkey()
+        key2 = key1 + 'x'
+        bk2 = key2.encode('utf-8')
+        eq = self.assertEqual
+        c = self.client
+        eq(await c.xread({key1: 0}), [])
+        await c.xadd(key1, {'a': 1}, id=1)
+        await c.xadd(key2, {'b': 1}, id=1)
+        await c.xadd(key2, {'b': 2}, id=2)
+        eq(await c.xread({key1: '1', key2: '0'}, count=1),
+           [(bk2, [(b'1-0', {b'b': b'1'})])])
+        eq(await c.xread({key2: '$'}, block=100), [])
+        waiter = asyncio.ensure_future(
+            self.create_store(self.store.dns).client().xread(
+                {key1: '$', key2: '$'}, block=5000))
+        await asyncio.sleep(0.1)
+        eq(await c.xadd(key2, {'b': 3}, id=3), b'3-0')
+        eq(await waiter, [(bk2, [(b'3-0', {b'b': b'3'})])])
+
+    async def test_xreadgroup(self):
+        key = self.randomkey()
+        bkey = key.encode('utf-8')
+        eq = self.assertEqual
+        c = self.client
+        await self.wait.assertRaises(ResponseError, c.xreadgroup, 'g', 'c1',
+                                     {key: '>'})
+        eq(await c.execute('xgroup', 'create', key, 'g', '$', 'mkstream'),
+           b'OK')
+        await self.wait.assertRaises(ResponseError, c.execute, 'xgroup',
+                                     'create', key, 'g', '$')
+        for n in range(1, 4):
+            await c.xadd(key, {'n': n}, id=n)
+        eq(await c.xreadgroup('g', 'c1', {key: '>'}, count=2),
+           [(bkey, [(b'1-0', {b'n': b'1'}), (b'2-0', {b'n': b'2'})])])
+        eq(await c.xreadgroup('g', 'c2', {key: '>'}),
+           [(bkey, [(b'3-0', {b'n': b'3'})])])
+        eq(await c.xreadgroup('g', 'c2', {key: '>'}), [])
+        # the pending entries of a consumer
+        eq(await c.xreadgroup('g', 'c1', {key: '0'}),
+           [(bkey, [(b'1-0', {b'n': b'1'}), (b'2-0', {b'n': b'2'})])])
+        eq(await c.execute('xack', key, 'g', '1-0', '1-0', '3-0'), 2)
+        eq(await c.xreadgroup('g', 'c1', {key: '0'}),
+           [(bkey, [(b'2-0', {b'n': b'2'})])])
+        count, first, last, consumers = await c.execute('xpending', key, 'g')
+        eq((int(count), first, last), (1, b'2-0', b'2-0'))
+        eq([(name, int(n)) for name, n in consumers], [(b'c1', 1)])
+        [[id, consumer, _, deliveries]] = await c.execute(
+            'xpending', key, 'g', '-', '+', 10)
+        eq((id, consumer, int(deliveries)), (b'2-0', b'c1', 3))
+        eq(await c.execute('xpending', key, 'g', 'idle', 60000, '-', '+',
+                           10), [])
+        waiter = asyncio.ensure_future(
+            self.create_store(self.store.dns).client().xreadgroup(
+                'g', 'c3', {key: '>'}, block=5000, noack=True))
+        await asyncio.sleep(0.1)
+        await c.xadd(key, {'n': 4}, id=4)
+        eq(await waiter, [(bkey, [(b'4-0', {b'n': b'4'})])])
+        count, _, _, _ = await c.execute('xpending', key, 'g')
+        eq(int(count), 1)
+
+    async def test_xreadgroup_destroyed_group(self):
+        key = self.randomkey()
+        c = self.client
+        await c.execute('xgroup', 'create', key, 'g', '0', 'mkstream')
+        waiter = asyncio.ensure_future(
+            self.create_store(self.store.dns).client().xreadgroup(
+                'g', 'c1', {key: '>'}, block=5000))
+        await asyncio.sleep(0.1)
+        self.assertEqual(await c.execute('xgroup', 'destroy', key, 'g'), 1)
+        with self.assertRaises(ResponseError):
+            await waiter
+
+    async def test_xclaim(self):
+        key = self.randomkey()
+        eq = self.assertEqual
+        c = self.client
+        await c.execute('xgroup', 'create', key, 'g', '0', 'mkstream')
+        await c.xadd(key, {'n': 1}, id=1)
+        await c.xadd(key, {'n': 2}, id=2)
+        await c.xreadgroup('g', 'c1', {key: '>'})
+        eq(await c.execute('xclaim', key, 'g', 'c2', 60000, '1-0'), [])
+        eq(await c.execute('xclaim', key, 'g', 'c2', 0, '1-0'),
+           [[b'1-0', [b'n', b'1']]])
+        eq(await c.execute('xdel', key, '2-0'), 1)
+        eq(await c.execute('xclaim', key, 'g', 'c2', 0, '2-0', 'justid'), [])
+        [[id, consumer, _, deliveries]] = await c.execute(
+            'xpending', key, 'g', '-', '+', 10)
+        eq((id, consumer, int(deliveries)), (b'1-0', b'c2', 2))
+        eq(await c.execute('xgroup', 'delconsumer', key, 'g', 'c2'), 1)
+        count, _, _, _ = await c.execute('xpending', key, 'g')
+        eq(int(count), 0)
+
     ###########################################################################
     #    CONNECTION
     async def test_ping(self):
@@ -1205,6 +1624,22 @@ class RedisCommands(StoreMixin):
             eq(await pubsub.punsubscribe(), None)
             # await listener.get()
 
+    async def test_pattern_publish_count(self):
+        if self.store.name == 'pulsar':
+            eq = self.assertEqual
+            pubsub = self.client.pubsub(protocol=StringProtocol())
+            listener = Listener()
+            pubsub.add_client(listener)
+            channel = self.randomkey()
+            eq(await pubsub.subscribe(channel), None)
+            eq(await pubsub.psubscribe(channel[:2] + '*', channel), None)
+            eq(await pubsub.publish(channel, 'hello'), 3)
+            for _ in range(3):
+                eq(await listener.get(), (channel, 'hello'))
+            eq(await pubsub.punsubscribe(), None)
+            eq(await pubsub.publish(channel, 'hi'), 1)
+            eq(await listener.get(), (channel, 'hi'))
+
     ###########################################################################
     #    TRANSACTION
     async def test_watch(self):
@@ -1214,25 +1649,16 @@ class RedisCommands(StoreMixin):
         self.assertEqual(result, 1)
 
 
-class TestPulsarStore(RedisCommands, unittest.TestCase):
-    app_cfg = None
+class TestPulsarStore(ServerMixin, RedisCommands, unittest.TestCase):
 
     @classmethod
     async def setUpClass(cls):
-        server = PulsarDS(name=cls.__name__.lower(),
-                          bind='127.0.0.1:0',
-                          concurrency=cls.cfg.concurrency,
-                          redis_py_parser=cls.redis_py_parser)
-        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        cls.app_cfg = await cls.run_server(
+            redis_py_parser=cls.redis_py_parser)
         cls.pulsards_uri = 'pulsar://%s:%s' % cls.app_cfg.addresses[0]
         cls.store = cls.create_store('%s/9' % cls.pulsards_uri)
         cls.client = cls.store.client()
 
-    @classmethod
-    def tearDownClass(cls):
-        if cls.app_cfg is not None:
-            return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
-
     def test_store_methods(self):
         store = self.create_store('%s/8' % self.pulsards_uri)
         self.assertEqual(store.database, 8)
@@ -1246,3 +1672,131 @@ class TestPulsarStore(RedisCommands, unittest.TestCase):
 @unittest.skipUnless(pulsar.HAS_C_EXTENSIONS, 'Requires cython extensions')
 class TestPulsarStorePyParser(TestPulsarStore):
     redis_py_parser = True
+
+
+class TestPulsarStoreMultiplexed(TestPulsarStore):
+    multiplex = 2
+
+    async def test_multiplexed(self):
+        store = self.create_store('%s/9' % self.pulsards_uri)
+        client = store.client()
+        key = self.randomkey()
+        results = await asyncio.gather(*[client.incr(key)
+                                         for _ in range(100)])
+        self.assertEqual(sorted(results), list(range(1, 101)))
+        self.assertTrue(1 <= len(store._multiplexed) <= 2)
+        self.assertEqual(store.pool.in_use + store.pool.available, 0)
+        self.assertTrue(await client.set(key, 'a'))
+        results = await asyncio.gather(
+            client.get(key), client.lpush(key, 'b'), client.get(key),
+            return_exceptions=True)
+        self.assertEqual(results[0], b'a')
+        self.assertIsInstance(results[1], ResponseError)
+        self.assertEqual(results[2], b'a')
+        await store.close()
+
+    async def test_multiplexed_connection_lost(self):
+        store = self.create_store('%s/9' % self.pulsards_uri)
+        client = store.client()
+        self.assertTrue(await client.ping())
+        connection = store._multiplexed[0]
+        waiter = asyncio.ensure_future(client.get(self.randomkey()))
+        await asyncio.sleep(0)
+        connection.close()
+        with self.assertRaises(ConnectionResetError):
+            await waiter
+        self.assertTrue(await client.ping())
+        self.assertNotEqual(store._multiplexed, [connection])
+
+    async def test_multiplexed_unexpected_response(self):
+        store = self.create_store('%s/9' % self.pulsards_uri)
+        client = store.client()
+        self.assertTrue(await client.ping())
+        connection = store._multiplexed[0]
+        connection.data_received(b'+OK\r\n')
+        await asyncio.sleep(0.05)
+        self.assertTrue(connection.closed)
+        self.assertTrue(await client.ping())
+        self.assertNotEqual(store._multiplexed, [connection])
+        await store.close()
+
+
+class TestPulsarStoreSharedPubSub(TestPulsarStore):
+    shared_pubsub = True
+
+    async def test_subscribe_one(self):
+        key = self.randomkey()
+        pubsub1 = self.client.pubsub()
+        pubsub2 = self.client.pubsub()
+        await pubsub1.subscribe(key)
+        await pubsub2.subscribe(key)
+        self.assertTrue(pubsub1._connection is pubsub2._connection)
+        # the handlers share one subscription in the server
+        count = await pubsub1.count(key)
+        self.assertEqual(count[key.encode('utf-8')], 1)
+        self.assertEqual(self.store.fanin.channels[key.encode('utf-8')], 2)
+        await pubsub1.unsubscribe(key)
+        count = await pubsub2.count(key)
+        self.assertEqual(count[key.encode('utf-8')], 1)
+        await pubsub2.unsubscribe(key)
+        count = await pubsub2.count(key)
+        self.assertEqual(count[key.encode('utf-8')], 0)
+
+    async def test_fanin_dispatch(self):
+        store = self.create_store('%s/9' % self.pulsards_uri)
+        key1, key2 = self.randomkey(), self.randomkey()
+        listeners = []
+        for key in (key1, key2, key1):
+            pubsub = store.pubsub()
+            listener = Listener()
+            pubsub.add_client(listener)
+            await pubsub.subscribe(key)
+            listeners.append((pubsub, listener))
+        self.assertEqual(await listeners[0][0].publish(key1, 'a'), 1)
+        self.assertEqual(await listeners[0][0].publish(key2, 'b'), 1)
+        self.assertEqual(await listeners[0][1].get(), (key1, b'a'))
+        self.assertEqual(await listeners[1][1].get(), (key2, b'b'))
+        self.assertEqual(await listeners[2][1].get(), (key1, b'a'))
+        self.assertTrue(listeners[0][1]._messages.empty())
+        await listeners[0][0].close()
+        channels = store.fanin.channels
+        self.assertEqual(channels[key1.encode('utf-8')], 1)
+        self.assertEqual(channels[key2.encode('utf-8')], 1)
+        await store.close()
+
+    async def test_fanin_shared(self):
+        store1 = self.create_store('%s/9' % self.pulsards_uri)
+        store2 = self.create_store('%s/10' % self.pulsards_uri)
+        # stores of the same server share the fan-in whatever the database
+        self.assertTrue(store1.fanin is store2.fanin)
+        self.assertTrue(store1.fanin is self.store.fanin)
+        key = self.randomkey()
+        pubsub1, pubsub2 = store1.pubsub(), store2.pubsub()
+        listener = Listener()
+        pubsub2.add_client(listener)
+        await pubsub1.subscribe(key)
+        await pubsub2.subscribe(key)
+        count = await pubsub1.count(key)
+        self.assertEqual(count[key.encode('utf-8')], 1)
+        # the shared connection survives the store which opened it
+        await store1.close()
+        self.assertEqual(await pubsub2.publish(key, 'a'), 1)
+        self.assertEqual(await listener.get(), (key, b'a'))
+        await store2.close()
+        self.assertFalse(store1 in self.store.fanin._stores)
+        self.assertFalse(store2 in self.store.fanin._stores)
+
+    async def test_fanin_connection_lost(self):
+        store = self.create_store('%s/9' % self.pulsards_uri)
+        # a fan-in of its own, the shared one is used by concurrent tests
+        store.fanin.release(store)
+        store._fanin = PubSubFanIn(store)
+        pubsub = store.pubsub()
+        lost = asyncio.Future()
+        pubsub.bind_event('connection_lost', lambda _: lost.set_result(1))
+        await pubsub.subscribe(self.randomkey())
+        store.fanin._connection.close()
+        self.assertEqual(await lost, 1)
+        self.assertEqual(pubsub._connection, None)
+        self.assertEqual(store.fanin.channels, {})
+        await store.close()
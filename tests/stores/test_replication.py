@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import unittest
+
+from pulsar.apps.ds import ResponseError, redis_parser
+from pulsar.apps.ds.replication import (Backlog, Master, ReplicaState,
+                                        ONLINE, SEND_SNAPSHOT)
+
+from tests.stores.test_pulsards import ServerMixin
+
+
+class TestBacklog(unittest.TestCase):
+
+    def test_append(self):
+        backlog = Backlog(10)
+        self.assertEqual(backlog.since(0), b'')
+        backlog.append(b'abcd')
+        self.assertEqual(backlog.offset, 4)
+        self.assertEqual(backlog.since(0), b'abcd')
+        self.assertEqual(backlog.since(2), b'cd')
+        self.assertEqual(backlog.since(5), None)
+
+    def test_wrap(self):
+        backlog = Backlog(10)
+        backlog.append(b'abcdefgh')
+        backlog.append(b'ijkl')
+        self.assertEqual(backlog.offset, 12)
+        self.assertEqual(backlog.since(1), None)
+        self.assertEqual(backlog.since(2), b'cdefghijkl')
+        self.assertEqual(backlog.since(9), b'jkl')
+        backlog.append(b'0123456789xyz')
+        self.assertEqual(backlog.offset, 25)
+        self.assertEqual(backlog.since(15), b'3456789xyz')
+        self.assertEqual(backlog.since(14), None)
+
+
+class Store:
+    REPL_BACKLOG_SIZE = 100
+    REPL_BUFFER_LIMIT = 64
+    logger = logging.getLogger('pulsar.test')
+
+    def __init__(self):
+        self._loop = asyncio.get_event_loop()
+        self._parser = redis_parser()()
+
+
+class Client:
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def _send(self, data):
+        self.sent.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+class TestMaster(unittest.TestCase):
+
+    def test_buffer_limit(self):
+        master = Master(Store())
+        online, syncing = Client(), Client()
+        master.replicas[online] = ReplicaState(ONLINE)
+        master.replicas[syncing] = ReplicaState(SEND_SNAPSHOT)
+        master.feed(0, b'abcd')
+        self.assertEqual(len(master.replicas), 2)
+        master.feed(0, b'x'*64)
+        self.assertEqual(list(master.replicas), [online])
+        self.assertTrue(syncing.closed)
+        self.assertFalse(online.closed)
+        self.assertEqual(b''.join(online.sent)[-64:], b'x'*64)
+        self.assertTrue(master.info()['slave0'].startswith('ip=,port=,'))
+
+
+class TestReplication(ServerMixin, unittest.TestCase):
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.master_cfg = await cls.run_server('repl')
+        cls.master = cls.client(cls.master_cfg)
+
+    @classmethod
+    def client(cls, cfg, db=5):
+        return cls.server_store(cfg, db).client()
+
+    async def replica(self):
+        cfg = await self.run_server(
+            'repl', key_value_slaveof='%s:%s' % self.master_cfg.addresses[0])
+        replica = self.client(cfg)
+        await self.synced(replica)
+        return replica
+
+    async def synced(self, replica):
+        while True:
+            info = await replica.info()
+            if (info['master_link_status'] == 'up' and
+                    not info['master_sync_in_progress'] and
+                    not info['loading']):
+                break
+            await asyncio.sleep(0.05)
+
+    async def wait_for(self, client, key, value):
+        for _ in range(100):
+            result = await client.get(key)
+            if result == value:
+                return result
+            await asyncio.sleep(0.02)
+        self.assertEqual(result, value)
+
+    async def test_sync(self):
+        m = self.master
+        key = self.randomkey()
+        eq = self.assertEqual
+        eq(await m.set(key, 'foo'), True)
+        eq(await m.rpush(key + 'l', 'a', 'b'), 2)
+        eq(await m.setex(key + 'e', 100, 'foo'), b'OK')
+        replica = await self.replica()
+        await self.wait_for(replica, key, b'foo')
+        eq(await replica.lrange(key + 'l', 0, -1), [b'a', b'b'])
+        self.assertTrue(90 < await replica.ttl(key + 'e') <= 100)
+        # live stream
+        eq(await m.append(key, 'bar'), 6)
+        eq(await m.lpop(key + 'l'), b'a')
+        await self.wait_for(replica, key, b'foobar')
+        eq(await replica.lrange(key + 'l', 0, -1), [b'b'])
+        info = await m.info()
+        self.assertTrue(info['connected_slaves'] >= 1)
+        # the replica offset counts the bytes of the stream
+        for _ in range(100):
+            offset = (await replica.info())['slave_repl_offset']
+            if offset == info['master_repl_offset']:
+                break
+            await asyncio.sleep(0.02)
+        self.assertEqual(offset, info['master_repl_offset'])
+
+    async def test_read_only(self):
+        replica = await self.replica()
+        key = self.randomkey()
+        with self.assertRaises(ResponseError):
+            await replica.set(key, 'foo')
+        self.assertEqual(await replica.get(key), None)
+        self.assertEqual(await replica.execute('slaveof', 'no', 'one'),
+                         True)
+        self.assertEqual(await replica.set(key, 'foo'), True)
+        info = await replica.info()
+        self.assertEqual(info['role'], 'master')
+
+    async def test_partial_resync(self):
+        m = self.master
+        # make sure the master has a backlog
+        await self.replica()
+        info = await m.info()
+        replid = info['master_replid']
+        offset = info['master_repl_offset']
+        key = self.randomkey()
+        self.assertEqual(await m.set(key, 'foo'), True)
+        host, port = self.master_cfg.addresses[0]
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(('*3\r\n$5\r\npsync\r\n$%d\r\n%s\r\n$%d\r\n%d\r\n' % (
+            len(replid), replid, len(str(offset)), offset)).encode('utf-8'))
+        self.assertEqual(await reader.readline(), b'+CONTINUE\r\n')
+        self.assertEqual(await reader.readline(), b'*2\r\n')
+        self.assertEqual(await reader.readline(), b'$6\r\n')
+        self.assertEqual(await reader.readline(), b'select\r\n')
+        writer.close()
@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+
+from pulsar.utils.string import random_string
+from pulsar.apps.ds import redis_parser
+from pulsar.apps.ds.server import validate_output_buffer_limit
+
+from tests.stores.test_pulsards import ServerMixin
+
+
+class TestOutputBufferLimit(unittest.TestCase):
+
+    def test_validate(self):
+        self.assertEqual(validate_output_buffer_limit('32mb 8mb 60'),
+                         (32*1024*1024, 8*1024*1024, 60))
+        self.assertEqual(validate_output_buffer_limit(('1kb', 0, '0')),
+                         (1024, 0, 0))
+        self.assertRaises(ValueError, validate_output_buffer_limit, '1kb 0')
+
+
+class TestReplies(ServerMixin, unittest.TestCase):
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.app_cfg = await cls.run_server(
+            'replies', key_value_pubsub_output_buffer_limit='256kb 0 0')
+        cls.address = cls.app_cfg.addresses[0]
+        cls.store = cls.server_store(cls.app_cfg, 5)
+        cls.client = cls.store.client()
+
+    async def connect(self, *commands):
+        reader, writer = await asyncio.open_connection(*self.address)
+        pack = redis_parser()().pack_command
+        writer.write(b''.join(pack(command) for command in commands))
+        return reader, writer
+
+    async def replies(self, reader, number):
+        parser = redis_parser()()
+        replies = []
+        while len(replies) < number:
+            parser.feed(await reader.read(65536))
+            reply = parser.get()
+            while reply is not False:
+                replies.append(reply)
+                reply = parser.get()
+        return replies
+
+    async def test_pipeline_order(self):
+        key = random_string()
+        reader, writer = await self.connect(
+            ('set', key, 'a'), ('multi',), ('append', key, 'b'),
+            ('get', key), ('exec',), ('get', key), ('ping',))
+        replies = await self.replies(reader, 7)
+        writer.close()
+        self.assertEqual(replies, [b'OK', b'OK', b'QUEUED', b'QUEUED',
+                                   [2, b'ab'], b'ab', b'PONG'])
+
+    async def test_large_pipeline(self):
+        key = random_string()
+        value = 'x'*1000
+        number = 200
+        reader, writer = await self.connect(
+            ('set', key, value), *[('get', key)]*number)
+        replies = await self.replies(reader, number + 1)
+        writer.close()
+        self.assertEqual(replies[0], b'OK')
+        self.assertEqual(replies[1:], [value.encode('utf-8')]*number)
+
+    async def test_quit(self):
+        reader, writer = await self.connect(('ping',), ('quit',))
+        self.assertEqual(await self.replies(reader, 2), [b'PONG', b'OK'])
+        writer.close()
+
+    async def test_slow_subscriber(self):
+        channel = random_string()
+        reader, writer = await self.connect(('subscribe', channel))
+        self.assertEqual(await self.replies(reader, 1),
+                         [[b'subscribe', channel.encode('utf-8'), b'1']])
+        numsub = await self.client.execute('pubsub', 'numsub', channel)
+        self.assertEqual(numsub, [channel.encode('utf-8'), b'1'])
+        # the subscriber does not read messages
+        message = 'x'*65536
+        for _ in range(200):
+            if not await self.client.execute('publish', channel, message):
+                break
+        numsub = await self.client.execute('pubsub', 'numsub', channel)
+        self.assertEqual(numsub, [channel.encode('utf-8'), b'0'])
+        info = await self.client.info()
+        self.assertTrue(info['client_output_buffer_limit_disconnections'] > 0)
+        writer.close()
@@ -0,0 +1,169 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pulsar.apps.ds import ResponseError, NoScriptError
+from pulsar.apps.ds.scripting import lupa, script_sha
+from pulsar.apps.data.redis.lock import Lock
+
+from tests.stores.lock import RedisLockTests
+from tests.stores.test_pulsards import Listener, ServerMixin
+
+
+@unittest.skipUnless(lupa, 'Requires lupa')
+class TestScripting(ServerMixin, RedisLockTests, unittest.TestCase):
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.client = await cls.server()
+
+    @classmethod
+    async def tearDownClass(cls):
+        await super().tearDownClass()
+        shutil.rmtree(cls.dir)
+
+    @classmethod
+    async def server(cls, **params):
+        cfg = await cls.run_server('lua', **params)
+        return cls.server_store(cfg, 4).client()
+
+    async def test_redlock(self):
+        clients = [self.client, await self.server(), await self.server()]
+        key = self.randomkey()
+        eq = self.assertEqual
+        lock1 = Lock(clients, key, timeout=10, blocking=False)
+        lock2 = Lock(clients, key, blocking=False)
+        eq(lock1.quorum, 2)
+        pubsub = self.client.store.pubsub()
+        listener = Listener()
+        pubsub.add_client(listener)
+        await pubsub.subscribe(lock1.channel)
+        # no majority: the minority acquired is removed, not released
+        await clients[1].set(lock1.key, 'x')
+        await clients[2].set(lock1.key, 'x')
+        eq(await lock1.acquire(), False)
+        eq(await clients[0].get(lock1.key), None)
+        await clients[2].delete(lock1.key)
+        eq(await lock2.acquire(), True)
+        eq(lock2.fencing_token, 2)
+        token = lock2._token
+        eq(await lock1.acquire(), False)
+        eq(await lock2.release(), True)
+        # the first release notified is the release of lock2
+        eq(await listener.get(), (lock1.channel, token))
+        await pubsub.close()
+        await clients[1].delete(lock1.key)
+        eq(await lock1.acquire(), True)
+        # the fencing token is the highest counter of the majority
+        eq(lock1.fencing_token, 3)
+        fences = [await c.get('%s:fencing' % lock1.key) for c in clients]
+        eq(fences, [b'3', b'3', b'3'])
+        self.assertTrue(await clients[2].pttl(lock1.key) > 9000)
+        eq(await lock1.release(), True)
+
+    async def test_conversions(self):
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.eval('return 1'), 1)
+        eq(await c.eval('return 3.9'), 3)
+        eq(await c.eval('return "foo"'), b'foo')
+        eq(await c.eval('return true'), 1)
+        eq(await c.eval('return false'), None)
+        eq(await c.eval('return nil'), None)
+        eq(await c.eval('return {1, "a", {"b"}, nil, "c"}'),
+           [b'1', b'a', [b'b']])
+        eq(await c.eval("return redis.status_reply('DONE')"), b'DONE')
+        with self.assertRaises(ResponseError):
+            await c.eval("return redis.error_reply('bad things')")
+
+    async def test_keys_and_args(self):
+        c = self.client
+        key = self.randomkey()
+        result = await c.eval("return {KEYS[1], ARGV[1], ARGV[2]}",
+                              keys=[key], args=['a', 'b'])
+        self.assertEqual(result, [key.encode('utf-8'), b'a', b'b'])
+        with self.assertRaises(ResponseError):
+            await c.execute('eval', 'return 1', 2, key)
+        with self.assertRaises(ResponseError):
+            await c.execute('eval', 'return 1', 'x')
+
+    async def test_call(self):
+        c = self.client
+        key = self.randomkey()
+        script = '''
+            redis.call('set', KEYS[1], ARGV[1])
+            redis.call('append', KEYS[1], 'bar')
+            return {redis.call('get', KEYS[1]), redis.call('strlen', KEYS[1]),
+                    redis.call('get', KEYS[1] .. 'missing')}
+        '''
+        self.assertEqual(await c.eval(script, [key], ['foo']),
+                         [b'foobar', b'6', None])
+        self.assertEqual(await c.get(key), b'foobar')
+        self.assertEqual(await c.eval("return redis.call('set', KEYS[1], 1)",
+                                      [key]), b'OK')
+        self.assertEqual(await c.eval("return redis.call('exists', KEYS[1])",
+                                      [key]), 1)
+
+    async def test_call_errors(self):
+        c = self.client
+        key = self.randomkey()
+        self.assertEqual(await c.rpush(key, 'a'), 1)
+        with self.assertRaises(ResponseError):
+            await c.eval("return redis.call('get', KEYS[1])", [key])
+        result = await c.eval('''
+            local reply = redis.pcall('get', KEYS[1])
+            return reply.err
+        ''', [key])
+        self.assertTrue(result.startswith(b'WRONGTYPE'))
+        with self.assertRaises(ResponseError):
+            await c.eval("return redis.call('nocommand')")
+        with self.assertRaises(ResponseError):
+            await c.eval("return redis.call('blpop', KEYS[1], 0)", [key])
+        with self.assertRaises(ResponseError):
+            await c.eval('return (')
+
+    async def test_sandbox(self):
+        c = self.client
+        for name in ('os', 'io', 'python', 'require', 'loadfile'):
+            self.assertEqual(await c.eval('return %s == nil' % name), 1)
+
+    async def test_script_commands(self):
+        c = self.client
+        script = "return 'hello'"
+        sha = script_sha(script.encode('utf-8'))
+        self.assertEqual(await c.execute('script', 'load', script), sha)
+        self.assertEqual(await c.execute('script', 'exists', sha, 'x' * 40),
+                         [1, 0])
+        self.assertEqual(await c.evalsha(sha), b'hello')
+        self.assertEqual(await c.evalsha(sha.upper()), b'hello')
+        self.assertEqual(await c.execute('script', 'flush'), b'OK')
+        with self.assertRaises(NoScriptError):
+            await c.evalsha(sha)
+
+    async def test_select(self):
+        c = self.client
+        key = self.randomkey()
+        self.assertEqual(await c.eval('''
+            redis.call('select', 5)
+            return redis.call('set', KEYS[1], 'foo')
+        ''', [key]), b'OK')
+        self.assertEqual(await c.get(key), None)
+        self.assertEqual(await c.eval("return redis.call('get', KEYS[1])",
+                                      [key]), None)
+
+    async def test_append_only_file(self):
+        filename = os.path.join(self.dir, 'lua.aof')
+        c = await self.server(key_value_appendonly=True,
+                              key_value_appendfilename=filename,
+                              key_value_appendfsync='always')
+        key = self.randomkey()
+        self.assertEqual(await c.eval('''
+            redis.call('set', KEYS[1], 'foo')
+            return redis.call('spop', KEYS[1] .. 's')
+        ''', [key]), None)
+        with open(filename, 'rb') as fp:
+            data = fp.read()
+        self.assertTrue(b'set' in data)
+        self.assertFalse(b'eval' in data)
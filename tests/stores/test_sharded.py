@@ -0,0 +1,124 @@
+import unittest
+from collections import Counter
+
+from pulsar.utils.string import random_string
+from pulsar.apps.ds import ResponseError
+from pulsar.apps.data import create_store, ShardedStore
+from pulsar.apps.data.redis.sharded import hash_key, node_points
+
+from tests.stores.test_pulsards import ServerMixin
+
+
+URLS = ['pulsar://127.0.0.1:%d/3' % port for port in range(6501, 6505)]
+
+
+class TestRing(unittest.TestCase):
+
+    def keys(self, number=10000):
+        return ['key%d' % n for n in range(number)]
+
+    def test_hash_key(self):
+        self.assertEqual(hash_key('a'), hash_key(b'a'))
+        self.assertEqual(hash_key('{user1}.following'),
+                         hash_key('{user1}.followers'))
+        self.assertNotEqual(hash_key('foo{}'), hash_key(''))
+        self.assertEqual(len(set(node_points('a:1/0', 10))), 10)
+
+    def test_distribution(self):
+        store = create_store(URLS[:3])
+        self.assertIsInstance(store, ShardedStore)
+        self.assertEqual(len(store.nodes), 3)
+        counts = Counter(store.node(key) for key in self.keys())
+        self.assertEqual(len(counts), 3)
+        for count in counts.values():
+            self.assertTrue(2500 < count < 4500)
+
+    def test_add_remove_node(self):
+        store = ShardedStore(URLS[:3])
+        before = dict((key, store.node(key)) for key in self.keys())
+        node = store.add_node(URLS[3])
+        self.assertRaises(ValueError, store.add_node, URLS[3])
+        moved = [key for key, old in before.items()
+                 if store.node(key) is not old]
+        # keys move only to the new node, about a quarter of them
+        self.assertTrue(1500 < len(moved) < 3500)
+        self.assertTrue(all(store.node(key) is node for key in moved))
+        self.assertEqual(store.remove_node(URLS[3]), node)
+        self.assertTrue(all(store.node(key) is old
+                            for key, old in before.items()))
+
+    def test_command_node(self):
+        store = ShardedStore(URLS[:2])
+        self.assertEqual(store._command_node('ping', 'ping', ()),
+                         store.nodes[0])
+        a, b = self.keys(2)
+        while store.node(a) is store.node(b):
+            b = random_string()
+        self.assertRaises(ResponseError, store._command_node,
+                          'rpoplpush', 'rpoplpush', (a, b))
+
+
+class TestShardedStore(ServerMixin, unittest.TestCase):
+    store = None
+
+    @classmethod
+    async def setUpClass(cls):
+        cfgs = [await cls.run_server('sharded') for _ in range(2)]
+        cls.urls = [cls.server_url(cfg, 8) for cfg in cfgs]
+        cls.store = create_store(cls.urls)
+        cls.client = cls.store.client()
+
+    @classmethod
+    async def tearDownClass(cls):
+        if cls.store is not None:
+            await cls.store.close()
+        await super().tearDownClass()
+
+    def keys(self, number=20):
+        keys = [random_string() for _ in range(number)]
+        nodes = set(self.store.node(key) for key in keys)
+        self.assertEqual(len(nodes), 2)
+        return keys
+
+    async def test_get_set(self):
+        keys = self.keys()
+        for key in keys:
+            self.assertTrue(await self.client.set(key, key))
+        for key in keys:
+            value = await self.store.node(key).client().get(key)
+            self.assertEqual(value, key.encode('utf-8'))
+
+    async def test_multi_keys(self):
+        keys = self.keys()
+        self.assertTrue(await self.client.mset(*[
+            value for n, key in enumerate(keys) for value in (key, n)]))
+        values = await self.client.mget(*keys)
+        self.assertEqual(values, [str(n).encode('utf-8')
+                                  for n in range(len(keys))])
+        self.assertEqual(await self.client.delete(*keys), len(keys))
+        self.assertEqual(await self.client.mget(*keys), [None]*len(keys))
+
+    async def test_hash_tags(self):
+        tag = random_string()
+        keys = ['{%s}:%d' % (tag, n) for n in range(5)]
+        for n, key in enumerate(keys):
+            await self.client.rpush(key, n)
+        self.assertEqual(await self.client.rpoplpush(keys[0], keys[1]),
+                         b'0')
+
+    async def test_pipeline(self):
+        keys = self.keys()
+        pipe = self.client.pipeline()
+        for n, key in enumerate(keys):
+            pipe.set(key, n)
+            pipe.incr(key)
+        pipe.ping()
+        result = await pipe.commit()
+        self.assertEqual(len(result), 2*len(keys) + 1)
+        self.assertEqual(result[1:-1:2], list(range(1, len(keys) + 1)))
+        self.assertEqual(result[-1], True)
+
+    async def test_broadcast(self):
+        self.assertTrue(await self.store.ping())
+        results = await self.store.broadcast('dbsize')
+        self.assertEqual(len(results), 2)
@@ -0,0 +1,159 @@
+import os
+import time
+import pickle
+import tempfile
+import unittest
+
+from pulsar import get_event_loop
+from pulsar.utils.structures import Dict, Zset, Deque
+from pulsar.apps.ds.snapshot import (SnapshotWriter, SnapshotReader,
+                                     SnapshotError)
+from pulsar.apps.ds.streams import Stream, ConsumerGroup
+
+
+class Db:
+
+    def __init__(self, num, data, expires=None):
+        self._num = num
+        self._data = data
+        self._keys = list(data)
+        self._expires = expires or {}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Store:
+    list_type = Deque
+    hash_type = Dict
+    zset_type = Zset
+    set_type = set
+
+    def __init__(self, *dbs):
+        self._loop = get_event_loop()
+        self.databases = dict(((db._num, db) for db in dbs))
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def store(self):
+        loop = get_event_loop()
+        db = Db(0, {b'a': bytearray(b'hello'),
+                    b'l': Deque((b'1', b'22', b'')),
+                    b's': set((b'x', b'y')),
+                    b'h': Dict(((b'f', b'v'), (b'g', b''))),
+                    b'z': Zset(((1.5, b'm'), (-2.0, b'n')))},
+                {b'a': loop.time() + 100})
+        return Store(db, Db(3, {b'q': bytearray(b'w')}), Db(4, {}))
+
+    def stream(self):
+        stream = Stream()
+        stream.add(1 << 64, (b'a', b'1'))
+        stream.add(2 << 64, (b'a', b'2', b'b', b''))
+        stream.add(3 << 64, (b'a', b'3'))
+        stream.delete(3 << 64)
+        group = stream.groups[b'g'] = ConsumerGroup(b'g', 2 << 64, 2)
+        group.deliver(1 << 64, group.consumer(b'c1', 100), 150, 3)
+        group.consumer(b'c2', 200)
+        stream.groups[b'h'] = ConsumerGroup(b'h', 0)
+        return stream
+
+    def load(self):
+        reader = SnapshotReader(self.filename)
+        try:
+            return dict(((num, key), (value, when))
+                        for num, key, value, when in reader)
+        finally:
+            reader.close()
+
+    def test_round_trip(self):
+        store = self.store()
+        writer = SnapshotWriter(store, self.filename)
+        while not writer.step(0.001):
+            pass
+        writer.close()
+        self.assertEqual(writer.keys, 6)
+        data = self.load()
+        self.assertEqual(len(data), 6)
+        value, when = data[(0, b'a')]
+        self.assertEqual(value, bytearray(b'hello'))
+        self.assertTrue(when > time.time() + 90)
+        self.assertEqual(list(data[(0, b'l')][0]), [b'1', b'22', b''])
+        self.assertEqual(data[(0, b's')][0], set((b'x', b'y')))
+        self.assertEqual(dict(data[(0, b'h')][0]), {b'f': b'v', b'g': b''})
+        self.assertEqual(list(data[(0, b'z')][0].items()),
+                         [(-2.0, b'n'), (1.5, b'm')])
+        self.assertEqual(data[(3, b'q')], (bytearray(b'w'), None))
+
+    def test_stream(self):
+        store = Store(Db(0, {b'x': self.stream()}))
+        writer = SnapshotWriter(store, self.filename)
+        writer.step()
+        writer.close()
+        stream = self.load()[(0, b'x')][0]
+        self.assertEqual(list(stream.range()),
+                         [(1 << 64, [b'a', b'1']),
+                          (2 << 64, [b'a', b'2', b'b', b''])])
+        self.assertEqual(stream.last_id, 3 << 64)
+        self.assertEqual(stream.max_deleted_id, 3 << 64)
+        self.assertEqual(stream.entries_added, 3)
+        self.assertEqual(list(stream.groups), [b'g', b'h'])
+        group = stream.groups[b'g']
+        self.assertEqual((group.last_id, group.entries_read), (2 << 64, 2))
+        self.assertEqual(stream.groups[b'h'].entries_read, None)
+        self.assertEqual(list(group.consumers), [b'c1', b'c2'])
+        [(id, entry)] = group.pending_range()
+        self.assertEqual((id, entry.consumer.name, entry.delivery_time,
+                          entry.delivery_count), (1 << 64, b'c1', 150, 3))
+        self.assertEqual(group.consumers[b'c2'].seen_time, 200)
+
+    def test_point_in_time(self):
+        store = self.store()
+        db = store.databases[0]
+        writer = SnapshotWriter(store, self.filename)
+        writer.before_write(db, (b'l',))
+        db._data[b'l'].append(b'333')
+        writer.created(db, b'new')
+        db._data[b'new'] = bytearray(b'x')
+        db._keys.append(b'new')
+        writer.step()
+        writer.close()
+        data = self.load()
+        self.assertEqual(list(data[(0, b'l')][0]), [b'1', b'22', b''])
+        self.assertFalse((0, b'new') in data)
+
+    def test_expired_during_save(self):
+        store = self.store()
+        db = store.databases[0]
+        writer = SnapshotWriter(store, self.filename)
+        # b'a' expires after the snapshot started
+        db._expires[b'a'] = writer._started + 0.001
+        writer.before_write(db, (b'a',))
+        db._data.pop(b'a')
+        db._expires.pop(b'a')
+        writer.step()
+        writer.close()
+        data = self.load()
+        self.assertEqual(data[(0, b'a')][0], b'hello')
+
+    def test_checksum(self):
+        writer = SnapshotWriter(self.store(), self.filename)
+        writer.step()
+        writer.close()
+        with open(self.filename, 'r+b') as file:
+            file.seek(-6, 2)
+            file.write(b'x')
+        self.assertRaises(SnapshotError, self.load)
+
+    def test_pickle(self):
+        with open(self.filename, 'wb') as file:
+            pickle.dump((2, [(1, {b'a': bytearray(b'b')}, {b'a': 10.0})]),
+                        file, protocol=2)
+        self.assertEqual(self.load(), {(1, b'a'): (bytearray(b'b'), 10.0)})
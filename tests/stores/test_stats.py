@@ -0,0 +1,107 @@
+import unittest
+
+from pulsar.apps.ds import ResponseError
+from pulsar.apps.ds.stats import Histogram, SlowLog
+
+from tests.stores import test_pulsards
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_small_values(self):
+        h = Histogram()
+        for value in range(10):
+            h.add(value)
+        self.assertEqual(h.count, 10)
+        self.assertEqual(h.percentile(50), 4)
+        self.assertEqual(h.percentile(100), 9)
+        self.assertEqual(Histogram().percentile(50), 0)
+
+    def test_relative_error(self):
+        h = Histogram()
+        for value in (100, 1000, 10000, 123456789):
+            h.add(value)
+        for percent, value in ((25, 100), (50, 1000), (75, 10000),
+                               (100, 123456789)):
+            upper = h.percentile(percent)
+            self.assertTrue(value <= upper <= 1.07*value)
+
+    def test_buckets(self):
+        h = Histogram(3)
+        indices = [h._index(value) for value in range(1000)]
+        self.assertEqual(indices, sorted(indices))
+        for value in range(1000):
+            self.assertTrue(h._upper(h._index(value)) >= value)
+            self.assertTrue(h._index(h._upper(h._index(value))) ==
+                            h._index(value))
+
+
+class TestSlowLog(unittest.TestCase):
+
+    def test_ring(self):
+        log = SlowLog(0, 3, max_args=3, max_arg_len=4)
+        for n in range(5):
+            log.add(None, ['set', b'key%d' % n, b'value'], n)
+        self.assertEqual(len(log), 3)
+        entries = log.get()
+        self.assertEqual([e[0] for e in entries], [4, 3, 2])
+        self.assertEqual(entries[0][2], 4)
+        self.assertEqual(entries[0][3], [b'set', b'key4',
+                                         b'valu... (1 more bytes)'])
+        log.add(None, ['del', b'a', b'b', b'c'], 10)
+        self.assertEqual(log.get(1)[0][3],
+                         [b'del', b'a', b'... (2 more arguments)'])
+        log.reset()
+        self.assertEqual(log.get(), [])
+
+
+class TestCommandStats(test_pulsards.ServerMixin, test_pulsards.StoreMixin,
+                       unittest.TestCase):
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.app_cfg = await cls.run_server(
+            key_value_slowlog_log_slower_than=0)
+        cls.store = cls.create_store(cls.server_url(cls.app_cfg, 9))
+        cls.client = cls.store.client()
+
+    async def test_slowlog(self):
+        c = self.client
+        key = self.randomkey()
+        bkey = key.encode('utf-8')
+        self.assertEqual(await c.execute('slowlog', 'reset'), b'OK')
+        await c.set(key, 'foo')
+        await c.get(key)
+        entries = [e for e in await c.execute('slowlog', 'get', -1)
+                   if bkey in e[3]]
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0][3], [b'get', bkey])
+        self.assertEqual(entries[1][3], [b'set', bkey, b'foo'])
+        self.assertTrue(int(entries[0][0]) > int(entries[1][0]))
+        self.assertTrue(entries[0][4].startswith(b'127.0.0.1:'))
+        self.assertEqual(len(await c.execute('slowlog', 'get', 1)), 1)
+        self.assertTrue(await c.execute('slowlog', 'len') >= 3)
+        with self.assertRaises(ResponseError):
+            await c.execute('slowlog', 'foo')
+
+    async def test_commandstats(self):
+        c = self.client
+        key = self.randomkey()
+        await c.execute('config', 'resetstat')
+        await c.execute('strlen', key)
+        await c.execute('strlen', key)
+        await c.execute('getrange', key, 0, 1)
+        info = await c.info('commandstats')
+        self.assertEqual(info['cmdstat_strlen']['calls'], 2)
+        self.assertEqual(info['cmdstat_getrange']['calls'], 1)
+        self.assertTrue(info['cmdstat_strlen']['usec'] >= 0)
+        self.assertFalse('keyspace_hits' in info)
+        info = await c.info('latencystats')
+        self.assertEqual(set(info['latency_percentiles_usec_strlen']),
+                         set(('p50', 'p99', 'p99.9')))
+        info = await c.info()
+        self.assertFalse('cmdstat_strlen' in info)
+        self.assertTrue('keyspace_hits' in info)
+        info = await c.info('all')
+        self.assertTrue('cmdstat_strlen' in info)
+        self.assertTrue('keyspace_hits' in info)
@@ -0,0 +1,126 @@
+import unittest
+
+from pulsar.apps.ds import CommandError
+from pulsar.apps.ds.streams import (Stream, ConsumerGroup, parse_id,
+                                    parse_range, format_id, MAX_ID, SEQ_MASK)
+
+
+def ID(ms, seq=0):
+    return ms << 64 | seq
+
+
+class TestIds(unittest.TestCase):
+
+    def test_parse_id(self):
+        self.assertEqual(parse_id(b'5-3'), ID(5, 3))
+        self.assertEqual(parse_id(b'5'), ID(5))
+        self.assertEqual(parse_id(b'5', SEQ_MASK), ID(5, SEQ_MASK))
+        self.assertEqual(parse_id(b'-'), 0)
+        self.assertEqual(parse_id(b'+'), MAX_ID)
+        self.assertRaises(CommandError, parse_id, b'a-1')
+        self.assertRaises(CommandError, parse_id, b'1--1')
+        self.assertEqual(format_id(ID(5, 3)), b'5-3')
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range(b'(5-3'), ID(5, 4))
+        self.assertEqual(parse_range(b'(5-3', True), ID(5, 2))
+        self.assertEqual(parse_range(b'5', True), ID(5, SEQ_MASK))
+        self.assertRaises(CommandError, parse_range, b'(+')
+        self.assertRaises(CommandError, parse_range, b'(0-0', True)
+
+
+class TestStream(unittest.TestCase):
+
+    def stream(self, size=10, node_size=4):
+        stream = Stream(node_size)
+        for n in range(1, size + 1):
+            stream.add(ID(n), (b'n', str(n).encode('utf-8')))
+        return stream
+
+    def ids(self, stream, *args, **kw):
+        return [id >> 64 for id, _ in stream.range(*args, **kw)]
+
+    def test_add(self):
+        stream = self.stream()
+        self.assertEqual(len(stream), 10)
+        self.assertEqual(stream.nodes, 3)
+        self.assertEqual(stream.last_id, ID(10))
+        self.assertEqual(stream.entries_added, 10)
+        stream.add(ID(11), (b'a', b'1', b'b', b'2'))
+        self.assertEqual(stream.get(ID(11)), [b'a', b'1', b'b', b'2'])
+        self.assertEqual(stream.get(ID(3)), [b'n', b'3'])
+        self.assertEqual(stream.get(ID(3, 1)), None)
+
+    def test_next_id(self):
+        stream = Stream()
+        self.assertEqual(stream.next_id(0), 1)
+        stream.add(ID(5, 2), (b'a', b'b'))
+        self.assertEqual(stream.next_id(5), ID(5, 3))
+        self.assertEqual(stream.next_id(4), None)
+        self.assertEqual(stream.next_id(6), ID(6))
+        self.assertTrue(stream.next_id() > ID(5, 2))
+
+    def test_range(self):
+        stream = self.stream()
+        self.assertEqual(self.ids(stream), list(range(1, 11)))
+        self.assertEqual(self.ids(stream, ID(3), ID(6)), [3, 4, 5, 6])
+        self.assertEqual(self.ids(stream, ID(3), ID(6), True), [6, 5, 4, 3])
+        self.assertEqual(self.ids(stream, ID(6), ID(3)), [])
+        self.assertEqual(self.ids(stream, ID(11)), [])
+
+    def test_delete(self):
+        stream = self.stream()
+        nbytes = stream.nbytes
+        for n in (5, 6, 7, 8):
+            self.assertTrue(stream.delete(ID(n)))
+        self.assertFalse(stream.delete(ID(5)))
+        self.assertEqual(stream.nodes, 2)
+        self.assertEqual(len(stream), 6)
+        self.assertEqual(stream.max_deleted_id, ID(8))
+        self.assertTrue(stream.nbytes < nbytes)
+        self.assertEqual(self.ids(stream, ID(4), ID(9)), [4, 9])
+        self.assertEqual(self.ids(stream, ID(4), ID(9), True), [9, 4])
+
+    def test_trim_maxlen(self):
+        stream = self.stream()
+        self.assertEqual(stream.trim(maxlen=7, approx=True), 0)
+        self.assertEqual(stream.trim(maxlen=6, approx=True), 4)
+        self.assertEqual(stream.trim(maxlen=3), 3)
+        self.assertEqual(self.ids(stream), [8, 9, 10])
+        self.assertEqual(stream.first_id(), ID(8))
+        self.assertEqual(stream.trim(maxlen=0), 3)
+        self.assertEqual(len(stream), 0)
+        self.assertEqual(stream.nbytes, 0)
+        self.assertEqual(stream.last_id, ID(10))
+
+    def test_trim_minid(self):
+        stream = self.stream()
+        self.assertEqual(stream.trim(minid=ID(7), approx=True), 4)
+        self.assertEqual(stream.trim(minid=ID(7)), 2)
+        self.assertEqual(self.ids(stream), [7, 8, 9, 10])
+        stream = self.stream()
+        self.assertEqual(stream.trim(minid=ID(10), approx=True, limit=5), 4)
+
+
+class TestConsumerGroup(unittest.TestCase):
+
+    def test_pending(self):
+        group = ConsumerGroup(b'g', 0)
+        alice = group.consumer(b'alice', 0)
+        bob = group.consumer(b'bob', 0)
+        self.assertEqual(group.consumer(b'alice'), alice)
+        for ms in (3, 1, 2):
+            group.deliver(ID(ms), alice, 100)
+        group.deliver(ID(2), bob, 200, 2)
+        self.assertEqual(group.pending_bounds(), (ID(1), ID(3)))
+        self.assertEqual([id >> 64 for id, _ in group.pending_range()],
+                         [1, 2, 3])
+        self.assertEqual([id >> 64 for id, _ in
+                          group.pending_range(consumer=alice)], [1, 3])
+        self.assertEqual(group.pending[ID(2)].delivery_count, 2)
+        self.assertTrue(group.ack(ID(1)))
+        self.assertFalse(group.ack(ID(1)))
+        self.assertEqual(len(alice.pending), 1)
+        self.assertEqual(group.delete_consumer(b'alice'), 1)
+        self.assertEqual(group.delete_consumer(b'alice'), None)
+        self.assertEqual(group.pending_bounds(), (ID(2), ID(2)))
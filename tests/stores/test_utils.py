@@ -33,3 +33,13 @@ class TestUtils(unittest.TestCase):
         self.match(c, 'hello')
         self.match(c, 'hallo')
         self.not_match(c, 'hollo')
+        #
+        p = redis_to_py_pattern('news.*')
+        c = re.compile(p)
+        self.match(c, 'news.sport')
+        self.not_match(c, 'newsXsport')
+        #
+        p = redis_to_py_pattern('h\\*llo')
+        c = re.compile(p)
+        self.match(c, 'h*llo')
+        self.not_match(c, 'hello')
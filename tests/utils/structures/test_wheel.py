@@ -0,0 +1,54 @@
+import unittest
+
+from pulsar.utils.structures import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def test_add_remove(self):
+        wheel = TimerWheel(0.25, 10)
+        self.assertEqual(len(wheel), 0)
+        wheel.add('a', 10.55)
+        wheel.add('b', 10.55)
+        wheel.add('c', 12)
+        self.assertEqual(len(wheel), 3)
+        self.assertTrue(wheel.remove('b', 10.55))
+        self.assertFalse(wheel.remove('b', 10.55))
+        self.assertFalse(wheel.remove('c', 13))
+        self.assertEqual(len(wheel), 2)
+        self.assertTrue(repr(wheel))
+
+    def test_advance(self):
+        wheel = TimerWheel(0.25, 10)
+        wheel.add('a', 10.6)
+        wheel.add('b', 11.1)
+        wheel.add('c', 12)
+        self.assertEqual(wheel.advance(10.5), [])
+        self.assertEqual(wheel.advance(10.75), ['a'])
+        self.assertEqual(wheel.advance(10.75), [])
+        self.assertEqual(sorted(wheel.advance(12.25)), ['b', 'c'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_advance_limit(self):
+        wheel = TimerWheel(0.25, 10)
+        for n in range(10):
+            wheel.add(n, 10 + 0.1*n)
+        expired = wheel.advance(20, 4)
+        self.assertEqual(len(expired), 4)
+        self.assertEqual(len(wheel), 6)
+        expired.extend(wheel.advance(20, 4))
+        expired.extend(wheel.advance(20, 4))
+        self.assertEqual(sorted(expired), list(range(10)))
+        self.assertEqual(len(wheel), 0)
+
+    def test_add_past(self):
+        wheel = TimerWheel(0.25, 10)
+        wheel.advance(11)
+        wheel.add('a', 10.5)
+        self.assertEqual(wheel.advance(11.25), ['a'])
+        wheel.add('b', 10.5)
+        self.assertTrue(wheel.remove('b', 10.5))
+        wheel.add('c', 11.5)
+        wheel.clear()
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(wheel.advance(20), [])